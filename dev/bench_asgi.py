@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Compare how many queries one process keeps in flight when CodeHelp is
+served over WSGI and over ASGI (see gened.asgi).
+
+Both deployments get the same number of threads and the same burst of
+concurrent POST /api/query requests, with every completion replaced by
+mock_async_completion() from gened.testing.mocks (a fixed latency, no
+network).  Under WSGI, a server's worker threads are modeled by a thread
+pool driving the Flask test client: each request holds its thread until its
+response is ready.  Under ASGI, the requests are sent straight to an
+AsgiApp with that many sync worker threads, which are only used between
+completions.
+
+Reports the most completions in flight at once and the wall-clock time for
+the burst.  Uses a temporary database loaded with tests/test_data.sql and
+the settings in .env.test.
+
+Usage:
+    python dev/bench_asgi.py [--threads N] [--requests N] [--delay SECONDS]
+'''
+
+import argparse
+import asyncio
+import json
+import logging
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+from unittest.mock import patch
+
+import jwt
+from dotenv import find_dotenv, load_dotenv
+
+QUERY = {'code': "x = 1", 'error': "NameError: name 'y' is not defined", 'issue': "Why?", 'user_id': "1"}
+JWT_KEY = 'bench-secret-key-long-enough-for-hs256'
+
+
+class InFlight:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.current = 0
+        self.peak = 0
+
+    def __enter__(self) -> None:
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def __exit__(self, *args: object) -> None:
+        with self._lock:
+            self.current -= 1
+
+
+def make_app(instance_path: Path):  # type: ignore[no-untyped-def]
+    import codehelp
+    from gened.admin import reload_consumers
+    from gened.db import get_db, init_db
+
+    app = codehelp.create_app(
+        test_config={
+            'TESTING': True,
+            'DATABASE': str(instance_path / 'bench.db'),
+            'COMPLETION_CACHE_TTL': 0,  # every query calls the (mock) LLM
+            'SUFFICIENCY_PRECHECK': 'off',
+            'SIMILAR_QUERY_THRESHOLD': 0,
+        },
+        instance_path=instance_path,
+    )
+    test_sql = Path(__file__).resolve().parent.parent / 'tests' / 'test_data.sql'
+    with app.app_context():
+        init_db()
+        get_db().executescript(test_sql.read_text(encoding='utf8'))
+        reload_consumers()
+    logging.getLogger().setLevel(logging.WARNING)  # keep the benchmark output readable
+    return app
+
+
+def bench_wsgi(app, n_threads: int, n_requests: int, headers: dict[str, str]) -> list[int]:  # type: ignore[no-untyped-def]
+    def one_request(_: int) -> int:
+        return app.test_client().post('/api/query', json=QUERY, headers=headers).status_code  # type: ignore[no-any-return]
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        return list(pool.map(one_request, range(n_requests)))
+
+
+def bench_asgi(app, n_threads: int, n_requests: int, headers: dict[str, str]) -> list[int]:  # type: ignore[no-untyped-def]
+    from gened.asgi import AsgiApp
+
+    asgi_app = AsgiApp(app, sync_workers=n_threads)
+    body = json.dumps(QUERY).encode()
+    scope = {
+        'type': 'http',
+        'method': 'POST',
+        'path': '/api/query',
+        'query_string': b'',
+        'http_version': '1.1',
+        'headers': [(k.lower().encode(), v.encode()) for k, v in {**headers, 'Content-Type': 'application/json'}.items()],
+    }
+
+    async def one_request() -> int:
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive() -> dict[str, Any]:
+            return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+        async def send(message: dict[str, Any]) -> None:
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await asgi_app(scope, receive, send)
+        return status[0]
+
+    async def burst() -> list[int]:
+        return list(await asyncio.gather(*[one_request() for _ in range(n_requests)]))
+
+    try:
+        return asyncio.run(burst())
+    finally:
+        asgi_app.executor.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help="WSGI worker threads / ASGI sync threads (default: 8)")
+    parser.add_argument('--requests', type=int, default=64, help="concurrent queries in the burst (default: 64)")
+    parser.add_argument('--delay', type=float, default=1.0, help="mocked latency per completion, in seconds (default: 1.0)")
+    args = parser.parse_args()
+
+    load_dotenv(find_dotenv('.env.test'))
+
+    from gened.testing.mocks import mock_async_completion
+
+    mocked = mock_async_completion(delay=args.delay)
+    in_flight = InFlight()
+
+    async def get_completion(llm: Any, messages: list[dict[str, str]], **kwargs: Any) -> tuple[dict[str, Any], str]:
+        with in_flight:
+            completion = await mocked(messages=messages)
+        return completion.model_dump(), completion.choices[0].message.content  # type: ignore[union-attr]
+
+    token = jwt.encode({'user_id': 11}, JWT_KEY, algorithm="HS256")  # testuser in tests/test_data.sql
+    headers = {'Authorization': f"Bearer {token}"}
+
+    print(f"{args.requests} concurrent queries, {args.threads} threads, {args.delay}s per mocked completion\n")
+    with tempfile.TemporaryDirectory() as temp_dir, \
+            patch('gened.completion_cache.get_completion', get_completion), \
+            patch('codehelp.api.SECRET_KEY', JWT_KEY):
+        app = make_app(Path(temp_dir))
+        for label, bench in [("WSGI", bench_wsgi), ("ASGI", bench_asgi)]:
+            in_flight.peak = 0
+            start = time.perf_counter()
+            statuses = bench(app, args.threads, args.requests, headers)
+            elapsed = time.perf_counter() - start
+            failed = sum(status != 200 for status in statuses)
+            print(f"  {label}:  peak {in_flight.peak:4d} completions in flight  {elapsed:6.2f}s  ({args.requests / elapsed:.1f} queries/s, {failed} failed)")
+
+
+if __name__ == '__main__':
+    main()
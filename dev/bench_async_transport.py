@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Benchmark the Dartmouth and Mistral completion transports against a local
+mock server with injected latency.
+
+run_query_prompts() launches the main and sufficiency completions as two
+concurrent tasks.  With a blocking transport (requests.post, or Mistral's
+sync client.chat.complete) inside an async function, the tasks still run one
+after the other.  This script measures the wall-clock time of that pattern
+with the old blocking calls and with the current get_completion()
+implementations.
+
+Usage:
+    python dev/bench_async_transport.py [--delay SECONDS] [--rounds N] [--tasks N]
+'''
+
+import argparse
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+
+MESSAGES = [{'role': 'user', 'content': "Please write 'OK'"}]
+
+
+def make_handler(delay: float) -> type[BaseHTTPRequestHandler]:
+    class MockHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args: object) -> None:
+            pass  # keep the benchmark output readable
+
+        def do_POST(self) -> None:
+            length = int(self.headers.get('Content-Length', 0))
+            self.rfile.read(length)
+
+            if self.path.endswith('/jwt'):
+                token = jwt.encode({'exp': int(time.time()) + 3600}, 'mock-secret-long-enough-for-hs256', algorithm='HS256')
+                body = {'jwt': token}
+            else:
+                time.sleep(delay)  # simulated model latency
+                body = {
+                    'id': 'mock',
+                    'object': 'chat.completion',
+                    'model': 'mock',
+                    'created': int(time.time()),
+                    'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'OK'}}],
+                    'usage': {'prompt_tokens': 5, 'completion_tokens': 1, 'total_tokens': 6},
+                }
+
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return MockHandler
+
+
+def start_server(delay: float) -> str:
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(delay))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+async def run_concurrently(n_tasks: int, make_coro) -> float:  # type: ignore[no-untyped-def]
+    start = time.perf_counter()
+    tasks = [asyncio.create_task(make_coro()) for _ in range(n_tasks)]
+    await asyncio.gather(*tasks)
+    return time.perf_counter() - start
+
+
+def bench(label: str, rounds: int, n_tasks: int, make_coro) -> float:  # type: ignore[no-untyped-def]
+    times = [asyncio.run(run_concurrently(n_tasks, make_coro)) for _ in range(rounds)]
+    avg = sum(times) / len(times)
+    print(f"  {label:<38} {avg:6.3f}s  (min {min(times):.3f}s, max {max(times):.3f}s)")
+    return avg
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--delay', type=float, default=1.0, help="injected latency per completion, in seconds (default: 1.0)")
+    parser.add_argument('--rounds', type=int, default=3, help="rounds per measurement (default: 3)")
+    parser.add_argument('--tasks', type=int, default=2, help="concurrent completions per round (default: 2, as in run_query_prompts)")
+    args = parser.parse_args()
+
+    base_url = start_server(args.delay)
+
+    # The provider modules read these when imported.
+    os.environ['BASE_URL'] = base_url
+    os.environ['JWT_URL'] = f"{base_url}/api/jwt"
+    os.environ['MISTRAL_BASE_URL'] = base_url
+
+    import requests
+    from flask import Flask
+    from mistralai import Mistral
+
+    from gened import dartmouth, mistral
+
+    app = Flask(__name__)
+    model = "/api/ai/mock/v1/chat/completions"
+
+    async def dartmouth_blocking() -> None:
+        token = dartmouth.jwt_cache.get('bench-key')
+        requests.post(f"{base_url}{model}", headers={'Authorization': f"Bearer {token}"}, json={'messages': MESSAGES}, timeout=60)
+
+    async def dartmouth_async() -> None:
+        await dartmouth.get_completion(dartmouth.LLMConfig(api_key='bench-key', model=model), MESSAGES)
+
+    sync_mistral = Mistral(api_key='bench-key', server_url=base_url)
+
+    async def mistral_blocking() -> None:
+        sync_mistral.chat.complete(model='mock', messages=MESSAGES)  # type: ignore[arg-type]
+
+    async def mistral_async() -> None:
+        await mistral.get_completion(mistral.LLMConfig(api_key='bench-key', model='mock'), MESSAGES)
+
+    print(f"Mock latency {args.delay}s, {args.tasks} concurrent completions, {args.rounds} rounds each\n")
+    with app.app_context():
+        print("Dartmouth:")
+        blocking = bench("blocking requests.post", args.rounds, args.tasks, dartmouth_blocking)
+        non_blocking = bench("get_completion (httpx, pooled)", args.rounds, args.tasks, dartmouth_async)
+        print(f"  -> {blocking / non_blocking:.2f}x faster\n")
+
+        print("Mistral:")
+        blocking = bench("blocking client.chat.complete", args.rounds, args.tasks, mistral_blocking)
+        non_blocking = bench("get_completion (complete_async)", args.rounds, args.tasks, mistral_async)
+        print(f"  -> {blocking / non_blocking:.2f}x faster")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Benchmark near-duplicate lookups in codehelp.similarity.
+
+Builds an in-memory SimilarityIndex of synthetic queries (variations on a set
+of small programs, as in a class where many students work on the same
+exercise) and times signature computation and lookups.
+
+Usage:
+    python dev/bench_similarity.py [--queries N] [--lookups N] [--threshold T]
+'''
+
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
+
+from codehelp.similarity import SimilarityIndex, query_signature  # noqa: E402
+
+TEMPLATES = [
+    "def {f}({a}):\n    {t} = 0\n    for {v} in {a}:\n        {t} += {v}\n    return {t} / len({a})\n",
+    "{a} = input()\nif {a} == {n}:\n    print('{s}')\nelse:\n    print({a} * {n})\n",
+    "int {f}(int {a}) {{\n    if ({a} <= {n}) return 1;\n    return {a} * {f}({a} - 1);\n}}\n",
+    "while {v} < {n}:\n    {t}.append({v} ** 2)\n    {v} += 1\nprint({t}[{n}])\n",
+]
+ERRORS = ["ZeroDivisionError: division by zero", "IndexError: list index out of range", "", "RecursionError"]
+NAMES = ['x', 'y', 'count', 'total', 'vals', 'data', 'item', 'n', 'num', 'acc', 'res', 'lst']
+
+
+def make_query(rng: random.Random) -> tuple[str, str, str]:
+    template = rng.choice(TEMPLATES)
+    names = rng.sample(NAMES, 4)
+    extra = "\n".join(f"{rng.choice(NAMES)} = {rng.randint(0, 99)}" for _ in range(rng.randint(0, 6)))
+    code = template.format(f=names[0], a=names[1], t=names[2], v=names[3], n=rng.randint(0, 99), s=rng.choice(NAMES)) + extra
+    issue = " ".join(rng.choices("why does my code not work crash print wrong value loop list function".split(), k=rng.randint(4, 10)))
+    return code, rng.choice(ERRORS), issue
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=100_000)
+    parser.add_argument('--lookups', type=int, default=1_000)
+    parser.add_argument('--threshold', type=float, default=0.9)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    index = SimilarityIndex()
+
+    start = time.perf_counter()
+    for query_id in range(1, args.queries + 1):
+        index.add(query_id, query_signature(*make_query(rng)))
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {args.queries} queries in {elapsed:.1f}s ({elapsed / args.queries * 1e6:.0f} us/query, including signatures)")
+
+    lookups = [query_signature(*make_query(rng)) for _ in range(args.lookups)]
+    found = 0
+    start = time.perf_counter()
+    for sig in lookups:
+        found += bool(index.find(sig, args.threshold))
+    elapsed = time.perf_counter() - start
+    print(f"{args.lookups} lookups: {elapsed / args.lookups * 1e3:.3f} ms/lookup, {found} with a match >= {args.threshold}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,7 +6,7 @@ from pathlib import Path
 from typing import Any
 from flask.app import Flask
 from gened import base
-from . import admin, context_config, helper, tutor
+from . import admin, context_config, helper, query_config, tutor, webhooks
 import os
 from . import api
 from .commands import register_commands
@@ -31,7 +31,38 @@ def create_app(test_config: dict[str, Any] | None = None, instance_path: Path |
             "Java",
             "Python",
             "C++",
-        ]
+        ],
+        # Near-duplicate queries (see similarity.py): minimum (Jaccard) similarity
+        # to a helpful earlier query in the same class and context (0 disables),
+        # and whether to serve its response instead of calling the LLM.
+        SIMILAR_QUERY_THRESHOLD=float(os.environ.get('SIMILAR_QUERY_THRESHOLD', 0.9)),
+        SIMILAR_QUERY_SERVE=os.environ.get('SIMILAR_QUERY_SERVE', '').lower() in ('1', 'true', 'yes'),
+        # Local pre-check of query sufficiency (see sufficiency.py): 'off', 'shadow', or 'on'
+        SUFFICIENCY_PRECHECK=os.environ.get('SUFFICIENCY_PRECHECK', 'shadow').lower(),
+        # Remove code from responses locally when possible, rather than with an LLM rewrite (see cleanup.py)
+        LOCAL_CODE_CLEANUP=os.environ.get('LOCAL_CODE_CLEANUP', 'true').lower() in ('1', 'true', 'yes'),
+        # Default budget, in estimated tokens, for a query's code, error, and issue; longer
+        # queries are trimmed or rejected before calling the LLM (see preflight.py)
+        QUERY_INPUT_TOKEN_BUDGET=int(os.environ.get('QUERY_INPUT_TOKEN_BUDGET', 4000)),
+        # Order of prompt text (see prompts.PROMPT_LAYOUTS): 'classic', or 'static_first' to
+        # put static instructions before the query so providers can cache the prompt prefix
+        PROMPT_LAYOUT=os.environ.get('PROMPT_LAYOUT', 'classic').lower(),
+        # API job mode (see jobs.py): background threads per process for queries, and
+        # the longest a status request may wait for a job to finish (seconds)
+        QUERY_JOB_WORKERS=int(os.environ.get('QUERY_JOB_WORKERS', 8)),
+        QUERY_JOB_MAX_WAIT=30,
+        # Batch API (POST /api/queries/batch): most queries per batch, and most answered at once per batch
+        BATCH_MAX_QUERIES=int(os.environ.get('BATCH_MAX_QUERIES', 100)),
+        BATCH_QUERY_CONCURRENCY=int(os.environ.get('BATCH_QUERY_CONCURRENCY', 4)),
+        # Completion webhooks (see webhooks.py): whether each process delivers them from a background thread
+        # (else only with "flask deliver-webhooks"), seconds to gather a burst of completions into batches, largest batch,
+        # seconds between checks for due retries, first retry delay in seconds (doubled for each retry), and attempts before giving up
+        WEBHOOK_DISPATCHER=True,
+        WEBHOOK_BATCH_WINDOW=2.0,
+        WEBHOOK_BATCH_SIZE=50,
+        WEBHOOK_POLL_INTERVAL=30.0,
+        WEBHOOK_RETRY_BASE=30.0,
+        WEBHOOK_MAX_ATTEMPTS=8,
     )
     if test_config:
         app_config.update(test_config)
@@ -40,13 +71,16 @@ def create_app(test_config: dict[str, Any] | None = None, instance_path: Path |
     
     app.register_blueprint(context_config.bp)
     app.register_blueprint(helper.bp)
+    app.register_blueprint(query_config.bp)
     app.register_blueprint(tutor.bp)
     app.register_blueprint(api.bp)
 
     context_config.register(app)
+    query_config.register()
     admin.register_with_gened()
 
     app.config['NAVBAR_ITEM_TEMPLATES'].append("tutor_nav_item.html")
     register_commands(app)
+    webhooks.init_app(app)
     
     return app
\ No newline at end of file
@@ -4,6 +4,9 @@
 
 from gened.admin import ChartData, register_admin_chart
 from gened.db import get_db
+from gened.llm_status import StatusTable, register_status_table
+
+from . import sufficiency
 
 
 def gen_query_charts(where_clause: str, where_params: list[str]) -> list[ChartData]:
@@ -61,9 +64,162 @@ def gen_query_charts(where_clause: str, where_params: list[str]) -> list[ChartDa
         ),
     ]
 
+    # Daily rollups of the completions made for those queries (see gened.usage)
+    stage_data = db.execute(f"""
+        WITH RECURSIVE
+            cnt(val) AS (VALUES(0) UNION ALL SELECT val+1 FROM cnt WHERE val<14)
+        SELECT
+            val AS days_since,
+            COALESCE(prompt_tokens, 0) AS prompt_tokens,
+            COALESCE(completion_tokens, 0) AS completion_tokens,
+            COALESCE(cached_tokens, 0) AS cached_tokens,
+            COALESCE(main_ms, 0) AS main_ms,
+            COALESCE(sufficiency_ms, 0) AS sufficiency_ms,
+            COALESCE(cleanup_ms, 0) AS cleanup_ms
+        FROM cnt
+        LEFT JOIN (
+        SELECT
+            CAST(julianday() AS INTEGER) - CAST(julianday(queries.query_time) AS INTEGER) AS days_since,
+            SUM(query_stages.prompt_tokens) FILTER (WHERE query_stages.source = 'api') AS prompt_tokens,
+            SUM(query_stages.completion_tokens) FILTER (WHERE query_stages.source = 'api') AS completion_tokens,
+            SUM(query_stages.cached_tokens) FILTER (WHERE query_stages.source = 'api') AS cached_tokens,
+            AVG(query_stages.wall_ms) FILTER (WHERE query_stages.stage IN ('main', 'structured') AND query_stages.source = 'api' AND NOT query_stages.error) AS main_ms,
+            AVG(query_stages.wall_ms) FILTER (WHERE query_stages.stage = 'sufficiency' AND query_stages.source = 'api' AND NOT query_stages.error) AS sufficiency_ms,
+            AVG(query_stages.wall_ms) FILTER (WHERE query_stages.stage = 'cleanup' AND query_stages.source = 'api' AND NOT query_stages.error) AS cleanup_ms
+            FROM query_stages
+            JOIN queries ON query_stages.query_id=queries.id
+            JOIN users ON queries.user_id=users.id
+            LEFT JOIN auth_providers ON users.auth_provider=auth_providers.id
+            LEFT JOIN roles ON queries.role_id=roles.id
+            LEFT JOIN classes ON roles.class_id=classes.id
+            LEFT JOIN classes_lti ON classes.id=classes_lti.class_id
+            LEFT JOIN consumers ON consumers.id=classes_lti.lti_consumer_id
+            WHERE days_since <= 14
+            AND {where_clause}
+            GROUP BY days_since
+        ) ON days_since = val
+        ORDER BY days_since DESC
+    """, where_params).fetchall()
+    days_since = [row['days_since'] for row in stage_data]
+    charts += [
+        ChartData(
+            labels=days_since,
+            series={
+                'prompt tokens': [row['prompt_tokens'] for row in stage_data],
+                'completion tokens': [row['completion_tokens'] for row in stage_data],
+                'cached prompt tokens': [row['cached_tokens'] for row in stage_data],
+            },
+            colors=['#66ccff', '#9966ff', '#33cc99'],
+        ),
+        ChartData(
+            labels=days_since,
+            series={
+                'main (avg s)': [row['main_ms'] / 1000 for row in stage_data],
+                'sufficiency (avg s)': [row['sufficiency_ms'] / 1000 for row in stage_data],
+                'cleanup (avg s)': [row['cleanup_ms'] / 1000 for row in stage_data],
+            },
+            colors=['#ff9933', '#ffcc00', '#999999'],
+        ),
+    ]
+
     return charts
 
 
+def gen_sufficiency_tables() -> list[StatusTable]:
+    """ Summarize the local sufficiency pre-check (see sufficiency.py) for the LLM status page. """
+    rows = []
+    for period, days in [("today", 1), ("last 7 days", 7), ("last 30 days", 30), ("all time", None)]:
+        stats = sufficiency.get_stats(days)
+        rows.append({
+            'period': period,
+            'ambiguous': stats.ambiguous,
+            'clear': stats.skipped + stats.shadowed,
+            'skip_rate': f"{stats.skip_rate:.1%}",
+            'agreed': stats.agreed,
+            'disagreed': stats.disagreed,
+            'disagreement_rate': f"{stats.disagreement_rate:.1%}",
+        })
+    return [StatusTable(
+        name='sufficiency_precheck',
+        title="Sufficiency Pre-check",
+        columns=[('period', 'period'), ('sent to LLM', 'ambiguous', 'r'), ('clearly sufficient', 'clear', 'r'), ('skip rate', 'skip_rate', 'r'),
+                 ('shadow: agreed', 'agreed', 'r'), ('shadow: disagreed', 'disagreed', 'r'), ('disagreement rate', 'disagreement_rate', 'r')],
+        rows=rows,
+    )]
+
+
+def gen_latency_tables() -> list[StatusTable]:
+    """ Summarize completion tokens and wall time per stage and model over the last 7 days, to find slow models. """
+    db = get_db()
+    rows = db.execute("""
+        SELECT
+            stage,
+            provider,
+            model,
+            COUNT(*) AS calls,
+            SUM(error) AS errors,
+            ROUND(AVG(wall_ms) FILTER (WHERE NOT error)) AS avg_ms,
+            MAX(wall_ms) FILTER (WHERE NOT error) AS max_ms,
+            ROUND(AVG(prompt_tokens)) AS avg_prompt_tokens,
+            ROUND(AVG(completion_tokens)) AS avg_completion_tokens,
+            SUM(cached_tokens) AS cached_tokens
+        FROM query_stages
+        WHERE source = 'api'
+          AND created > datetime('now', '-7 days')
+        GROUP BY stage, provider, model
+        ORDER BY stage, avg_ms DESC
+    """).fetchall()
+    return [StatusTable(
+        name='completion_latency',
+        title="Completions by Stage and Model (last 7 days)",
+        columns=[('stage', 'stage'), ('provider', 'provider'), ('model', 'model'), ('calls', 'calls', 'r'), ('errors', 'errors', 'r'),
+                 ('avg ms', 'avg_ms', 'r'), ('max ms', 'max_ms', 'r'), ('avg prompt tokens', 'avg_prompt_tokens', 'r'),
+                 ('avg completion tokens', 'avg_completion_tokens', 'r'), ('cached prompt tokens', 'cached_tokens', 'r')],
+        rows=[dict(row) for row in rows],
+    )]
+
+
+def get_prompt_cache_stats(days: int = 7) -> list[dict[str, object]]:
+    """ Compare provider prompt-cache hits and latency of completions by prompt layout and stage over the last `days` days.
+    Queries recorded before prompt layouts were introduced used the 'classic' layout.
+    """
+    db = get_db()
+    rows = db.execute("""
+        SELECT
+            COALESCE(queries.prompt_layout, 'classic') AS layout,
+            query_stages.stage,
+            COUNT(*) AS calls,
+            SUM(query_stages.cached_tokens > 0) AS calls_with_hits,
+            SUM(query_stages.prompt_tokens) AS prompt_tokens,
+            SUM(query_stages.cached_tokens) AS cached_tokens,
+            ROUND(100.0 * SUM(query_stages.cached_tokens) / SUM(query_stages.prompt_tokens), 1) AS hit_pct,
+            ROUND(AVG(query_stages.wall_ms)) AS avg_ms
+        FROM query_stages
+        JOIN queries ON queries.id = query_stages.query_id
+        WHERE query_stages.source = 'api'
+          AND NOT query_stages.error
+          AND query_stages.prompt_tokens IS NOT NULL
+          AND query_stages.created > datetime('now', ?)
+        GROUP BY layout, query_stages.stage
+        ORDER BY query_stages.stage, layout
+    """, [f"-{days} days"]).fetchall()
+    return [dict(row) for row in rows]
+
+
+def gen_prompt_cache_tables() -> list[StatusTable]:
+    return [StatusTable(
+        name='prompt_cache',
+        title="Provider Prompt Cache by Prompt Layout (last 7 days)",
+        columns=[('layout', 'layout'), ('stage', 'stage'), ('calls', 'calls', 'r'), ('calls with hits', 'calls_with_hits', 'r'),
+                 ('prompt tokens', 'prompt_tokens', 'r'), ('cached tokens', 'cached_tokens', 'r'), ('hit %', 'hit_pct', 'r'),
+                 ('avg ms', 'avg_ms', 'r')],
+        rows=get_prompt_cache_stats(),
+    )]
+
+
 def register_with_gened() -> None:
     """ Register any chart-generating functions with the main gened admin module."""
     register_admin_chart(gen_query_charts)
+    register_status_table(gen_sufficiency_tables)
+    register_status_table(gen_latency_tables)
+    register_status_table(gen_prompt_cache_tables)
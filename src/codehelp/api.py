@@ -1,21 +1,28 @@
 
+import asyncio
 import json
-from flask import Blueprint, current_app, jsonify, request, g
+from flask import Blueprint, current_app, jsonify, make_response, request, g, url_for
 from functools import wraps
 from werkzeug.security import check_password_hash
 import jwt
 import os
 import datetime
+from typing import Any
 from werkzeug.wrappers.response import Response
 from flask_cors import cross_origin
+from flask_cors.core import get_cors_options, set_cors_headers
 
+from gened.asgi import async_view, then
 from gened.db import get_db
-from .helper import run_query, get_query, store_algorea_id
+from . import webhooks
+from .helper import QueryInput, answer_queries_async, answer_query_async, stream_query, get_query, record_queries, record_query, store_algorea_id
+from .jobs import job_status, start_batch_job, start_job, wait_for_job, wants_job
 from .context import get_context_by_name
 from gened.auth import class_enabled_required, set_session_auth_user, set_session_auth_class, get_last_class
-from gened.dartmouth import LLMConfig, with_llm
+from gened.providers import LLMConfig, with_llm
 from gened.classes import switch_class
-from .context import get_context_by_name, TaskInstructions, get_available_contexts
+from gened.streaming import sse_response, wants_stream
+from .context import ContextConfig, get_context_by_name, TaskInstructions, get_available_contexts
 
 bp = Blueprint('api', __name__)
 SECRET_KEY = os.environ.get("SECRET_KEY")
@@ -164,8 +171,57 @@ def token_required(f):
     return decorated_function
 
 
+def async_cross_origin(f):
+    """cross_origin() for views that may return a coroutine (see gened.asgi),
+    which cross_origin() would pass straight to make_response()."""
+    f.required_methods = {*getattr(f, 'required_methods', ()), 'OPTIONS'}
+    f.provide_automatic_options = False
+
+    def add_cors_headers(rv):
+        response = make_response(rv)
+        set_cors_headers(response, get_cors_options(current_app, {}))
+        return response
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method == 'OPTIONS':
+            return add_cors_headers(current_app.make_default_options_response())
+        return then(f(*args, **kwargs), add_cors_headers)
+    return decorated_function
+
+
+def parse_context(data: dict[str, Any], contexts: dict[str, ContextConfig | None] | None = None) -> ContextConfig | TaskInstructions | None:
+    """Get the context or task instructions given in a query's JSON, if any.
+
+    Raises LookupError for an unknown context and ValueError for invalid task instructions.
+    Contexts looked up by name are cached in `contexts`, if given.
+    """
+    if contexts is None:
+        contexts = {}
+    if 'context' in data:
+        name = data['context']
+        if name not in contexts:
+            contexts[name] = get_context_by_name(name)
+        if not contexts[name]:
+            raise LookupError(f"Context not found: {name}")
+        return contexts[name]
+    elif 'task_instructions' in data:
+        try:
+            task_data = data['task_instructions']
+            return TaskInstructions(
+                tools=task_data.get('tools'),
+                details=task_data.get('details'),
+                avoid=task_data.get('avoid'),
+                name=task_data.get('name')
+            )
+        except Exception as e:
+            raise ValueError(f"Invalid task instructions format: {str(e)}") from e
+    return None
+
+
 @bp.route("/api/query", methods=["POST"])
-@cross_origin()
+@async_view
+@async_cross_origin
 @token_required
 @class_enabled_required
 @with_llm(spend_token=True)
@@ -178,23 +234,13 @@ def submit_query(llm: LLMConfig):
         current_app.logger.debug(f"Auth: {g.auth}")
 
         # Get either context or task_instructions
-        context = None
-        if 'context' in data:
-            context = get_context_by_name(data['context'])
-            if not context:
-                return jsonify({"error": f"Context not found: {data['context']}"}), 404
-        elif 'task_instructions' in data:
-            try:
-                task_data = data['task_instructions']
-                context = TaskInstructions(
-                    tools=task_data.get('tools'),
-                    details=task_data.get('details'),
-                    avoid=task_data.get('avoid'),
-                    name=task_data.get('name')
-                )
-            except Exception as e:
-                current_app.logger.error(f"Invalid task instructions: {e}")
-                return jsonify({"error": f"Invalid task instructions format: {str(e)}"}), 400
+        try:
+            context = parse_context(data)
+        except LookupError as e:
+            return jsonify({"error": str(e)}), 404
+        except ValueError as e:
+            current_app.logger.error(f"Invalid task instructions: {e}")
+            return jsonify({"error": str(e)}), 400
 
         # Extract query data
         code = data.get("code", "")
@@ -202,6 +248,17 @@ def submit_query(llm: LLMConfig):
         issue = data.get("issue", "")
         if code is None or error is None or issue is None:
             return jsonify({"error": "Code, Error, or Issue parameters cannot be None"}), 400
+
+        # Notified with the responses once they are recorded (see webhooks.py); not used for streamed queries
+        callback_url = data.get("callback_url")
+        if callback_url is not None:
+            # Deliveries are signed with the class's secret, so only its instructors may direct them
+            if not g.auth.get('is_admin') and g.auth.get('role') != 'instructor':
+                return jsonify({"error": "Callbacks are only available to instructors"}), 403
+            try:
+                webhooks.check_callback_url(callback_url, g.auth.get('class_id'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
             
         # Group prompt selection logic
         db = get_db()
@@ -230,22 +287,67 @@ def submit_query(llm: LLMConfig):
         algorea_id_str = data.get("user_id")
         algorea_id = int(algorea_id_str) if algorea_id_str and str(algorea_id_str).isdigit() else None
 
-        # Pass both class_id and algorea_id to run_query
-        current_app.logger.debug(f"Passing class_id: {class_id} and algorea_id: {algorea_id} to run_query")
-        query_id = run_query(llm, context, code, error, issue, class_id=class_id, algorea_user_id=algorea_id)
-        query_row, responses = get_query(query_id)
+        if wants_job():
+            # Run the query in the background; the client polls GET /api/query/<id> for the responses (or gets a callback).
+            query_id = record_query(context, code, error, issue, job_status='pending', callback_url=callback_url)
+            if "user_id" in data:
+                store_algorea_id(query_id, data["user_id"])
+            start_job(llm, context, code, error, issue, query_id, class_id=class_id, algorea_user_id=algorea_id)
+            status_url = url_for('api.get_query_response', query_id=query_id)
+            return jsonify({
+                "query_id": query_id,
+                "status": "pending",
+                "status_url": status_url,
+                "context": context.name if context is not None else None,
+                "group_prompt": group_prompt
+            }), 202, {'Location': status_url}
+
+        if wants_stream():
+            # Stream the main response as Server-Sent Events; the final 'done'
+            # event carries the same payload as the non-streamed response.
+            def done_data(query_id):
+                _, responses = get_query(query_id)
+                return {
+                    "query_id": query_id,
+                    "responses": responses,
+                    "context": context.name if context is not None else None,
+                    "group_prompt": group_prompt
+                }
+
+            query_id, events = stream_query(llm, context, code, error, issue, done_data, class_id=class_id, algorea_user_id=algorea_id)
+            if "user_id" in data:
+                store_algorea_id(query_id, data["user_id"])
+            return sse_response(events)
+
+        # The LLM calls are awaited (natively, when served over ASGI; see gened.asgi)
+        return answer_query_request(llm, context, code, error, issue, data, class_id, algorea_id, group_prompt, callback_url)
+
+    except Exception as e:
+        current_app.logger.error(f"Error processing query: {e}")
+        return jsonify({"error": str(e)}), 500
+
 
-        algorea_id = data.get("user_id", "no_set_id")
-        if algorea_id == "no_set_id":
+async def answer_query_request(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, data: dict[str, Any], class_id: int | None, algorea_id: int | None, group_prompt: str | None, callback_url: str | None = None) -> Response | tuple[Response, int]:
+    """Run a query submitted to submit_query() and return its response."""
+    try:
+        query_id = await asyncio.to_thread(record_query, context, code, error, issue, callback_url=callback_url)
+
+        # Stored before answering, so a webhook notification includes it
+        if data.get("user_id", "no_set_id") == "no_set_id":
             current_app.logger.debug("No algorea id was provided")
             print("No algorea id provided, was that intended behavior?")
         else:
-            store_algorea_id(query_id, algorea_id)
+            await asyncio.to_thread(store_algorea_id, query_id, data["user_id"])
+
+        # Pass both class_id and algorea_id to answer_query_async
+        current_app.logger.debug(f"Passing class_id: {class_id} and algorea_id: {algorea_id} to answer_query_async")
+        await answer_query_async(llm, context, code, error, issue, query_id, class_id=class_id, algorea_user_id=algorea_id)
+        query_row, responses = await asyncio.to_thread(get_query, query_id)
 
         return jsonify({
             "query_id": query_id,
             "responses": responses,
-            "context": context.name if hasattr(context, 'name') else None,
+            "context": context.name if context is not None else None,
             "group_prompt": group_prompt
         })
 
@@ -253,14 +355,135 @@ def submit_query(llm: LLMConfig):
         current_app.logger.error(f"Error processing query: {e}")
         return jsonify({"error": str(e)}), 500
 
+def parse_query_input(item: object, contexts: dict[str, ContextConfig | None], callback_url: str | None = None, class_id: int | None = None) -> QueryInput:
+    """Validate one item of a batch, raising LookupError or ValueError if it is invalid.
+
+    An item's callback_url overrides the batch's callback_url, if given.
+    """
+    if not isinstance(item, dict):
+        raise ValueError("Each query must be an object")
+    context = parse_context(item, contexts)
+    code = item.get("code", "")
+    error = item.get("error", "")
+    issue = item.get("issue", "")
+    if not all(isinstance(field, str) for field in (code, error, issue)):
+        raise ValueError("Code, Error, and Issue must be strings")
+    algorea_id = item.get("user_id")
+    callback_url = item.get("callback_url", callback_url)
+    if callback_url is not None:
+        webhooks.check_callback_url(callback_url, class_id)
+    return QueryInput(context, code, error, issue, algorea_id=str(algorea_id) if algorea_id is not None else None, callback_url=callback_url)
+
+
+@bp.route("/api/queries/batch", methods=["POST"])
+@async_view
+@async_cross_origin
+@token_required
+@class_enabled_required
+@with_llm(spend_token=True)
+def submit_query_batch(llm: LLMConfig):
+    """Submit a batch of queries (e.g., from an autograder) and return a result for each.
+
+    The body is {"queries": [...]}, each with the same fields as for POST /api/query,
+    and optionally a "callback_url" for all of them.
+    Auth and the class's LLM are checked once for the whole batch, the valid
+    queries are recorded in a single transaction, and they are answered
+    concurrently, at most BATCH_QUERY_CONCURRENCY at a time.  In job mode
+    (see jobs.py), the batch runs in the background and each valid query's
+    result is its query ID, to be polled with GET /api/query/<id>.
+
+    Limited to instructors and admins, since the whole batch spends a single query.
+    """
+    if not (g.auth['is_admin'] or g.auth['role'] == 'instructor'):
+        return jsonify({"error": "Batch queries are only available to instructors"}), 403
+
+    data = request.get_json(silent=True)
+    items = data.get('queries') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Expected a non-empty list of queries"}), 400
+    if data.get('callback_url') is not None:
+        try:
+            webhooks.check_callback_url(data['callback_url'], g.auth.get('class_id'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    max_queries = current_app.config['BATCH_MAX_QUERIES']
+    if len(items) > max_queries:
+        return jsonify({"error": f"At most {max_queries} queries can be submitted in a batch"}), 400
+
+    class_id = g.auth.get('class_id')
+    results: list[dict[str, Any] | None] = [None] * len(items)
+    queries = []
+    indexes = []
+    contexts: dict[str, ContextConfig | None] = {}
+    for i, item in enumerate(items):
+        try:
+            queries.append(parse_query_input(item, contexts, data.get('callback_url'), class_id))
+            indexes.append(i)
+        except (LookupError, TypeError, ValueError) as e:
+            results[i] = {"index": i, "status": "invalid", "error": str(e)}
+
+    if not queries:
+        return jsonify({"results": results})
+
+    if wants_job():
+        query_ids = record_queries(queries, job_status='pending')
+        start_batch_job(llm, queries, query_ids, class_id=class_id)
+        for i, query_id in zip(indexes, query_ids, strict=True):
+            results[i] = {
+                "index": i,
+                "query_id": query_id,
+                "status": "pending",
+                "status_url": url_for('api.get_query_response', query_id=query_id),
+            }
+        return jsonify({"results": results}), 202
+
+    query_ids = record_queries(queries)
+    return answer_query_batch(llm, queries, query_ids, indexes, results, class_id)
+
+
+def get_batch_responses(query_ids: list[int]) -> dict[int, Any]:
+    db = get_db()
+    placeholders = ",".join("?" * len(query_ids))
+    rows = db.execute(f"SELECT id, response_text FROM queries WHERE id IN ({placeholders})", query_ids).fetchall()
+    return {row['id']: json.loads(row['response_text']) if row['response_text'] else None for row in rows}
+
+
+async def answer_query_batch(llm: LLMConfig, queries: list[QueryInput], query_ids: list[int], indexes: list[int], results: list[dict[str, Any] | None], class_id: int | None) -> Response:
+    """Answer the queries of a batch submitted to submit_query_batch() and return its results."""
+    errors = await answer_queries_async(llm, queries, query_ids, class_id, current_app.config['BATCH_QUERY_CONCURRENCY'])
+    responses = await asyncio.to_thread(get_batch_responses, query_ids)
+    for i, query_id, error in zip(indexes, query_ids, errors, strict=True):
+        result: dict[str, Any] = {
+            "index": i,
+            "query_id": query_id,
+            "status": "done" if error is None else "error",
+            "responses": responses.get(query_id),
+        }
+        if error is not None:
+            result["error"] = str(error)
+        results[i] = result
+    return jsonify({"results": results})
+
+
 @bp.route("/api/query/<int:query_id>", methods=["GET"]) 
 @token_required
 def get_query_response(query_id):
+    """Get a query and its responses, with the status of its job if it was run as one.
+
+    With ?wait=N, wait up to N seconds (at most QUERY_JOB_MAX_WAIT) for a pending job to finish.
+    """
     query_row, responses = get_query(query_id)
     if query_row is None:
         return jsonify({"error": "Query not found"}), 404
 
+    wait = request.args.get('wait', 0, type=float)
+    if job_status(query_row) == 'pending' and wait > 0:
+        wait_for_job(query_id, min(wait, current_app.config['QUERY_JOB_MAX_WAIT']))
+        query_row, responses = get_query(query_id)
+
+    status = job_status(query_row)
     return jsonify({
+        "status": status,
         "query": {
             "id": query_row['id'],
             "code": query_row['code'],
@@ -268,7 +491,7 @@ def get_query_response(query_id):
             "issue": query_row['issue'],
             "context": query_row['context_name']
         },
-        "responses": responses
+        "responses": responses if status != 'pending' else None
     })
 
 @bp.route("/api/contexts", methods=["GET"])
@@ -370,6 +593,44 @@ def delete_context(name):
     except Exception as e:
         db.rollback()
         return jsonify({"error": str(e)}), 500
+
+
+@bp.route("/api/class/webhook", methods=["GET", "PUT", "DELETE"])
+@token_required
+def class_webhook():
+    """Get, set, or remove the current class's webhook (instructor only).
+
+    The webhook is notified when any query in the class is answered (see webhooks.py).
+    PUT takes {"url": ...} and returns the URL with the secret that signs its
+    deliveries, kept across updates unless {"new_secret": true} is given.
+    The secret also signs callbacks given with requests in the class; with
+    {"url": null}, only the secret is registered, for those.
+    """
+    if not g.auth.get('is_admin') and g.auth.get('role') != 'instructor':
+        return jsonify({"error": "Unauthorized. Requires instructor role."}), 403
+    class_id = g.auth.get('class_id')
+    if class_id is None:
+        return jsonify({"error": "No class selected."}), 400
+
+    if request.method == 'PUT':
+        data = request.get_json(silent=True) or {}
+        url = data.get('url')
+        if url is not None:
+            try:
+                webhooks.check_url(url)
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+        secret = webhooks.set_class_webhook(class_id, url, new_secret=bool(data.get('new_secret')))
+        return jsonify({"url": url, "secret": secret})
+
+    if request.method == 'DELETE':
+        webhooks.delete_class_webhook(class_id)
+        return jsonify({"message": "Webhook removed"})
+
+    webhook = webhooks.get_class_webhook(class_id)
+    if webhook is None:
+        return jsonify({"error": "No webhook registered"}), 404
+    return jsonify({"url": webhook['url'], "secret": webhook['secret']})
     
 
 @bp.route("/api/classes/switch/<int:class_id>", methods=["POST"])
@@ -0,0 +1,16 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''ASGI entry point, for serving CodeHelp with native async views (see gened.asgi).
+
+    uvicorn --factory codehelp.asgi:create_asgi_app
+'''
+
+from gened.asgi import AsgiApp
+
+from . import create_app
+
+
+def create_asgi_app() -> AsgiApp:
+    return AsgiApp(create_app())
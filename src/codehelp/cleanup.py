@@ -0,0 +1,134 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Local removal of example code from responses.
+
+A main response that contains code (see helper.needs_cleanup()) used to be
+rewritten by a second, sequential LLM call.  strip_code() instead removes
+fenced and indented code blocks locally, along with the sentences that
+introduce them ("Your code should look like this:").  The result is checked,
+and None is returned if it isn't good enough to show on its own, in which case
+the caller falls back to the LLM rewrite.
+'''
+
+import re
+
+_FENCE_RE = re.compile(r"^[ \t]*(```|~~~)")
+_INDENTED_CODE_RE = re.compile(r"^(    |\t)\S")
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+")
+
+# Phrases that introduce example code; a sentence containing one is removed along with the code.
+INTRO_PHRASES = (
+    "should look like", "should look something like", "could look like", "would look like",
+    "here's", "here is", "for example", "like this", "like so", "as follows", "following code",
+    "corrected version", "updated version", "updated code", "corrected code", "fixed code",
+)
+# Phrases that point at code, which would dangle once it is removed
+CODE_REFERENCES = (
+    "code above", "code below", "shown above", "shown below", "example above", "example below",
+    "the snippet", "this snippet", "above snippet", "above code", "below code",
+)
+
+# Stored in place of the cleanup response when the code was removed locally
+LOCAL_CLEANUP_RESPONSE = {'cleanup': 'local'}
+
+MIN_WORDS = 40             # a stripped response shorter than this isn't helpful on its own
+MAX_CODE_FRACTION = 0.6    # responses that are mostly code are better rewritten by the LLM
+
+
+def _is_intro(text: str) -> bool:
+    lowered = text.lower()
+    return any(phrase in lowered for phrase in INTRO_PHRASES)
+
+
+def _drop_intro(line: str) -> str:
+    ''' Remove the sentence that introduces a removed code block from the line before it. '''
+    sentences = _SENTENCE_END_RE.split(line.rstrip())
+    if sentences and _is_intro(sentences[-1]):
+        sentences.pop()
+    kept = " ".join(sentences)
+    return kept[:-1] + '.' if kept.endswith(':') else kept
+
+
+def _looks_like_code(line: str) -> bool:
+    return any(c in line for c in "=(){};[]")
+
+
+def _split_code(text: str) -> tuple[list[str], int]:
+    ''' Remove code blocks from the text.  Returns the remaining lines and the number of characters of code removed. '''
+    kept: list[str] = []
+    code_chars = 0
+    in_fence = False
+    in_indented = False
+
+    def drop_intro() -> None:
+        # the last non-blank line kept before a code block may introduce it
+        for i in range(len(kept) - 1, -1, -1):
+            if kept[i].strip():
+                kept[i] = _drop_intro(kept[i])
+                return
+
+    for line in text.splitlines():
+        if _FENCE_RE.match(line):
+            if not in_fence:
+                drop_intro()
+            in_fence = not in_fence
+            code_chars += len(line)
+        elif in_fence:
+            code_chars += len(line)
+        elif _INDENTED_CODE_RE.match(line) and (in_indented or ((not kept or not kept[-1].strip()) and _looks_like_code(line))):
+            # an indented code block, which (as in Markdown) must follow a blank line
+            if not in_indented:
+                drop_intro()
+            in_indented = True
+            code_chars += len(line)
+        else:
+            if line.strip():
+                in_indented = False
+            kept.append(line)
+    return kept, code_chars
+
+
+def strip_code(response_txt: str) -> str | None:
+    ''' Remove example code from a response, or return None if the result fails quality checks. '''
+    kept, code_chars = _split_code(response_txt)
+
+    # Sentences promising code that isn't in a fenced block ("...should look like: ...")
+    paragraphs = []
+    for paragraph in "\n".join(kept).split("\n\n"):
+        if "should look" in paragraph.lower():
+            sentences = _SENTENCE_END_RE.split(paragraph.strip())
+            paragraph = " ".join(s for s in sentences if "should look" not in s.lower())
+        paragraphs.append(paragraph)
+    result = "\n\n".join(p for p in paragraphs if p.strip())
+    result = re.sub(r"\n{3,}", "\n\n", result).strip()
+
+    # Quality checks
+    if "```" in result or "~~~" in result:
+        return None
+    if len(result.split()) < MIN_WORDS:
+        return None
+    if code_chars > MAX_CODE_FRACTION * len(response_txt):
+        return None
+    lowered = result.lower()
+    if any(ref in lowered for ref in CODE_REFERENCES):
+        return None
+    # The end of a response often carries what a group instruction asked for
+    # (e.g., a closing question); it must survive intact.
+    original_end = _last_paragraph(response_txt)
+    if original_end is not None and original_end not in result:
+        return None
+
+    return result
+
+
+def _last_paragraph(text: str) -> str | None:
+    ''' The last paragraph of prose in the text, or None if it ends with code. '''
+    stripped = text.rstrip()
+    if stripped.endswith("```") or stripped.endswith("~~~"):
+        return None
+    last = stripped.rpartition("\n\n")[2].strip()
+    if _INDENTED_CODE_RE.match(last) or _FENCE_RE.match(last):
+        return None
+    return last
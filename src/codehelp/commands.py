@@ -1,4 +1,9 @@
+import asyncio
+import contextlib
+import json
 import os
+import statistics
+import time
 import click
 import sqlite3
 from flask import current_app
@@ -81,5 +86,147 @@ def dartmouth_migrations():
 
     click.echo('Dartmouth migrations applied successfully.')
 
+@click.command('backfill-query-signatures')
+@click.option('--class-id', type=int, default=None, help="Only queries from this class.")
+@with_appcontext
+def backfill_query_signatures(class_id):
+    """Compute near-duplicate signatures for queries recorded without one (or with one of an earlier size)."""
+    from .similarity import backfill
+    count = backfill(class_id)
+    click.echo(f"Added signatures for {count} queries.")
+
+def _mock_pipeline_response(messages):
+    """Content for mocked completions in compare-pipelines: JSON when the structured prompt asks for it."""
+    if any("Reply with only a JSON object" in str(message.get('content', '')) for message in messages):
+        return json.dumps({'sufficient': True, 'clarification': "", 'main': "Mocked explanation. " * 60})
+    if "evaluate whether a student's query contains sufficient detail" in str(messages[0].get('content', '')):
+        return "OK."
+    return "Mocked explanation. " * 60
+
+
+def _pipeline_stats(results):
+    """Summarize (seconds, responses, texts) results from one pipeline."""
+    latencies = sorted(seconds for seconds, _, _ in results)
+    # API calls: response objects from the provider (not from the completion cache, a coalesced request, or local markers)
+    calls = [r for _, responses, _ in results for r in responses if isinstance(r, dict) and 'choices' in r and not r.get('cached') and not r.get('coalesced')]
+    usage = [r.get('usage') or {} for r in calls]
+    return {
+        'queries': len(results),
+        'mean (s)': f"{statistics.mean(latencies):.2f}",
+        'p50 (s)': f"{statistics.median(latencies):.2f}",
+        'p95 (s)': f"{latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]:.2f}",
+        'API calls': len(calls),
+        'calls/query': f"{len(calls) / len(results):.2f}",
+        'prompt tokens': sum(u.get('prompt_tokens') or 0 for u in usage),
+        'completion tokens': sum(u.get('completion_tokens') or 0 for u in usage),
+        'insufficient': sum('insufficient' in texts for _, _, texts in results),
+        'errors': sum('error' in texts for _, _, texts in results),
+    }
+
+
+@click.command('compare-pipelines')
+@click.option('--limit', default=20, show_default=True, help="Number of recent queries to run.")
+@click.option('--mock', is_flag=True, help="Use a mocked OpenAI API instead of the system model.")
+@click.option('--delay', default=1.0, show_default=True, help="Latency of each mocked completion (seconds).")
+@with_appcontext
+def compare_pipelines(limit, mock, delay):
+    """Compare latency, API calls, and tokens of the 'multi' and 'structured' query pipelines.
+
+    Re-runs recent queries (without their contexts) through both pipelines
+    using the system model, with the completion cache and sufficiency
+    pre-check disabled.  Token counts are only available from providers that
+    report usage (e.g., OpenAI).
+    """
+    from unittest.mock import patch
+
+    from gened.db import get_db
+    from gened.providers import with_llm
+
+    from .helper import run_multi_prompts, run_structured_prompts
+
+    db = get_db()
+    queries = db.execute(
+        "SELECT code, error, issue FROM queries ORDER BY id DESC LIMIT ?", [limit]
+    ).fetchall()
+    if not queries:
+        click.echo("No queries to compare.")
+        return
+
+    current_app.config['COMPLETION_CACHE_TTL'] = 0
+    current_app.config['SUFFICIENCY_PRECHECK'] = 'off'
+
+    @with_llm(use_system_key=True)
+    def system_llm(llm):
+        return llm
+
+    async def run_all(llm, run_prompts):
+        results = []
+        for row in queries:
+            start = time.perf_counter()
+            responses, texts = await run_prompts(llm, None, row['code'] or '', row['error'] or '', row['issue'] or '', None, None)
+            results.append((time.perf_counter() - start, responses, texts))
+        return results
+
+    with current_app.test_request_context():
+        if mock:
+            from gened.openai import LLMConfig
+            from gened.testing.mocks import mock_async_completion
+            llm = LLMConfig(model='mock', api_key='mock')
+            patcher = patch("openai.resources.chat.AsyncCompletions.create", side_effect=mock_async_completion(delay, _mock_pipeline_response))
+        else:
+            llm = system_llm()
+            patcher = contextlib.nullcontext()
+        with patcher:
+            report = {
+                'multi': _pipeline_stats(asyncio.run(run_all(llm, run_multi_prompts))),
+                'structured': _pipeline_stats(asyncio.run(run_all(llm, run_structured_prompts))),
+            }
+
+    click.echo(f"{'':20}{'multi':>14}{'structured':>14}")
+    for key in report['multi']:
+        click.echo(f"{key:20}{report['multi'][key]!s:>14}{report['structured'][key]!s:>14}")
+
+
+@click.command('prompt-cache-report')
+@click.option('--days', default=7, show_default=True, help="Number of days of recorded queries to include.")
+@with_appcontext
+def prompt_cache_report(days):
+    """Compare provider prompt-cache hit ratios and latency of the prompt layouts (see PROMPT_LAYOUT).
+
+    Uses the cached-token counts and wall times recorded for each query's
+    completions, so run it after serving queries with each layout.  Only
+    providers that report cached tokens (e.g., OpenAI) will show hits.
+    """
+    from .admin import get_prompt_cache_stats
+
+    rows = get_prompt_cache_stats(days)
+    if not rows:
+        click.echo("No completions recorded.")
+        return
+
+    click.echo(f"{'stage':14}{'layout':>14}{'calls':>8}{'prompt tokens':>15}{'cached tokens':>15}{'hit %':>8}{'avg ms':>9}")
+    for row in rows:
+        click.echo(f"{row['stage']:14}{row['layout']:>14}{row['calls']:>8}{row['prompt_tokens']:>15}{row['cached_tokens'] or 0:>15}{row['hit_pct'] or 0:>8}{row['avg_ms']:>9.0f}")
+
+
+@click.command('deliver-webhooks')
+@with_appcontext
+def deliver_webhooks():
+    """Deliver any due webhook notifications (see webhooks.py).
+
+    The dispatcher thread only starts on a new notification, so this picks up
+    notifications left in the outbox by a restart; it can also run from cron
+    where WEBHOOK_DISPATCHER is off.
+    """
+    from .webhooks import deliver_due
+
+    count = deliver_due()
+    click.echo(f"Attempted {count} webhook deliveries.")
+
+
 def register_commands(app):
-    app.cli.add_command(dartmouth_migrations)
\ No newline at end of file
+    app.cli.add_command(dartmouth_migrations)
+    app.cli.add_command(backfill_query_signatures)
+    app.cli.add_command(compare_pipelines)
+    app.cli.add_command(prompt_cache_report)
+    app.cli.add_command(deliver_webhooks)
@@ -0,0 +1,22 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Additional API keys of a consumer or user class, to spread requests over (see gened.keypool)
+CREATE TABLE api_key_pool (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    consumer_id  INTEGER,  -- exactly one of consumer_id and class_id is set
+    class_id     INTEGER,  -- a user class (classes_user.class_id)
+    api_key      TEXT NOT NULL,
+    weight       INTEGER NOT NULL DEFAULT 1,  -- relative share of requests (with 'weighted' selection)
+    created      DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(consumer_id) REFERENCES consumers(id),
+    FOREIGN KEY(class_id) REFERENCES classes_user(class_id),
+    CHECK ((consumer_id IS NULL) != (class_id IS NULL))
+);
+CREATE INDEX api_key_pool_by_consumer ON api_key_pool(consumer_id);
+CREATE INDEX api_key_pool_by_class ON api_key_pool(class_id);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Per-class settings for how queries are answered (see codehelp/query_config.py)
+CREATE TABLE IF NOT EXISTS class_query_configs (
+    class_id  INTEGER PRIMARY KEY,
+    pipeline  TEXT NOT NULL CHECK (pipeline IN ('multi', 'structured')) DEFAULT 'multi',
+    FOREIGN KEY(class_id) REFERENCES classes(id)
+);
+
+COMMIT;
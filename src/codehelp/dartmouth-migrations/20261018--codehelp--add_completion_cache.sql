@@ -0,0 +1,27 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Per-class opt-out of the completion cache (see gened.completion_cache)
+ALTER TABLE classes ADD COLUMN cache_completions BOOLEAN NOT NULL CHECK (cache_completions IN (0,1)) DEFAULT 1;
+
+CREATE TABLE IF NOT EXISTS completion_cache (
+    key            TEXT PRIMARY KEY,  -- hash of (provider, model, normalized messages, temperature)
+    model          TEXT NOT NULL,
+    response_json  TEXT NOT NULL,
+    response_text  TEXT NOT NULL,
+    created        DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    last_used      DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    hits           INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS completion_cache_by_last_used ON completion_cache(last_used);
+
+CREATE TABLE IF NOT EXISTS completion_cache_stats (
+    day     DATE PRIMARY KEY,
+    hits    INTEGER NOT NULL DEFAULT 0,
+    misses  INTEGER NOT NULL DEFAULT 0
+);
+
+COMMIT;
@@ -0,0 +1,14 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Record which provider serves each model, so classes can be routed to different providers (see gened.providers)
+ALTER TABLE models ADD COLUMN provider TEXT NOT NULL DEFAULT 'openai';
+
+UPDATE models SET provider = 'dartmouth' WHERE model LIKE '/api/%';
+UPDATE models SET provider = 'mistral' WHERE model LIKE 'open-%' OR model LIKE 'mistral-%' OR model LIKE 'codestral-%';
+UPDATE models SET provider = 'gemini' WHERE model LIKE 'gemini-%';
+
+COMMIT;
@@ -0,0 +1,13 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Estimated tokens of each query's main prompt, from the preflight check (see codehelp.preflight)
+ALTER TABLE queries ADD COLUMN prompt_tokens_est INTEGER;
+
+-- Per-class input token budget (NULL: QUERY_INPUT_TOKEN_BUDGET)
+ALTER TABLE class_query_configs ADD COLUMN input_token_budget INTEGER;
+
+COMMIT;
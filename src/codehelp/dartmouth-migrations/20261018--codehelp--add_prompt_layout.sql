@@ -0,0 +1,10 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Prompt layout used for each query (see codehelp.prompts.PROMPT_LAYOUTS)
+ALTER TABLE queries ADD COLUMN prompt_layout TEXT;
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- State of queries run as API jobs (see codehelp.jobs); NULL for other queries
+ALTER TABLE queries ADD COLUMN job_status TEXT CHECK (job_status IN ('pending', 'done', 'error'));
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- MinHash signatures of queries for near-duplicate detection (see codehelp/similarity.py)
+-- Signatures for existing queries can be added with `flask backfill-query-signatures`.
+CREATE TABLE IF NOT EXISTS query_signatures (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_id     INTEGER NOT NULL UNIQUE,
+    class_id     INTEGER,
+    context_name TEXT,
+    signature    BLOB NOT NULL,
+    FOREIGN KEY(query_id) REFERENCES queries(id)
+);
+CREATE INDEX IF NOT EXISTS query_signatures_by_context ON query_signatures(class_id, context_name, id);
+
+COMMIT;
@@ -0,0 +1,26 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Tokens, wall time, and provider of each completion made for a query (see gened.usage)
+CREATE TABLE query_stages (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_id           INTEGER NOT NULL,
+    stage              TEXT NOT NULL,  -- 'main', 'sufficiency', 'cleanup', 'structured', or 'topics'
+    provider           TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    prompt_tokens      INTEGER,  -- NULL if not reported by the provider
+    completion_tokens  INTEGER,
+    cached_tokens      INTEGER,  -- prompt tokens served from the provider's prompt cache
+    wall_ms            INTEGER NOT NULL,
+    source             TEXT NOT NULL CHECK (source IN ('api', 'cache', 'coalesced')),
+    error              BOOLEAN NOT NULL CHECK (error IN (0, 1)),
+    created            DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    FOREIGN KEY(query_id) REFERENCES queries(id)
+);
+CREATE INDEX query_stages_by_query ON query_stages(query_id);
+CREATE INDEX query_stages_by_created ON query_stages(created);
+
+COMMIT;
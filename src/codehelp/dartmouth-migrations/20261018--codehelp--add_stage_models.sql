@@ -0,0 +1,26 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Models for the auxiliary stages of a query (sufficiency check, cleanup, topics)
+-- when a model is a class's main model (NULL: use the main model).  See gened.providers.for_stage().
+ALTER TABLE models ADD COLUMN sufficiency_model_id INTEGER REFERENCES models(id);
+ALTER TABLE models ADD COLUMN cleanup_model_id INTEGER REFERENCES models(id);
+ALTER TABLE models ADD COLUMN topics_model_id INTEGER REFERENCES models(id);
+
+-- Route the large OpenAI models' auxiliary stages to their small counterparts
+UPDATE models SET
+    sufficiency_model_id=(SELECT id FROM models WHERE shortname='GPT-4o-mini'),
+    cleanup_model_id=(SELECT id FROM models WHERE shortname='GPT-4o-mini'),
+    topics_model_id=(SELECT id FROM models WHERE shortname='GPT-4o-mini')
+WHERE shortname='GPT-4o';
+
+UPDATE models SET
+    sufficiency_model_id=(SELECT id FROM models WHERE shortname='GPT-5-nano'),
+    cleanup_model_id=(SELECT id FROM models WHERE shortname='GPT-5-mini'),
+    topics_model_id=(SELECT id FROM models WHERE shortname='GPT-5-nano')
+WHERE shortname='GPT-5';
+
+COMMIT;
@@ -0,0 +1,17 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Daily counts of local sufficiency pre-check outcomes (see codehelp/sufficiency.py)
+CREATE TABLE IF NOT EXISTS sufficiency_stats (
+    day        DATE PRIMARY KEY,
+    ambiguous  INTEGER NOT NULL DEFAULT 0,
+    skipped    INTEGER NOT NULL DEFAULT 0,
+    shadowed   INTEGER NOT NULL DEFAULT 0,
+    agreed     INTEGER NOT NULL DEFAULT 0,
+    disagreed  INTEGER NOT NULL DEFAULT 0
+);
+
+COMMIT;
@@ -0,0 +1,50 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Model prices in USD per million tokens, for usage budgets (see gened.budgets; NULL: not priced)
+ALTER TABLE models ADD COLUMN price_prompt REAL;
+ALTER TABLE models ADD COLUMN price_cached REAL;  -- cached prompt tokens (NULL: price_prompt)
+ALTER TABLE models ADD COLUMN price_completion REAL;
+UPDATE models SET price_prompt=0.50, price_completion=1.50 WHERE model LIKE 'gpt-3.5-turbo%';
+UPDATE models SET price_prompt=2.50, price_cached=1.25, price_completion=10.00 WHERE model='gpt-4o';
+UPDATE models SET price_prompt=0.15, price_cached=0.075, price_completion=0.60 WHERE model='gpt-4o-mini';
+
+-- Token and cost budgets of a consumer or class
+CREATE TABLE usage_budgets (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    consumer_id        INTEGER UNIQUE,  -- exactly one of consumer_id and class_id is set
+    class_id           INTEGER UNIQUE,
+    token_limit        INTEGER,  -- NULL: no token limit
+    cost_limit         REAL,     -- USD; NULL: no cost limit
+    fallback_model_id  INTEGER,  -- model to switch to when the budget runs low (NULL: none)
+    spent_tokens       INTEGER NOT NULL DEFAULT 0,
+    spent_cost         REAL NOT NULL DEFAULT 0,
+    period_start       DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,  -- spending is counted from here
+    FOREIGN KEY(consumer_id) REFERENCES consumers(id),
+    FOREIGN KEY(class_id) REFERENCES classes(id),
+    FOREIGN KEY(fallback_model_id) REFERENCES models(id),
+    CHECK ((consumer_id IS NULL) != (class_id IS NULL))
+);
+
+-- Every completion charged to a class
+CREATE TABLE usage_ledger (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    class_id           INTEGER NOT NULL,
+    consumer_id        INTEGER,  -- of an LTI class
+    provider           TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    prompt_tokens      INTEGER NOT NULL,
+    cached_tokens      INTEGER NOT NULL,
+    completion_tokens  INTEGER NOT NULL,
+    estimated          BOOLEAN NOT NULL CHECK (estimated IN (0, 1)),  -- tokens estimated (not reported by the provider)
+    cost               REAL NOT NULL,  -- USD
+    created            DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    FOREIGN KEY(class_id) REFERENCES classes(id),
+    FOREIGN KEY(consumer_id) REFERENCES consumers(id)
+);
+CREATE INDEX usage_ledger_by_class ON usage_ledger(class_id, created);
+
+COMMIT;
@@ -0,0 +1,33 @@
+-- SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+--
+-- SPDX-License-Identifier: AGPL-3.0-only
+
+BEGIN;
+
+-- Completion webhooks (see codehelp.webhooks)
+ALTER TABLE queries ADD COLUMN callback_url TEXT;
+
+CREATE TABLE class_webhooks (
+    class_id  INTEGER PRIMARY KEY,
+    url       TEXT,
+    secret    TEXT NOT NULL,
+    created   DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    FOREIGN KEY(class_id) REFERENCES classes(id)
+);
+
+CREATE TABLE webhook_outbox (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_id      INTEGER NOT NULL,
+    class_id      INTEGER,
+    url           TEXT NOT NULL,
+    status        TEXT NOT NULL CHECK (status IN ('pending', 'delivered', 'failed')) DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    next_attempt  DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    last_error    TEXT,
+    created       DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    delivered     DATETIME,
+    FOREIGN KEY(query_id) REFERENCES queries(id)
+);
+CREATE INDEX webhook_outbox_by_status ON webhook_outbox(status, next_attempt);
+
+COMMIT;
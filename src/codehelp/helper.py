@@ -4,11 +4,15 @@
 
 import asyncio
 import json
+import time
+from collections.abc import AsyncIterator, Callable, Coroutine, Iterator
+from dataclasses import dataclass
 from unittest.mock import patch
 
 from flask import (
     Blueprint,
     abort,
+    current_app,
     flash,
     make_response,
     redirect,
@@ -25,15 +29,19 @@ from gened.auth import (
     login_required,
     tester_required,
 )
+from gened.asgi import async_view
 from gened.classes import switch_class
-from gened.db import get_db
+from gened.db import get_db, run_in_thread
+from gened.eventloop import run_async
 from gened.queries import get_history, get_query
-from gened.testing.mocks import mock_async_completion
-from flask import Flask, current_app
-import os
-import importlib
+from gened.streaming import StreamResult, iter_async, sse_event, sse_response, wants_stream
+from gened.completion_cache import cached_completion, cached_stream_completion
+from gened.providers import LLMConfig, Messages, for_stage, get_completion, with_llm
+from gened.resilience import deadline
+from gened.usage import StageUsage, collect_usage, record_stage
 from typing import Any, Union
-from . import prompts
+from . import prompts, sufficiency, webhooks
+from .cleanup import LOCAL_CLEANUP_RESPONSE, strip_code
 from .context import (
     ContextConfig,
     TaskInstructions,
@@ -41,27 +49,28 @@ from .context import (
     get_context_by_name,
     record_context_string,
 )
+from .preflight import PreflightResult, QueryTooLongError, preflight
 from .prompts import get_group_prompt_for_user
+from .query_config import Pipeline, get_input_budget, get_pipeline
+from .similarity import SimilarQuery, find_similar_helpful, index_queries, index_query
 
 
-# Get the model provider from environment variable or default to 'openai'
-provider = os.environ.get('MODEL_PROVIDER', 'openai').lower()
-
-try:
-    # Dynamically import the relevant module based on the provider
-    module = importlib.import_module(f"gened.{provider}")
+bp = Blueprint('helper', __name__, url_prefix="/help", template_folder='templates')
 
-    # Dynamically retrieve the necessary components from the module
-    LLMConfig: Any = getattr(module, "LLMConfig")
-    get_completion: Any = getattr(module, "get_completion")
-    with_llm: Any = getattr(module, "with_llm")
 
-except ImportError:
-    raise ValueError(f"Model provider '{provider}' could not be found. Please ensure it is installed and available.")
-except AttributeError as e:
-    raise AttributeError(f"One or more expected attributes (LLMConfig, get_completion, with_llm) were not found in the '{provider}' module. {str(e)}")
+@dataclass(frozen=True)
+class QueryInput:
+    ''' One query of a batch (see record_queries() and answer_queries_async()). '''
+    context: ContextConfig | TaskInstructions | None
+    code: str
+    error: str
+    issue: str
+    algorea_id: str | None = None
+    callback_url: str | None = None
 
-bp = Blueprint('helper', __name__, url_prefix="/help", template_folder='templates')
+    @property
+    def algorea_user_id(self) -> int | None:
+        return int(self.algorea_id) if self.algorea_id and self.algorea_id.isdigit() else None
 
 
 @bp.route("/")
@@ -70,7 +79,7 @@ bp = Blueprint('helper', __name__, url_prefix="/help", template_folder='template
 @login_required
 @class_enabled_required
 @with_llm(spend_token=False)  # get information on the selected LLM, tokens remaining
-def help_form(llm: LLMConfig, query_id: int | None = None, class_id: int | None = None, ctx_name: str | None = None) -> str | Response: # type: ignore
+def help_form(llm: LLMConfig, query_id: int | None = None, class_id: int | None = None, ctx_name: str | None = None) -> str | Response:
     db = get_db()
     auth = get_auth()
     
@@ -157,43 +166,55 @@ def help_view(query_id: int) -> str | Response:
 
     return render_template("help_view.html", query=query_row, responses=responses, history=history, topics=topics)
 
-async def run_query_prompts(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None, algorea_user_id: int | None) -> tuple[list[dict[str, str]], dict[str, str]]: # type: ignore
-    ''' Run the given query against the coding help system of prompts using Dartmouth API.
+def current_pipeline() -> Pipeline:
+    ''' The query pipeline configured for the current class (see query_config.py). '''
+    return get_pipeline(get_auth()['class_id'])
+
+
+def ids_from_context(context: ContextConfig | TaskInstructions | None, class_id: int | None, algorea_user_id: int | None) -> tuple[int | None, int | None]:
+    ''' Fill in the class and Algorea user IDs from the context, where it has them and they weren't given. '''
+    if class_id is None:
+        class_id = getattr(context, 'class_id', None)
+    if algorea_user_id is None:
+        algorea_user_id = getattr(context, 'algorea_user_id', None)
+    return class_id, algorea_user_id
+
+
+async def run_query_prompts(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None, algorea_user_id: int | None) -> tuple[list[dict[str, str]], dict[str, str]]:
+    ''' Run the given query against the coding help system of prompts, using llm's provider
+    and the pipeline configured for the current class (see query_config.py).
 
     Returns a tuple containing:
-      1) A list of response objects from the Dartmouth completion (to be stored in the database)
+      1) A list of response objects from the LLM completions (to be stored in the database)
       2) A dictionary of response text, potentially including keys 'insufficient' and 'main'.
     '''
+    if await asyncio.to_thread(current_pipeline) == 'structured':
+        return await run_structured_prompts(llm, context, code, error, issue, class_id, algorea_user_id)
+    return await run_multi_prompts(llm, context, code, error, issue, class_id, algorea_user_id)
+
+
+async def run_multi_prompts(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None, algorea_user_id: int | None) -> tuple[list[dict[str, str]], dict[str, str]]:
+    ''' The 'multi' pipeline: separate main and sufficiency completions, plus a cleanup completion if needed. '''
     context_str = context.prompt_str() if context is not None else None
-    
-    #print(f"[DEBUG] Initial values - class_id: {class_id}, algorea_user_id: {algorea_user_id}")
-    
-    # Extract IDs from context if not provided
-    if class_id is None and hasattr(context, 'class_id'):
-        class_id = getattr(context, 'class_id', None)
-        #print(f"[DEBUG] After context check - got class_id: {class_id} from context")
-    if algorea_user_id is None and hasattr(context, 'algorea_user_id'):
-        algorea_user_id = getattr(context, 'algorea_user_id', None)
-        #print(f"[DEBUG] After context check - got algorea_user_id: {algorea_user_id} from context")
-        
-    #print(f"[DEBUG] Final values before make_main_prompt - class_id: {class_id}, algorea_user_id: {algorea_user_id}")
-    
-    main_prompt_messages = prompts.make_main_prompt(code, error, issue, context_str, class_id=class_id, algorea_user_id=algorea_user_id)
+    class_id, algorea_user_id = ids_from_context(context, class_id, algorea_user_id)
+
+    # (reads the class's group prompts from the database, so it runs in a worker thread)
+    main_prompt_messages = await asyncio.to_thread(prompts.make_main_prompt, code, error, issue, context_str, class_id=class_id, algorea_user_id=algorea_user_id, layout=prompts.prompt_layout())
     # print(f"algorea id here: {algorea_user_id}")
     # print(f"class id: {class_id}")
     # print("Prompt sent to LLM:", main_prompt_messages)
     # Launch the "sufficient detail" check concurrently with the main prompt
+    # (Identical prompts are answered from the completion cache, if enabled for the class.)
     task_main = asyncio.create_task(
-        get_completion(
+        stage_completion(
+            'main',
             llm,  # Pass whole llm config instead of client
             main_prompt_messages,
+            hedge=True,
         )
     )
     task_sufficient = asyncio.create_task(
-        get_completion(
-            llm,  # Pass whole llm config instead of client
-            prompts.make_sufficient_prompt(code, error, issue, context_str),
-        )
+        run_sufficient_check(llm, context, code, error, issue, context_str)
     )
 
     # Store all responses received
@@ -203,46 +224,403 @@ async def run_query_prompts(llm: LLMConfig, context: ContextConfig | TaskInstruc
     response_main, response_txt = await task_main
     responses.append(response_main)
 
-    if "```" in response_txt or "should look like" in response_txt or "should look something like" in response_txt:
-        # Extract custom prompt from the DB using class_id and algorea_user_id
-        custom_prompt = ""
-        if class_id is not None and algorea_user_id is not None:
-            # You may need to pass additional arguments as required by your function
-            custom_prompt = get_group_prompt_for_user(class_id, algorea_user_id, code, error, issue, context_str)
-        
-        # That's probably too much code. Let's clean it up...
-        cleanup_prompt = prompts.make_cleanup_prompt(response_text=response_txt, custom_instruction=custom_prompt)
-        cleanup_response, cleanup_response_txt = await get_completion(
-            llm,  # Pass whole llm config
-            [{"role" : "user", "content": cleanup_prompt}]
-        )
+    if needs_cleanup(response_txt):
+        cleanup_response, response_txt = await run_cleanup(llm, response_txt, code, error, issue, context_str, class_id, algorea_user_id)
         responses.append(cleanup_response)
-        response_txt = cleanup_response_txt
 
     # Check whether there is sufficient information
     response_sufficient, response_sufficient_txt = await task_sufficient
     responses.append(response_sufficient)
-    if 'error' in response_main:
+    return responses, combine_texts(response_main, response_txt, response_sufficient_txt)
+
+
+def parse_structured_response(response_txt: str) -> dict[str, Any] | None:
+    ''' Parse the JSON object requested by prompts.make_structured_prompt(), or None if it is malformed. '''
+    text = response_txt.strip()
+    # Some models wrap JSON in a Markdown code block despite instructions
+    if text.startswith("```"):
+        text = text.partition("\n")[2].rpartition("```")[0]
+    try:
+        data = json.loads(text)
+    except json.decoder.JSONDecodeError:
+        return None
+    if not isinstance(data, dict) or not isinstance(data.get('main'), str) or not isinstance(data.get('sufficient'), bool):
+        return None
+    if not isinstance(data.get('clarification'), str):
+        data['clarification'] = ""
+    return data
+
+
+async def run_structured_prompts(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None, algorea_user_id: int | None) -> tuple[list[dict[str, str]], dict[str, str]]:
+    ''' The 'structured' pipeline: one completion returning the main response and sufficiency assessment as JSON.
+
+    Falls back to the cleanup completion if the response still contains code, and
+    to the 'multi' pipeline if the model doesn't return the requested JSON.
+    '''
+    context_str = context.prompt_str() if context is not None else None
+    class_id, algorea_user_id = ids_from_context(context, class_id, algorea_user_id)
+
+    messages = await asyncio.to_thread(prompts.make_structured_prompt, code, error, issue, context_str, class_id=class_id, algorea_user_id=algorea_user_id, layout=prompts.prompt_layout())
+    response, response_txt = await stage_completion('structured', llm, messages, hedge=True)
+    responses = [response]
+    if 'error' in response:
         return responses, {'error': response_txt}
-    elif response_sufficient_txt.endswith("OK") or "OK." in response_sufficient_txt or "```" in response_sufficient_txt or "is sufficient for me" in response_sufficient_txt or response_sufficient_txt.startswith("Error ("):
+
+    data = parse_structured_response(response_txt)
+    if data is None:
+        multi_responses, texts = await run_multi_prompts(llm, context, code, error, issue, class_id, algorea_user_id)
+        return responses + multi_responses, texts
+
+    main_txt = data['main']
+    if needs_cleanup(main_txt):
+        cleanup_response, main_txt = await run_cleanup(llm, main_txt, code, error, issue, context_str, class_id, algorea_user_id)
+        responses.append(cleanup_response)
+
+    if data['sufficient'] or not data['clarification']:
+        return responses, {'main': main_txt}
+    else:
+        return responses, {'insufficient': data['clarification'], 'main': main_txt}
+
+
+async def run_sufficient_check(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, context_str: str | None) -> tuple[dict[str, str], str | None]:
+    ''' Check whether the query has sufficient detail, skipping the LLM call if the local
+    pre-check finds it clearly sufficient (see sufficiency.py).
+
+    Returns the response object and text, with text None if the LLM call was skipped.
+    '''
+    decision = await asyncio.to_thread(sufficiency.precheck, context.name if context is not None else None, code, error, issue)
+    if decision == 'skip':
+        return sufficiency.SKIPPED_RESPONSE, None
+
+    response, response_txt = await stage_completion(
+        'sufficiency',
+        for_stage(llm, 'sufficiency'),
+        prompts.make_sufficient_prompt(code, error, issue, context_str, layout=prompts.prompt_layout()),
+    )
+    if decision == 'shadow' and 'error' not in response:
+        await asyncio.to_thread(sufficiency.record_shadow_result, sufficiency.llm_says_sufficient(response_txt))
+    return response, response_txt
+
+
+async def stage_completion(stage: str, llm: LLMConfig, messages: Messages, *, hedge: bool = False) -> tuple[dict[str, Any], str]:
+    ''' cached_completion(), recording the stage's tokens and wall time (see gened.usage). '''
+    start = time.monotonic()
+    response, response_txt = await cached_completion(llm, messages, hedge=hedge)
+    record_stage(stage, llm, response, time.monotonic() - start)
+    return response, response_txt
+
+
+def needs_cleanup(response_txt: str) -> bool:
+    ''' True if the main response probably contains too much code and should be cleaned up. '''
+    return "```" in response_txt or "should look like" in response_txt or "should look something like" in response_txt
+
+
+async def run_cleanup(llm: LLMConfig, response_txt: str, code: str, error: str, issue: str, context_str: str | None, class_id: int | None, algorea_user_id: int | None) -> tuple[dict[str, str], str]:
+    ''' Remove example code from a response: locally if possible (see cleanup.py), otherwise with an LLM rewrite. '''
+    if current_app.config['LOCAL_CODE_CLEANUP']:
+        stripped = strip_code(response_txt)
+        if stripped is not None:
+            return LOCAL_CLEANUP_RESPONSE, stripped
+
+    # Extract custom prompt from the DB using class_id and algorea_user_id
+    custom_prompt = ""
+    if class_id is not None and algorea_user_id is not None:
+        # You may need to pass additional arguments as required by your function
+        custom_prompt = await asyncio.to_thread(get_group_prompt_for_user, class_id, algorea_user_id, code, error, issue, context_str)
+
+    # That's probably too much code. Let's clean it up...
+    cleanup_prompt = prompts.make_cleanup_prompt(response_text=response_txt, custom_instruction=custom_prompt)
+    return await stage_completion(
+        'cleanup',
+        for_stage(llm, 'cleanup'),
+        [{"role" : "user", "content": cleanup_prompt}]
+    )
+
+
+def combine_texts(response_main: dict[str, str], response_txt: str, response_sufficient_txt: str | None) -> dict[str, str]:
+    ''' Build the dictionary of response texts stored with a query from the main and sufficiency responses.
+
+    response_sufficient_txt is None if the sufficiency check was skipped.
+    '''
+    if 'error' in response_main:
+        return {'error': response_txt}
+    elif response_sufficient_txt is None or sufficiency.llm_says_sufficient(response_sufficient_txt):
         # We're using just the main response.
-        return responses, {'main': response_txt}
+        return {'main': response_txt}
     else:
         # Give them the request for more information plus the main response
-        return responses, {'insufficient': response_sufficient_txt, 'main': response_txt}
+        return {'insufficient': response_sufficient_txt, 'main': response_txt}
+
 
-def run_query(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None = None, algorea_user_id: int | None = None) -> int: # type: ignore
-    ''' Run the given query against the coding help system of prompts using Dartmouth API.
+async def stream_query_prompts(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None, algorea_user_id: int | None) -> AsyncIterator[tuple[str, Any]]:
+    ''' Streaming version of run_query_prompts().
+
+    Yields (event, data) pairs:
+      - ('delta', {'text': ...}) for each piece of the main response as it arrives
+      - ('replace', {'text': ...}) if the main response was rewritten by the cleanup pass
+      - ('insufficient', {'text': ...}) if the query needs more information
+      - ('error', {'text': ...}) if the main completion failed
+      - ('result', (responses, texts)) last, with the same values run_query_prompts() returns
+    '''
+    if await asyncio.to_thread(current_pipeline) == 'structured':
+        # A JSON response can't be shown as it streams; send the main text when it's complete.
+        responses, texts = await run_structured_prompts(llm, context, code, error, issue, class_id, algorea_user_id)
+        if 'main' in texts:
+            yield 'delta', {'text': texts['main']}
+        if 'error' in texts:
+            yield 'error', {'text': texts['error']}
+        if 'insufficient' in texts:
+            yield 'insufficient', {'text': texts['insufficient']}
+        yield 'result', (responses, texts)
+        return
+
+    context_str = context.prompt_str() if context is not None else None
+    class_id, algorea_user_id = ids_from_context(context, class_id, algorea_user_id)
+
+    main_prompt_messages = await asyncio.to_thread(prompts.make_main_prompt, code, error, issue, context_str, class_id=class_id, algorea_user_id=algorea_user_id, layout=prompts.prompt_layout())
+    task_sufficient = asyncio.create_task(
+        run_sufficient_check(llm, context, code, error, issue, context_str)
+    )
+
+    try:
+        main = StreamResult()
+        start = time.monotonic()
+        async for delta in cached_stream_completion(llm, main_prompt_messages, main):
+            yield 'delta', {'text': delta}
+        record_stage('main', llm, main.response, time.monotonic() - start)
+
+        responses = [main.response]
+        response_txt = main.text
+
+        if not main.is_error and needs_cleanup(response_txt):
+            cleanup_response, response_txt = await run_cleanup(llm, response_txt, code, error, issue, context_str, class_id, algorea_user_id)
+            responses.append(cleanup_response)
+            yield 'replace', {'text': response_txt}
+
+        response_sufficient, response_sufficient_txt = await task_sufficient
+        responses.append(response_sufficient)
+        texts = combine_texts(main.response, response_txt, response_sufficient_txt)
+    finally:
+        # If the client went away mid-stream, don't leave the check running
+        task_sufficient.cancel()
+
+    if 'error' in texts:
+        yield 'error', {'text': texts['error']}
+    if 'insufficient' in texts:
+        yield 'insufficient', {'text': texts['insufficient']}
+    yield 'result', (responses, texts)
+
+
+def run_query(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None = None, algorea_user_id: int | None = None) -> int:
+    ''' Run the given query against the coding help system of prompts, using llm's provider.
     
     Returns the ID of the newly created query.
     '''
     query_id = record_query(context, code, error, issue)
-    responses, texts = asyncio.run(run_query_prompts(llm, context, code, error, issue, class_id, algorea_user_id))
-    record_response(query_id, responses, texts)
+    answer_query(llm, context, code, error, issue, query_id, class_id=class_id, algorea_user_id=algorea_user_id)
+    return query_id
+
+
+async def run_query_async(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None = None, algorea_user_id: int | None = None) -> int:
+    ''' Async version of run_query(), for async views (see gened.asgi). '''
+    query_id = await asyncio.to_thread(record_query, context, code, error, issue)
+    await answer_query_async(llm, context, code, error, issue, query_id, class_id=class_id, algorea_user_id=algorea_user_id)
     return query_id
 
 
-def record_query(context: Union[ContextConfig, TaskInstructions, None], code: str, error: str, issue: str) -> int:
+async def answer_queries_async(llm: LLMConfig, queries: list[QueryInput], query_ids: list[int], class_id: int | None, concurrency: int, on_done: Callable[[int, Exception | None], None] | None = None) -> list[Exception | None]:
+    ''' Answer a batch of queries already recorded with record_queries(), at most `concurrency` at a time.
+
+    Returns, for each query, the exception that stopped it from being answered, or None.
+    If given, on_done(query_id, exception) is called (in a thread) as each one finishes.
+
+    Each query's database work runs in its own worker-thread calls, with their own
+    connections and transactions (see gened.db), so concurrent queries can't commit
+    or roll back each other's writes.
+    '''
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer_one(query: QueryInput, query_id: int) -> Exception | None:
+        async with semaphore:
+            try:
+                await answer_query_async(llm, query.context, query.code, query.error, query.issue, query_id, class_id=class_id, algorea_user_id=query.algorea_user_id)
+                result = None
+            except Exception as e:
+                current_app.logger.exception(f"Batch query {query_id} failed")
+                result = e
+        if on_done is not None:
+            await run_in_thread(on_done, query_id, result)
+        return result
+
+    return list(await asyncio.gather(*[answer_one(query, query_id) for query, query_id in zip(queries, query_ids, strict=True)]))
+
+
+def answer_query(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, query_id: int, class_id: int | None = None, algorea_user_id: int | None = None) -> None:
+    ''' Get and record the responses to a query already recorded with record_query(). '''
+    run_async(answer_query_async(llm, context, code, error, issue, query_id, class_id=class_id, algorea_user_id=algorea_user_id))
+
+
+async def answer_query_async(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, query_id: int, class_id: int | None = None, algorea_user_id: int | None = None) -> None:
+    ''' Async version of answer_query().
+
+    The similarity search, preflight check, and database writes run in threads, so the event loop only waits on completions.
+    '''
+    similar = await run_in_thread(find_similar, query_id, context, code, error, issue)
+    if similar is not None and current_app.config['SIMILAR_QUERY_SERVE']:
+        await run_in_thread(record_response, query_id, [reused_response(similar)], similar.responses)
+        return
+
+    try:
+        checked = await run_in_thread(run_preflight, llm, context, code, error, issue, query_id)
+    except QueryTooLongError:
+        return  # with the error recorded as its response
+
+    with collect_usage() as stages, deadline(current_app.config['QUERY_DEADLINE']):
+        responses, texts = await run_query_prompts(llm, context, checked.code, checked.error, checked.issue, class_id, algorea_user_id)
+    await run_in_thread(record_response, query_id, responses, texts)
+    await run_in_thread(record_stages, query_id, stages)
+
+
+def stream_query(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, done_data: Callable[[int], dict[str, Any]], class_id: int | None = None, algorea_user_id: int | None = None) -> tuple[int, Iterator[str]]:
+    ''' Streaming version of run_query().
+
+    Records the query immediately and returns its ID along with an iterator of
+    Server-Sent Events carrying the response as it is generated.  The responses
+    are recorded when the stream ends, and the final 'done' event carries
+    done_data(query_id).
+
+    If a helpful response to a near-duplicate query is found, it is sent first
+    in a 'similar' event, and if SIMILAR_QUERY_SERVE is set, it is used as the
+    response without calling the LLM.
+    '''
+    query_id = record_query(context, code, error, issue)
+    similar = find_similar(query_id, context, code, error, issue)
+    serve_similar = similar is not None and current_app.config['SIMILAR_QUERY_SERVE']
+    checked = None
+    rejected_text = None
+    if not serve_similar:
+        try:
+            checked = run_preflight(llm, context, code, error, issue, query_id)
+        except QueryTooLongError as e:
+            rejected_text = too_long_text(e)
+
+    def events() -> Iterator[str]:
+        yield sse_event('query', {'query_id': query_id})
+        if similar is not None:
+            yield sse_event('similar', {
+                'query_id': similar.query_id,
+                'similarity': round(similar.similarity, 3),
+                'text': similar.responses.get('main', ''),
+                'served': serve_similar,
+            })
+        if serve_similar:
+            assert similar is not None
+            record_response(query_id, [reused_response(similar)], similar.responses)
+            yield sse_event('delta', {'text': similar.responses.get('main', '')})
+            if 'insufficient' in similar.responses:
+                yield sse_event('insufficient', {'text': similar.responses['insufficient']})
+            yield sse_event('done', done_data(query_id))
+            return
+
+        if checked is None:
+            # rejected by the preflight check, with the error already recorded
+            yield sse_event('error', {'text': rejected_text})
+            yield sse_event('done', done_data(query_id))
+            return
+
+        # The deadline covers opening the main stream and the other completions, not the streamed text itself
+        with collect_usage() as stages, deadline(current_app.config['QUERY_DEADLINE']):
+            sent_text = ""  # the main response, as far as the client has been sent it
+            recorded = False
+            try:
+                for event, data in iter_async(stream_query_prompts(llm, context, checked.code, checked.error, checked.issue, class_id, algorea_user_id)):
+                    if event == 'result':
+                        responses, texts = data
+                        record_response(query_id, responses, texts)
+                        record_stages(query_id, stages)
+                        recorded = True
+                    else:
+                        if event == 'delta':
+                            sent_text += data['text']
+                        elif event == 'replace':
+                            sent_text = data['text']
+                        yield sse_event(event, data)
+            except BaseException as e:
+                # Includes GeneratorExit, if the client went away mid-stream: record what it was sent
+                if not recorded:
+                    name = "ClientDisconnected" if isinstance(e, GeneratorExit) else type(e).__name__
+                    error_text = f"Error ({name}).  The response was not completed."
+                    texts = {'error': error_text, 'main': sent_text} if sent_text else {'error': error_text}
+                    record_response(query_id, [{'error': error_text}], texts)
+                    record_stages(query_id, stages)
+                raise
+        yield sse_event('done', done_data(query_id))
+
+    return query_id, events()
+
+
+def too_long_text(e: QueryTooLongError) -> str:
+    return f"Error (QueryTooLongError).  {e}"
+
+
+def run_preflight(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, query_id: int) -> PreflightResult:
+    ''' Fit a query into its class's input budget before any completion is requested (see preflight.py),
+    recording the estimated prompt tokens with the query.
+
+    Raises QueryTooLongError, after recording it as the query's response, if the query is too long.
+    '''
+    db = get_db()
+    context_str = context.prompt_str() if context is not None else None
+    try:
+        checked = preflight(llm.model, code, error, issue, context_str, get_input_budget(get_auth()['class_id']))
+    except QueryTooLongError as e:
+        db.execute("UPDATE queries SET prompt_tokens_est=? WHERE id=?", [e.estimated_tokens, query_id])
+        record_response(query_id, [{'error': f"QueryTooLongError: estimated {e.estimated_tokens} tokens, limit {e.limit}"}], {'error': too_long_text(e)})
+        raise
+
+    db.execute("UPDATE queries SET prompt_tokens_est=? WHERE id=?", [checked.prompt_tokens, query_id])
+    db.commit()
+    return checked
+
+
+def record_query(context: Union[ContextConfig, TaskInstructions, None], code: str, error: str, issue: str, job_status: str | None = None, callback_url: str | None = None) -> int:
+    auth = get_auth()
+    db = get_db()
+
+    new_row_id = _insert_query(context, code, error, issue, job_status, callback_url)
+    db.commit()
+
+    index_query(new_row_id, auth['class_id'], context.name if context is not None else None, code, error, issue)
+
+    return new_row_id
+
+
+def record_queries(queries: list[QueryInput], job_status: str | None = None) -> list[int]:
+    ''' Record a batch of queries in a single transaction, returning their IDs. '''
+    auth = get_auth()
+    db = get_db()
+
+    try:
+        query_ids = [_insert_query(q.context, q.code, q.error, q.issue, job_status, q.callback_url) for q in queries]
+        db.executemany(
+            "UPDATE queries SET algorea_id=? WHERE id=?",
+            [(q.algorea_id, query_id) for q, query_id in zip(queries, query_ids, strict=True) if q.algorea_id is not None]
+        )
+    except Exception:
+        db.rollback()
+        raise
+    db.commit()
+
+    index_queries(auth['class_id'], [
+        (query_id, q.context.name if q.context is not None else None, q.code, q.error, q.issue)
+        for q, query_id in zip(queries, query_ids, strict=True)
+    ])
+
+    return query_ids
+
+
+def _insert_query(context: Union[ContextConfig, TaskInstructions, None], code: str, error: str, issue: str, job_status: str | None, callback_url: str | None = None) -> int:
+    ''' Insert a row into queries, without committing. '''
     db = get_db()
     auth = get_auth()
     role_id = auth['role_id']
@@ -258,17 +636,26 @@ def record_query(context: Union[ContextConfig, TaskInstructions, None], code: st
         context_string_id = None
 
     cur = db.execute(
-        "INSERT INTO queries (context_name, context_string_id, code, error, issue, user_id, role_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-        [context_name, context_string_id, code, error, issue, auth['user_id'], role_id]
+        "INSERT INTO queries (context_name, context_string_id, code, error, issue, prompt_layout, job_status, callback_url, user_id, role_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [context_name, context_string_id, code, error, issue, prompts.prompt_layout(), job_status, callback_url, auth['user_id'], role_id]
     )
     new_row_id = cur.lastrowid
-    db.commit()
-
     assert new_row_id is not None
-
     return new_row_id
 
 
+def find_similar(query_id: int, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str) -> SimilarQuery | None:
+    ''' Find a helpful earlier query in the current class and context that is a near-duplicate of the given one. '''
+    auth = get_auth()
+    context_name = context.name if context is not None else None
+    return find_similar_helpful(auth['class_id'], context_name, code, error, issue, exclude_id=query_id)
+
+
+def reused_response(similar: SimilarQuery) -> dict[str, Any]:
+    ''' The response object stored for a query answered with a near-duplicate's response. '''
+    return {'reused_query_id': similar.query_id, 'similarity': round(similar.similarity, 3)}
+
+
 def record_response(query_id: int, responses: list[dict[str, str]], texts: dict[str, str]) -> None:
     db = get_db()
 
@@ -276,6 +663,19 @@ def record_response(query_id: int, responses: list[dict[str, str]], texts: dict[
         "UPDATE queries SET response_json=?, response_text=? WHERE id=?",
         [json.dumps(responses), json.dumps(texts), query_id]
     )
+    notified = webhooks.enqueue(query_id)  # in the same transaction, so the notification can't be lost
+    db.commit()
+    if notified:
+        webhooks.notify()
+
+
+def record_stages(query_id: int, stages: list[StageUsage]) -> None:
+    ''' Store the tokens, wall time, and provider of each completion made for a query. '''
+    db = get_db()
+    db.executemany(
+        "INSERT INTO query_stages (query_id, stage, provider, model, prompt_tokens, completion_tokens, cached_tokens, wall_ms, source, error) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        [(query_id, st.stage, st.provider, st.model, st.prompt_tokens, st.completion_tokens, st.cached_tokens, st.wall_ms, st.source, st.error) for st in stages]
+    )
     db.commit()
 
 
@@ -291,11 +691,12 @@ def store_algorea_id(query_id: int, algorea_id: str) -> None:
     db.commit()
 
 
-@bp.route("/request", methods=["POST"])
+@bp.route("/request", methods=["POST"])  # type: ignore[type-var]  # may return a coroutine (see gened.asgi)
+@async_view
 @login_required
 @class_enabled_required
 @with_llm(spend_token=True)
-def help_request(llm: LLMConfig) -> Response: # type: ignore
+def help_request(llm: LLMConfig) -> Response | Coroutine[Any, Any, Response]:
     if 'context' in request.form:
         context = get_context_by_name(request.form['context'])
         if context is None:
@@ -317,9 +718,20 @@ def help_request(llm: LLMConfig) -> Response: # type: ignore
     
     # print(f"We are getting class id {class_id} (from {class_id_str}) and algorea id: {algorea_user_id} (from {algorea_user_id_str})")
 
-    # TODO: limit length of code/error/issue
+    # Long code and errors are trimmed, and queries too long for the model rejected, by run_preflight()
+
+    if wants_stream():
+        def done_data(query_id: int) -> dict[str, Any]:
+            return {'query_id': query_id, 'url': url_for(".help_view", query_id=query_id)}
+
+        _, events = stream_query(llm, context, code, error, issue, done_data, class_id=class_id, algorea_user_id=algorea_user_id)
+        return sse_response(events)
 
-    query_id = run_query(llm, context, code, error, issue, class_id=class_id, algorea_user_id=algorea_user_id)
+    return help_request_async(llm, context, code, error, issue, class_id, algorea_user_id)
+
+
+async def help_request_async(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, class_id: int | None, algorea_user_id: int | None) -> Response:
+    query_id = await run_query_async(llm, context, code, error, issue, class_id=class_id, algorea_user_id=algorea_user_id)
 
     return redirect(url_for(".help_view", query_id=query_id))
 
@@ -327,7 +739,7 @@ def help_request(llm: LLMConfig) -> Response: # type: ignore
 @bp.route("/load_test", methods=["POST"])
 @admin_required
 @with_llm(use_system_key=True)  # get a populated LLMConfig; not actually used (API is mocked)
-def load_test(llm: LLMConfig) -> Response: # type: ignore
+def load_test(llm: LLMConfig) -> Response:
     # Require that we're logged in as the load_test admin user
     auth = get_auth()
     if auth['display_name'] != 'load_test':
@@ -338,6 +750,9 @@ def load_test(llm: LLMConfig) -> Response: # type: ignore
     error = "__LOADTEST_Error"
     issue = "__LOADTEST_Issue"
 
+    # Only needed here, so the openai SDK isn't loaded at startup unless a provider uses it
+    from gened.testing.mocks import mock_async_completion
+
     # Monkey-patch to not call the API but simulate it with a delay
     with patch("openai.resources.chat.AsyncCompletions.create") as mocked:
         # simulate a 2 second delay for a network request
@@ -361,29 +776,31 @@ def post_helpful() -> str:
     return ""
 
 
-@bp.route("/topics/html/<int:query_id>", methods=["GET", "POST"])
+@bp.route("/topics/html/<int:query_id>", methods=["GET", "POST"])  # type: ignore[type-var]  # may return a coroutine (see gened.asgi)
+@async_view
 @login_required
 @tester_required
 @with_llm(spend_token=False)
-def get_topics_html(llm: LLMConfig, query_id: int) -> str: # type: ignore
-    topics = get_topics(llm, query_id)
+async def get_topics_html(llm: LLMConfig, query_id: int) -> str:
+    topics = await get_topics(llm, query_id)
     if not topics:
         return render_template("topics_fragment.html", error=True)
     else:
         return render_template("topics_fragment.html", query_id=query_id, topics=topics)
 
 
-@bp.route("/topics/raw/<int:query_id>", methods=["GET", "POST"])
+@bp.route("/topics/raw/<int:query_id>", methods=["GET", "POST"])  # type: ignore[type-var]  # may return a coroutine (see gened.asgi)
+@async_view
 @login_required
 @tester_required
 @with_llm(spend_token=False)
-def get_topics_raw(llm: LLMConfig, query_id: int) -> list[str]: # type: ignore
-    topics = get_topics(llm, query_id)
+async def get_topics_raw(llm: LLMConfig, query_id: int) -> list[str]:
+    topics = await get_topics(llm, query_id)
     return topics
 
 
-def get_topics(llm: LLMConfig, query_id: int) -> list[str]: # type: ignore
-    query_row, responses = get_query(query_id)
+async def get_topics(llm: LLMConfig, query_id: int) -> list[str]:
+    query_row, responses = await asyncio.to_thread(get_query, query_id)
 
     if not query_row or not responses or 'main' not in responses:
         return []
@@ -396,11 +813,12 @@ def get_topics(llm: LLMConfig, query_id: int) -> list[str]: # type: ignore
         responses['main']
     )
 
-    response, response_txt = asyncio.run(get_completion(
-        client=llm.client,
-        model=llm.model,
-        messages=messages,
-    ))
+    topics_llm = for_stage(llm, 'topics')
+    with collect_usage() as stages:
+        start = time.monotonic()
+        response, response_txt = await get_completion(topics_llm, messages)
+        record_stage('topics', topics_llm, response, time.monotonic() - start)
+    await asyncio.to_thread(record_stages, query_id, stages)
 
     # Verify it is actually JSON
     # May be "Error (..." if an API error occurs, or every now and then may get "Here is the JSON: ..." or similar.
@@ -409,8 +827,12 @@ def get_topics(llm: LLMConfig, query_id: int) -> list[str]: # type: ignore
     except json.decoder.JSONDecodeError:
         return []
 
-    # Save topics into queries table for the given query
+    await asyncio.to_thread(record_topics, query_id, response_txt)
+    return topics
+
+
+def record_topics(query_id: int, topics_json: str) -> None:
+    ''' Save topics into queries table for the given query. '''
     db = get_db()
-    db.execute("UPDATE queries SET topics_json=? WHERE id=?", [response_txt, query_id])
+    db.execute("UPDATE queries SET topics_json=? WHERE id=?", [topics_json, query_id])
     db.commit()
-    return topics
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Queries run as background jobs, for the API's asynchronous job mode.
+
+POST /api/query normally holds its request, and a WSGI worker, for the
+whole multi-call query pipeline.  In job mode (requested with "?async=1" or
+a "Prefer: respond-async" header), the query is recorded with job_status
+'pending', its pipeline is submitted to a thread pool of QUERY_JOB_WORKERS
+threads per process, and the endpoint returns 202 Accepted with the query's
+ID right away.
+
+Each job runs in its own request context carrying the submitting request's
+auth, so completions are charged and recorded as usual.  The job's state is
+kept in queries.job_status ('pending', 'done', or 'error'), so any process
+can report it, and GET /api/query/<id>?wait=N can wait up to N seconds
+(at most QUERY_JOB_MAX_WAIT) for it to finish.  A job whose process exits
+before it finishes stays 'pending'.
+
+A batch of queries (see POST /api/queries/batch) runs as a single job,
+answering at most BATCH_QUERY_CONCURRENCY of its queries at once, with each
+query's job_status updated as it finishes.
+'''
+
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from sqlite3 import Row
+from typing import Any
+
+from flask import Flask, current_app, g, request
+
+from gened.auth import get_auth
+from gened.db import get_db
+from gened.eventloop import run_async
+from gened.providers import LLMConfig
+
+from .context import ContextConfig, TaskInstructions
+from .helper import QueryInput, answer_queries_async, answer_query
+
+# How often to check the database for a job run by another process (seconds)
+POLL_INTERVAL = 0.25
+
+_executor_lock = threading.Lock()
+_futures: dict[int, Future[None]] = {}  # jobs submitted by this process, by query ID
+
+
+def wants_job() -> bool:
+    '''True if the current request asked for the query to be run as a job.'''
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return request.args.get('async', '') in ('1', 'true')
+
+
+def _get_executor(app: Flask) -> ThreadPoolExecutor:
+    with _executor_lock:
+        if 'query_jobs' not in app.extensions:
+            app.extensions['query_jobs'] = ThreadPoolExecutor(
+                max_workers=app.config['QUERY_JOB_WORKERS'],
+                thread_name_prefix='query-job',
+            )
+        return app.extensions['query_jobs']  # type: ignore[no-any-return]
+
+
+def _set_status(query_id: int, status: str) -> None:
+    db = get_db()
+    db.execute("UPDATE queries SET job_status=? WHERE id=?", [status, query_id])
+    db.commit()
+
+
+def _run_job(app: Flask, auth: dict[str, Any], llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, query_id: int, class_id: int | None, algorea_user_id: int | None) -> None:
+    with app.test_request_context():
+        g.auth = auth
+        try:
+            answer_query(llm, context, code, error, issue, query_id, class_id=class_id, algorea_user_id=algorea_user_id)
+        except Exception:
+            app.logger.exception(f"Query job {query_id} failed")
+            _set_status(query_id, 'error')
+        else:
+            _set_status(query_id, 'done')
+
+
+def start_job(llm: LLMConfig, context: ContextConfig | TaskInstructions | None, code: str, error: str, issue: str, query_id: int, class_id: int | None = None, algorea_user_id: int | None = None) -> None:
+    '''Answer a query recorded with job_status 'pending' in the background.'''
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    auth = dict(get_auth())
+    future = _get_executor(app).submit(_run_job, app, auth, llm, context, code, error, issue, query_id, class_id, algorea_user_id)
+    _futures[query_id] = future
+    future.add_done_callback(lambda _: _futures.pop(query_id, None))
+
+
+def _run_batch_job(app: Flask, auth: dict[str, Any], llm: LLMConfig, queries: list[QueryInput], query_ids: list[int], class_id: int | None) -> None:
+    with app.test_request_context():
+        g.auth = auth
+
+        def on_done(query_id: int, error: Exception | None) -> None:
+            _set_status(query_id, 'done' if error is None else 'error')
+
+        try:
+            run_async(answer_queries_async(llm, queries, query_ids, class_id, app.config['BATCH_QUERY_CONCURRENCY'], on_done=on_done))
+        except Exception:
+            app.logger.exception(f"Batch job for queries {query_ids[0]}-{query_ids[-1]} failed")
+            db = get_db()
+            db.executemany("UPDATE queries SET job_status='error' WHERE id=? AND job_status='pending'", [(query_id,) for query_id in query_ids])
+            db.commit()
+
+
+def start_batch_job(llm: LLMConfig, queries: list[QueryInput], query_ids: list[int], class_id: int | None = None) -> None:
+    '''Answer a batch of queries recorded with job_status 'pending' in the background.'''
+    app = current_app._get_current_object()  # type: ignore[attr-defined]
+    auth = dict(get_auth())
+    future = _get_executor(app).submit(_run_batch_job, app, auth, llm, queries, query_ids, class_id)
+    for query_id in query_ids:
+        _futures[query_id] = future
+
+    def forget(_: Future[None]) -> None:
+        for query_id in query_ids:
+            _futures.pop(query_id, None)
+
+    future.add_done_callback(forget)
+
+
+def job_status(query_row: Row) -> str:
+    '''The job status of a query: 'pending', 'done', or 'error' (queries not run as jobs are 'done').'''
+    return query_row['job_status'] or 'done'
+
+
+def wait_for_job(query_id: int, timeout: float) -> None:
+    '''Wait up to `timeout` seconds for a query's job to finish.'''
+    future = _futures.get(query_id)
+    if future is not None:
+        wait_futures([future], timeout=timeout)
+        return
+
+    # Run by another process (or already finished): check the database
+    db = get_db()
+    end = time.monotonic() + timeout
+    while True:
+        row = db.execute("SELECT job_status FROM queries WHERE id=?", [query_id]).fetchone()
+        if row is None or row['job_status'] != 'pending' or time.monotonic() >= end:
+            return
+        time.sleep(min(POLL_INTERVAL, max(0.0, end - time.monotonic())))
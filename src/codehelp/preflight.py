@@ -0,0 +1,168 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Preflight checks of a query's size, before any completion is requested.
+
+An oversized submission used to fail only after a round trip to the
+provider ("maximum context length").  Before a query's prompts are built,
+preflight() estimates the tokens of its code, error, and issue for the
+class's model (see gened.tokens), and if they exceed the class's input
+budget (see query_config.get_input_budget()):
+
+  - a long error message is cut to its first and last lines
+  - the code is cut to the lines around those referenced in the error
+    message (or its beginning and end, if none are), with markers where
+    lines were omitted
+
+A query that still doesn't fit (e.g., a very long issue), or whose whole
+prompt wouldn't fit in the model's context window, is rejected with
+QueryTooLongError.  The query itself is stored as submitted; only the
+prompts use the trimmed text.
+'''
+
+import re
+from dataclasses import dataclass
+
+from gened.tokens import context_window, estimate_messages, estimate_tokens, max_chars
+
+from . import prompts
+
+# Tokens left in the context window for the completion itself
+COMPLETION_RESERVE = 1000
+
+# Share of the input budget an error message may take before it is trimmed
+ERROR_SHARE = 0.25
+ERROR_HEAD_LINES = 3
+
+# Line references in error messages from common compilers and interpreters:
+# 'line 12' (Python, many others), 'main.c:12:5' (gcc, clang, rustc, go), 'Main.java:12)', and '(12,5)' (C#)
+LINE_REF_RE = re.compile(r"\bline (\d+)|:(\d+):|:(\d+)\)|\((\d+),\d+\)", re.IGNORECASE)
+
+
+class QueryTooLongError(Exception):
+    def __init__(self, estimated_tokens: int, limit: int) -> None:
+        super().__init__("Your query is too long for the model to process.  Please reduce the length of your input, e.g., by including only the part of your code that the issue is about.")
+        self.estimated_tokens = estimated_tokens
+        self.limit = limit
+
+
+@dataclass(frozen=True)
+class PreflightResult:
+    code: str
+    error: str
+    issue: str
+    trimmed: bool
+    prompt_tokens: int  # estimated tokens of the main prompt
+
+
+def error_line_numbers(error: str) -> list[int]:
+    '''Line numbers referenced in an error message, in order of appearance.'''
+    numbers = []
+    for match in LINE_REF_RE.finditer(error):
+        number = int(next(group for group in match.groups() if group))
+        if number not in numbers:
+            numbers.append(number)
+    return numbers
+
+
+def _omitted(count: int) -> str:
+    return f"[... {count} line{'s' if count != 1 else ''} omitted ...]"
+
+
+def _join_kept(lines: list[str], kept: set[int]) -> str:
+    '''Join the kept lines (0-based indexes), marking each gap.'''
+    out = []
+    gap = 0
+    for i, line in enumerate(lines):
+        if i in kept:
+            if gap:
+                out.append(_omitted(gap))
+                gap = 0
+            out.append(line)
+        else:
+            gap += 1
+    if gap:
+        out.append(_omitted(gap))
+    return "\n".join(out)
+
+
+def trim_code(code: str, line_numbers: list[int], max_tokens: int, model: str | None) -> str:
+    '''Cut code to at most about max_tokens, keeping the lines around the given
+    (1-based) line numbers, or the beginning and end of the code if none are in it.'''
+    if estimate_tokens(code, model) <= max_tokens:
+        return code
+
+    lines = code.split("\n")
+    centers = [n - 1 for n in line_numbers if 1 <= n <= len(lines)]
+    if not centers:
+        # No referenced lines: keep the beginning (definitions) and the end (often where the work is)
+        centers = [0, len(lines) - 1]
+
+    # Grow a window around each center, one line on each side at a time, until the budget
+    # (less room for a marker before, between, and after the windows) is used
+    char_budget = max_chars(max_tokens, model) - (len(centers) + 1) * (len(_omitted(len(lines))) + 1)
+    kept: set[int] = set()
+    used = 0
+    for radius in range(len(lines)):
+        added = False
+        for center in centers:
+            for i in (center - radius, center + radius):
+                if 0 <= i < len(lines) and i not in kept:
+                    cost = len(lines[i]) + 1
+                    if used + cost > char_budget:
+                        return _join_kept(lines, kept)
+                    kept.add(i)
+                    used += cost
+                    added = True
+        if not added:
+            break
+    return _join_kept(lines, kept)
+
+
+def trim_error(error: str, max_tokens: int, model: str | None) -> str:
+    '''Cut an error message to its first lines (the error) and as many of its last lines
+    (e.g., the innermost frames of a traceback) as fit in max_tokens.'''
+    if estimate_tokens(error, model) <= max_tokens:
+        return error
+    lines = error.split("\n")
+    kept = set(range(min(ERROR_HEAD_LINES, len(lines))))
+    char_budget = max_chars(max_tokens, model) - len(_omitted(len(lines))) - 1
+    used = sum(len(lines[i]) + 1 for i in kept)
+    for i in range(len(lines) - 1, ERROR_HEAD_LINES - 1, -1):
+        used += len(lines[i]) + 1
+        if used > char_budget:
+            break
+        kept.add(i)
+    return _join_kept(lines, kept)
+
+
+def preflight(model: str | None, code: str, error: str, issue: str, context_str: str | None, budget: int) -> PreflightResult:
+    '''Fit a query's code, error, and issue into an input budget (in estimated tokens) for the given model.
+
+    Raises QueryTooLongError if the query can't be made to fit.
+    '''
+    trimmed = False
+
+    def input_tokens() -> int:
+        return sum(estimate_tokens(text, model) for text in (code, error, issue))
+
+    if input_tokens() > budget:
+        line_numbers = error_line_numbers(error)
+        error_budget = int(budget * ERROR_SHARE)
+        if estimate_tokens(error, model) > error_budget:
+            error = trim_error(error, error_budget, model)
+            trimmed = True
+        code_budget = budget - estimate_tokens(error, model) - estimate_tokens(issue, model)
+        if code_budget <= 0:
+            raise QueryTooLongError(input_tokens(), budget)
+        if estimate_tokens(code, model) > code_budget:
+            code = trim_code(code, line_numbers, code_budget, model)
+            trimmed = True
+
+    prompt_tokens = estimate_messages(prompts.make_main_prompt(code, error, issue, context_str), model)
+    limit = context_window(model) - COMPLETION_RESERVE
+    if prompt_tokens > limit:
+        raise QueryTooLongError(prompt_tokens, limit)
+
+    return PreflightResult(code=code, error=error, issue=issue, trimmed=trimmed, prompt_tokens=prompt_tokens)
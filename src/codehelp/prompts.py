@@ -2,6 +2,7 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+from flask import current_app
 from jinja2 import Environment
 from openai.types.chat import ChatCompletionMessageParam
 from gened.db import get_db
@@ -67,7 +68,57 @@ common_template_user = jinja_env.from_string("""\
 {% endif %}
 """)
 
-def make_main_prompt(code: str, error: str, issue: str, context: str | None = None, class_id: int | None = None, algorea_user_id: int | None = None) -> list[ChatCompletionMessageParam]:
+# Prompt layouts (see PROMPT_LAYOUT in codehelp/__init__.py):
+#   'classic': the query's parts and context are described in the first system message,
+#     before the query and the instructions.
+#   'static_first': all static instruction text comes first, then the context and the query,
+#     so that providers' prefix caching can reuse the identical leading tokens across queries.
+PROMPT_LAYOUTS = ('classic', 'static_first')
+
+
+def prompt_layout() -> str:
+    ''' The configured prompt layout, or 'classic' if PROMPT_LAYOUT isn't one of PROMPT_LAYOUTS. '''
+    layout = current_app.config.get('PROMPT_LAYOUT', 'classic')
+    return layout if layout in PROMPT_LAYOUTS else 'classic'
+
+static_template_sys = jinja_env.from_string("""\
+You are a system for assisting students learning CS and programming.  Your job here is {{ job }}.
+
+A query contains some of:
+ - a relevant snippet of their code (in "<code>")
+ - an error message they are seeing (in "<error>")
+ - an issue or question and how they want assistance (in "<issue>")
+Additional context provided by the instructor, if any, is given before the query (in "<context>").
+
+{{ instructions }}""")
+
+context_template_sys = jinja_env.from_string("""\
+Additional context provided by the instructor:
+<context>
+{{ context }}
+</context>
+""")
+
+
+def _query_messages(layout: str, job: str, instructions: str, code: str, error: str, issue: str, context: str | None) -> list[ChatCompletionMessageParam]:
+    ''' Arrange a query and its instructions as messages in the given layout. '''
+    if layout == 'static_first':
+        messages: list[ChatCompletionMessageParam] = [
+            {'role': 'system', 'content': static_template_sys.render(job=job, instructions=instructions)},
+        ]
+        if context:
+            messages.append({'role': 'system', 'content': context_template_sys.render(context=context)})
+        messages.append({'role': 'user', 'content': common_template_user.render(code=code, error=error, issue=issue)})
+        return messages
+
+    return [
+        {'role': 'system', 'content': common_template_sys1.render(job=job, code=code, error=error, issue=issue, context=context)},
+        {'role': 'user',   'content': common_template_user.render(code=code, error=error, issue=issue)},
+        {'role': 'system', 'content': instructions},
+    ]
+
+
+def make_main_prompt(code: str, error: str, issue: str, context: str | None = None, class_id: int | None = None, algorea_user_id: int | None = None, *, layout: str = 'classic') -> list[ChatCompletionMessageParam]:
     error = error.rstrip()
     issue = issue.rstrip()
     if error and not issue:
@@ -89,11 +140,7 @@ def make_main_prompt(code: str, error: str, issue: str, context: str | None = No
         ]
     else:
         sys_job = "to respond to a student's query as a helpful expert teacher"
-        return [
-            {'role': 'system', 'content': common_template_sys1.render(job=sys_job, code=code, error=error, issue=issue, context=context_val)},
-            {'role': 'user',   'content': common_template_user.render(code=code, error=error, issue=issue)},
-            {'role': 'system', 'content': main_template_sys2.render()},
-        ]
+        return _query_messages(layout, sys_job, main_template_sys2.render(), code, error, issue, context_val)
 
 
 sufficient_template_sys2 = jinja_env.from_string("""\
@@ -105,18 +152,61 @@ Please assess their query and tell them whether it contains sufficient detail fo
 """)
 
 
-def make_sufficient_prompt(code: str, error: str, issue: str, context: str | None) -> list[ChatCompletionMessageParam]:
+def make_sufficient_prompt(code: str, error: str, issue: str, context: str | None, *, layout: str = 'classic') -> list[ChatCompletionMessageParam]:
     error = error.rstrip()
     issue = issue.rstrip()
     if error and not issue:
         issue = "Please help me understand this error."
 
     sys_job = "to evaluate whether a student's query contains sufficient detail for you to provide assistance"
-    return [
-        {'role': 'system', 'content': common_template_sys1.render(job=sys_job, code=code, error=error, issue=issue, context=context)},
-        {'role': 'user',   'content': common_template_user.render(code=code, error=error, issue=issue)},
-        {'role': 'system', 'content': sufficient_template_sys2.render()},
-    ]
+    return _query_messages(layout, sys_job, sufficient_template_sys2.render(), code, error, issue, context)
+
+
+structured_template_sys2 = jinja_env.from_string("""\
+{% if custom_instruction %}
+Respond to the student following these instructions:
+{{ custom_instruction }}
+
+{% else %}
+If the student query is off-topic, respond with an error.
+
+Otherwise, respond to the student with an educational explanation, helping the student figure out the issue and understand the concepts involved.  If the student query includes an error message, tell the student what it means, giving a detailed explanation to help the student understand the message.  Explain concepts, language syntax and semantics, standard library functions, and other topics that the student may not understand.  Be positive and encouraging!
+
+- Use Markdown formatting, including ` for inline code.
+- Use TeX syntax for mathematical formulas, wrapping them in \\(...\\) or \\[...\\] as appropriate.
+- Do not write a heading for the response.
+- Do not greet the student, sign the response, or thank the student for the query.
+
+{% endif %}
+Do not write a corrected or updated version of the student's code, and do not write any example code blocks (no ``` delimiters).  Explain what the student should do without providing solution code.
+
+Also assess whether the query contains sufficient detail for you to potentially provide help.  You can make reasonable assumptions about missing details.  Only ask for clarification if the query is completely ambiguous or unclear.
+
+Reply with only a JSON object with these fields and no other text:
+{
+  "sufficient": true or false,
+  "clarification": if not sufficient, a message written directly to the student asking for the most important piece of missing information; otherwise "",
+  "main": your response to the student
+}
+""")
+
+
+def make_structured_prompt(code: str, error: str, issue: str, context: str | None = None, class_id: int | None = None, algorea_user_id: int | None = None, *, layout: str = 'classic') -> list[ChatCompletionMessageParam]:
+    """
+    Build a single prompt that produces the main response, the sufficiency
+    check, and a code-free response in one JSON object (see helper.run_structured_prompts()).
+    """
+    error = error.rstrip()
+    issue = issue.rstrip()
+    if error and not issue:
+        issue = "Please help me understand this error."
+
+    custom_instruction = ""
+    if class_id is not None and algorea_user_id is not None:
+        custom_instruction = get_group_prompt_for_user(class_id, algorea_user_id, code, error, issue, context)
+
+    sys_job = "to respond to a student's query as a helpful expert teacher and to evaluate whether the query contains sufficient detail for you to provide assistance"
+    return _query_messages(layout, sys_job, structured_template_sys2.render(custom_instruction=custom_instruction), code, error, issue, context)
 
 
 def make_cleanup_prompt(response_text: str, custom_instruction: str = "") -> str:
@@ -168,7 +258,7 @@ def get_group_prompt_for_user(class_id: int, algorea_user_id: int, code: str, er
 
 
 
-chat_template_sys = jinja_env.from_string("""\
+chat_guidelines_sys = """\
 You are an AI tutor specializing in programming and computer science. Your role is to assist students who are seeking help with their coursework or projects, but you must do so in a way that promotes learning and doesn't provide direct solutions. Here are your guidelines:
 
 1. Always maintain a supportive and encouraging tone.
@@ -192,7 +282,9 @@ When a student asks a question, follow this process:
 6. Use markdown formatting, including ` for inline code.
 
 Do not provide direct solutions or complete code snippets. Instead, focus on guiding the student's learning process.
+"""
 
+chat_topic_sys = """\
 The topic of this chat from the student is: <topic>{{ topic }}</topic>
 
 If the topic is broad and it could take more than one chat session to cover all aspects of it, first ask the student to clarify what, specifically, they are attempting to learn about it.
@@ -203,9 +295,23 @@ Additional context provided by the instructor that may be relevant to this chat:
 {{ context }}
 </context>
 {% endif %}
-""")
+"""
+
+# 'classic' layout: one system message; 'static_first' (see PROMPT_LAYOUTS): the guidelines are a separate first message
+chat_template_sys = jinja_env.from_string(chat_guidelines_sys + "\n" + chat_topic_sys)
+chat_topic_template_sys = jinja_env.from_string(chat_topic_sys)
 
 tutor_monologue = """<internal_monologue>I am a Socratic tutor. I am trying to help the user learn a topic by leading them to understanding, not by telling them things directly.  I should check to see how well the user understands each aspect of what I am teaching. But if I just ask them if they understand, they may say yes even if they don't, so I should NEVER ask if they understand something. Instead of asking "does that make sense?", I need to check their understanding by asking them a question that makes them demonstrate understanding. It should be a question for which they can only answer correctly if they understand the concept, and it should not be a question I've already given an answer for myself.  If and only if they can apply the knowledge correctly, then I should move on to the next piece of information.</internal_monologue>"""
 
 def make_chat_sys_prompt(topic: str, context: str) -> str:
     return chat_template_sys.render(topic=topic, context=context)
+
+
+def make_chat_sys_messages(topic: str, context: str, *, layout: str = 'classic') -> list[ChatCompletionMessageParam]:
+    ''' The system message(s) that start a tutor chat, in the given layout (see PROMPT_LAYOUTS). '''
+    if layout == 'static_first':
+        return [
+            {'role': 'system', 'content': chat_guidelines_sys},
+            {'role': 'system', 'content': chat_topic_template_sys.render(topic=topic, context=context)},
+        ]
+    return [{'role': 'system', 'content': make_chat_sys_prompt(topic, context)}]
@@ -0,0 +1,106 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from typing import Literal
+
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from markupsafe import Markup
+from werkzeug.wrappers.response import Response
+
+from gened.auth import get_auth, instructor_required
+from gened.class_config import register_extra_section
+from gened.db import get_db
+
+# This module manages per-class settings for how queries are answered, stored
+# in the class_query_configs table (one row per class; classes without a row,
+# or with a NULL setting, use the defaults).
+
+Pipeline = Literal['multi', 'structured']
+
+PIPELINES: dict[Pipeline, str] = {
+    'multi': "Separate calls (main response, sufficiency check, and code removal if needed)",
+    'structured': "Single call (one structured response covering all three)",
+}
+DEFAULT_PIPELINE: Pipeline = 'multi'
+
+# Allowed range of per-class input token budgets
+MIN_INPUT_BUDGET = 500
+MAX_INPUT_BUDGET = 100_000
+
+
+def get_pipeline(class_id: int | None) -> Pipeline:
+    ''' Get the query pipeline configured for the given class. '''
+    if class_id is None:
+        return DEFAULT_PIPELINE
+    db = get_db()
+    row = db.execute("SELECT pipeline FROM class_query_configs WHERE class_id=?", [class_id]).fetchone()
+    return row['pipeline'] if row else DEFAULT_PIPELINE
+
+
+def get_input_budget(class_id: int | None) -> int:
+    ''' Get the input token budget for the code, error, and issue of a query in the given class (see preflight.py). '''
+    default: int = current_app.config['QUERY_INPUT_TOKEN_BUDGET']
+    if class_id is None:
+        return default
+    db = get_db()
+    row = db.execute("SELECT input_token_budget FROM class_query_configs WHERE class_id=?", [class_id]).fetchone()
+    return row['input_token_budget'] if row and row['input_token_budget'] else default
+
+
+def register() -> None:
+    """ Register the configuration UI (render function) inside gened's class_config module. """
+    register_extra_section(config_section_render)
+
+
+def config_section_render() -> Markup:
+    auth = get_auth()
+    pipeline = get_pipeline(auth['class_id'])
+    input_budget = get_input_budget(auth['class_id'])
+    default_budget = current_app.config['QUERY_INPUT_TOKEN_BUDGET']
+    # Wrap in Markup because it's already escaped (by Jinja) and safe.
+    return Markup(render_template("query_config.html", pipeline=pipeline, pipelines=PIPELINES, input_budget=input_budget, default_budget=default_budget))
+
+
+bp = Blueprint('query_config', __name__, url_prefix="/instructor/query", template_folder='templates')
+
+@bp.before_request
+@instructor_required
+def before_request() -> None:
+    """ Apply decorator to protect all query_config blueprint endpoints. """
+
+
+@bp.route("/update", methods=["POST"])
+def update_query_config() -> Response:
+    db = get_db()
+    auth = get_auth()
+    assert auth['class_id']
+
+    pipeline = request.form.get('pipeline', DEFAULT_PIPELINE)
+    if pipeline not in PIPELINES:
+        flash(f"Invalid query pipeline: {pipeline}", "danger")
+        return redirect(url_for("class_config.config_form"))
+
+    input_budget = request.form.get('input_token_budget', type=int)
+    if input_budget is not None and not MIN_INPUT_BUDGET <= input_budget <= MAX_INPUT_BUDGET:
+        flash(f"Invalid input token budget: must be between {MIN_INPUT_BUDGET} and {MAX_INPUT_BUDGET}.", "danger")
+        return redirect(url_for("class_config.config_form"))
+    if input_budget == current_app.config['QUERY_INPUT_TOKEN_BUDGET']:
+        input_budget = None  # follow the default if it changes
+
+    db.execute("""
+        INSERT INTO class_query_configs (class_id, pipeline, input_token_budget) VALUES (?, ?, ?)
+        ON CONFLICT (class_id) DO UPDATE SET pipeline=excluded.pipeline, input_token_budget=excluded.input_token_budget
+    """, [auth['class_id'], pipeline, input_budget])
+    db.commit()
+
+    flash("Query settings updated.", "success")
+    return redirect(url_for("class_config.config_form"))
@@ -16,6 +16,11 @@ CREATE TABLE queries (
     response_json TEXT,
     response_text TEXT,
     topics_json TEXT,
+    prompt_tokens_est INTEGER,  -- estimated tokens of the main prompt, from the preflight check (see preflight.py)
+    prompt_layout TEXT,  -- 'classic' or 'static_first' (see prompts.PROMPT_LAYOUTS); NULL for queries from before layouts
+    algorea_id TEXT DEFAULT 'no_set_id',  -- the client's user ID, from the API (see api.py)
+    job_status TEXT CHECK (job_status IN ('pending', 'done', 'error')),  -- for queries run as API jobs (see jobs.py); NULL otherwise
+    callback_url TEXT,  -- notified when the response is recorded, if given with the API request (see webhooks.py)
     helpful BOOLEAN CHECK (helpful in (0, 1)),
     helpful_emoji TEXT GENERATED ALWAYS AS (CASE helpful WHEN 1 THEN '✅' WHEN 0 THEN '❌' ELSE '' END) VIRTUAL,
     user_id INTEGER NOT NULL,
@@ -29,6 +34,52 @@ CREATE INDEX queries_by_user ON queries(user_id);
 DROP INDEX IF EXISTS queries_by_role;
 CREATE INDEX queries_by_role ON queries(role_id);
 
+-- Tokens, wall time, and provider of each completion made for a query (see gened.usage)
+DROP TABLE IF EXISTS query_stages;
+CREATE TABLE query_stages (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_id           INTEGER NOT NULL,
+    stage              TEXT NOT NULL,  -- 'main', 'sufficiency', 'cleanup', 'structured', or 'topics'
+    provider           TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    prompt_tokens      INTEGER,  -- NULL if not reported by the provider
+    completion_tokens  INTEGER,
+    cached_tokens      INTEGER,  -- prompt tokens served from the provider's prompt cache
+    wall_ms            INTEGER NOT NULL,
+    source             TEXT NOT NULL CHECK (source IN ('api', 'cache', 'coalesced')),
+    error              BOOLEAN NOT NULL CHECK (error IN (0, 1)),
+    created            DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    FOREIGN KEY(query_id) REFERENCES queries(id)
+);
+DROP INDEX IF EXISTS query_stages_by_query;
+CREATE INDEX query_stages_by_query ON query_stages(query_id);
+DROP INDEX IF EXISTS query_stages_by_created;
+CREATE INDEX query_stages_by_created ON query_stages(created);
+
+-- MinHash signatures of queries for near-duplicate detection (see similarity.py)
+DROP TABLE IF EXISTS query_signatures;
+CREATE TABLE query_signatures (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,  -- order written, for catching up in-memory indexes
+    query_id     INTEGER NOT NULL UNIQUE,
+    class_id     INTEGER,
+    context_name TEXT,
+    signature    BLOB NOT NULL,
+    FOREIGN KEY(query_id) REFERENCES queries(id)
+);
+DROP INDEX IF EXISTS query_signatures_by_context;
+CREATE INDEX query_signatures_by_context ON query_signatures(class_id, context_name, id);
+
+-- Daily counts of local sufficiency pre-check outcomes (see sufficiency.py)
+DROP TABLE IF EXISTS sufficiency_stats;
+CREATE TABLE sufficiency_stats (
+    day        DATE PRIMARY KEY,
+    ambiguous  INTEGER NOT NULL DEFAULT 0,
+    skipped    INTEGER NOT NULL DEFAULT 0,
+    shadowed   INTEGER NOT NULL DEFAULT 0,
+    agreed     INTEGER NOT NULL DEFAULT 0,
+    disagreed  INTEGER NOT NULL DEFAULT 0
+);
+
 DROP TABLE IF EXISTS chats;
 CREATE TABLE chats (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,6 +116,43 @@ CREATE TABLE contexts (
 DROP INDEX IF EXISTS contexts_by_class_name;
 CREATE UNIQUE INDEX  contexts_by_class_name ON contexts(class_id, name);
 
+-- Per-class settings for how queries are answered (see query_config.py)
+DROP TABLE IF EXISTS class_query_configs;
+CREATE TABLE class_query_configs (
+    class_id  INTEGER PRIMARY KEY,
+    pipeline  TEXT NOT NULL CHECK (pipeline IN ('multi', 'structured')) DEFAULT 'multi',
+    input_token_budget  INTEGER,  -- NULL: QUERY_INPUT_TOKEN_BUDGET (see preflight.py)
+    FOREIGN KEY(class_id) REFERENCES classes(id)
+);
+
+-- Per-class webhook, notified when any query in the class is answered (see webhooks.py)
+DROP TABLE IF EXISTS class_webhooks;
+CREATE TABLE class_webhooks (
+    class_id  INTEGER PRIMARY KEY,
+    url       TEXT,  -- NULL: only a secret, for callbacks given with requests
+    secret    TEXT NOT NULL,  -- key for signing deliveries (to the class's webhook and callbacks)
+    created   DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    FOREIGN KEY(class_id) REFERENCES classes(id)
+);
+
+-- Webhook notifications of answered queries, kept until delivered or given up on (see webhooks.py)
+DROP TABLE IF EXISTS webhook_outbox;
+CREATE TABLE webhook_outbox (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    query_id      INTEGER NOT NULL,
+    class_id      INTEGER,  -- whose webhook secret signs the delivery
+    url           TEXT NOT NULL,
+    status        TEXT NOT NULL CHECK (status IN ('pending', 'delivered', 'failed')) DEFAULT 'pending',
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    next_attempt  DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,  -- also pushed back while a delivery is in progress
+    last_error    TEXT,
+    created       DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    delivered     DATETIME,
+    FOREIGN KEY(query_id) REFERENCES queries(id)
+);
+DROP INDEX IF EXISTS webhook_outbox_by_status;
+CREATE INDEX webhook_outbox_by_status ON webhook_outbox(status, next_attempt);
+
 DROP TABLE IF EXISTS context_strings;
 CREATE TABLE context_strings (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
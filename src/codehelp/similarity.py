@@ -0,0 +1,313 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Near-duplicate detection for queries within a class and context.
+
+Each query's code, error, and issue are reduced to shingles of tokens.  In
+code, identifiers, numbers, and string literals are replaced by
+placeholders, so renamed variables or changed constants still match.  Error
+messages and issues are reduced to their words, so that exception names
+(e.g., TypeError vs. NameError) and messages distinguish queries.  The
+shingles are summarized in a MinHash signature using one-permutation hashing
+(a single hash per shingle, binned into SIGNATURE_SIZE slots), and the
+signatures are indexed with LSH banding so that a lookup only compares
+against the few earlier queries that share a band.  The signature only
+estimates similarity, so a match is confirmed before its response is
+reused: the code, error, and issue shingles must each have an exact Jaccard
+similarity above the threshold (otherwise a short error message, outweighed
+by the code's shingles, could differ entirely).
+
+Signatures are stored in the query_signatures table when a query is recorded.
+Each process keeps an in-memory index per (class_id, context_name), loaded on
+first use and caught up on every lookup with the signatures written since,
+by any process (including backfill()).  Rows are caught up in the order they
+were written (query_signatures.id), not by query id, so a signature written
+late for an earlier query isn't skipped.
+'''
+
+import hashlib
+import json
+import operator
+import re
+import threading
+from array import array
+from collections import defaultdict
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from sqlite3 import Row
+
+from flask import current_app
+
+from gened.db import get_db
+
+SIGNATURE_SIZE = 128
+BANDS = 16
+ROWS_PER_BAND = SIGNATURE_SIZE // BANDS
+# Only the most recent signatures in each LSH bucket are compared in a lookup,
+# which bounds lookup time when many queries in a context are alike.
+BUCKET_SCAN_LIMIT = 16
+_EMPTY = 0xFFFFFFFF  # value of a signature slot that no shingle hashed into
+
+CODE_SHINGLE_SIZE = 4
+ERROR_SHINGLE_SIZE = 2
+ISSUE_SHINGLE_SIZE = 2
+
+# Identifiers that carry meaning across submissions and are kept as-is.  Other
+# identifiers (variable, function names, etc.) are replaced by a placeholder.
+KEEP_IDENTIFIERS = frozenset("""
+    and as assert async await break case catch class const continue def default del do elif else enum except export
+    extends false final finally for from function global if import in instanceof interface is lambda let new none
+    nonlocal not null or pass private protected public raise return self static struct super switch this throw
+    true try typeof var void while with yield
+    int float double char bool boolean long short string str list dict set tuple
+    print println printf input len range open append main printf scanf cout cin endl std include
+""".split())
+
+_TOKEN_RE = re.compile(r"""
+    (?P<str>"(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*')
+    | (?P<num>\d+(?:\.\d+)?)
+    | (?P<ident>[A-Za-z_]\w*)
+    | (?P<op>[^\sA-Za-z_\d])
+""", re.VERBOSE)
+
+_WORD_RE = re.compile(r"[a-z0-9_']+")
+_ERROR_WORD_RE = re.compile(r"[a-z_]\w*|\d+")
+
+
+def code_tokens(text: str) -> list[str]:
+    '''Tokenize code, normalizing names, numbers, and string literals.'''
+    tokens = []
+    for match in _TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == 'str':
+            tokens.append('S')
+        elif kind == 'num':
+            tokens.append('N')
+        elif kind == 'ident':
+            ident = match.group()
+            tokens.append(ident if ident.lower() in KEEP_IDENTIFIERS else 'I')
+        else:
+            tokens.append(match.group())
+    return tokens
+
+
+def error_tokens(text: str) -> list[str]:
+    '''Tokenize an error message into lowercased words (keeping exception names), with numbers (e.g., line numbers) normalized.'''
+    return ['N' if word.isdigit() else word for word in _ERROR_WORD_RE.findall(text.lower())]
+
+
+def _shingles(tag: str, tokens: list[str], size: int) -> set[str]:
+    if not tokens:
+        return set()
+    if len(tokens) < size:
+        return {f"{tag}:{' '.join(tokens)}"}
+    return {f"{tag}:{' '.join(tokens[i:i+size])}" for i in range(len(tokens) - size + 1)}
+
+
+def query_shingles(code: str, error: str, issue: str) -> set[str]:
+    return (
+        _shingles('c', code_tokens(code), CODE_SHINGLE_SIZE)
+        | _shingles('e', error_tokens(error), ERROR_SHINGLE_SIZE)
+        | _shingles('i', _WORD_RE.findall(issue.lower()), ISSUE_SHINGLE_SIZE)
+    )
+
+
+def signature(shingles: set[str]) -> "array[int]":
+    '''One-permutation MinHash: each shingle is hashed once, and the hash's
+    low bits pick the slot in which it competes for the minimum.'''
+    sig = array('I', [_EMPTY]) * SIGNATURE_SIZE
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'little')
+        slot = h % SIGNATURE_SIZE
+        value = (h >> 32) & 0xFFFFFFFE  # never equal to _EMPTY
+        if value < sig[slot]:
+            sig[slot] = value
+    return sig
+
+
+def query_signature(code: str, error: str, issue: str) -> "array[int]":
+    return signature(query_shingles(code or '', error or '', issue or ''))
+
+
+def jaccard(shingles1: set[str], shingles2: set[str]) -> float:
+    '''Exact Jaccard similarity of two shingle sets (1.0 if both are empty).'''
+    union = len(shingles1 | shingles2)
+    return len(shingles1 & shingles2) / union if union else 1.0
+
+
+def field_similarity(shingles1: set[str], shingles2: set[str]) -> float:
+    '''The lowest exact Jaccard similarity of two queries' code, error, and issue shingles.'''
+    return min(
+        jaccard({s for s in shingles1 if s.startswith(tag)}, {s for s in shingles2 if s.startswith(tag)})
+        for tag in ('c:', 'e:', 'i:')
+    )
+
+
+def estimate_similarity(sig1: Sequence[int], sig2: Sequence[int]) -> float:
+    '''Estimated Jaccard similarity of the shingle sets of two signatures.'''
+    matches = sum(map(operator.eq, sig1, sig2))
+    used = len(sig1)
+    if _EMPTY in sig1 and _EMPTY in sig2:
+        # Slots that are empty in both signatures carry no information.
+        both_empty = sum(a == b == _EMPTY for a, b in zip(sig1, sig2, strict=True))
+        matches -= both_empty
+        used -= both_empty
+    return matches / used if used else 0.0
+
+
+def _band_keys(sig: "array[int]") -> list[tuple[int, bytes]]:
+    return [(band, sig[band*ROWS_PER_BAND:(band+1)*ROWS_PER_BAND].tobytes()) for band in range(BANDS)]
+
+
+@dataclass
+class SimilarityIndex:
+    '''An LSH index of query signatures for one class and context.
+
+    Queries with identical signatures (common when many students submit the
+    same starter code) share one entry, so a lookup scores each distinct
+    signature only once, and at most BUCKET_SCAN_LIMIT entries per band.
+    '''
+    loaded_id: int = 0  # the last query_signatures.id added (only advanced by _catch_up())
+    entries: dict[bytes, tuple[tuple[int, ...], list[int]]] = field(default_factory=dict)  # signature -> (signature values, query IDs)
+    buckets: dict[tuple[int, bytes], list[bytes]] = field(default_factory=lambda: defaultdict(list))
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def add(self, query_id: int, sig: "array[int]") -> None:
+        sig_bytes = sig.tobytes()
+        if sig_bytes in self.entries:
+            self.entries[sig_bytes][1].append(query_id)
+            return
+        self.entries[sig_bytes] = (tuple(sig), [query_id])  # tuples compare faster than arrays
+        for key in _band_keys(sig):
+            self.buckets[key].append(sig_bytes)
+
+    def find(self, sig: "array[int]", threshold: float) -> list[tuple[float, int]]:
+        '''Return (similarity, query_id) for indexed queries at or above the threshold, most similar first.'''
+        candidates: set[bytes] = set()
+        with self.lock:
+            for key in _band_keys(sig):
+                bucket = self.buckets.get(key)
+                if bucket:
+                    candidates.update(bucket[-BUCKET_SCAN_LIMIT:])
+        values = tuple(sig)
+        results: list[tuple[float, int]] = []
+        for sig_bytes in candidates:
+            other, query_ids = self.entries[sig_bytes]
+            sim = estimate_similarity(values, other)
+            if sim >= threshold:
+                results.extend((sim, qid) for qid in query_ids)
+        return sorted(results, reverse=True)
+
+
+_indexes: dict[tuple[int | None, str | None], SimilarityIndex] = {}
+_lock = threading.Lock()  # guards _indexes; each index has its own lock
+
+
+def _catch_up(index: SimilarityIndex, class_id: int | None, context_name: str | None) -> None:
+    '''Add any signatures written (by any process) since the index was last caught up.'''
+    with index.lock:
+        loaded_id = index.loaded_id
+    # Read without holding a lock; rows another thread added meanwhile are skipped below.
+    rows = get_db().execute(
+        "SELECT id, query_id, signature FROM query_signatures WHERE class_id IS ? AND context_name IS ? AND id > ? ORDER BY id",
+        [class_id, context_name, loaded_id]
+    ).fetchall()
+    with index.lock:
+        for row in rows:
+            if row['id'] <= index.loaded_id:
+                continue
+            index.loaded_id = row['id']
+            sig = array('I')
+            sig.frombytes(row['signature'])
+            if len(sig) == SIGNATURE_SIZE:  # skip any left from an earlier signature size (see backfill())
+                index.add(row['query_id'], sig)
+
+
+def _get_index(class_id: int | None, context_name: str | None) -> SimilarityIndex:
+    with _lock:
+        index = _indexes.setdefault((class_id, context_name), SimilarityIndex())
+    _catch_up(index, class_id, context_name)
+    return index
+
+
+def index_query(query_id: int, class_id: int | None, context_name: str | None, code: str, error: str, issue: str) -> None:
+    '''Record the signature of a new query (called from record_query()).'''
+    index_queries(class_id, [(query_id, context_name, code, error, issue)])
+
+
+def index_queries(class_id: int | None, queries: list[tuple[int, str | None, str, str, str]]) -> None:
+    '''Record the signatures of new queries, given as (query_id, context_name, code, error, issue), in one transaction.
+
+    They are added to this process's indexes by the next lookup's catch-up, like those of other processes.
+    '''
+    db = get_db()
+    db.executemany(
+        "INSERT OR REPLACE INTO query_signatures (query_id, class_id, context_name, signature) VALUES (?, ?, ?, ?)",
+        [(query_id, class_id, context_name, query_signature(code, error, issue).tobytes()) for query_id, context_name, code, error, issue in queries]
+    )
+    db.commit()
+
+
+@dataclass(frozen=True)
+class SimilarQuery:
+    query_id: int
+    similarity: float
+    responses: dict[str, str]
+    response_json: str
+
+
+def find_similar_helpful(class_id: int | None, context_name: str | None, code: str, error: str, issue: str, *, exclude_id: int | None = None) -> SimilarQuery | None:
+    '''Find the most similar earlier query in the same class and context
+    that was marked helpful, if it is above SIMILAR_QUERY_THRESHOLD.
+
+    Candidates found with their signatures are checked with field_similarity().
+    '''
+    threshold = current_app.config['SIMILAR_QUERY_THRESHOLD']
+    if not threshold:
+        return None
+
+    shingles = query_shingles(code or '', error or '', issue or '')
+    matches = [qid for _, qid in _get_index(class_id, context_name).find(signature(shingles), threshold) if qid != exclude_id]
+    if not matches:
+        return None
+
+    db = get_db()
+    placeholders = ",".join("?" * len(matches))
+    rows: list[Row] = db.execute(
+        f"SELECT id, code, error, issue, response_json, response_text FROM queries WHERE id IN ({placeholders}) AND helpful=1 AND response_text IS NOT NULL",
+        matches
+    ).fetchall()
+    by_id = {row['id']: field_similarity(shingles, query_shingles(row['code'] or '', row['error'] or '', row['issue'] or '')) for row in rows}
+    rows = [row for row in rows if by_id[row['id']] >= threshold]
+    if not rows:
+        return None
+
+    best = max(rows, key=lambda row: (by_id[row['id']], row['id']))
+    return SimilarQuery(
+        query_id=best['id'],
+        similarity=by_id[best['id']],
+        responses=json.loads(best['response_text']),
+        response_json=best['response_json'],
+    )
+
+
+def backfill(class_id: int | None = None) -> int:
+    '''Compute signatures for recorded queries that don't have a current one (none, or one of an
+    earlier SIGNATURE_SIZE).  Returns the number added.'''
+    db = get_db()
+    rows = db.execute("""
+        SELECT queries.id, roles.class_id, queries.context_name, queries.code, queries.error, queries.issue
+        FROM queries
+        LEFT JOIN roles ON roles.id = queries.role_id
+        LEFT JOIN query_signatures ON query_signatures.query_id = queries.id
+        WHERE (query_signatures.query_id IS NULL OR LENGTH(query_signatures.signature) != ?) AND (? IS NULL OR roles.class_id = ?)
+    """, [SIGNATURE_SIZE * array('I').itemsize, class_id, class_id]).fetchall()
+    for row in rows:
+        sig = query_signature(row['code'], row['error'], row['issue'])
+        db.execute(
+            "INSERT OR REPLACE INTO query_signatures (query_id, class_id, context_name, signature) VALUES (?, ?, ?, ?)",
+            [row['id'], row['class_id'], row['context_name'], sig.tobytes()]
+        )
+    db.commit()
+    return len(rows)
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Local pre-check of whether a query clearly has sufficient detail.
+
+Every query normally gets a second LLM call (prompts.make_sufficient_prompt)
+asking whether it contains enough detail to help with.  Most queries with a
+real piece of code, an error message, and a substantive issue plainly do.
+precheck() recognizes those locally, using the query's shape and how often
+recent queries in the same class and context were found insufficient.  It
+never decides that a query is *insufficient*; anything not clearly
+sufficient is left to the LLM.
+
+SUFFICIENCY_PRECHECK selects the mode:
+  - 'off': always ask the LLM
+  - 'shadow': ask the LLM anyway, and count how often it agrees with the pre-check
+  - 'on': skip the LLM call for queries the pre-check finds clearly sufficient
+'''
+
+import datetime as dt
+import re
+from dataclasses import dataclass
+from typing import Literal
+
+from flask import current_app
+
+from gened.auth import get_auth
+from gened.db import get_db
+
+Decision = Literal['check', 'shadow', 'skip']
+
+# Stored in place of the sufficiency response when the LLM call is skipped
+SKIPPED_RESPONSE = {'sufficiency': 'local'}
+
+MIN_CODE_LINES = 3
+MIN_ISSUE_WORDS_WITH_ERROR = 3
+MIN_ISSUE_WORDS = 8
+# Don't skip the check in contexts where recent queries were often insufficient
+MAX_RECENT_INSUFFICIENT_RATE = 0.25
+RECENT_QUERIES = 100
+
+_CODE_STRUCTURE_RE = re.compile(r"[(){}\[\]:;=]")
+# An issue made only of these words ("help, my code doesn't work") says nothing specific
+VAGUE_WORDS = frozenset("""
+    a an the i my me it its this that is isn't are what why how does doesn't do don't not can can't
+    help fix please code program work works working wrong error errors problem issue run runs running
+""".split())
+_WORD_RE = re.compile(r"[a-z']+")
+
+
+def llm_says_sufficient(response_txt: str) -> bool:
+    ''' Interpret the LLM's response to the sufficiency prompt. '''
+    return (
+        response_txt.endswith("OK")
+        or "OK." in response_txt
+        or "```" in response_txt
+        or "is sufficient for me" in response_txt
+        or response_txt.startswith("Error (")
+    )
+
+
+def looks_sufficient(code: str, error: str, issue: str) -> bool:
+    ''' True if the query itself clearly has enough detail to help with. '''
+    code_lines = [line for line in code.splitlines() if line.strip()]
+    if len(code_lines) < MIN_CODE_LINES or not _CODE_STRUCTURE_RE.search(code):
+        return False
+
+    words = _WORD_RE.findall(issue.lower())
+    if all(word in VAGUE_WORDS for word in words):
+        return False
+    issue_words = len(issue.split())
+    if error.strip():
+        return issue_words >= MIN_ISSUE_WORDS_WITH_ERROR
+    return issue_words >= MIN_ISSUE_WORDS
+
+
+def recent_insufficient_rate(class_id: int, context_name: str | None) -> float:
+    ''' The fraction of recent LLM-checked queries in the class and context that were insufficient. '''
+    db = get_db()
+    row = db.execute("""
+        SELECT COUNT(*) AS checked, COALESCE(SUM(json_extract(response_text, '$.insufficient') IS NOT NULL), 0) AS insufficient
+        FROM (
+            SELECT queries.response_text
+            FROM queries
+            JOIN roles ON roles.id=queries.role_id
+            WHERE roles.class_id=? AND queries.context_name IS ?
+              AND json_valid(queries.response_text) AND json_valid(queries.response_json)
+              AND json_extract(queries.response_json, '$[#-1].sufficiency') IS NULL
+            ORDER BY queries.id DESC
+            LIMIT ?
+        )
+    """, [class_id, context_name, RECENT_QUERIES]).fetchone()
+    return row['insufficient'] / row['checked'] if row['checked'] else 0.0
+
+
+def _count(column: str) -> None:
+    db = get_db()
+    db.execute(f"""
+        INSERT INTO sufficiency_stats (day, {column}) VALUES (?, 1)
+        ON CONFLICT (day) DO UPDATE SET {column}={column}+1
+    """, [dt.date.today()])
+    db.commit()
+
+
+def precheck(context_name: str | None, code: str, error: str, issue: str) -> Decision:
+    ''' Decide whether the sufficiency LLM call is needed for a query in the current class. '''
+    mode = current_app.config['SUFFICIENCY_PRECHECK']
+    if mode not in ('shadow', 'on'):
+        return 'check'
+
+    class_id = get_auth()['class_id']
+    sufficient = looks_sufficient(code, error, issue) and (
+        class_id is None or recent_insufficient_rate(class_id, context_name) <= MAX_RECENT_INSUFFICIENT_RATE
+    )
+    if not sufficient:
+        _count('ambiguous')
+        return 'check'
+    elif mode == 'shadow':
+        _count('shadowed')
+        return 'shadow'
+    else:
+        _count('skipped')
+        return 'skip'
+
+
+def record_shadow_result(llm_sufficient: bool) -> None:
+    ''' Record whether the LLM agreed with a shadowed pre-check. '''
+    _count('agreed' if llm_sufficient else 'disagreed')
+
+
+@dataclass(frozen=True)
+class PrecheckStats:
+    ambiguous: int  # left to the LLM
+    skipped: int    # LLM call skipped
+    shadowed: int   # clearly sufficient in shadow mode (LLM still called)
+    agreed: int     # shadowed and the LLM found it sufficient
+    disagreed: int  # shadowed and the LLM asked for more information
+
+    @property
+    def skip_rate(self) -> float:
+        ''' The fraction of queries found clearly sufficient (skipped, or would have been in shadow mode). '''
+        total = self.ambiguous + self.skipped + self.shadowed
+        return (self.skipped + self.shadowed) / total if total else 0.0
+
+    @property
+    def disagreement_rate(self) -> float:
+        compared = self.agreed + self.disagreed
+        return self.disagreed / compared if compared else 0.0
+
+
+def get_stats(days: int | None = None) -> PrecheckStats:
+    ''' Pre-check statistics over the last `days` days (or all time if None). '''
+    db = get_db()
+    since = dt.date.min if days is None else dt.date.today() - dt.timedelta(days=days - 1)
+    row = db.execute("""
+        SELECT COALESCE(SUM(ambiguous), 0) AS ambiguous, COALESCE(SUM(skipped), 0) AS skipped, COALESCE(SUM(shadowed), 0) AS shadowed,
+               COALESCE(SUM(agreed), 0) AS agreed, COALESCE(SUM(disagreed), 0) AS disagreed
+        FROM sufficiency_stats WHERE day >= ?
+    """, [since]).fetchone()
+    return PrecheckStats(**dict(row))
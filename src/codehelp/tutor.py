@@ -20,11 +20,13 @@ from werkzeug.wrappers.response import Response
 
 from gened.admin import bp as bp_admin
 from gened.admin import register_admin_link
+from gened.asgi import async_view
 from gened.auth import get_auth, login_required
 from gened.classes import switch_class
 from gened.db import get_db
 from gened.experiments import experiment_required
-from gened.openai import LLMConfig, get_completion, with_llm
+from gened.eventloop import run_async
+from gened.providers import LLMConfig, Messages, get_completion, with_llm
 from gened.queries import get_query
 
 from . import prompts
@@ -210,7 +212,7 @@ def get_chat(chat_id: int) -> tuple[list[ChatCompletionMessageParam], str, str,
     return chat, topic, context_name, context_string
 
 
-def get_response(llm: LLMConfig, chat: list[ChatCompletionMessageParam]) -> tuple[dict[str, str], str]:
+async def get_response(llm: LLMConfig, chat: Messages) -> tuple[dict[str, str], str]:
     ''' Get a new 'assistant' completion for the specified chat.
 
     Parameters:
@@ -218,14 +220,10 @@ def get_response(llm: LLMConfig, chat: list[ChatCompletionMessageParam]) -> tupl
               following the OpenAI chat completion API spec.
 
     Returns a tuple containing:
-      1) A response object from the OpenAI completion (to be stored in the database).
+      1) A response object from the LLM completion (to be stored in the database).
       2) The response text.
     '''
-    response, text = asyncio.run(get_completion(
-        client=llm.client,
-        model=llm.model,
-        messages=chat,
-    ))
+    response, text = await get_completion(llm, chat)
 
     return response, text
 
@@ -240,9 +238,14 @@ def save_chat(chat_id: int, chat: list[ChatCompletionMessageParam]) -> None:
 
 
 def run_chat_round(llm: LLMConfig, chat_id: int, message: str|None = None) -> None:
+    run_async(run_chat_round_async(llm, chat_id, message))
+
+
+async def run_chat_round_async(llm: LLMConfig, chat_id: int, message: str|None = None) -> None:
+    ''' Async version of run_chat_round(), for async views (see gened.asgi). '''
     # Get the specified chat
     try:
-        chat, topic, context_name, context_string = get_chat(chat_id)
+        chat, topic, context_name, context_string = await asyncio.to_thread(get_chat, chat_id)
     except (ChatNotFoundError, AccessDeniedError):
         return
 
@@ -253,36 +256,37 @@ def run_chat_round(llm: LLMConfig, chat_id: int, message: str|None = None) -> No
             'content': message,
         })
 
-    save_chat(chat_id, chat)
+    await asyncio.to_thread(save_chat, chat_id, chat)
 
     # Get a response (completion) from the API using an expanded version of the chat messages
     # Insert a system prompt beforehand and an internal monologue after to guide the assistant
     expanded_chat : list[ChatCompletionMessageParam] = [
-        {'role': 'system', 'content': prompts.make_chat_sys_prompt(topic, context_string)},
+        *prompts.make_chat_sys_messages(topic, context_string, layout=prompts.prompt_layout()),
         *chat,  # chat is a list; expand it here with *
         {'role': 'assistant', 'content': prompts.tutor_monologue},
     ]
 
-    response_obj, response_txt = get_response(llm, expanded_chat)
+    response_obj, response_txt = await get_response(llm, expanded_chat)
 
     # Update the chat w/ the response
     chat.append({
         'role': 'assistant',
         'content': response_txt,
     })
-    save_chat(chat_id, chat)
+    await asyncio.to_thread(save_chat, chat_id, chat)
 
 
 @bp.route("/message", methods=["POST"])
+@async_view
 @with_llm()
-def new_message(llm: LLMConfig) -> Response:
+async def new_message(llm: LLMConfig) -> Response:
     chat_id = int(request.form["id"])
     new_msg = request.form["message"]
 
     # TODO: limit length
 
     # Run a round of the chat with the given message.
-    run_chat_round(llm, chat_id, new_msg)
+    await run_chat_round_async(llm, chat_id, new_msg)
 
     # Send the user back to the now-updated chat view
     return redirect(url_for("tutor.chat_interface", chat_id=chat_id))
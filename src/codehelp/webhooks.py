@@ -0,0 +1,354 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Completion webhooks, so API clients needn't block or poll for responses.
+
+A webhook can be registered for a class (in class_webhooks, with PUT
+/api/class/webhook), and instructors and admins can give a callback URL with
+an API request ("callback_url", stored in queries.callback_url) in a class
+with a registered webhook secret.  When record_response() stores a query's
+response, a notification for the query's callback URL, or else its class's
+webhook, is added to the webhook_outbox table in the same transaction, so a
+crash can't lose it.
+
+Webhook URLs come from API clients, so deliveries must not reach the
+server's own network: a URL's host must resolve only to public addresses
+(not loopback, private, link-local, or otherwise reserved ones, such as a
+cloud metadata endpoint).  That is checked when a URL is given and again
+before each delivery, since DNS answers can change.
+
+Each process delivers the outbox from a dispatcher thread, started by the
+first notification (or with "flask deliver-webhooks"):
+
+ - After a new notification, it waits WEBHOOK_BATCH_WINDOW seconds so that
+   a burst of completions (e.g., from a batch) is sent together:
+   notifications for the same URL are POSTed together, up to
+   WEBHOOK_BATCH_SIZE at a time.  It also checks for due retries every
+   WEBHOOK_POLL_INTERVAL seconds.
+ - The body is {"deliveries": [{"delivery_id", "query_id", "algorea_id",
+   "responses"}, ...]}.  It is signed with HMAC-SHA256 over
+   "<timestamp>.<url>.<body>", given as "sha256=<hex digest>" in the
+   X-CodeHelp-Signature header, with the Unix timestamp in
+   X-CodeHelp-Timestamp.  The key is the webhook secret of the query's
+   class, which only its instructors can see, and the destination URL is
+   signed so that a delivery can't be replayed to another endpoint.
+ - A 2xx response marks the notifications delivered.  Otherwise they are
+   retried after WEBHOOK_RETRY_BASE seconds, doubling each time (up to an
+   hour), and marked 'failed' after WEBHOOK_MAX_ATTEMPTS attempts.
+
+Notifications are claimed by pushing back their next_attempt, so processes
+can share the outbox, and those claimed by a process that died are retried
+once the claim expires.  Delivery is at least once: clients should ignore
+repeated delivery_ids.
+'''
+
+import asyncio
+import atexit
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+from sqlite3 import Row
+from urllib.parse import urlsplit
+
+import httpx
+from flask import Flask, current_app
+
+from gened.clients import http_clients
+from gened.db import get_db
+from gened.eventloop import run_async
+
+SIGNATURE_HEADER = 'X-CodeHelp-Signature'
+TIMESTAMP_HEADER = 'X-CodeHelp-Timestamp'
+
+# Seconds a claimed notification is held before it may be claimed again (e.g., if its process died)
+CLAIM_SECONDS = 120
+# Most notifications claimed in one pass, and the longest delay between retries (seconds)
+MAX_CLAIM = 500
+MAX_RETRY_DELAY = 60 * 60
+
+
+class WebhookError(Exception):
+    pass
+
+
+def valid_url(url: object) -> bool:
+    return isinstance(url, str) and urlsplit(url).scheme in ('http', 'https') and bool(urlsplit(url).hostname)
+
+
+def _resolve(host: str, port: int) -> list[str]:
+    return [info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)]
+
+
+def check_destination(url: str) -> None:
+    '''Raise ValueError unless url's host resolves only to public addresses (see the module docstring).'''
+    parts = urlsplit(url)
+    host = parts.hostname or ''
+    try:
+        addresses = _resolve(host, parts.port or (443 if parts.scheme == 'https' else 80))
+    except (OSError, UnicodeError) as e:
+        raise ValueError(f"Host {host} could not be resolved") from e
+    for address in addresses:
+        ip = ipaddress.ip_address(address.partition('%')[0])  # without an IPv6 scope
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError(f"Host {host} has a private or local address")
+
+
+def check_url(url: object, name: str = 'url') -> str:
+    '''Validate a webhook URL, raising ValueError if it can't be used.'''
+    if not valid_url(url):
+        raise ValueError(f"{name} must be an http or https URL")
+    assert isinstance(url, str)
+    check_destination(url)
+    return url
+
+
+def check_callback_url(url: object, class_id: int | None) -> str:
+    '''Validate a callback URL given with an API request in a class, raising ValueError if it can't be used.'''
+    url = check_url(url, 'callback_url')
+    if _signing_secret(class_id) is None:
+        raise ValueError("Callbacks are signed with the class's webhook secret: register one with PUT /api/class/webhook first")
+    return url
+
+
+# ### Class webhooks ###
+
+def get_class_webhook(class_id: int | None) -> Row | None:
+    if class_id is None:
+        return None
+    db = get_db()
+    return db.execute("SELECT url, secret FROM class_webhooks WHERE class_id=?", [class_id]).fetchone()  # type: ignore[no-any-return]
+
+
+def set_class_webhook(class_id: int, url: str | None, *, new_secret: bool = False) -> str:
+    '''Register a class's webhook URL, returning its signing secret (kept from an earlier registration unless new_secret).
+
+    With no URL, only the secret is registered, for signing callbacks given with requests.
+    '''
+    db = get_db()
+    current = get_class_webhook(class_id)
+    secret = current['secret'] if current is not None and not new_secret else secrets.token_urlsafe(32)
+    db.execute("INSERT OR REPLACE INTO class_webhooks (class_id, url, secret) VALUES (?, ?, ?)", [class_id, url, secret])
+    db.commit()
+    return secret
+
+
+def delete_class_webhook(class_id: int) -> None:
+    db = get_db()
+    db.execute("DELETE FROM class_webhooks WHERE class_id=?", [class_id])
+    db.commit()
+
+
+# ### Outbox ###
+
+def enqueue(query_id: int) -> bool:
+    '''Add a notification for a newly answered query to the outbox, if it has a callback URL or its class has a webhook.
+
+    Doesn't commit, so that it is part of the transaction recording the response.
+    Returns True if a notification was added.
+    '''
+    db = get_db()
+    row = db.execute("""
+        SELECT queries.callback_url, roles.class_id, class_webhooks.url AS class_url
+        FROM queries
+        LEFT JOIN roles ON roles.id=queries.role_id
+        LEFT JOIN class_webhooks ON class_webhooks.class_id=roles.class_id
+        WHERE queries.id=?
+    """, [query_id]).fetchone()
+    if row is None or not (row['callback_url'] or row['class_url']):
+        return False
+
+    db.execute(
+        "INSERT INTO webhook_outbox (query_id, class_id, url) VALUES (?, ?, ?)",
+        [query_id, row['class_id'], row['callback_url'] or row['class_url']]
+    )
+    return True
+
+
+def notify() -> None:
+    '''Wake the current app's dispatcher to deliver new notifications.'''
+    if current_app.config['WEBHOOK_DISPATCHER']:
+        current_app.extensions['webhooks'].wake()
+
+
+def sign(secret: str, timestamp: int, url: str, body: bytes) -> str:
+    digest = hmac.new(secret.encode(), f"{timestamp}.{url}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+async def post_batch(url: str, body: bytes, headers: dict[str, str]) -> None:
+    '''POST a batch of deliveries, raising WebhookError unless the response is a 2xx.'''
+    try:
+        await asyncio.to_thread(check_destination, url)  # its host may resolve differently now
+    except ValueError as e:
+        raise WebhookError(str(e)) from e
+    parts = urlsplit(url)
+    async with http_clients.lease(f"{parts.scheme}://{parts.netloc}") as http:
+        try:
+            response = await http.post(url, content=body, headers=headers)
+        except httpx.HTTPError as e:
+            raise WebhookError(f"{type(e).__name__}: {e}") from e
+    if not response.is_success:
+        raise WebhookError(f"HTTP {response.status_code}")
+
+
+def _claim(after_id: int) -> list[Row]:
+    db = get_db()
+    rows = db.execute("""
+        UPDATE webhook_outbox
+        SET next_attempt=DATETIME('now', ?), attempts=attempts+1
+        WHERE id IN (
+            SELECT id FROM webhook_outbox
+            WHERE status='pending' AND next_attempt <= DATETIME('now') AND id > ?
+            ORDER BY id
+            LIMIT ?
+        )
+        RETURNING id, query_id, class_id, url, attempts
+    """, [f"+{CLAIM_SECONDS} seconds", after_id, MAX_CLAIM]).fetchall()
+    db.commit()
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def _signing_secret(class_id: int | None) -> str | None:
+    webhook = get_class_webhook(class_id)
+    return webhook['secret'] if webhook is not None else None
+
+
+def _finish(batch: list[Row], error: BaseException | None) -> None:
+    db = get_db()
+    if error is None:
+        db.executemany(
+            "UPDATE webhook_outbox SET status='delivered', delivered=CURRENT_TIMESTAMP, last_error=NULL WHERE id=?",
+            [(row['id'],) for row in batch]
+        )
+        return
+
+    current_app.logger.warning(f"Webhook delivery to {batch[0]['url']} failed: {error}")
+    base = current_app.config['WEBHOOK_RETRY_BASE']
+    for row in batch:
+        if row['attempts'] >= current_app.config['WEBHOOK_MAX_ATTEMPTS']:
+            db.execute("UPDATE webhook_outbox SET status='failed', last_error=? WHERE id=?", [str(error), row['id']])
+        else:
+            delay = min(base * 2 ** (row['attempts'] - 1), MAX_RETRY_DELAY)
+            db.execute("UPDATE webhook_outbox SET next_attempt=DATETIME('now', ?), last_error=? WHERE id=?", [f"+{delay} seconds", str(error), row['id']])
+
+
+def _delivery_body(batch: list[Row], queries: dict[int, Row]) -> bytes:
+    return json.dumps({'deliveries': [
+        {
+            'delivery_id': row['id'],
+            'query_id': row['query_id'],
+            'algorea_id': queries[row['query_id']]['algorea_id'] if row['query_id'] in queries else None,
+            'responses': json.loads(queries[row['query_id']]['response_text'] or 'null') if row['query_id'] in queries else None,
+        } for row in batch
+    ]}).encode()
+
+
+async def _send(url: str, secret: str | None, body: bytes) -> None:
+    if not secret:
+        raise WebhookError("No secret to sign the delivery")
+    timestamp = int(time.time())
+    headers = {
+        'Content-Type': 'application/json',
+        TIMESTAMP_HEADER: str(timestamp),
+        SIGNATURE_HEADER: sign(secret, timestamp, url, body),
+    }
+    await post_batch(url, body, headers)
+
+
+async def _send_all(deliveries: list[tuple[str, str | None, bytes]]) -> list[BaseException | None]:
+    '''Send (url, secret, body) deliveries concurrently, returning each one's exception, if any.'''
+    return await asyncio.gather(*[_send(url, secret, body) for url, secret, body in deliveries], return_exceptions=True)
+
+
+def deliver_due() -> int:
+    '''Deliver the notifications that are due, in batches by URL.  Returns the number attempted.
+
+    Makes one pass through the outbox, so each notification is attempted at most once per call.
+    '''
+    db = get_db()
+    attempted = 0
+    last_id = 0
+    while rows := _claim(last_id):
+        attempted += len(rows)
+        last_id = rows[-1]['id']
+        queries = {
+            row['id']: row for row in
+            db.execute(f"SELECT id, algorea_id, response_text FROM queries WHERE id IN ({','.join('?' * len(rows))})", [row['query_id'] for row in rows])
+        }
+
+        # Group by destination (and signing key), in batches of at most WEBHOOK_BATCH_SIZE
+        by_dest: dict[tuple[str, int | None], list[Row]] = {}
+        for row in rows:
+            by_dest.setdefault((row['url'], row['class_id']), []).append(row)
+        size = current_app.config['WEBHOOK_BATCH_SIZE']
+        batches = [(dest, group[i:i+size]) for dest, group in by_dest.items() for i in range(0, len(group), size)]
+        # Looked up here: the database can't be used from the coroutines in _send_all() (see gened.db)
+        signing_secrets = {class_id: _signing_secret(class_id) for _, class_id in by_dest}
+        deliveries = [(url, signing_secrets[class_id], _delivery_body(batch, queries)) for (url, class_id), batch in batches]
+
+        results = run_async(_send_all(deliveries))
+        for (_, batch), error in zip(batches, results, strict=True):
+            _finish(batch, error)
+        db.commit()
+    return attempted
+
+
+# ### Dispatcher ###
+
+class WebhookDispatcher:
+    '''A thread delivering an app's webhook outbox (see the module docstring).'''
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+
+    def wake(self) -> None:
+        with self._lock:
+            # Started on first use, so that forked worker processes each start their own
+            if self._thread is None or self._pid != os.getpid():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+        self._wake.set()
+
+    def _run(self) -> None:
+        config = self.app.config
+        while not self._stop.is_set():
+            if self._wake.wait(timeout=config['WEBHOOK_POLL_INTERVAL']):
+                self._stop.wait(config['WEBHOOK_BATCH_WINDOW'])  # let a burst of completions accumulate
+                self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                with self.app.app_context():
+                    deliver_due()
+            except Exception:
+                self.app.logger.exception("Webhook delivery failed")
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join(timeout=timeout)
+
+
+def init_app(app: Flask) -> None:
+    dispatcher = WebhookDispatcher(app)
+    app.extensions['webhooks'] = dispatcher
+    atexit.register(dispatcher.stop)
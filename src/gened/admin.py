@@ -25,10 +25,12 @@ from flask import (
 from flask.app import Flask
 from werkzeug.wrappers.response import Response
 
+from . import budgets, keypool
 from .auth import admin_required
+from .circuit import circuits
 from .csv import csv_response
 from .db import backup_db, get_db
-from .openai import get_models
+from .providers import get_models
 
 bp = Blueprint('admin', __name__, url_prefix="/admin", template_folder='templates')
 
@@ -270,6 +272,15 @@ def main() -> str:
         ORDER BY num_recent_queries DESC, classes.id DESC
     """, where_params).fetchall()
 
+    # state of the API key circuit each class last used (see circuit.py); a consumer shows its classes' states
+    class_states = {row['id']: circuits.class_state(row['id']) for row in db.execute("SELECT id FROM classes").fetchall()}
+    consumer_states: dict[int, set[str]] = {}
+    for row in db.execute("SELECT lti_consumer_id, class_id FROM classes_lti").fetchall():
+        if class_states.get(row['class_id']):
+            consumer_states.setdefault(row['lti_consumer_id'], set()).add(class_states[row['class_id']])
+    consumers_data = [dict(row) | {'api_state': ", ".join(sorted(consumer_states.get(row['id'], [])))} for row in consumers]
+    classes_data = [dict(row) | {'api_state': class_states.get(row['id'], "")} for row in classes]
+
     # users, filtered by consumer and class
     where_clause, where_params = filters.make_where(['consumer', 'class'])
     users = db.execute(f"""
@@ -329,7 +340,7 @@ def main() -> str:
     for generate_chart in _admin_chart_generators:
         charts.extend(generate_chart(where_clause, where_params))
 
-    return render_template("admin.html", charts=charts, consumers=consumers, classes=classes, users=users, roles=roles, queries=queries, filters=filters)
+    return render_template("admin.html", charts=charts, consumers=consumers_data, classes=classes_data, users=users, roles=roles, queries=queries, filters=filters)
 
 
 @register_admin_link("Download DB", right=True)
@@ -381,7 +392,9 @@ def consumer_delete(consumer_id: int) -> Response:
 
     consumer_name = consumer_name_row['lti_consumer']
 
-    # Delete the row
+    # Delete the row, along with its additional keys and budget
+    keypool.clear_keys(consumer_id=consumer_id)
+    budgets.set_budget(None, None, None, consumer_id=consumer_id)
     db.execute("DELETE FROM consumers WHERE id=?", [consumer_id])
     db.commit()
     reload_consumers()
@@ -395,7 +408,9 @@ def consumer_delete(consumer_id: int) -> Response:
 def consumer_form(consumer_id: int | None = None) -> str:
     db = get_db()
     consumer_row = db.execute("SELECT * FROM consumers WHERE id=?", [consumer_id]).fetchone()
-    return render_template("consumer_form.html", consumer=consumer_row, models=get_models())
+    pool_keys = keypool.list_keys(consumer_id=consumer_id)
+    budget = budgets.get_budget(consumer_id=consumer_id) if consumer_id is not None else None
+    return render_template("consumer_form.html", consumer=consumer_row, pool_keys=pool_keys, budget=budget, models=get_models())
 
 
 @bp.route("/consumer/update", methods=['POST'])
@@ -404,11 +419,25 @@ def consumer_update() -> Response:
 
     consumer_id = request.form.get("consumer_id", type=int)
 
+    try:
+        pool_keys = keypool.parse_keys(request.form.get('pool_keys', ''))
+    except ValueError as e:
+        flash(f"Invalid additional API keys: {e}", "warning")
+        return redirect(url_for(".consumer_form", consumer_id=consumer_id) if consumer_id else url_for(".consumer_new"))
+
+    try:
+        token_limit, cost_limit, fallback_model_id = budgets.parse_limits(request.form)
+    except ValueError as e:
+        flash(f"Invalid usage budget: {e}", "warning")
+        return redirect(url_for(".consumer_form", consumer_id=consumer_id) if consumer_id else url_for(".consumer_new"))
+
     if consumer_id is None:
         # Adding a new consumer
         cur = db.execute("INSERT INTO consumers (lti_consumer, lti_secret, openai_key, model_id) VALUES (?, ?, ?, ?)",
                          [request.form['lti_consumer'], request.form['lti_secret'], request.form['openai_key'], request.form['model_id']])
         consumer_id = cur.lastrowid
+        keypool.add_keys(pool_keys, consumer_id=consumer_id)
+        budgets.set_budget(token_limit, cost_limit, fallback_model_id, consumer_id=consumer_id)
         db.commit()
         flash(f"Consumer {request.form['lti_consumer']} created.")
 
@@ -422,6 +451,16 @@ def consumer_update() -> Response:
         db.commit()
         flash("Consumer API key cleared.")
 
+    elif 'clear_pool_keys' in request.form:
+        keypool.clear_keys(consumer_id=consumer_id)
+        db.commit()
+        flash("Consumer additional API keys cleared.")
+
+    elif 'reset_budget' in request.form:
+        budgets.reset_budget(consumer_id=consumer_id)
+        db.commit()
+        flash("Consumer usage budget reset.")
+
     else:
         # Updating
         if request.form.get('lti_secret', ''):
@@ -430,6 +469,8 @@ def consumer_update() -> Response:
             db.execute("UPDATE consumers SET openai_key=? WHERE id=?", [request.form['openai_key'], consumer_id])
         if request.form.get('model_id', ''):
             db.execute("UPDATE consumers SET model_id=? WHERE id=?", [request.form['model_id'], consumer_id])
+        keypool.add_keys(pool_keys, consumer_id=consumer_id)
+        budgets.set_budget(token_limit, cost_limit, fallback_model_id, consumer_id=consumer_id)
         db.commit()
         flash("Consumer updated.")
 
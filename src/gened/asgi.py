@@ -0,0 +1,251 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Serving an app over ASGI, with views that await their LLM calls natively.
+
+Under WSGI, each request holds a worker thread until its response is ready,
+including the seconds spent waiting on LLM completions.  AsgiApp serves the
+same Flask app from an ASGI server (e.g., "uvicorn --factory
+codehelp.asgi:create_asgi_app"):
+
+ - Synchronous work (routing, decorators, before/after-request handlers,
+   sync views, and iterating response bodies) runs in a pool of
+   ASGI_SYNC_WORKERS threads, as a WSGI server would run it.
+ - A view decorated with @async_view may return a coroutine (typically, it
+   is an `async def` under the usual sync decorators).  AsgiApp awaits that
+   coroutine on the server's event loop, with no thread held, and then
+   finishes the request in the thread pool.  Many more requests can then wait
+   on completions at once than there are threads.
+
+Under WSGI (and in the test client), @async_view runs the view's coroutine
+on the app's event loop thread with run_async() instead, so the same views
+work in both deployments.  Since that runs it in a copy of the request's
+context, streamed responses using stream_with_context() (e.g.,
+gened.streaming.sse_response()) must be returned by the sync part of a view,
+not by its coroutine.
+
+Coroutines run in the request's context (with Flask's request and app
+contexts), so the usual helpers work in them, but blocking work must be
+handed to a thread with asyncio.to_thread().  That includes any database
+access: get_db() raises RuntimeError in a coroutine (see gened.db).
+
+Decorators that post-process a view's result (e.g., flask_cors's
+cross_origin()) can't be applied to a view that returns a coroutine; see
+then() for writing ones that can.
+'''
+
+import asyncio
+import contextvars
+import inspect
+import io
+import sys
+from collections.abc import Awaitable, Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+from typing import Any, ParamSpec, TypeVar
+
+from flask import request, request_started
+from flask.app import Flask
+from flask.ctx import RequestContext
+from werkzeug.wrappers.response import Response
+
+from . import clients
+from .eventloop import run_async
+
+P = ParamSpec('P')
+R = TypeVar('R')
+T = TypeVar('T')
+
+# Set in the WSGI environ of requests served by AsgiApp
+ENVIRON_KEY = 'gened.asgi'
+
+Scope = dict[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+def served_by_asgi() -> bool:
+    '''True if the current request is being served by AsgiApp.'''
+    return bool(request.environ.get(ENVIRON_KEY))
+
+
+def async_view(f: Callable[P, R]) -> Callable[P, R]:
+    '''Decorate a view that may return a coroutine, to be applied directly under the route decorator.
+
+    Served by AsgiApp, the coroutine is returned for AsgiApp to await.
+    Otherwise, it is run on the app's event loop thread (see gened.eventloop).
+    '''
+    @wraps(f)
+    def decorated_function(*args: P.args, **kwargs: P.kwargs) -> R:
+        rv = f(*args, **kwargs)
+        if inspect.iscoroutine(rv) and not served_by_asgi():
+            return run_async(rv)  # type: ignore[no-any-return]
+        return rv
+    return decorated_function
+
+
+def then(rv: T | Awaitable[T], f: Callable[[T], R]) -> R | Awaitable[R]:
+    '''Apply f to a view's result, after awaiting it if it is awaitable.'''
+    if inspect.isawaitable(rv):
+        async def apply() -> R:
+            return f(await rv)
+        return apply()
+    return f(rv)
+
+
+def build_environ(scope: Scope, body: bytes) -> dict[str, Any]:
+    '''A WSGI environ for an ASGI HTTP request (following PEP 3333 and the ASGI spec).'''
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+    environ: dict[str, Any] = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf8').decode('latin1'),
+        'PATH_INFO': path.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.input_terminated': True,  # the whole body has been read
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        ENVIRON_KEY: True,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_LENGTH', 'CONTENT_TYPE'):
+            name = f"HTTP_{name}"
+        value = raw_value.decode('latin1')
+        if name in environ:
+            value = f"{environ[name]},{value}"
+        environ[name] = value
+    return environ
+
+
+class AsgiApp:
+    '''An ASGI application serving a Flask app (see the module docstring).'''
+    def __init__(self, app: Flask, sync_workers: int | None = None) -> None:
+        self.app = app
+        self.executor = ThreadPoolExecutor(
+            max_workers=sync_workers or app.config['ASGI_SYNC_WORKERS'],
+            thread_name_prefix='asgi-sync',
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http':
+            await self.handle_http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.handle_lifespan(receive, send)
+        else:
+            raise NotImplementedError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def handle_lifespan(self, receive: Receive, send: Send) -> None:
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def shutdown(self) -> None:
+        '''Close the clients opened on this event loop and let their closes (and pending calls) finish.'''
+        clients.close_all_clients(asyncio.get_running_loop())
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=self.app.config['EVENT_LOOP_SHUTDOWN_TIMEOUT'])
+        self.executor.shutdown(wait=False)
+
+    async def handle_http(self, scope: Scope, receive: Receive, send: Send) -> None:
+        body = b''
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body', False):
+                break
+
+        environ = build_environ(scope, body)
+        loop = asyncio.get_running_loop()
+        # Every step of the request runs in this context (or, for the view's coroutine, a copy of it), in turn,
+        # so they all see the request context it pushes.
+        context = contextvars.copy_context()
+
+        def in_thread(f: Callable[..., T], *args: Any) -> Awaitable[T]:
+            return loop.run_in_executor(self.executor, context.run, f, *args)
+
+        request_ctx = self.app.request_context(environ)
+        error: Exception | None = None
+        try:
+            rv, error = await in_thread(self._dispatch, request_ctx)
+            if inspect.isawaitable(rv):
+                try:
+                    # (create_task()'s context argument needs Python 3.11; the task copies this context instead)
+                    rv = await context.run(asyncio.ensure_future, rv)
+                except Exception as e:
+                    rv, error = None, e
+            response, error = await in_thread(self._finalize, rv, error)
+            app_iter, status, headers = await in_thread(response.get_wsgi_response, environ)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            await in_thread(self._pop, request_ctx, error)
+
+        await send({
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [(name.lower().encode('latin1'), value.encode('latin1')) for name, value in headers],
+        })
+        chunks = iter(app_iter)
+        try:
+            while (chunk := await in_thread(next, chunks, None)) is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            if hasattr(app_iter, 'close'):
+                await in_thread(app_iter.close)
+
+    # The steps below follow Flask.wsgi_app() and Flask.full_dispatch_request(), split where a view may return a coroutine.
+
+    def _dispatch(self, request_ctx: RequestContext) -> tuple[Any, Exception | None]:
+        app = self.app
+        request_ctx.push()
+        try:
+            request_started.send(app, _async_wrapper=app.ensure_sync)
+            rv = app.preprocess_request()
+            if rv is None:
+                rv = app.dispatch_request()
+            return rv, None
+        except Exception as e:
+            return None, e
+
+    def _finalize(self, rv: Any, error: Exception | None) -> tuple[Response, Exception | None]:
+        app = self.app
+        try:
+            try:
+                if error is not None:
+                    raise error
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            return app.finalize_request(rv), None
+        except Exception as e:
+            return app.handle_exception(e), e
+
+    def _pop(self, request_ctx: RequestContext, error: Exception | None) -> None:
+        if error is not None and self.app.should_ignore_error(error):
+            error = None
+        request_ctx.pop(error)
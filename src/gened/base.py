@@ -18,14 +18,18 @@ from werkzeug.middleware.proxy_fix import ProxyFix
 from . import (
     admin,
     auth,
+    budget_config,
     class_config,
     classes,
+    clients,
     db,
     demo,
     docs,
+    eventloop,
     experiments,  # noqa: F401 (import registers routes even though unused here)
     filters,
     instructor,
+    llm_status,  # noqa: F401 (import registers routes even though unused here)
     lti,
     migrate,
     oauth,
@@ -117,6 +121,47 @@ def create_app_base(import_name: str, app_config: dict[str, Any], instance_path:
         SEND_FILE_MAX_AGE_DEFAULT=3*60*60,  # 3 hours
         # Free query tokens given to new users
         DEFAULT_TOKENS=10,
+        # Max number of pooled LLM API clients (one per API key and endpoint) kept per registry
+        LLM_CLIENT_POOL_SIZE=32,
+        # Seconds to let pending LLM calls finish when the app's event loop is stopped at exit (see gened.eventloop)
+        EVENT_LOOP_SHUTDOWN_TIMEOUT=5.0,
+        # Threads for the synchronous parts of requests when served over ASGI (see gened.asgi)
+        ASGI_SYNC_WORKERS=16,
+        # Exact-match completion cache (see gened.completion_cache): entry lifetime in seconds (0 disables), max entries,
+        # and seconds its writes wait for the database's write lock before being skipped
+        COMPLETION_CACHE_TTL=7*24*60*60,  # 1 week
+        COMPLETION_CACHE_MAX_ENTRIES=10000,
+        COMPLETION_CACHE_DB_TIMEOUT=1.0,
+        # Completion retries and hedging (see gened.resilience): max retries per request,
+        # backoff base and cap in seconds, and whether to hedge slow main-prompt requests
+        COMPLETION_RETRIES=3,
+        COMPLETION_BACKOFF_BASE=0.5,
+        COMPLETION_BACKOFF_MAX=8.0,
+        COMPLETION_HEDGE=False,
+        # Share one API call among identical completion requests in flight at once (see gened.coalesce)
+        COMPLETION_COALESCE=True,
+        # Time limit for all of a query's completions, in seconds (0 for none)
+        QUERY_DEADLINE=90,
+        # Circuit breakers per provider and API key (see gened.circuit): the failure rate
+        # (0 disables) over the last CIRCUIT_WINDOW requests (at least CIRCUIT_MIN_REQUESTS)
+        # at which requests fail fast, and for how long before a probe request is let through
+        CIRCUIT_ERROR_RATE=0.5,
+        CIRCUIT_WINDOW=20,
+        CIRCUIT_MIN_REQUESTS=5,
+        CIRCUIT_OPEN_SECONDS=30,
+        # Client-side rate limits per API key (see gened.ratelimit): requests and tokens per
+        # minute (0 for no limit), the longest a request may queue, and 'memory' (per process)
+        # or 'sqlite' (shared by all processes using the instance folder)
+        RATE_LIMIT_RPM=int(os.environ.get('RATE_LIMIT_RPM', 0)),
+        RATE_LIMIT_TPM=int(os.environ.get('RATE_LIMIT_TPM', 0)),
+        RATE_LIMIT_MAX_WAIT=30,
+        RATE_LIMIT_BACKEND=os.environ.get('RATE_LIMIT_BACKEND', 'memory').lower(),
+        # Pools of API keys (see gened.keypool): 'least_outstanding' or 'weighted' selection,
+        # and how long a key with an exhausted quota is left out of its pool
+        KEY_POOL_STRATEGY='least_outstanding',
+        KEY_POOL_DRAIN_SECONDS=60*60,  # 1 hour
+        # Share of a usage budget left at which a class switches to the budget's fallback model (see gened.budgets)
+        BUDGET_LOW_FRACTION=0.2,
 
         PYLTI_CONFIG={
             # will be loaded from the consumers table in the database
@@ -138,27 +183,27 @@ def create_app_base(import_name: str, app_config: dict[str, Any], instance_path:
             app.logger.error(f"{varname} environment variable not set.")
             sys.exit(1)
 
-    # Load provider-specific API keys based on MODEL_PROVIDER
+    # MODEL_PROVIDER serves requests that are not routed by a class's model (see gened.providers),
+    # so its API key is required.  Keys for other providers are loaded if set, for classes using them.
+    provider_keys = {
+        'openai': "OPENAI_API_KEY",
+        'mistral': "MISTRAL_API_KEY",
+        'dartmouth': "DARTMOUTH_API_KEY",
+        'gemini': "GEMINI_API_KEY",
+    }
     model_provider = os.environ.get('MODEL_PROVIDER', 'openai').lower()
-    if model_provider == 'openai':
-        required_keys = ["OPENAI_API_KEY"]
-    elif model_provider == 'mistral':
-        required_keys = ["MISTRAL_API_KEY"]
-    elif model_provider == 'dartmouth':
-        required_keys = ["DARTMOUTH_API_KEY"]
-    elif model_provider == 'gemini':
-        required_keys = ["GEMINI_API_KEY"]
-    else:
+    if model_provider not in provider_keys:
         app.logger.error(f"Unsupported MODEL_PROVIDER: {model_provider}")
         sys.exit(1)
-    for varname in required_keys:
+    base_config['MODEL_PROVIDER'] = model_provider
+    for provider, varname in provider_keys.items():
         try:
             env_var = os.environ[varname]
             base_config[varname] = env_var
-            print(f'Loaded in environment variable = {env_var}')
         except KeyError:
-            app.logger.error(f"{varname} environment variable not set.")
-            sys.exit(1)
+            if provider == model_provider:
+                app.logger.error(f"{varname} environment variable not set.")
+                sys.exit(1)
 
     # CLIENT_ID/CLIENT_SECRET vars are used by authlib:
     #   https://docs.authlib.org/en/latest/client/flask.html#configuration
@@ -181,7 +226,9 @@ def create_app_base(import_name: str, app_config: dict[str, Any], instance_path:
     app.config.from_mapping(total_config)
 
     admin.init_app(app)
+    clients.init_app(app)
     db.init_app(app)
+    eventloop.init_app(app)
     filters.init_app(app)
     migrate.init_app(app)
     oauth.init_app(app)
@@ -196,6 +243,8 @@ def create_app_base(import_name: str, app_config: dict[str, Any], instance_path:
     app.register_blueprint(profile.bp)
     app.register_blueprint(classes.bp)
     app.register_blueprint(class_config.bp)
+    app.register_blueprint(budget_config.bp)
+    budget_config.register()
 
     # Only register the docs blueprint if we're configured with a documentation directory
     docs_dir = app.config.get('DOCS_DIR')
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from flask import (
+    Blueprint,
+    current_app,
+    flash,
+    redirect,
+    render_template,
+    request,
+    url_for,
+)
+from markupsafe import Markup
+from werkzeug.wrappers.response import Response
+
+from .auth import get_auth, instructor_required
+from .budgets import get_budget, get_budgets, get_burndown, parse_limits, reset_budget, set_budget
+from .class_config import register_extra_section
+from .db import get_db
+
+# This module provides the usage budget section of the class configuration
+# page: the class's budget, its burn-down, and a form to change it (see budgets.py).
+
+
+def register() -> None:
+    """ Register the budget section (render function) in the class configuration UI. """
+    register_extra_section(config_section_render)
+
+
+def config_section_render() -> Markup:
+    auth = get_auth()
+    class_id = auth['class_id']
+    assert class_id is not None
+    budget = get_budget(class_id=class_id)
+    consumer_budgets = [b for b in get_budgets(class_id) if b.scope == 'consumer']
+    burndown = get_burndown(class_id, budget) if budget else []
+    db = get_db()
+    models = db.execute("SELECT id, name, provider FROM models WHERE active ORDER BY id").fetchall()
+    # Wrap in Markup because it's already escaped (by Jinja) and safe.
+    return Markup(render_template(
+        "budget_config.html",
+        budget=budget,
+        consumer_budget=consumer_budgets[0] if consumer_budgets else None,
+        burndown=burndown,
+        models=models,
+        low_fraction=current_app.config['BUDGET_LOW_FRACTION'],
+    ))
+
+
+bp = Blueprint('budget_config', __name__, url_prefix="/instructor/budget", template_folder='templates')
+
+@bp.before_request
+@instructor_required
+def before_request() -> None:
+    """ Apply decorator to protect all budget_config blueprint endpoints. """
+
+
+@bp.route("/update", methods=["POST"])
+def update_budget() -> Response:
+    db = get_db()
+    auth = get_auth()
+    class_id = auth['class_id']
+    assert class_id is not None
+
+    if 'reset_budget' in request.form:
+        reset_budget(class_id=class_id)
+        db.commit()
+        flash("Usage budget reset.", "success")
+        return redirect(url_for("class_config.config_form"))
+
+    try:
+        token_limit, cost_limit, fallback_model_id = parse_limits(request.form)
+    except ValueError as e:
+        flash(f"Invalid usage budget: {e}", "danger")
+        return redirect(url_for("class_config.config_form"))
+
+    set_budget(token_limit, cost_limit, fallback_model_id, class_id=class_id)
+    db.commit()
+    flash("Usage budget updated.", "success")
+    return redirect(url_for("class_config.config_form"))
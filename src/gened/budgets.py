@@ -0,0 +1,261 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Token and cost budgets for consumers and classes.
+
+A query limit (classes.max_queries) treats every query alike, though one
+with a 2,000-line file can cost as much as a hundred ordinary ones.  A
+consumer or class can instead have a budget (in the usage_budgets table)
+with a token limit, a cost limit (in USD), or both.  A class is subject to
+its own budget and its consumer's.
+
+Each completion made for a class is charged when its response arrives (by
+providers.get_completion() and stream_completion()).  The tokens reported
+by the provider (or estimated, if it reports none), priced with the
+model's prices in the models table, are added to the usage_ledger table.
+In the same transaction, the spending is added to the counters of every
+budget that applies.  A response shared by identical requests in flight
+(see gened.coalesce) is charged to each request that receives it, so a
+class's usage counts against its budgets however its requests are served.
+
+When with_llm() gets an LLM for a class:
+  - if a budget has BUDGET_LOW_FRACTION or less remaining and names a
+    fallback model on the same provider, that cheaper model is used;
+  - if a budget is used up, a request that spends a token is refused with
+    BudgetExhaustedError.
+
+Responses already in flight when a budget runs out are still charged, so
+a budget can be overspent slightly.
+'''
+
+import dataclasses
+import datetime as dt
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from sqlite3 import Row
+from typing import Any, TypeVar
+
+from flask import current_app, has_request_context
+from werkzeug.datastructures import MultiDict
+
+from .auth import get_auth
+from .db import get_db
+from .tokens import estimate_messages, estimate_tokens, token_counts
+
+C = TypeVar('C')
+
+
+class BudgetExhaustedError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class Budget:
+    scope: str  # 'class' or 'consumer'
+    token_limit: int | None
+    cost_limit: float | None
+    spent_tokens: int
+    spent_cost: float
+    period_start: dt.datetime
+    fallback_model_id: int | None = None
+    fallback_model: str | None = None
+    fallback_provider: str | None = None
+
+    @property
+    def remaining_fraction(self) -> float:
+        '''The smallest fraction remaining of the budget's limits.'''
+        fractions = [1.0]
+        if self.token_limit is not None:
+            fractions.append(1 - self.spent_tokens / self.token_limit if self.token_limit else 0.0)
+        if self.cost_limit is not None:
+            fractions.append(1 - self.spent_cost / self.cost_limit if self.cost_limit else 0.0)
+        return max(0.0, min(fractions))
+
+    @property
+    def exhausted(self) -> bool:
+        return self.remaining_fraction <= 0
+
+
+def _budget(row: Row) -> Budget:
+    return Budget(
+        scope='class' if row['class_id'] is not None else 'consumer',
+        token_limit=row['token_limit'],
+        cost_limit=row['cost_limit'],
+        spent_tokens=row['spent_tokens'],
+        spent_cost=row['spent_cost'],
+        period_start=row['period_start'],
+        fallback_model_id=row['fallback_model_id'],
+        fallback_model=row['fallback_model'],
+        fallback_provider=row['fallback_provider'],
+    )
+
+
+_BUDGET_QUERY = """
+    SELECT usage_budgets.*, models.model AS fallback_model, models.provider AS fallback_provider
+    FROM usage_budgets
+    LEFT JOIN models ON models.id = usage_budgets.fallback_model_id
+"""
+
+
+def get_budgets(class_id: int) -> list[Budget]:
+    '''Get the budgets that apply to a class: its own and its consumer's.'''
+    db = get_db()
+    rows = db.execute(f"""
+        {_BUDGET_QUERY}
+        WHERE usage_budgets.class_id = ?
+           OR usage_budgets.consumer_id = (SELECT lti_consumer_id FROM classes_lti WHERE class_id = ?)
+        ORDER BY usage_budgets.class_id IS NULL
+    """, [class_id, class_id]).fetchall()
+    return [_budget(row) for row in rows]
+
+
+def get_budget(*, consumer_id: int | None = None, class_id: int | None = None) -> Budget | None:
+    '''Get the budget set for a consumer or class, if any.'''
+    db = get_db()
+    row = db.execute(f"""
+        {_BUDGET_QUERY}
+        WHERE usage_budgets.consumer_id IS ? AND usage_budgets.class_id IS ?
+    """, [consumer_id, class_id]).fetchone()
+    return _budget(row) if row else None
+
+
+def parse_limits(form: MultiDict[str, str]) -> tuple[int | None, float | None, int | None]:
+    '''Parse the token limit, cost limit, and fallback model ID of a budget form (blank: none).'''
+    try:
+        token_limit = int(form['token_limit']) if form.get('token_limit', '').strip() else None
+        cost_limit = float(form['cost_limit']) if form.get('cost_limit', '').strip() else None
+        fallback_model_id = int(form['fallback_model_id']) if form.get('fallback_model_id', '').strip() else None
+    except ValueError as e:
+        raise ValueError("Limits must be numbers") from e
+    if (token_limit is not None and token_limit < 1) or (cost_limit is not None and cost_limit <= 0):
+        raise ValueError("Limits must be positive")
+    return token_limit, cost_limit, fallback_model_id
+
+
+def set_budget(token_limit: int | None, cost_limit: float | None, fallback_model_id: int | None, *, consumer_id: int | None = None, class_id: int | None = None) -> None:
+    '''Set (or, with no limits, remove) the budget of a consumer or class, keeping its spending.'''
+    db = get_db()
+    if token_limit is None and cost_limit is None:
+        db.execute("DELETE FROM usage_budgets WHERE consumer_id IS ? AND class_id IS ?", [consumer_id, class_id])
+        return
+    cur = db.execute(
+        "UPDATE usage_budgets SET token_limit=?, cost_limit=?, fallback_model_id=? WHERE consumer_id IS ? AND class_id IS ?",
+        [token_limit, cost_limit, fallback_model_id, consumer_id, class_id]
+    )
+    if cur.rowcount == 0:
+        # A new budget counts spending from now
+        db.execute(
+            "INSERT INTO usage_budgets (consumer_id, class_id, token_limit, cost_limit, fallback_model_id) VALUES (?, ?, ?, ?, ?)",
+            [consumer_id, class_id, token_limit, cost_limit, fallback_model_id]
+        )
+
+
+def reset_budget(*, consumer_id: int | None = None, class_id: int | None = None) -> None:
+    '''Start a new budget period, with nothing spent.'''
+    db = get_db()
+    db.execute(
+        "UPDATE usage_budgets SET spent_tokens=0, spent_cost=0, period_start=CURRENT_TIMESTAMP WHERE consumer_id IS ? AND class_id IS ?",
+        [consumer_id, class_id]
+    )
+
+
+def apply_budgets(llm: C, provider: str, class_id: int, *, spend_token: bool) -> C:
+    '''Apply a class's budgets to the LLM config for a request (see above).
+
+    Raises BudgetExhaustedError if spend_token and a budget is used up.
+    '''
+    budgets = get_budgets(class_id)
+    if spend_token:
+        for budget in budgets:
+            if budget.exhausted:
+                raise BudgetExhaustedError(f"This {'class' if budget.scope == 'class' else 'institution'}'s usage budget has been used up.  Please contact your instructor.")
+
+    low_fraction = current_app.config['BUDGET_LOW_FRACTION']
+    for budget in budgets:
+        if budget.remaining_fraction <= low_fraction and budget.fallback_model and budget.fallback_provider == provider:
+            if budget.fallback_model != llm.model:  # type: ignore[attr-defined]
+                current_app.logger.info(f"Class {class_id} budget low ({budget.remaining_fraction:.0%} left): using {budget.fallback_model}")
+                return dataclasses.replace(llm, model=budget.fallback_model)  # type: ignore[type-var]
+            break
+    return llm
+
+
+def completion_cost(prices: Row | None, prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    '''The cost in USD of a completion, given a models table row's prices (per million tokens).'''
+    if prices is None:
+        return 0.0
+    price_prompt = prices['price_prompt'] or 0.0
+    price_cached = prices['price_cached'] if prices['price_cached'] is not None else price_prompt
+    price_completion = prices['price_completion'] or 0.0
+    uncached = prompt_tokens - cached_tokens
+    return (uncached * price_prompt + cached_tokens * price_cached + completion_tokens * price_completion) / 1_000_000
+
+
+def charge(provider: str, llm: Any, messages: Sequence[Mapping[str, Any]], response: dict[str, Any], response_txt: str) -> None:
+    '''Charge a completion to the current class's ledger and budgets, if there is a class.'''
+    if not has_request_context():
+        return  # e.g., a CLI command
+    class_id = get_auth()['class_id']
+    if class_id is None:
+        return
+
+    prompt_tokens, completion_tokens, cached_tokens = token_counts(response)
+    estimated = prompt_tokens is None or completion_tokens is None
+    if prompt_tokens is None:
+        prompt_tokens = estimate_messages(messages, llm.model)
+    if completion_tokens is None:
+        completion_tokens = estimate_tokens(response_txt, llm.model)
+    cached_tokens = cached_tokens or 0
+
+    db = get_db()
+    prices = db.execute(
+        "SELECT price_prompt, price_cached, price_completion FROM models WHERE model=? AND provider=? ORDER BY active DESC LIMIT 1",
+        [llm.model, provider]
+    ).fetchone()
+    cost = completion_cost(prices, prompt_tokens, cached_tokens, completion_tokens)
+    tokens = prompt_tokens + completion_tokens
+
+    # One transaction: the ledger entry and every budget's counters are updated together
+    db.execute("""
+        INSERT INTO usage_ledger (class_id, consumer_id, provider, model, prompt_tokens, cached_tokens, completion_tokens, estimated, cost)
+        VALUES (?, (SELECT lti_consumer_id FROM classes_lti WHERE class_id = ?), ?, ?, ?, ?, ?, ?, ?)
+    """, [class_id, class_id, provider, llm.model, prompt_tokens, cached_tokens, completion_tokens, estimated, cost])
+    db.execute("""
+        UPDATE usage_budgets SET spent_tokens = spent_tokens + ?, spent_cost = spent_cost + ?
+        WHERE class_id = ?
+           OR consumer_id = (SELECT lti_consumer_id FROM classes_lti WHERE class_id = ?)
+    """, [tokens, cost, class_id, class_id])
+    db.commit()
+
+
+def get_burndown(class_id: int, budget: Budget, days: int = 14) -> list[dict[str, Any]]:
+    '''Daily spending of a class in the current budget period (up to the last `days` days),
+    with what remained of the budget's limits at the end of each day.'''
+    db = get_db()
+    since = max(dt.date.today() - dt.timedelta(days=days - 1), budget.period_start.date())
+    rows = db.execute("""
+        SELECT DATE(created) AS day, SUM(prompt_tokens + completion_tokens) AS tokens, SUM(cost) AS cost
+        FROM usage_ledger
+        WHERE class_id = ? AND created >= DATETIME(?)
+        GROUP BY day
+        ORDER BY day DESC
+    """, [class_id, budget.period_start]).fetchall()
+
+    # Walk back from today's totals to find what remained at the end of each day
+    by_day = {row['day']: row for row in rows}
+    tokens_left = budget.token_limit - budget.spent_tokens if budget.token_limit is not None else None
+    cost_left = budget.cost_limit - budget.spent_cost if budget.cost_limit is not None else None
+    burndown = []
+    day = dt.date.today()
+    while day >= since:
+        row = by_day.get(day.isoformat())
+        tokens = row['tokens'] if row else 0
+        cost = row['cost'] if row else 0.0
+        burndown.append({'day': day.isoformat(), 'tokens': tokens, 'cost': cost, 'tokens_left': tokens_left, 'cost_left': cost_left})
+        if tokens_left is not None:
+            tokens_left += tokens
+        if cost_left is not None:
+            cost_left += cost
+        day -= dt.timedelta(days=1)
+    return burndown
@@ -0,0 +1,179 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Circuit breakers for LLM API keys.
+
+When a provider is down, or a class's API key is invalid or out of quota,
+every query used to wait for its own timeout or error (and spend one of the
+student's queries).  A CircuitBreaker per (provider, API key) tracks the
+outcomes of recent requests (see resilience.with_retries()).  When the
+failure rate over the last CIRCUIT_WINDOW requests reaches
+CIRCUIT_ERROR_RATE, the circuit opens: requests fail immediately with
+CircuitOpenError, and providers' _get_llm() refuse to spend a query on them.
+After CIRCUIT_OPEN_SECONDS, the circuit is half-open, and a single probe
+request is let through.  It closes the circuit if it succeeds and reopens it
+if it fails.
+
+Breakers are kept in memory, so each process has its own.
+'''
+
+import threading
+import time
+from collections import deque
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from typing import Literal
+
+from flask import current_app
+
+State = Literal['closed', 'open', 'half-open']
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, retry_in: float) -> None:
+        super().__init__("The AI service for this class is not responding right now, so the query was not sent.  Please try again in a few minutes.")
+        self.retry_in = retry_in
+
+
+@dataclass
+class CircuitBreaker:
+    window: int          # number of recent requests the failure rate is computed over
+    min_requests: int    # the circuit can't open with fewer requests than this in the window
+    error_rate: float    # failure rate at which the circuit opens
+    open_seconds: float  # time open before a probe request is allowed
+    state: State = 'closed'
+    opened_at: float = 0.0
+    probing: bool = False  # a half-open probe request is in flight
+    trips: int = 0
+    outcomes: deque[bool] = field(default_factory=deque)  # True for success
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def _update(self) -> None:
+        if self.state == 'open' and time.monotonic() >= self.opened_at + self.open_seconds:
+            self.state = 'half-open'
+
+    def _trip(self) -> None:
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.trips += 1
+        self.outcomes.clear()
+
+    def available(self) -> bool:
+        '''True if a request would currently be allowed.'''
+        with self._lock:
+            self._update()
+            return self.state == 'closed' or (self.state == 'half-open' and not self.probing)
+
+    def acquire(self) -> bool:
+        '''Allow a request, or not.  In the half-open state, the allowed request is the probe.'''
+        with self._lock:
+            self._update()
+            if self.state == 'closed':
+                return True
+            if self.state == 'half-open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def release(self) -> None:
+        '''Give up an acquired request without a result (e.g., it was cancelled).'''
+        with self._lock:
+            self.probing = False
+
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            if self.state == 'half-open':
+                self.probing = False
+                if ok:
+                    self.state = 'closed'
+                else:
+                    self._trip()
+                return
+            if self.state == 'open':
+                return  # a request started before the circuit opened
+            self.outcomes.append(ok)
+            while len(self.outcomes) > self.window:
+                self.outcomes.popleft()
+            if len(self.outcomes) >= self.min_requests and self.failure_rate >= self.error_rate:
+                self._trip()
+
+    @property
+    def failure_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def retry_in(self) -> float:
+        '''Seconds until an open circuit lets a probe through.'''
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic()) if self.state == 'open' else 0.0
+
+
+def _mask(api_key: str | None) -> str:
+    return f"...{api_key[-4:]}" if api_key else "(none)"
+
+
+class CircuitRegistry:
+    '''The breakers of this process, keyed by (provider, API key).  Also
+    remembers the key each class last used, for reporting by class.'''
+    def __init__(self) -> None:
+        self._breakers: dict[tuple[str, str | None], CircuitBreaker] = {}
+        self._class_keys: dict[int, tuple[str, str | None]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, api_key: str | None) -> CircuitBreaker | None:
+        '''Get the breaker for a provider and key, or None if circuit breaking is disabled.'''
+        config = current_app.config
+        if not config['CIRCUIT_ERROR_RATE']:
+            return None
+        with self._lock:
+            breaker = self._breakers.get((provider, api_key))
+            if breaker is None:
+                breaker = CircuitBreaker(
+                    window=config['CIRCUIT_WINDOW'],
+                    min_requests=config['CIRCUIT_MIN_REQUESTS'],
+                    error_rate=config['CIRCUIT_ERROR_RATE'],
+                    open_seconds=config['CIRCUIT_OPEN_SECONDS'],
+                )
+                self._breakers[(provider, api_key)] = breaker
+            return breaker
+
+    def check(self, provider: str, api_key: str | None, class_id: int | None = None, *, pool: Sequence[str] = ()) -> None:
+        '''Raise CircuitOpenError if requests with this provider and key would fail
+        fast.  With a pool of keys (see gened.keypool), only if every key's would.'''
+        if class_id is not None:
+            with self._lock:
+                self._class_keys[class_id] = (provider, api_key)
+        breakers = [self.get(provider, key) for key in (pool or [api_key])]
+        open_breakers = [breaker for breaker in breakers if breaker is not None and not breaker.available()]
+        if open_breakers and len(open_breakers) == len(breakers):
+            raise CircuitOpenError(min(breaker.retry_in() for breaker in open_breakers))
+
+    def class_state(self, class_id: int) -> str:
+        '''A description of the state of the circuit last used by a class, for display.'''
+        with self._lock:
+            key = self._class_keys.get(class_id)
+            breaker = self._breakers.get(key) if key else None
+        if breaker is None:
+            return ""
+        breaker.available()  # updates an open circuit that has waited long enough
+        if breaker.state == 'open':
+            return f"open ({breaker.retry_in():.0f}s)"
+        return breaker.state
+
+    def status(self) -> list[dict[str, str | int]]:
+        with self._lock:
+            items = list(self._breakers.items())
+        rows: list[dict[str, str | int]] = []
+        for (provider, api_key), breaker in items:
+            breaker.available()
+            rows.append({
+                'provider': provider,
+                'key': _mask(api_key),
+                'state': breaker.state,
+                'failure_rate': f"{breaker.failure_rate:.0%}",
+                'trips': breaker.trips,
+                'retry_in': round(breaker.retry_in()),
+            })
+        return rows
+
+
+circuits = CircuitRegistry()
@@ -2,7 +2,6 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
-import asyncio
 import datetime as dt
 from collections.abc import Callable
 
@@ -12,10 +11,11 @@ from flask import (
     render_template,
 )
 
+from . import keypool
 from .auth import get_auth, instructor_required
 from .db import get_db
-# from .openai import LLMConfig, get_completion, get_models, with_llm
-from .dartmouth import LLMConfig, get_completion, get_models, with_llm
+from .eventloop import run_async
+from .providers import LLMConfig, get_completion, get_models, with_llm
 from .tz import date_is_past
 
 bp = Blueprint('class_config', __name__, url_prefix="/instructor/config", template_folder='templates')
@@ -47,7 +47,7 @@ def config_form() -> str:
     class_id = auth['class_id']
 
     class_row = db.execute("""
-        SELECT classes.id, classes.max_queries, classes.enabled, contexts.config, classes_user.link_ident, classes_user.link_reg_expires, classes_user.dartmouth_key, classes_user.model_id
+        SELECT classes.id, classes.max_queries, classes.enabled, classes.cache_completions, contexts.config, classes_user.link_ident, classes_user.link_reg_expires, classes_user.dartmouth_key, classes_user.model_id
         FROM classes
         LEFT JOIN classes_user
           ON classes.id = classes_user.class_id
@@ -86,17 +86,15 @@ def config_form() -> str:
     class_row = dict(class_row) if class_row else {}
     class_row['group_config'] = group_config
 
-    return render_template("instructor_class_config.html", class_row=class_row, link_reg_state=link_reg_state, models=get_models(), extra_sections=extra_sections)
+    pool_keys = keypool.list_keys(class_id=class_id)
+
+    return render_template("instructor_class_config.html", class_row=class_row, link_reg_state=link_reg_state, pool_keys=pool_keys, models=get_models(), extra_sections=extra_sections)
 
 
 @bp.route("/test_llm")
 @with_llm()
 def test_llm(llm: LLMConfig) -> str:
-    response, response_txt = asyncio.run(get_completion(
-        client=llm.client,
-        model=llm.model,
-        prompt="Please write 'OK'"
-    ))
+    response, response_txt = run_async(get_completion(llm, [{"role": "user", "content": "Please write 'OK'"}]))
 
     if 'error' in response:
         return f"<b>Error:</b><br>{response_txt}"
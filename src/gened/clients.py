@@ -0,0 +1,224 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Process-wide registries of reusable LLM API clients.
+
+Creating an API client per request means a new HTTP connection pool (and a new
+TLS handshake) for every completion.  A ClientRegistry hands out clients keyed
+by their connection parameters (e.g., API key and base URL) so that requests
+share clients and their keep-alive connections.
+
+Async clients are bound to the event loop on which their connections were
+opened, so entries are also keyed by the running event loop.  Entries whose
+loop has been closed are pruned automatically.
+'''
+
+import asyncio
+import atexit
+import threading
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Awaitable, Callable, Hashable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Generic, TypeVar
+
+import httpx
+from flask.app import Flask
+from openai import AsyncOpenAI
+
+C = TypeVar('C')
+
+DEFAULT_MAX_SIZE = 32
+
+# Timeouts for plain HTTP clients (LLM completions can legitimately take a while)
+HTTP_TIMEOUT = httpx.Timeout(120.0, connect=10.0)
+
+
+@dataclass(frozen=True)
+class RegistryStats:
+    name: str
+    size: int
+    max_size: int
+    in_use: int
+    hits: int
+    misses: int
+    evictions: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+@dataclass
+class _Entry(Generic[C]):
+    client: C
+    loop: asyncio.AbstractEventLoop
+    leases: int = 0
+    evicted: bool = False
+
+
+class ClientRegistry(Generic[C]):
+    '''A bounded, thread-safe, LRU-evicting registry of async API clients.
+
+    Clients are obtained with `async with registry.lease(*key) as client:`.
+    A leased client is never closed out from under its user: if it is evicted
+    while leased, it is closed when the last lease is released.
+    '''
+    def __init__(self, name: str, factory: Callable[..., C], closer: Callable[[C], Awaitable[None]], max_size: int = DEFAULT_MAX_SIZE) -> None:
+        self.name = name
+        self.max_size = max_size
+        self._factory = factory
+        self._closer = closer
+        self._entries: OrderedDict[tuple[Hashable, ...], _Entry[C]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._pending_closes: set[asyncio.Future[None]] = set()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @asynccontextmanager
+    async def lease(self, *key: Hashable) -> AsyncIterator[C]:
+        loop = asyncio.get_running_loop()
+        entry = self._acquire(key, loop)
+        try:
+            yield entry.client
+        finally:
+            with self._lock:
+                entry.leases -= 1
+                close_now = entry.evicted and entry.leases == 0
+            if close_now:
+                await self._closer(entry.client)
+
+    def _acquire(self, key: tuple[Hashable, ...], loop: asyncio.AbstractEventLoop) -> _Entry[C]:
+        full_key = (*key, id(loop))
+        to_close: list[_Entry[C]] = []
+        with self._lock:
+            entry = self._entries.get(full_key)
+            if entry is not None and entry.loop is loop:
+                self._hits += 1
+                self._entries.move_to_end(full_key)
+            else:
+                self._misses += 1
+                # Drop entries from event loops that no longer exist.  Their
+                # connections died with the loop, so there is nothing to close.
+                for stale_key in [k for k, e in self._entries.items() if e.loop.is_closed()]:
+                    del self._entries[stale_key]
+                entry = _Entry(self._factory(*key), loop)
+                self._entries[full_key] = entry
+                while len(self._entries) > self.max_size:
+                    _, evicted = self._entries.popitem(last=False)
+                    self._evictions += 1
+                    evicted.evicted = True
+                    if evicted.leases == 0:
+                        to_close.append(evicted)
+            entry.leases += 1
+
+        for evicted in to_close:
+            self._schedule_close(evicted)
+
+        return entry
+
+    def _schedule_close(self, entry: _Entry[C]) -> None:
+        '''Close a client on the event loop that owns it, if that loop is still usable.'''
+        loop = entry.loop
+        if loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if loop is running:
+            task = loop.create_task(self._closer(entry.client))  # type: ignore[arg-type]
+            self._pending_closes.add(task)
+            task.add_done_callback(self._pending_closes.discard)
+        elif loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._closer(entry.client), loop)  # type: ignore[arg-type]
+        else:
+            loop.run_until_complete(self._closer(entry.client))
+
+    def close_all(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        '''Close and forget every registered client (or only those bound to `loop`).  Used at shutdown.'''
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if loop is None or e.loop is loop]
+            entries = [self._entries.pop(k) for k in keys]
+        for entry in entries:
+            if entry.leases == 0:
+                self._schedule_close(entry)
+            else:
+                entry.evicted = True  # closed when its last lease is released
+
+    def stats(self) -> RegistryStats:
+        with self._lock:
+            return RegistryStats(
+                name=self.name,
+                size=len(self._entries),
+                max_size=self.max_size,
+                in_use=sum(e.leases for e in self._entries.values()),
+                hits=self._hits,
+                misses=self._misses,
+                evictions=self._evictions,
+            )
+
+
+async def _close_openai(client: AsyncOpenAI) -> None:
+    await client.close()
+
+
+openai_clients: ClientRegistry[AsyncOpenAI] = ClientRegistry(
+    "openai",
+    # Retries are made by gened.resilience (within a query's deadline), not by the SDK
+    factory=lambda api_key, base_url: AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0),
+    closer=_close_openai,
+)
+
+
+def make_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(timeout=HTTP_TIMEOUT)
+
+
+async def close_http_client(client: httpx.AsyncClient) -> None:
+    await client.aclose()
+
+
+# Plain async HTTP clients (with connection pools), keyed by the base URL they are used for
+http_clients: ClientRegistry[httpx.AsyncClient] = ClientRegistry(
+    "http",
+    factory=lambda base_url: make_http_client(),
+    closer=close_http_client,
+)
+
+# All registries in this process, for configuration, shutdown, and reporting.
+_registries: list[ClientRegistry[object]] = [openai_clients, http_clients]  # type: ignore[list-item]
+
+
+def register_registry(registry: ClientRegistry[C]) -> ClientRegistry[C]:
+    _registries.append(registry)  # type: ignore[arg-type]
+    return registry
+
+
+def all_stats() -> list[RegistryStats]:
+    return [registry.stats() for registry in _registries]
+
+
+def close_all_clients(loop: asyncio.AbstractEventLoop | None = None) -> None:
+    for registry in _registries:
+        registry.close_all(loop)
+
+
+_shutdown_registered = False
+
+
+def init_app(app: Flask) -> None:
+    global _shutdown_registered  # noqa: PLW0603
+
+    max_size = app.config.get('LLM_CLIENT_POOL_SIZE', DEFAULT_MAX_SIZE)
+    for registry in _registries:
+        registry.max_size = max_size
+
+    # Registries are process-wide, so close them once, when the process exits.
+    if not _shutdown_registered:
+        atexit.register(close_all_clients)
+        _shutdown_registered = True
@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Single-flight coalescing of identical in-flight completion requests.
+
+Students often double-submit, and a whole class can hit the same starter-code
+error within seconds.  The completion cache only helps once the first
+completion has finished, so identical prompts sent while it is still in
+flight would each make their own API call.  providers.get_completion() runs
+requests through SingleFlight.run(): the first caller with a given key makes
+the request, and callers arriving before it finishes wait for and share its
+result.  Each caller still stores its own query (and is charged for the
+response; see gened.budgets); only the API call is shared.
+
+The key is a hash of the provider, model, and messages, and of a scope: the
+API key (or pool of keys) and class of the request.  Only requests from the
+same class, made with the same keys, are shared, so a request is never
+answered with another tenant's key or rate limits.  A follower waits no
+longer than its own deadline (see resilience.deadline()).
+
+Requests are normally served on the app's event loop (see gened.eventloop),
+but other loops (e.g., asyncio.run() in CLI commands) may share requests too,
+so the shared result is a concurrent.futures.Future, which can be awaited
+from any event loop.  If the leading request is cancelled (e.g., a losing hedge), its
+followers make the request themselves.  Streamed completions are not
+coalesced.
+'''
+
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import threading
+from collections.abc import Awaitable, Callable, Mapping, Sequence
+from typing import Any, TypeVar
+
+T = TypeVar('T')
+
+
+class _Abandoned(Exception):
+    '''The leading request was cancelled before it had a result.'''
+
+
+class WaitTimeoutError(Exception):
+    '''A follower's timeout passed before the shared request finished.'''
+
+
+def make_key(provider: str, model: str, messages: Sequence[Mapping[str, Any]], scope: Sequence[Any] = ()) -> str:
+    key_data = {'provider': provider, 'model': model, 'messages': list(messages), 'scope': list(scope)}
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+class SingleFlight:
+    def __init__(self) -> None:
+        self._calls: dict[str, concurrent.futures.Future[Any]] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[T]], timeout: float | None = None) -> tuple[T, bool]:
+        '''Await fn(), or the result of an identical call already in flight.
+
+        Returns the result and whether this caller made the call (True) or
+        shared another's (False).  A caller sharing another's call waits at
+        most `timeout` seconds (if not None), then raises WaitTimeoutError.
+        '''
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if future is None:
+                future = self._calls[key] = concurrent.futures.Future()
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            try:
+                # shield: a cancelled (or timed out) follower must not cancel the shared future
+                return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout), False
+            except asyncio.TimeoutError as e:
+                raise WaitTimeoutError from e
+            except _Abandoned:
+                with self._lock:
+                    self.followers -= 1
+                return await self.run(key, fn, timeout)
+
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._finish(key, future)
+            future.set_exception(e if isinstance(e, Exception) else _Abandoned())
+            raise
+        self._finish(key, future)
+        future.set_result(result)
+        return result, True
+
+    def _finish(self, key: str, future: concurrent.futures.Future[Any]) -> None:
+        with self._lock:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+inflight = SingleFlight()
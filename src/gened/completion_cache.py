@@ -0,0 +1,211 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Exact-match cache of LLM completions, stored in the application database.
+
+Students in a class often submit identical queries (e.g., the same starter
+code with the same compile error), which produce identical prompts.  Cached
+completions are keyed by a hash of the provider, model, normalized messages,
+and temperature.  Entries expire after COMPLETION_CACHE_TTL seconds, and the
+least recently used entries are evicted beyond COMPLETION_CACHE_MAX_ENTRIES.
+
+Classes can opt out (classes.cache_completions), and setting
+COMPLETION_CACHE_TTL to 0 disables the cache entirely.
+
+Lookups and stores run in a worker thread (asyncio.to_thread()), so they
+don't block the event loop, and on a short-lived connection of their own,
+so they never commit (or roll back) the calling request's transaction.  The
+cache is an optimization: if its writes can't get the database's write lock
+within COMPLETION_CACHE_DB_TIMEOUT seconds, they are skipped.
+'''
+
+import asyncio
+import datetime as dt
+import hashlib
+import json
+import sqlite3
+from collections.abc import AsyncIterator, Iterator, Mapping, Sequence
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import Any
+
+from flask import current_app
+
+from .auth import get_auth
+from .db import get_db
+from .providers import LLMConfig, Messages, get_completion, providers, stream_completion
+from .streaming import StreamResult
+
+
+def normalize_content(content: str) -> str:
+    '''Normalize text that doesn't change a prompt's meaning: line endings,
+    trailing whitespace, and leading/trailing blank lines.  Indentation is
+    preserved, since it can be significant in code.'''
+    lines = content.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip('\n')
+
+
+def normalize_messages(messages: Sequence[Mapping[str, Any]]) -> list[dict[str, Any]]:
+    return [
+        {**msg, 'content': normalize_content(msg['content'])} if isinstance(msg.get('content'), str) else dict(msg)
+        for msg in messages
+    ]
+
+
+def make_key(llm: LLMConfig, messages: Sequence[Mapping[str, Any]]) -> str:
+    provider = providers.for_config(llm)
+    key_data = {
+        'provider': provider.__name__,
+        'model': llm.model,
+        'messages': normalize_messages(messages),
+        'temperature': getattr(provider, 'TEMPERATURE', None),  # None: the provider's default
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+
+def cache_enabled() -> bool:
+    '''True if completions for the current request may be cached.'''
+    if not current_app.config['COMPLETION_CACHE_TTL']:
+        return False
+
+    auth = get_auth()
+    if not auth['class_id']:
+        return True
+
+    db = get_db()
+    row = db.execute("SELECT cache_completions FROM classes WHERE id=?", [auth['class_id']]).fetchone()
+    return bool(row['cache_completions']) if row else True
+
+
+@contextmanager
+def _cache_db() -> Iterator[sqlite3.Connection]:
+    '''A connection of the cache's own, committed if the block succeeds and rolled back otherwise.'''
+    conn = sqlite3.connect(current_app.config['DATABASE'], timeout=current_app.config['COMPLETION_CACHE_DB_TIMEOUT'])
+    conn.row_factory = sqlite3.Row
+    with closing(conn), conn:
+        yield conn
+
+
+def _count(db: sqlite3.Connection, column: str) -> None:
+    db.execute(f"""
+        INSERT INTO completion_cache_stats (day, {column}) VALUES (?, 1)
+        ON CONFLICT (day) DO UPDATE SET {column}={column}+1
+    """, [dt.date.today()])
+
+
+def lookup(key: str) -> tuple[dict[str, Any], str] | None:
+    with _cache_db() as db:
+        ttl = current_app.config['COMPLETION_CACHE_TTL']
+        row = db.execute(
+            "SELECT response_json, response_text FROM completion_cache WHERE key=? AND created > datetime('now', ?)",
+            [key, f"-{ttl} seconds"]
+        ).fetchone()
+
+        try:
+            if row is not None:
+                db.execute("UPDATE completion_cache SET hits=hits+1, last_used=CURRENT_TIMESTAMP WHERE key=?", [key])
+            _count(db, 'hits' if row is not None else 'misses')
+        except sqlite3.OperationalError as e:  # e.g., the database is locked: skip the bookkeeping
+            current_app.logger.warning(f"Completion cache statistics not updated: {e}")
+            db.rollback()
+
+    if row is None:
+        return None
+    response = json.loads(row['response_json'])
+    response['cached'] = True  # mark it in the stored response, so it isn't mistaken for a new API call
+    return response, row['response_text']
+
+
+def store(key: str, model: str, response: dict[str, Any], response_txt: str) -> None:
+    try:
+        with _cache_db() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO completion_cache (key, model, response_json, response_text) VALUES (?, ?, ?, ?)",
+                [key, model, json.dumps(response), response_txt]
+            )
+            evict(db)
+    except sqlite3.OperationalError as e:
+        current_app.logger.warning(f"Completion not cached: {e}")
+
+
+def evict(db: sqlite3.Connection) -> None:
+    '''Remove expired entries and the least recently used entries beyond the size limit.'''
+    ttl = current_app.config['COMPLETION_CACHE_TTL']
+    db.execute("DELETE FROM completion_cache WHERE created <= datetime('now', ?)", [f"-{ttl} seconds"])
+    db.execute("""
+        DELETE FROM completion_cache WHERE key IN (
+            SELECT key FROM completion_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    """, [current_app.config['COMPLETION_CACHE_MAX_ENTRIES']])
+
+
+async def cached_completion(llm: LLMConfig, messages: Messages, *, hedge: bool = False) -> tuple[dict[str, Any], str]:
+    '''get_completion() for llm's provider, consulting the completion cache first.
+
+    Error responses are never cached, and a response coalesced with an
+    identical request in flight is stored only by the request that made it.
+    '''
+    if not await asyncio.to_thread(cache_enabled):
+        return await get_completion(llm, messages, hedge=hedge)
+
+    key = make_key(llm, messages)
+    cached = await asyncio.to_thread(lookup, key)
+    if cached is not None:
+        return cached
+
+    response, response_txt = await get_completion(llm, messages, hedge=hedge)
+    if 'error' not in response and not response.get('coalesced'):
+        await asyncio.to_thread(store, key, llm.model, response, response_txt)
+    return response, response_txt
+
+
+async def cached_stream_completion(llm: LLMConfig, messages: Messages, result: StreamResult) -> AsyncIterator[str]:
+    '''stream_completion() for llm's provider, consulting the completion cache first.
+
+    A cached completion is yielded as a single delta.
+    '''
+    enabled = await asyncio.to_thread(cache_enabled)
+    if enabled:
+        key = make_key(llm, messages)
+        cached = await asyncio.to_thread(lookup, key)
+        if cached is not None:
+            result.response, result.text = cached
+            yield result.text
+            return
+
+    async for delta in stream_completion(llm, messages, result):
+        yield delta
+
+    if enabled and not result.is_error:
+        await asyncio.to_thread(store, key, llm.model, result.response, result.text)
+
+
+@dataclass(frozen=True)
+class CacheStats:
+    entries: int
+    total_hits: int  # over all current entries
+    hits: int        # over the requested period
+    misses: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def get_stats(days: int | None = None) -> CacheStats:
+    '''Cache statistics, with lookups counted over the last `days` days (or all time if None).'''
+    db = get_db()
+    entries_row = db.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(hits), 0) AS total_hits FROM completion_cache").fetchone()
+    since = dt.date.min if days is None else dt.date.today() - dt.timedelta(days=days - 1)
+    lookups_row = db.execute(
+        "SELECT COALESCE(SUM(hits), 0) AS hits, COALESCE(SUM(misses), 0) AS misses FROM completion_cache_stats WHERE day >= ?",
+        [since]
+    ).fetchone()
+    return CacheStats(
+        entries=entries_row['entries'],
+        total_hits=entries_row['total_hits'],
+        hits=lookups_row['hits'],
+        misses=lookups_row['misses'],
+    )
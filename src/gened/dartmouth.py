@@ -1,9 +1,15 @@
 
-from collections.abc import Callable
-from dataclasses import dataclass
+import asyncio
+import contextlib
+import json
+import threading
+import time
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
 from functools import wraps
 from sqlite3 import Row
 from typing import ParamSpec, TypeVar
+import httpx
 import jwt
 import requests
 from datetime import datetime, timezone
@@ -12,7 +18,13 @@ from dotenv import find_dotenv, load_dotenv
 import os
 
 from .auth import get_auth
+from .clients import http_clients
+from .circuit import CircuitOpenError, circuits
 from .db import get_db
+from .keypool import get_key_pool
+from .ratelimit import request_tokens
+from .resilience import RETRY_STATUS_CODES, RetryableStatusError, with_retries
+from .streaming import StreamResult
 
 
 class ClassDisabledError(Exception):
@@ -27,12 +39,16 @@ class NoTokensError(Exception):
 class TokenExpiredError(Exception):
     pass
 
+class TokenRefreshError(Exception):
+    pass
+
 @dataclass
 class LLMConfig:
     api_key: str
     model: str
     tokens_remaining: int | None = None
-    _token: str | None = None
+    stage_models: dict[str, str] = field(default_factory=dict)  # see gened.providers.for_stage()
+    key_pool: tuple[tuple[str, int], ...] = ()  # see gened.keypool
 
 def getBaseURL():
     load_dotenv()
@@ -44,7 +60,124 @@ def getJWTURL():
 
 BASE_URL = getBaseURL()
 JWT_URL = getJWTURL()
-    
+
+
+@dataclass
+class _CachedToken:
+    token: str | None = None
+    expires: float = 0.0      # unix timestamp, from the token's 'exp' claim
+    failures: int = 0         # consecutive failed refreshes
+    retry_after: float = 0.0  # no refresh attempts before this time (backoff)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class JWTCache:
+    ''' Process-wide cache of Dartmouth JWTs, keyed by API key.
+
+    Tokens are refreshed ahead of expiry (refresh_margin seconds before the
+    'exp' claim).  Only one refresh runs per key at a time; while a token is
+    being refreshed, other callers keep using the current one if it is still
+    valid, or wait for the refresh if not.  Failed refreshes back off
+    exponentially (up to backoff_max seconds) rather than retrying on every
+    request.
+    '''
+    def __init__(self, fetch: Callable[[str], str], refresh_margin: float = 300, backoff_base: float = 1.0, backoff_max: float = 60.0) -> None:
+        self._fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._entries: dict[str, _CachedToken] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, api_key: str) -> _CachedToken:
+        with self._lock:
+            return self._entries.setdefault(api_key, _CachedToken())
+
+    def peek(self, api_key: str) -> str | None:
+        ''' Return a cached token if it does not need refreshing yet, else None.  Never blocks. '''
+        entry = self._entries.get(api_key)
+        if entry is not None and entry.token and time.time() < entry.expires - self.refresh_margin:
+            return entry.token
+        return None
+
+    def get(self, api_key: str) -> str:
+        ''' Return a valid token for the given API key, refreshing it if needed.
+        Raises TokenRefreshError if no valid token can be obtained.
+        '''
+        entry = self._entry(api_key)
+        now = time.time()
+
+        if entry.token and now < entry.expires - self.refresh_margin:
+            return entry.token
+
+        if entry.token and now < entry.expires:
+            # Still valid, just due for a refresh: refresh if no one else is,
+            # but never wait on another thread's refresh.
+            if not entry.lock.acquire(blocking=False):
+                return entry.token
+        else:
+            entry.lock.acquire()
+
+        try:
+            # Another thread may have refreshed while we waited for the lock.
+            now = time.time()
+            if entry.token and now < entry.expires - self.refresh_margin:
+                return entry.token
+            if now < entry.retry_after:
+                if entry.token and now < entry.expires:
+                    return entry.token
+                raise TokenRefreshError(f"JWT refresh backing off for {entry.retry_after - now:.1f}s after {entry.failures} failure(s)")
+            return self._refresh(api_key, entry)
+        finally:
+            entry.lock.release()
+
+    def _refresh(self, api_key: str, entry: _CachedToken) -> str:
+        ''' Fetch a new token.  Must be called with entry.lock held. '''
+        try:
+            token = self._fetch(api_key)
+            decoded = jwt.decode(token, options={"verify_signature": False})
+            expires = float(decoded["exp"])
+        except Exception as e:
+            entry.failures += 1
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (entry.failures - 1))
+            entry.retry_after = time.time() + delay
+            current_app.logger.warning(f"Dartmouth JWT refresh failed ({entry.failures} in a row, retrying in {delay:.0f}s): {e}")
+            if entry.token and time.time() < entry.expires:
+                return entry.token  # keep using the old token while it lasts
+            raise TokenRefreshError(str(e)) from e
+
+        entry.token = token
+        entry.expires = expires
+        entry.failures = 0
+        entry.retry_after = 0.0
+        return token
+
+    def stats(self) -> list[dict[str, str | int | float]]:
+        now = time.time()
+        with self._lock:
+            items = list(self._entries.items())
+        return [
+            {
+                'key': f"...{api_key[-4:]}",
+                'valid': bool(entry.token) and now < entry.expires,
+                'expires_in': max(0, int(entry.expires - now)),
+                'failures': entry.failures,
+            }
+            for api_key, entry in items
+        ]
+
+
+def _fetch_jwt(api_key: str) -> str:
+    resp = requests.post(JWT_URL, headers={"Authorization": api_key}, timeout=30)  # type: ignore[arg-type]
+    if resp.status_code != 200:
+        raise TokenRefreshError(f"JWT request failed ({resp.status_code}): {resp.text}")
+    token: str = resp.json()["jwt"]
+    return token
+
+
+jwt_cache = JWTCache(_fetch_jwt)
+
+
 def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMConfig:
     db = get_db()
     auth = get_auth()
@@ -87,6 +220,11 @@ def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMC
 
         if not class_row['dartmouth_key']:
             raise NoKeyFoundError
+
+        key_pool = get_key_pool(auth['class_id'], class_row['dartmouth_key'])
+        if spend_token:
+            # Don't spend a query on a request that would fail fast (see circuit.py)
+            circuits.check('dartmouth', class_row['dartmouth_key'], auth['class_id'], pool=[key for key, _ in key_pool])
         
         if class_row['role'] == 'student':
             if class_row['queries_used'] >= class_row['max_queries']:
@@ -105,7 +243,8 @@ def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMC
 
         return LLMConfig(
             api_key=class_row['dartmouth_key'],
-            model=class_row['model']
+            model=class_row['model'],
+            key_pool=key_pool,
         )
 
     # Get user data for tokens, auth_provider
@@ -151,6 +290,9 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
             except NoKeyFoundError:
                 flash("Error: No API key set. An API key must be set by the instructor.")
                 return render_template("error.html")
+            except CircuitOpenError as e:
+                flash(f"Error: {e}")
+                return render_template("error.html")
             except NoTokensError:
                 flash("You have used all of your free queries.")
                 return render_template("error.html")
@@ -160,49 +302,147 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
         return decorated_function
     return decorator
  
+async def _get_token(llm: LLMConfig) -> str:
+    '''Get a JWT from the shared cache, only leaving the event loop if it needs a refresh.'''
+    token = jwt_cache.peek(llm.api_key)
+    if token is None:
+        token = await asyncio.to_thread(jwt_cache.get, llm.api_key)
+    return token
+
+
+def _request_headers(token: str) -> dict[str, str]:
+    return {"accept": "application/json",
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"}
+
+
+TEMPERATURE = 0.25
+
+
+def _request_body(prompt: list) -> dict:
+    return {
+        "messages": prompt,
+        "model": "unused",
+        "temperature": TEMPERATURE,
+        "max_tokens": 1000,
+    }
+
+
 async def get_completion(llm: LLMConfig, prompt: list) -> tuple[dict[str, str], str]:
     try:
-        # Get/refresh JWT token
-        if not hasattr(llm, '_token') or not llm._token or isTokenExpired(llm._token, False):
-            resp = sendInstructions(JWT_URL, llm.api_key, None, None, None)
-            if resp.status_code != 200:
-                return {'error': 'JWT token error'}, f"Error getting JWT token: {resp.text}"
-            llm._token = resp.json()["jwt"]
-        # else:
-        #     print("Already have unexpired token")
+        try:
+            token = await _get_token(llm)
+        except TokenRefreshError as e:
+            return {'error': 'JWT token error'}, f"Error getting JWT token: {e}"
 
         formattedURL = f"{BASE_URL}{llm.model}"
-        
-        # print(f"Prompt being sent: {prompt}") 
-        # print(f"Type of prompt being sent: {type(prompt)}")
-        # print("Formatted url: ", formattedURL)
-        resp = requests.post(
-            headers= {"accept": "application/json",
-                      "Authorization": f"Bearer {llm._token}",
-                      "Content-Type": "application/json"},
-            url=formattedURL,
-            json={
-                "messages": prompt,
-                "model": "unused",
-                "temperature": 0.25,
-                "max_tokens": 1000,
-            },
-        )
-        
+
+        async def request() -> httpx.Response:
+            # Non-blocking request on a pooled connection, so concurrent completions actually overlap
+            async with http_clients.lease(BASE_URL) as http:
+                resp = await http.post(formattedURL, headers=_request_headers(token), json=_request_body(prompt))
+            if resp.status_code in RETRY_STATUS_CODES:
+                raise RetryableStatusError(resp.status_code, resp.text)
+            return resp
+
+        try:
+            resp = await with_retries('dartmouth', request, api_key=llm.api_key, tokens=request_tokens(prompt, llm.model))
+        except RetryableStatusError as e:
+            current_app.logger.error(f"Dartmouth API returned {e.status_code}: {e}")
+            return {'error': str(e)}, f"Error: {e}"
+
         if resp.status_code != 200:
-            print(f"Error: {resp.text}")
+            current_app.logger.error(f"Dartmouth API returned {resp.status_code}: {resp.text}")
             return {'error': resp.text}, f"Error: {resp.text}"
 
-        if resp.json()["choices"][0]["finish_reason"] == "length":  # "length" if max_tokens reached
+        data = resp.json()
+        if data["choices"][0]["finish_reason"] == "length":  # "length" if max_tokens reached
             current_app.logger.warning("Response exceeded maximum length and was truncated")
 
-        # print(resp.json())
-        return resp.json(), resp.json()["choices"][0]["message"]["content"]
+        return data, data["choices"][0]["message"]["content"]
 
     except Exception as e:
         current_app.logger.error(f"Dartmouth API Error: {e}")
         return {'error': str(e)}, f"Error: {str(e)}"
 
+
+async def stream_completion(llm: LLMConfig, prompt: list, result: StreamResult) -> AsyncIterator[str]:
+    '''Stream a completion, yielding text deltas as they arrive.
+
+    The endpoint streams OpenAI-style chunks as Server-Sent Events.  When the
+    stream ends, result holds the same response object and text that
+    get_completion() would have returned.
+    '''
+    chunks = []
+    data: dict = {}
+    finish_reason = None
+    try:
+        try:
+            token = await _get_token(llm)
+        except TokenRefreshError as e:
+            result.response, result.text = {'error': 'JWT token error'}, f"Error getting JWT token: {e}"
+            return
+
+        formattedURL = f"{BASE_URL}{llm.model}"
+
+        async with http_clients.lease(BASE_URL) as http:
+            # Only opening the stream is retried; a failure after text has been sent can't be
+            async def open_stream() -> httpx.Response:
+                req = http.build_request("POST", formattedURL, headers=_request_headers(token), json={**_request_body(prompt), "stream": True})
+                resp = await http.send(req, stream=True)
+                if resp.status_code in RETRY_STATUS_CODES:
+                    body = (await resp.aread()).decode(errors='replace')
+                    await resp.aclose()
+                    raise RetryableStatusError(resp.status_code, body)
+                return resp
+
+            try:
+                resp = await with_retries('dartmouth', open_stream, api_key=llm.api_key, tokens=request_tokens(prompt, llm.model))
+            except RetryableStatusError as e:
+                current_app.logger.error(f"Dartmouth API returned {e.status_code}: {e}")
+                result.response, result.text = {'error': str(e)}, f"Error: {e}"
+                return
+
+            async with contextlib.aclosing(resp):
+                if resp.status_code != 200:
+                    body = (await resp.aread()).decode(errors='replace')
+                    current_app.logger.error(f"Dartmouth API returned {resp.status_code}: {body}")
+                    result.response, result.text = {'error': body}, f"Error: {body}"
+                    return
+
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line.removeprefix("data:").strip()
+                    if payload == "[DONE]":
+                        break
+                    data = json.loads(payload)
+                    if not data.get("choices"):
+                        continue
+                    choice = data["choices"][0]
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    delta = choice.get("delta", {}).get("content")
+                    if delta:
+                        chunks.append(delta)
+                        yield delta
+
+    except Exception as e:
+        current_app.logger.error(f"Dartmouth API Error: {e}")
+        result.response, result.text = {'error': str(e)}, f"Error: {str(e)}"
+        return
+
+    if finish_reason == "length":  # "length" if max_tokens reached
+        current_app.logger.warning("Response exceeded maximum length and was truncated")
+
+    result.text = "".join(chunks)
+    result.response = {
+        'id': data.get('id'),
+        'model': data.get('model'),
+        'object': 'chat.completion',
+        'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': {'role': 'assistant', 'content': result.text}}],
+        'usage': data.get('usage'),
+    }
+
 def get_models() -> list[Row]:
     db = get_db()
     models = db.execute("SELECT * FROM models WHERE active ORDER BY id ASC").fetchall()
@@ -251,7 +491,7 @@ def sendInstructions(apiURL, key, token, prompt, parameters):
 
     if response.status_code != 200:
         print(f"Error: {response.status_code} : {response.text}")
-        exit()
+        response.raise_for_status()
     else:
         try:
             return response
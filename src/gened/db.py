@@ -2,15 +2,18 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import asyncio
 import errno
 import secrets
 import sqlite3
 import string
+import threading
 from collections.abc import Callable
 from datetime import date, datetime
 from getpass import getpass
 from importlib import resources
 from pathlib import Path
+from typing import ParamSpec, TypeVar
 
 import click
 from flask import current_app, g
@@ -19,6 +22,9 @@ from werkzeug.security import generate_password_hash
 
 AUTH_PROVIDER_LOCAL = 1
 
+P = ParamSpec('P')
+T = TypeVar('T')
+
 
 # https://docs.python.org/3/library/sqlite3.html#sqlite3-adapter-converter-recipes
 # Register adapters going from date/datetime to text (going into SQLite).
@@ -45,16 +51,61 @@ sqlite3.register_converter("date", convert_date)
 sqlite3.register_converter("datetime", convert_datetime)
 
 
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
 def get_db() -> sqlite3.Connection:
-    if 'db' not in g:
-        g.db = sqlite3.connect(
+    """ The current app context's database connection for this thread.
+
+    Each thread using an app context gets its own connection, so work run in
+    worker threads (e.g., with asyncio.to_thread() from coroutines, see
+    gened.eventloop) has transactions of its own.  A connection is only used
+    by the thread that opened it; they are all closed by close_db() when the
+    app context ends, after its work has finished.
+
+    Blocking queries must not run on an event loop, so this raises
+    RuntimeError when called from a coroutine: run database code in a worker
+    thread instead.
+    """
+    if _on_event_loop():
+        raise RuntimeError("Database access from a coroutine would block the event loop; run it with asyncio.to_thread().")
+
+    connections = g.setdefault('db_connections', {})
+    thread_id = threading.get_ident()
+    if thread_id not in connections:
+        db = sqlite3.connect(
             current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            # Closed by close_db() on the thread ending the app context
+            check_same_thread=False,
         )
-        g.db.row_factory = sqlite3.Row
+        db.row_factory = sqlite3.Row
+        connections[thread_id] = db
+
+    db = connections[thread_id]
+    assert isinstance(db, sqlite3.Connection)
+    return db
+
 
-    assert isinstance(g.db, sqlite3.Connection)
-    return g.db
+async def run_in_thread(fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+    """ Run database code from a coroutine, in a worker thread with asyncio.to_thread().
+
+    If fn raises, its uncommitted changes are rolled back, so that they can't
+    be committed by later work using the same thread's connection.
+    """
+    def call() -> T:
+        try:
+            return fn(*args, **kwargs)
+        except BaseException:
+            if 'db_connections' in g and threading.get_ident() in g.db_connections:
+                g.db_connections[threading.get_ident()].rollback()
+            raise
+    return await asyncio.to_thread(call)
 
 
 def backup_db(target: Path) -> None:
@@ -72,9 +123,9 @@ def backup_db(target: Path) -> None:
 
 
 def close_db(e: BaseException | None = None) -> None:  # noqa: ARG001 - unused function argument
-    db = g.pop('db', None)
+    connections = g.pop('db_connections', {})
 
-    if db is not None:
+    for db in connections.values():
         db.close()
 
 
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''A long-lived event loop, in a thread owned by the app, for all LLM calls.
+
+Views are synchronous, and used to run their completions with asyncio.run(),
+creating and tearing down an event loop per request.  Async clients are
+bound to the loop on which their connections were opened, so pooled clients
+(see gened.clients) could only be reused within a single request.
+
+Instead, each app has one LoopThread (created by init_app()), and sync code
+runs coroutines on it with run_async() (or submit_async(), which returns a
+concurrent.futures.Future).  Coroutines run in a copy of the caller's
+context, as with asyncio.run(), so Flask's app and request contexts,
+deadlines (gened.resilience), and usage collection (gened.usage) carry over.
+Clients, rate limiters, and in-flight coalescing then all share one loop.
+
+Blocking work must not run on the loop, where it would stall every request
+sharing it.  In particular, get_db() raises RuntimeError in a coroutine:
+database code runs in a worker thread with asyncio.to_thread(), which gets
+a connection of its own (see gened.db), so concurrent coroutines never share
+a connection or a transaction.
+
+The thread is started on first use (so that forked worker processes each
+start their own) and is stopped at process exit, after closing its clients
+and letting pending tasks finish for up to EVENT_LOOP_SHUTDOWN_TIMEOUT
+seconds.
+'''
+
+import asyncio
+import atexit
+import concurrent.futures
+import os
+import threading
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+from flask import current_app, has_app_context
+from flask.app import Flask
+
+from . import clients
+
+T = TypeVar('T')
+
+
+class LoopThread:
+    def __init__(self, name: str = 'gened-event-loop', shutdown_timeout: float = 5.0) -> None:
+        self.name = name
+        self.shutdown_timeout = shutdown_timeout
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._pid: int | None = None
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            # A forked child inherits the loop but not its thread: start a new one
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._run, args=[loop], name=self.name, daemon=True)
+                thread.start()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+            return self._loop
+
+    @staticmethod
+    def _run(loop: asyncio.AbstractEventLoop) -> None:
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def in_loop_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+        '''Schedule a coroutine on the loop, in a copy of the caller's context.'''
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("Blocking on the event loop from its own thread would deadlock.")
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def run(self, coro: Coroutine[Any, Any, T]) -> T:
+        '''Run a coroutine on the loop and wait for its result.'''
+        future = self.submit(coro)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()  # e.g., the waiting thread was interrupted
+            raise
+
+    async def _drain(self) -> None:
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=self.shutdown_timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        await asyncio.get_running_loop().shutdown_asyncgens()
+
+    def stop(self) -> None:
+        '''Close the loop's clients, let pending tasks finish (or cancel them), and stop the thread.'''
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or thread is None or self._pid != os.getpid():
+                return
+            self._loop = self._thread = self._pid = None
+
+        clients.close_all_clients(loop)  # closed by tasks on the loop, which are drained below
+        try:
+            asyncio.run_coroutine_threadsafe(self._drain(), loop).result(timeout=self.shutdown_timeout * 2)
+        except (concurrent.futures.TimeoutError, RuntimeError):
+            pass
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=self.shutdown_timeout)
+        if not thread.is_alive():
+            loop.close()
+
+
+# For code run outside of an app context (e.g., scripts and tests)
+_default_loop_thread = LoopThread()
+atexit.register(_default_loop_thread.stop)
+
+
+def get_loop_thread() -> LoopThread:
+    '''The current app's LoopThread, or a process-wide one outside of an app context.'''
+    if has_app_context():
+        return current_app.extensions['event_loop']  # type: ignore[no-any-return]
+    return _default_loop_thread
+
+
+def submit_async(coro: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+    '''Schedule a coroutine on the current app's event loop thread.'''
+    return get_loop_thread().submit(coro)
+
+
+def run_async(coro: Coroutine[Any, Any, T]) -> T:
+    '''Run a coroutine on the current app's event loop thread and wait for its result
+    (in place of asyncio.run()).'''
+    return get_loop_thread().run(coro)
+
+
+def init_app(app: Flask) -> None:
+    loop_thread = LoopThread(shutdown_timeout=app.config['EVENT_LOOP_SHUTDOWN_TIMEOUT'])
+    app.extensions['event_loop'] = loop_thread
+    atexit.register(loop_thread.stop)
@@ -1,14 +1,19 @@
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
 from functools import wraps
 from sqlite3 import Row
-from typing import ParamSpec, TypeVar
+from typing import Any, ParamSpec, TypeVar
 from flask import current_app, flash, render_template
 from dotenv import find_dotenv, load_dotenv
 import asyncio
 
 from .auth import get_auth
+from .circuit import CircuitOpenError, circuits
 from .db import get_db
+from .keypool import get_key_pool
+from .ratelimit import request_tokens
+from .resilience import with_retries
+from .streaming import StreamResult
 
 try:
     from google import genai
@@ -29,6 +34,8 @@ class LLMConfig:
     api_key: str
     model: str
     tokens_remaining: int | None = None
+    stage_models: dict[str, str] = field(default_factory=dict)  # see gened.providers.for_stage()
+    key_pool: tuple[tuple[str, int], ...] = ()  # see gened.keypool
 
 def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMConfig:
     db = get_db()
@@ -74,6 +81,11 @@ def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMC
 
         if not class_row['gemini_key']:
             raise NoKeyFoundError
+
+        key_pool = get_key_pool(auth['class_id'], class_row['gemini_key'])
+        if spend_token:
+            # Don't spend a query on a request that would fail fast (see circuit.py)
+            circuits.check('gemini', class_row['gemini_key'], auth['class_id'], pool=[key for key, _ in key_pool])
         
         if class_row['role'] == 'student':
             if class_row['queries_used'] >= class_row['max_queries']:
@@ -90,7 +102,8 @@ def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMC
 
         return LLMConfig(
             api_key=class_row['gemini_key'],
-            model=class_row['model']
+            model=class_row['model'],
+            key_pool=key_pool,
         )
 
     # Get user data for tokens, auth_provider
@@ -136,6 +149,9 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
             except NoKeyFoundError:
                 flash("Error: No Gemini API key set. An API key must be set by the instructor.")
                 return render_template("error.html")
+            except CircuitOpenError as e:
+                flash(f"Error: {e}")
+                return render_template("error.html")
             except NoTokensError:
                 flash("You have used all of your free queries.")
                 return render_template("error.html")
@@ -145,6 +161,33 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
         return decorated_function
     return decorator
 
+def _make_contents(messages: list[dict] | None, prompt: str | None) -> str | None:
+    if messages:
+        # Convert OpenAI-style messages to Gemini format
+        # Gemini expects a simple string for single-turn or a list of content parts
+        if len(messages) == 1:
+            return messages[0].get('content', '')
+        else:
+            # For multi-turn, you might need to format differently
+            # For now, just concatenate
+            return "\n".join([msg.get('content', '') for msg in messages])
+    return prompt
+
+def _usage(response: Any) -> dict[str, Any] | None:
+    '''A response's usage metadata, in the same format as OpenAI's usage.'''
+    metadata = getattr(response, 'usage_metadata', None)
+    if metadata is None:
+        return None
+    prompt_tokens = metadata.prompt_token_count or 0
+    completion_tokens = metadata.candidates_token_count or 0
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': metadata.total_token_count or prompt_tokens + completion_tokens,
+        'prompt_tokens_details': {'cached_tokens': metadata.cached_content_token_count or 0},
+    }
+
+
 async def get_completion(llm: LLMConfig, messages: list[dict] | None = None, prompt: str | None = None) -> tuple[dict[str, str], str]:
     if genai is None:
         current_app.logger.error("Google Generative AI SDK not installed")
@@ -155,37 +198,63 @@ async def get_completion(llm: LLMConfig, messages: list[dict] | None = None, pro
         client = genai.Client(api_key=llm.api_key)
 
         # Prepare the content
-        if messages:
-            # Convert OpenAI-style messages to Gemini format
-            # Gemini expects a simple string for single-turn or a list of content parts
-            if len(messages) == 1:
-                content = messages[0].get('content', '')
-            else:
-                # For multi-turn, you might need to format differently
-                # For now, just concatenate
-                content = "\n".join([msg.get('content', '') for msg in messages])
-        elif prompt:
-            content = prompt
-        else:
+        content = _make_contents(messages, prompt)
+        if not content:
             return {'error': 'No prompt or messages provided.'}, "Error: No input"
         
         # Use the client to generate content
-        response = await asyncio.to_thread(
+        response = await with_retries('gemini', lambda: asyncio.to_thread(
             client.models.generate_content,
             model=llm.model,
             contents=content
-        )
+        ), api_key=llm.api_key, tokens=request_tokens(messages or prompt, llm.model))
         
         # Extract the text from the response
         response_text = response.text if hasattr(response, 'text') else str(response)
         
         # Return in the same format as OpenAI
-        return {'response': response_text}, response_text
+        return {'response': response_text, 'usage': _usage(response)}, response_text
         
     except Exception as e:
         current_app.logger.error(f"Gemini API Error: {e}")
         return {'error': str(e)}, f"Error: {str(e)}"
 
+async def stream_completion(llm: LLMConfig, messages: list[dict], result: StreamResult) -> AsyncIterator[str]:
+    '''Stream a completion, yielding text deltas as they arrive.
+
+    When the stream ends, result holds the same response object and text that
+    get_completion() would have returned.
+    '''
+    if genai is None:
+        current_app.logger.error("Google Generative AI SDK not installed")
+        result.response, result.text = {'error': 'Google Generative AI SDK not installed.'}, "Error: SDK missing"
+        return
+
+    content = _make_contents(messages, None)
+    if not content:
+        result.response, result.text = {'error': 'No prompt or messages provided.'}, "Error: No input"
+        return
+
+    chunks = []
+    usage = None
+    try:
+        client = genai.Client(api_key=llm.api_key)
+        # Only opening the stream is retried; a failure after text has been sent can't be
+        stream = await with_retries('gemini', lambda: client.aio.models.generate_content_stream(model=llm.model, contents=content), api_key=llm.api_key, tokens=request_tokens(messages, llm.model))
+        async for chunk in stream:
+            usage = _usage(chunk) or usage  # cumulative; complete on the last chunk
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+
+    except Exception as e:
+        current_app.logger.error(f"Gemini API Error: {e}")
+        result.response, result.text = {'error': str(e)}, f"Error: {str(e)}"
+        return
+
+    result.text = "".join(chunks)
+    result.response = {'response': result.text, 'usage': usage}
+
 def get_models() -> list[Row]:
     db = get_db()
     models = db.execute("SELECT * FROM models WHERE active ORDER BY id ASC").fetchall()
@@ -16,6 +16,7 @@ from flask import (
 )
 from werkzeug.wrappers.response import Response
 
+from . import keypool
 from .auth import get_auth, instructor_required
 from .csv import csv_response
 from .db import get_db
@@ -199,17 +200,29 @@ def set_user_class_setting() -> Response:
                 new_date = request.form['link_reg_expires']
             db.execute("UPDATE classes_user SET link_reg_expires=? WHERE class_id=?", [new_date, class_id])
         class_enabled = 1 if 'class_enabled' in request.form else 0
-        db.execute("UPDATE classes SET enabled=? WHERE id=?", [class_enabled, class_id])
+        cache_completions = 1 if 'cache_completions' in request.form else 0
+        db.execute("UPDATE classes SET enabled=?, cache_completions=? WHERE id=?", [class_enabled, cache_completions, class_id])
         db.commit()
         flash("Class access configuration updated.", "success")
 
+    elif 'clear_pool_keys' in request.form:
+        keypool.clear_keys(class_id=class_id)
+        db.commit()
+        flash("Class additional API keys cleared.", "success")
+
     elif 'save_llm_form' in request.form:
+        try:
+            pool_keys = keypool.parse_keys(request.form.get('pool_keys', ''))
+        except ValueError as e:
+            flash(f"Invalid additional API keys: {e}", "warning")
+            return safe_redirect(request.referrer, default_endpoint="profile.main")
         if 'dartmouth_key' in request.form:  # Changed from openai_key
             db.execute(
                 "UPDATE classes_user SET dartmouth_key=? WHERE class_id=?",  # Changed from openai_key
                 [request.form['dartmouth_key'], class_id]  # Changed from openai_key
             )
         db.execute("UPDATE classes_user SET model_id=? WHERE class_id=?", [request.form['model_id'], class_id])
+        keypool.add_keys(pool_keys, class_id=class_id)
         db.commit()
         flash("Class language model configuration updated.",  "success")
     
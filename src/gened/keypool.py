@@ -0,0 +1,239 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Pools of API keys for a consumer or user class.
+
+A single key caps a consumer's throughput at that key's provider rate limit.
+A consumer or user class can hold additional keys (in the api_key_pool
+table), each with a weight.  Providers' _get_llm() load the pool, including
+the consumer's or class's own key, into llm.key_pool, and
+providers.get_completion() and stream_completion() pick a key from it for
+each request with KeyBalancer.choose():
+
+  - 'least_outstanding' (KEY_POOL_STRATEGY): the key with the fewest
+    requests in flight in this process, relative to its weight
+  - 'weighted': smooth weighted round-robin
+
+Keys whose circuits are open (see gened.circuit) are skipped.  A key that
+reports an exhausted quota is drained: it isn't chosen again for
+KEY_POOL_DRAIN_SECONDS, and the request is retried with another key.  Like
+circuit breakers, this state is kept in memory, per process.
+'''
+
+import dataclasses
+import threading
+import time
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from flask import current_app
+
+from .circuit import circuits
+from .db import get_db
+from .streaming import StreamResult
+
+KeyPool = tuple[tuple[str, int], ...]  # (api key, weight) pairs
+
+C = TypeVar('C')
+
+
+def get_key_pool(class_id: int, api_key: str) -> KeyPool:
+    '''Get the pool of keys for a class: its own (or its consumer's) key
+    and any additional keys.  Empty if there are no additional keys.'''
+    db = get_db()
+    rows = db.execute("""
+        SELECT api_key_pool.api_key, api_key_pool.weight
+        FROM api_key_pool
+        LEFT JOIN classes_lti ON classes_lti.lti_consumer_id = api_key_pool.consumer_id
+        WHERE api_key_pool.class_id = ? OR classes_lti.class_id = ?
+        ORDER BY api_key_pool.id
+    """, [class_id, class_id]).fetchall()
+    extra = [(row['api_key'], row['weight']) for row in rows if row['api_key'] != api_key]
+    if not extra:
+        return ()
+    return ((api_key, 1), *extra)
+
+
+def parse_keys(text: str) -> list[tuple[str, int]]:
+    '''Parse keys entered one per line, each optionally followed by a weight.'''
+    keys = []
+    for line in text.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if len(parts) > 2 or (len(parts) == 2 and not parts[1].isdigit()):
+            raise ValueError(f"Expected an API key and an optional weight, got '{line.strip()[:8]}...'")
+        weight = int(parts[1]) if len(parts) == 2 else 1
+        if weight < 1:
+            raise ValueError("Key weights must be positive")
+        keys.append((parts[0], weight))
+    return keys
+
+
+def add_keys(keys: Sequence[tuple[str, int]], *, consumer_id: int | None = None, class_id: int | None = None) -> None:
+    db = get_db()
+    db.executemany(
+        "INSERT INTO api_key_pool (consumer_id, class_id, api_key, weight) VALUES (?, ?, ?, ?)",
+        [(consumer_id, class_id, key, weight) for key, weight in keys]
+    )
+
+
+def clear_keys(*, consumer_id: int | None = None, class_id: int | None = None) -> None:
+    db = get_db()
+    if consumer_id is not None:
+        db.execute("DELETE FROM api_key_pool WHERE consumer_id=?", [consumer_id])
+    if class_id is not None:
+        db.execute("DELETE FROM api_key_pool WHERE class_id=?", [class_id])
+
+
+def list_keys(*, consumer_id: int | None = None, class_id: int | None = None) -> list[dict[str, str | int]]:
+    '''Additional keys of a consumer or class, masked for display.'''
+    db = get_db()
+    rows = db.execute(
+        "SELECT api_key, weight FROM api_key_pool WHERE consumer_id IS ? AND class_id IS ? ORDER BY id",
+        [consumer_id, class_id]
+    ).fetchall()
+    return [{'key': "*" * 20 + row['api_key'][-4:], 'weight': row['weight']} for row in rows]
+
+
+def is_quota_error(response: dict[str, Any]) -> bool:
+    '''True if an error response reports an exhausted quota (which won't recover soon).'''
+    return 'quota' in str(response.get('error', '')).lower()
+
+
+@dataclass
+class _KeyState:
+    outstanding: int = 0
+    requests: int = 0
+    current_weight: int = 0  # for smooth weighted round-robin
+    drained_until: float = 0.0
+    drains: int = 0
+
+
+class KeyBalancer:
+    '''Per-key request counts and drain state of this process.'''
+    def __init__(self) -> None:
+        self._keys: dict[str, _KeyState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, api_key: str) -> _KeyState:
+        return self._keys.setdefault(api_key, _KeyState())
+
+    def choose(self, provider: str, pool: KeyPool, strategy: str) -> str:
+        '''Choose a key from a (non-empty) pool for one request.'''
+        now = time.monotonic()
+        with self._lock:
+            candidates = [(key, weight) for key, weight in pool if self._state(key).drained_until <= now]
+        open_keys = set()
+        for key, _ in candidates:
+            breaker = circuits.get(provider, key)
+            if breaker is not None and not breaker.available():
+                open_keys.add(key)
+        candidates = [(key, weight) for key, weight in candidates if key not in open_keys] or candidates
+        if not candidates:
+            # every key is drained: use the one that will recover first
+            with self._lock:
+                return min(pool, key=lambda item: self._state(item[0]).drained_until)[0]
+
+        with self._lock:
+            if strategy == 'weighted':
+                # smooth weighted round-robin (as in nginx): spreads each key's turns evenly
+                total = sum(weight for _, weight in candidates)
+                for key, weight in candidates:
+                    self._state(key).current_weight += weight
+                chosen = max(candidates, key=lambda item: self._state(item[0]).current_weight)[0]
+                self._state(chosen).current_weight -= total
+            else:
+                chosen = min(candidates, key=lambda item: (self._state(item[0]).outstanding + 1) / item[1])[0]
+            return chosen
+
+    @contextmanager
+    def lease(self, api_key: str) -> Iterator[None]:
+        '''Count a request as outstanding on api_key while it runs.'''
+        with self._lock:
+            state = self._state(api_key)
+            state.outstanding += 1
+            state.requests += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._state(api_key).outstanding -= 1
+
+    def drain(self, api_key: str, seconds: float) -> None:
+        current_app.logger.warning(f"API key ...{api_key[-4:]} drained from its pool for {seconds:.0f}s (quota exhausted)")
+        with self._lock:
+            state = self._state(api_key)
+            state.drained_until = time.monotonic() + seconds
+            state.drains += 1
+
+    def status(self) -> list[dict[str, str | int]]:
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'key': f"...{key[-4:]}",
+                    'requests': state.requests,
+                    'outstanding': state.outstanding,
+                    'drains': state.drains,
+                    'drained_for': max(0, round(state.drained_until - now)),
+                }
+                for key, state in self._keys.items()
+            ]
+
+
+balancer = KeyBalancer()
+
+
+async def with_pool_key(provider: str, llm: C, fn: Callable[[C], Awaitable[tuple[dict[str, Any], str]]]) -> tuple[dict[str, Any], str]:
+    '''Run fn(llm) with a key chosen from llm.key_pool, if it has one.
+
+    If the chosen key's quota is exhausted, it is drained, and the request
+    is retried with another key, once per key in the pool.
+    '''
+    pool: KeyPool = getattr(llm, 'key_pool', ())
+    if not pool:
+        return await fn(llm)
+
+    config = current_app.config
+    for _ in range(len(pool)):
+        api_key = balancer.choose(provider, pool, config['KEY_POOL_STRATEGY'])
+        keyed_llm = dataclasses.replace(llm, api_key=api_key)  # type: ignore[type-var]
+        with balancer.lease(api_key):
+            response, response_txt = await fn(keyed_llm)
+        if not is_quota_error(response):
+            break
+        balancer.drain(api_key, config['KEY_POOL_DRAIN_SECONDS'])
+    return response, response_txt
+
+
+async def stream_with_pool_key(provider: str, llm: C, stream: Callable[[C], AsyncIterator[str]], result: StreamResult) -> AsyncIterator[str]:
+    '''Stream from stream(llm) with a key chosen from llm.key_pool, if it has one.
+
+    A key whose quota is exhausted is drained, and the stream retried with
+    another key, as long as nothing has been yielded yet.
+    '''
+    pool: KeyPool = getattr(llm, 'key_pool', ())
+    if not pool:
+        async for delta in stream(llm):
+            yield delta
+        return
+
+    config = current_app.config
+    for _ in range(len(pool)):
+        api_key = balancer.choose(provider, pool, config['KEY_POOL_STRATEGY'])
+        yielded = False
+        with balancer.lease(api_key):
+            async for delta in stream(dataclasses.replace(llm, api_key=api_key)):  # type: ignore[type-var]
+                yielded = True
+                yield delta
+        if yielded or not (result.is_error and is_quota_error(result.response)):
+            return
+        balancer.drain(api_key, config['KEY_POOL_DRAIN_SECONDS'])
+
+
+def get_status() -> list[dict[str, str | int]]:
+    return balancer.status()
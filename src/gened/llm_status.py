@@ -0,0 +1,190 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any
+
+from flask import render_template
+
+from . import clients, completion_cache, keypool, ratelimit, resilience
+from .circuit import circuits
+from .coalesce import inflight
+from .admin import bp as bp_admin
+from .admin import register_admin_link
+from .providers import providers
+
+
+@dataclass(frozen=True)
+class StatusTable:
+    name: str     # used as the HTML table id
+    title: str
+    columns: list[tuple[str, ...]]  # (header, key) or (header, key, 'r') as in the datatable() macro
+    rows: list[dict[str, Any]] = field(default_factory=list)
+
+
+# A module-level list of registered status table generators.  Updated by register_status_table()
+_status_generators: list[Callable[[], list[StatusTable]]] = []
+
+
+def register_status_table(generator_func: Callable[[], list[StatusTable]]) -> None:
+    if generator_func not in _status_generators:  # may be registered again by each create_app()
+        _status_generators.append(generator_func)
+
+
+def _client_tables() -> list[StatusTable]:
+    rows = [
+        {
+            'registry': stats.name,
+            'size': f"{stats.size} / {stats.max_size}",
+            'in_use': stats.in_use,
+            'hits': stats.hits,
+            'misses': stats.misses,
+            'hit_rate': f"{stats.hit_rate:.1%}",
+            'evictions': stats.evictions,
+        }
+        for stats in clients.all_stats()
+    ]
+    return [StatusTable(
+        name='clients',
+        title="API Clients",
+        columns=[('registry', 'registry'), ('clients', 'size', 'r'), ('in use', 'in_use', 'r'), ('hits', 'hits', 'r'), ('misses', 'misses', 'r'), ('hit rate', 'hit_rate', 'r'), ('evictions', 'evictions', 'r')],
+        rows=rows,
+    )]
+
+register_status_table(_client_tables)
+
+
+def _provider_tables() -> list[StatusTable]:
+    rows = [{'provider': name, 'loaded': providers.is_loaded(name)} for name in providers.names]
+    return [StatusTable(
+        name='providers',
+        title="LLM Providers",
+        columns=[('provider', 'provider'), ('loaded', 'loaded')],
+        rows=rows,
+    )]
+
+register_status_table(_provider_tables)
+
+
+def _jwt_tables() -> list[StatusTable]:
+    # Provider modules are loaded on first use; don't load this one just to report on it.
+    if not providers.is_loaded('dartmouth'):
+        return []
+    dartmouth = providers.get('dartmouth')
+    return [StatusTable(
+        name='dartmouth_jwts',
+        title="Dartmouth JWTs",
+        columns=[('API key', 'key'), ('valid', 'valid'), ('expires in (s)', 'expires_in', 'r'), ('failed refreshes', 'failures', 'r')],
+        rows=dartmouth.jwt_cache.stats(),
+    )]
+
+register_status_table(_jwt_tables)
+
+
+def _cache_tables() -> list[StatusTable]:
+    rows = []
+    for period, days in [("today", 1), ("last 7 days", 7), ("last 30 days", 30), ("all time", None)]:
+        stats = completion_cache.get_stats(days)
+        rows.append({
+            'period': period,
+            'lookups': stats.hits + stats.misses,
+            'hits': stats.hits,
+            'hit_rate': f"{stats.hit_rate:.1%}",
+        })
+    entries = completion_cache.get_stats().entries
+    return [StatusTable(
+        name='completion_cache',
+        title=f"Completion Cache ({entries} entries)",
+        columns=[('period', 'period'), ('lookups', 'lookups', 'r'), ('hits', 'hits', 'r'), ('hit rate', 'hit_rate', 'r')],
+        rows=rows,
+    )]
+
+register_status_table(_cache_tables)
+
+
+def _resilience_tables() -> list[StatusTable]:
+    rows = [
+        {
+            'provider': stats.provider,
+            'requests': stats.requests,
+            'retries': stats.retries,
+            'failures': stats.failures,
+            'deadlines': stats.deadlines,
+            'hedges': stats.hedges,
+            'hedge_wins': stats.hedge_wins,
+            'fast_fails': stats.fast_fails,
+        }
+        for stats in resilience.get_stats()
+    ]
+    return [StatusTable(
+        name='completion_retries',
+        title="Completion Retries (this process)",
+        columns=[('provider', 'provider'), ('requests', 'requests', 'r'), ('retries', 'retries', 'r'), ('failed', 'failures', 'r'), ('past deadline', 'deadlines', 'r'), ('hedged', 'hedges', 'r'), ('hedge won', 'hedge_wins', 'r'), ('circuit open', 'fast_fails', 'r')],
+        rows=rows,
+    )]
+
+register_status_table(_resilience_tables)
+
+
+def _circuit_tables() -> list[StatusTable]:
+    return [StatusTable(
+        name='circuits',
+        title="Circuit Breakers (this process)",
+        columns=[('provider', 'provider'), ('API key', 'key'), ('state', 'state'), ('failure rate', 'failure_rate', 'r'), ('trips', 'trips', 'r'), ('probe in (s)', 'retry_in', 'r')],
+        rows=circuits.status(),
+    )]
+
+register_status_table(_circuit_tables)
+
+
+def _rate_limit_tables() -> list[StatusTable]:
+    if not ratelimit.enabled():
+        return []
+    return [StatusTable(
+        name='rate_limits',
+        title="Rate Limit Queues (this process)",
+        columns=[('API key', 'key'), ('requests', 'requests', 'r'), ('queued', 'queued', 'r'), ('refused', 'refused', 'r'), ('waiting now', 'waiting', 'r'), ('max waiting', 'max_waiting', 'r'), ('avg wait (s)', 'avg_wait', 'r'), ('max wait (s)', 'max_wait', 'r')],
+        rows=ratelimit.get_stats(),
+    )]
+
+register_status_table(_rate_limit_tables)
+
+
+def _coalesce_tables() -> list[StatusTable]:
+    return [StatusTable(
+        name='coalesced',
+        title="Coalesced Requests (this process)",
+        columns=[('API calls', 'leaders', 'r'), ('shared by', 'followers', 'r'), ('in flight', 'in_flight', 'r')],
+        rows=[{'leaders': inflight.leaders, 'followers': inflight.followers, 'in_flight': inflight.in_flight()}],
+    )]
+
+register_status_table(_coalesce_tables)
+
+
+def _key_pool_tables() -> list[StatusTable]:
+    rows = keypool.get_status()
+    if not rows:
+        return []
+    return [StatusTable(
+        name='key_pools',
+        title="API Key Pools (this process)",
+        columns=[('API key', 'key'), ('requests', 'requests', 'r'), ('in flight', 'outstanding', 'r'), ('drained', 'drains', 'r'), ('drained for (s)', 'drained_for', 'r')],
+        rows=rows,
+    )]
+
+register_status_table(_key_pool_tables)
+
+
+# ### Admin routes ###
+# Auth requirements covered by admin.before_request()
+
+@register_admin_link("LLM Status")
+@bp_admin.route("/llm_status/")
+def llm_status_view() -> str:
+    tables = []
+    for generate_tables in _status_generators:
+        tables.extend(generate_tables())
+
+    return render_template("admin_llm_status.html", tables=tables)
@@ -1,9 +1,9 @@
 
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
 from functools import wraps
 from sqlite3 import Row
-from typing import ParamSpec, TypeVar
+from typing import Any, ParamSpec, TypeVar
 import jwt
 import requests
 from datetime import datetime, timezone
@@ -12,7 +12,13 @@ from dotenv import find_dotenv, load_dotenv
 import os
 
 from .auth import get_auth
+from .clients import ClientRegistry, close_http_client, make_http_client, register_registry
+from .circuit import CircuitOpenError, circuits
 from .db import get_db
+from .keypool import get_key_pool
+from .ratelimit import request_tokens
+from .resilience import with_retries
+from .streaming import StreamResult
 from mistralai import Mistral
 
 class ClassDisabledError(Exception):
@@ -33,6 +39,8 @@ class LLMConfig:
     model: str
     tokens_remaining: int | None = None
     _token: str | None = None
+    stage_models: dict[str, str] = field(default_factory=dict)  # see gened.providers.for_stage()
+    key_pool: tuple[tuple[str, int], ...] = ()  # see gened.keypool
     
 def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMConfig:
     db = get_db()
@@ -77,6 +85,11 @@ def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMC
 
         if not class_row['dartmouth_key']:
             raise NoKeyFoundError
+
+        key_pool = get_key_pool(auth['class_id'], class_row['dartmouth_key'])
+        if spend_token:
+            # Don't spend a query on a request that would fail fast (see circuit.py)
+            circuits.check('mistral', class_row['dartmouth_key'], auth['class_id'], pool=[key for key, _ in key_pool])
         
         if class_row['role'] == 'student':
             if class_row['queries_used'] >= class_row['max_queries']:
@@ -95,7 +108,8 @@ def _get_llm(*, use_system_key: bool = False, spend_token: bool = False) -> LLMC
 
         return LLMConfig(
             api_key=class_row['dartmouth_key'],
-            model=class_row['model']
+            model=class_row['model'],
+            key_pool=key_pool,
         )
 
     # Get user data for tokens, auth_provider
@@ -141,6 +155,9 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
             except NoKeyFoundError:
                 flash("Error: No API key set. An API key must be set by the instructor.")
                 return render_template("error.html")
+            except CircuitOpenError as e:
+                flash(f"Error: {e}")
+                return render_template("error.html")
             except NoTokensError:
                 flash("You have used all of your free queries.")
                 return render_template("error.html")
@@ -150,45 +167,85 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
         return decorated_function
     return decorator
  
+def _make_client(api_key: str) -> Mistral:
+    # MISTRAL_BASE_URL optionally points at a proxy or a local mock server
+    return Mistral(api_key=api_key, server_url=os.environ.get("MISTRAL_BASE_URL"), async_client=make_http_client())
+
+
+async def _close_client(client: Mistral) -> None:
+    async_client = client.sdk_configuration.async_client
+    if async_client is not None:
+        await close_http_client(async_client)  # type: ignore[arg-type]
+
+
+# Pooled Mistral clients, one per API key, each with its own async connection pool
+mistral_clients: ClientRegistry[Mistral] = register_registry(ClientRegistry("mistral", factory=_make_client, closer=_close_client))
+
+
 async def get_completion(llm: LLMConfig, prompt: list) -> tuple[dict[str, str], str]:
     try:
-        # Get/refresh JWT token
-        client = Mistral(api_key=llm.api_key)
-        
-        print(f"Prompt being sent: {prompt}") 
-        print(f'llm: {llm.model}, {llm.api_key}')
-        # print(f"Type of prompt being sent: {type(prompt)}")
-        # print("Formatted url: ", formattedURL)
-        # resp = requests.post(
-        #     headers= {"accept": "application/json",
-        #               "Authorization": f"Bearer {llm._token}",
-        #               "Content-Type": "application/json"},
-        #     url=formattedURL,
-        #     json={
-        #         "messages": prompt,
-        #         "model": "unused",
-        #         "temperature": 0.25,
-        #         "max_tokens": 1000,
-        #     },
-        # )
-
-        resp = client.chat.complete(
-            model = llm.model,
-            messages = prompt
-        )
-        print(f'Response: {resp}')
+        current_app.logger.debug(f"Mistral completion: model={llm.model}, {len(prompt)} messages")
+
+        async def request() -> Any:
+            # complete_async() does not block the event loop, so concurrent completions actually overlap
+            async with mistral_clients.lease(llm.api_key) as client:
+                return await client.chat.complete_async(
+                    model = llm.model,
+                    messages = prompt
+                )
+
+        resp = await with_retries('mistral', request, api_key=llm.api_key, tokens=request_tokens(prompt, llm.model))
         response_text = resp.choices[0].message.content
         finish_reason = resp.choices[0].finish_reason
-        
+
         if finish_reason == "length":  # "length" if max_tokens reached
             current_app.logger.warning("Response exceeded maximum length and was truncated")
 
-        return {'response': response_text}, response_text
-        
+        return {'response': response_text, 'usage': resp.usage.model_dump() if resp.usage else None}, response_text
+
     except Exception as e:
             current_app.logger.error(f"Mistral API Error: {e}")
             return {'error': str(e)}, f"Error: {str(e)}"
 
+async def stream_completion(llm: LLMConfig, prompt: list, result: StreamResult) -> AsyncIterator[str]:
+    '''Stream a completion, yielding text deltas as they arrive.
+
+    When the stream ends, result holds the same response object and text that
+    get_completion() would have returned.
+    '''
+    chunks = []
+    finish_reason = None
+    usage = None
+    try:
+        async with mistral_clients.lease(llm.api_key) as client:
+            # Only opening the stream is retried; a failure after text has been sent can't be
+            stream = await with_retries('mistral', lambda: client.chat.stream_async(
+                model = llm.model,
+                messages = prompt
+            ), api_key=llm.api_key, tokens=request_tokens(prompt, llm.model))
+            async for event in stream:
+                if event.data.usage is not None:
+                    usage = event.data.usage.model_dump()  # on the last chunk
+                if not event.data.choices:
+                    continue
+                choice = event.data.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                delta = choice.delta.content
+                if isinstance(delta, str) and delta:
+                    chunks.append(delta)
+                    yield delta
+
+    except Exception as e:
+        current_app.logger.error(f"Mistral API Error: {e}")
+        result.response, result.text = {'error': str(e)}, f"Error: {str(e)}"
+        return
+
+    if finish_reason == "length":  # "length" if max_tokens reached
+        current_app.logger.warning("Response exceeded maximum length and was truncated")
+
+    result.text = "".join(chunks)
+    result.response = {'response': result.text, 'usage': usage}
+
 def get_models() -> list[Row]:
     db = get_db()
     models = db.execute("SELECT * FROM models WHERE active ORDER BY id ASC").fetchall()
@@ -2,19 +2,24 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
-from collections.abc import Callable
-from dataclasses import dataclass
+from collections.abc import AsyncIterator, Callable
+from dataclasses import dataclass, field
 from functools import wraps
 from sqlite3 import Row
-from typing import ParamSpec, TypeVar
+from typing import Any, ParamSpec, TypeVar
 
 import openai
 from flask import current_app, flash, render_template
-from openai import AsyncOpenAI
 from openai.types.chat import ChatCompletionMessageParam
 
 from .auth import get_auth
+from .clients import openai_clients
 from .db import get_db
+from .circuit import CircuitOpenError, circuits
+from .keypool import get_key_pool
+from .ratelimit import RateLimitWaitError, request_tokens
+from .resilience import DeadlineExceededError, is_retryable, with_retries
+from .streaming import StreamResult
 
 
 class ClassDisabledError(Exception):
@@ -35,6 +40,8 @@ class LLMConfig:
     api_key: str | None = None
     base_url: str | None = None
     tokens_remaining: int | None = None  # None if current user is not using tokens
+    stage_models: dict[str, str] = field(default_factory=dict, hash=False)  # see gened.providers.for_stage()
+    key_pool: tuple[tuple[str, int], ...] = field(default=(), hash=False)  # see gened.keypool
 
 
 def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLMConfig:
@@ -96,6 +103,10 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLMConfig:
             raise NoKeyFoundError
 
         api_key = class_row['api_key']
+        key_pool = get_key_pool(auth['class_id'], api_key)
+        if spend_token:
+            # Don't start a query that would fail fast (see circuit.py)
+            circuits.check('openai', api_key, auth['class_id'], pool=[key for key, _ in key_pool])
         
         # Determine base URL based on MODEL_PROVIDER
         model_provider = current_app.config.get('MODEL_PROVIDER', 'openai').lower()
@@ -112,6 +123,7 @@ def _get_llm(*, use_system_key: bool, spend_token: bool) -> LLMConfig:
             model=class_row['model'],
             api_key=api_key,
             base_url=base_url,
+            key_pool=key_pool,
         )
 
 
@@ -147,6 +159,9 @@ def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Call
             except NoKeyFoundError:
                 flash("Error: No API key set.  An API key must be set by the instructor before this page can be used.")
                 return render_template("error.html")
+            except CircuitOpenError as e:
+                flash(f"Error: {e}")
+                return render_template("error.html")
             except NoTokensError:
                 flash("You have used all of your free queries.  If you are using this application in a class, please connect using the link from your class for continued access.  Otherwise, you can create a class and add an OpenAI API key or contact us if you want to continue using this application.", "warning")
                 return render_template("error.html")
@@ -163,6 +178,72 @@ def get_models() -> list[Row]:
     models = db.execute("SELECT * FROM models WHERE active ORDER BY id ASC").fetchall()
     return models
 
+
+TEMPERATURE = 1
+
+
+def _completion_params(llm: LLMConfig, messages: list[ChatCompletionMessageParam]) -> dict[str, Any]:
+    params: dict[str, Any] = {
+        "model": llm.model,
+        "messages": messages,
+        "temperature": TEMPERATURE,
+    }
+    if llm.model.startswith(('gpt-3', 'gpt-3.5')):
+        params["max_tokens"] = 1000
+    else:
+        params["max_completion_tokens"] = 1000
+    return params
+
+
+def _is_retryable(e: BaseException) -> bool:
+    # An exhausted quota won't recover by retrying, unlike other rate limits
+    if isinstance(e, openai.RateLimitError) and "exceeded your current quota" in str(e):
+        return False
+    return isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)) or is_retryable(e)
+
+
+def _error_response(e: Exception) -> tuple[dict[str, str], str]:
+    '''Map an exception from a completion request to an error response object and user-facing text.'''
+    common_error_text = "Error ({error_type}).  Something went wrong with this query.  The error has been logged, and we'll work on it.  For now, please try again."
+
+    err_str = str(e)
+    if isinstance(e, ValueError):
+        response_txt = f"Error (ValueError). {err_str}"
+        current_app.logger.error(f"ValueError in get_completion: {e}")
+    elif isinstance(e, CircuitOpenError):
+        response_txt = f"Error (CircuitOpenError).  {err_str}"
+        current_app.logger.warning(f"OpenAI request not sent: circuit open for {e.retry_in:.0f}s")
+    elif isinstance(e, RateLimitWaitError):
+        response_txt = f"Error (RateLimitWaitError).  {err_str}"
+        current_app.logger.warning(f"OpenAI request not sent: rate limit wait over {e.wait:.0f}s")
+    elif isinstance(e, DeadlineExceededError):
+        response_txt = f"Error (DeadlineExceededError).  {err_str}"
+        current_app.logger.error("OpenAI request abandoned at the query deadline")
+    elif isinstance(e, openai.APITimeoutError):
+        response_txt = "Error (APITimeoutError).  The system timed out producing the response.  Please try again."
+        current_app.logger.error(f"OpenAI Timeout: {e}")
+    elif isinstance(e, openai.RateLimitError):
+        if "exceeded your current quota" in err_str:
+            response_txt = "Error (RateLimitError).  The API key for this class has exceeded its current quota (https://platform.openai.com/docs/guides/rate-limits/usage-tiers).  The instructor should check their API plan and billing details.  Possibly the key is in the free tier, which does not cover the models used here."
+        else:
+            response_txt = "Error (RateLimitError).  The system is receiving too many requests right now.  Please try again in one minute."
+        current_app.logger.error(f"OpenAI RateLimitError: {e}")
+    elif isinstance(e, openai.AuthenticationError):
+        response_txt = "Error (AuthenticationError).  The API key set by the instructor for this class is invalid.  The instructor needs to provide a valid API key for this application to work."
+        current_app.logger.error(f"OpenAI AuthenticationError: {e}")
+    elif isinstance(e, openai.BadRequestError):
+        if "maximum context length" in err_str:
+            response_txt = "Error (BadRequestError).  Your query is too long for the model to process.  Please reduce the length of your input."
+        else:
+            response_txt = common_error_text.format(error_type='BadRequestError')
+        current_app.logger.error(f"OpenAI BadRequestError: {e}")
+    else:
+        response_txt = common_error_text.format(error_type='APIError')
+        current_app.logger.error(f"Exception (OpenAI {type(e).__name__}, but I don't handle that specifically yet): {e}")
+
+    return {'error': err_str}, response_txt
+
+
 async def get_completion(llm: LLMConfig, messages: list[ChatCompletionMessageParam] | None = None, prompt: str | None = None) -> tuple[dict[str, str], str]:
     '''
     Takes an LLMConfig object and either messages or a prompt string.
@@ -172,8 +253,6 @@ async def get_completion(llm: LLMConfig, messages: list[ChatCompletionMessagePar
            - An OpenAI response object
            - The response text (stripped)
     '''
-    common_error_text = "Error ({error_type}).  Something went wrong with this query.  The error has been logged, and we'll work on it.  For now, please try again."
-    
     current_app.logger.debug(f"get_completion called with llm.model={llm.model}, prompt={prompt is not None}, messages={messages is not None}")
     if prompt:
         current_app.logger.debug(f"Prompt length: {len(prompt)}")
@@ -186,20 +265,14 @@ async def get_completion(llm: LLMConfig, messages: list[ChatCompletionMessagePar
                 raise ValueError("Either 'prompt' or 'messages' must be provided")
             messages = [{"role": "user", "content": prompt}]
 
-        # Prepare completion parameters
-        completion_params = {
-            "model": llm.model,
-            "messages": messages,
-            "temperature": 1,
-        }
-        if llm.model.startswith(('gpt-3', 'gpt-3.5')):
-            completion_params["max_tokens"] = 1000
-        else:
-            completion_params["max_completion_tokens"] = 1000
+        params = _completion_params(llm, messages)
 
-        # Instantiate AsyncOpenAI client here
-        client = AsyncOpenAI(api_key=llm.api_key, base_url=llm.base_url)
-        response = await client.chat.completions.create(**completion_params)
+        async def request() -> Any:
+            # Reuse a pooled client (and its keep-alive connections) for this key and endpoint
+            async with openai_clients.lease(llm.api_key, llm.base_url) as client:
+                return await client.chat.completions.create(**params)
+
+        response = await with_retries('openai', request, _is_retryable, api_key=llm.api_key, tokens=request_tokens(messages, llm.model))
         current_app.logger.debug(f"Full OpenAI response: {response}")
         response_txt = ""
         if hasattr(response, 'choices') and response.choices:
@@ -216,35 +289,52 @@ async def get_completion(llm: LLMConfig, messages: list[ChatCompletionMessagePar
 
         return response.model_dump(), response_txt.strip()
 
-    except ValueError as e:
-        err_str = str(e)
-        response_txt = f"Error (ValueError). {err_str}"
-        current_app.logger.error(f"ValueError in get_completion: {e}")
-    except openai.APITimeoutError as e:
-        err_str = str(e)
-        response_txt = "Error (APITimeoutError).  The system timed out producing the response.  Please try again."
-        current_app.logger.error(f"OpenAI Timeout: {e}")
-    except openai.RateLimitError as e:
-        err_str = str(e)
-        if "exceeded your current quota" in err_str:
-            response_txt = "Error (RateLimitError).  The API key for this class has exceeded its current quota (https://platform.openai.com/docs/guides/rate-limits/usage-tiers).  The instructor should check their API plan and billing details.  Possibly the key is in the free tier, which does not cover the models used here."
-        else:
-            response_txt = "Error (RateLimitError).  The system is receiving too many requests right now.  Please try again in one minute."
-        current_app.logger.error(f"OpenAI RateLimitError: {e}")
-    except openai.AuthenticationError as e:
-        err_str = str(e)
-        response_txt = "Error (AuthenticationError).  The API key set by the instructor for this class is invalid.  The instructor needs to provide a valid API key for this application to work."
-        current_app.logger.error(f"OpenAI AuthenticationError: {e}")
-    except openai.BadRequestError as e:
-        err_str = str(e)
-        if "maximum context length" in err_str:
-            response_txt = "Error (BadRequestError).  Your query is too long for the model to process.  Please reduce the length of your input."
-        else:
-            response_txt = common_error_text.format(error_type='BadRequestError')
-        current_app.logger.error(f"OpenAI BadRequestError: {e}")
-    except openai.APIError as e:
-        err_str = str(e)
-        response_txt = common_error_text.format(error_type='APIError')
-        current_app.logger.error(f"Exception (OpenAI {type(e).__name__}, but I don't handle that specifically yet): {e}")
+    except (ValueError, openai.APIError, CircuitOpenError, DeadlineExceededError, RateLimitWaitError) as e:
+        return _error_response(e)
 
-    return {'error': err_str}, response_txt
+
+async def stream_completion(llm: LLMConfig, messages: list[ChatCompletionMessageParam], result: StreamResult) -> AsyncIterator[str]:
+    '''
+    Stream a completion, yielding text deltas as they arrive.
+
+    When the stream ends, result holds the same response object and text that
+    get_completion() would have returned.
+    '''
+    chunks = []
+    response_id = None
+    response_model = llm.model
+    finish_reason = None
+    usage = None
+    try:
+        async with openai_clients.lease(llm.api_key, llm.base_url) as client:
+            # Only opening the stream is retried; a failure after text has been sent can't be
+            stream = await with_retries('openai', lambda: client.chat.completions.create(
+                **_completion_params(llm, messages),
+                stream=True,
+                stream_options={"include_usage": True},
+            ), _is_retryable, api_key=llm.api_key, tokens=request_tokens(messages, llm.model))
+            async for chunk in stream:
+                response_id, response_model = chunk.id, chunk.model
+                if chunk.usage is not None:
+                    usage = chunk.usage.model_dump()
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                if choice.delta.content:
+                    chunks.append(choice.delta.content)
+                    yield choice.delta.content
+
+    except (ValueError, openai.APIError, CircuitOpenError, DeadlineExceededError, RateLimitWaitError) as e:
+        result.response, result.text = _error_response(e)
+        return
+
+    result.text = "".join(chunks).strip()
+    # Reassemble a response object in the same shape as a non-streamed completion
+    result.response = {
+        'id': response_id,
+        'model': response_model,
+        'object': 'chat.completion',
+        'choices': [{'index': 0, 'finish_reason': finish_reason, 'message': {'role': 'assistant', 'content': result.text}}],
+        'usage': usage,
+    }
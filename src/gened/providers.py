@@ -0,0 +1,288 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Registry of LLM provider modules behind a common async interface.
+
+Each provider module (gened.openai, gened.dartmouth, gened.mistral, and
+gened.gemini) provides:
+
+  - LLMConfig: a dataclass with (at least) model, api_key, tokens_remaining,
+    stage_models, and key_pool
+  - with_llm(*, use_system_key, spend_token): a view decorator passing an 'llm' argument
+  - get_completion(llm, messages) -> (response object, response text)
+  - stream_completion(llm, messages, result): an async generator of text deltas
+
+Provider modules (and their SDKs) are imported the first time they are used,
+then cached.  Each request is routed by the `provider` column of its class's
+row in the models table, so classes on different providers can be served by
+the same process.  Requests without a class, or using the system key, go to
+the MODEL_PROVIDER configured for the application.
+
+A model in the models table can also name cheaper models for the auxiliary
+stages of a query (sufficiency_model_id, cleanup_model_id, topics_model_id).
+with_llm() carries them in llm.stage_models, and for_stage() selects one.
+'''
+
+import asyncio
+import dataclasses
+import importlib
+import threading
+import time
+from collections.abc import AsyncIterator, Callable, Sequence
+from functools import wraps
+from sqlite3 import Row
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, ParamSpec, Protocol, TypeAlias, TypeVar
+
+from flask import current_app, flash, has_request_context, render_template
+
+from . import budgets, keypool, ratelimit, resilience
+from .coalesce import WaitTimeoutError, inflight, make_key
+from .auth import get_auth
+from .db import get_db, run_in_thread
+from .streaming import StreamResult
+
+if TYPE_CHECKING:
+    from openai.types.chat import ChatCompletionMessageParam
+
+PROVIDERS = ('openai', 'dartmouth', 'mistral', 'gemini')
+
+_REQUIRED_ATTRS = ('LLMConfig', 'with_llm', 'get_completion', 'stream_completion')
+
+
+class UnknownProviderError(Exception):
+    pass
+
+
+# Chat messages in the OpenAI format, which every provider accepts
+Messages: TypeAlias = "Sequence[ChatCompletionMessageParam]"
+
+
+class LLMConfig(Protocol):
+    '''The common part of every provider's LLMConfig.'''
+    model: str
+    api_key: str | None
+    tokens_remaining: int | None
+    stage_models: dict[str, str]  # stage -> model, for stages that don't use the main model
+    key_pool: tuple[tuple[str, int], ...]  # (API key, weight) pairs to spread requests over (see gened.keypool)
+
+
+class ProviderRegistry:
+    '''Lazily imports and caches provider modules by name.'''
+    def __init__(self, names: tuple[str, ...]) -> None:
+        self.names = names
+        self._modules: dict[str, ModuleType] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str) -> ModuleType:
+        module = self._modules.get(name)
+        if module is not None:
+            return module
+
+        if name not in self.names:
+            raise UnknownProviderError(f"Unknown LLM provider: {name!r} (expected one of {', '.join(self.names)})")
+
+        with self._lock:
+            if name not in self._modules:
+                module = importlib.import_module(f".{name}", __package__)
+                missing = [attr for attr in _REQUIRED_ATTRS if not hasattr(module, attr)]
+                if missing:
+                    raise UnknownProviderError(f"Provider module '{module.__name__}' is missing {', '.join(missing)}")
+                self._modules[name] = module
+            return self._modules[name]
+
+    def for_config(self, llm: LLMConfig) -> ModuleType:
+        '''Get the provider module that created the given LLMConfig.'''
+        return self.get(type(llm).__module__.rpartition('.')[2])
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._modules
+
+
+providers = ProviderRegistry(PROVIDERS)
+
+
+def default_provider() -> str:
+    return str(current_app.config.get('MODEL_PROVIDER', 'openai')).lower()
+
+
+def get_class_provider(class_id: int) -> str | None:
+    '''Get the provider of the model configured for the given class, if any.'''
+    db = get_db()
+    row = db.execute("""
+        SELECT models.provider
+        FROM classes
+        LEFT JOIN classes_lti ON classes.id = classes_lti.class_id
+        LEFT JOIN consumers ON classes_lti.lti_consumer_id = consumers.id
+        LEFT JOIN classes_user ON classes.id = classes_user.class_id
+        LEFT JOIN models ON models.id = COALESCE(consumers.model_id, classes_user.model_id)
+        WHERE classes.id = ?
+    """, [class_id]).fetchone()
+    return row['provider'] if row else None
+
+
+def get_request_provider(*, use_system_key: bool = False) -> ModuleType:
+    '''Get the provider module that should serve the current request.'''
+    name = None
+    if not use_system_key:
+        auth = get_auth()
+        if auth['class_id']:
+            name = get_class_provider(auth['class_id'])
+    return providers.get(name or default_provider())
+
+
+# Stages of a query that can be routed to a model other than the main one, with their models table columns
+STAGE_COLUMNS = {
+    'sufficiency': 'sufficiency_model_id',
+    'cleanup': 'cleanup_model_id',
+    'topics': 'topics_model_id',
+}
+
+
+def get_stage_models(class_id: int) -> dict[str, str]:
+    '''Get the models configured for each auxiliary stage for the given class.
+
+    Stage models on a different provider than the class's main model are
+    ignored, since a single LLMConfig (and API key) serves all stages.
+    '''
+    db = get_db()
+    joins = "\n".join(
+        f"LEFT JOIN models AS {stage} ON {stage}.id = models.{column} AND {stage}.provider = models.provider"
+        for stage, column in STAGE_COLUMNS.items()
+    )
+    fields = ", ".join(f"{stage}.model AS {stage}" for stage in STAGE_COLUMNS)
+    row = db.execute(f"""
+        SELECT {fields}
+        FROM classes
+        LEFT JOIN classes_lti ON classes.id = classes_lti.class_id
+        LEFT JOIN consumers ON classes_lti.lti_consumer_id = consumers.id
+        LEFT JOIN classes_user ON classes.id = classes_user.class_id
+        JOIN models ON models.id = COALESCE(consumers.model_id, classes_user.model_id)
+        {joins}
+        WHERE classes.id = ?
+    """, [class_id]).fetchone()
+    if row is None:
+        return {}
+    return {stage: row[stage] for stage in STAGE_COLUMNS if row[stage]}
+
+
+def for_stage(llm: LLMConfig, stage: str) -> LLMConfig:
+    '''Get the config to use for one stage of a query (e.g., 'sufficiency'), which
+    differs from llm only in its model, if the class routes that stage elsewhere.'''
+    model = llm.stage_models.get(stage)
+    if model is None or model == llm.model:
+        return llm
+    return dataclasses.replace(llm, model=model)  # type: ignore[type-var]
+
+
+# For decorator type hints
+P = ParamSpec('P')
+R = TypeVar('R')
+
+
+def with_llm(*, use_system_key: bool = False, spend_token: bool = False) -> Callable[[Callable[P, R]], Callable[P, str | R]]:
+    '''Decorate a view function that requires an LLM and API key.
+
+    Assigns an 'llm' named argument, using the with_llm() decorator of the
+    provider that serves the current request (see get_request_provider()),
+    with the stage models of the current class added (see for_stage()).
+    '''
+    def decorator(f: Callable[P, R]) -> Callable[P, str | R]:
+        @wraps(f)
+        def decorated_function(*args: P.args, **kwargs: P.kwargs) -> str | R:
+            provider = get_request_provider(use_system_key=use_system_key)
+            name = provider.__name__.rpartition('.')[2]
+
+            def with_class_config(*args: P.args, **kwargs: P.kwargs) -> str | R:
+                auth = get_auth()
+                if not use_system_key and auth['class_id']:
+                    stage_models = get_stage_models(auth['class_id'])
+                    if stage_models:
+                        kwargs['llm'] = dataclasses.replace(kwargs['llm'], stage_models=stage_models)  # type: ignore[type-var]
+                    try:
+                        kwargs['llm'] = budgets.apply_budgets(kwargs['llm'], name, auth['class_id'], spend_token=spend_token)
+                    except budgets.BudgetExhaustedError as e:
+                        flash(f"Error: {e}")
+                        return render_template("error.html")
+                return f(*args, **kwargs)
+
+            provider_decorator = provider.with_llm(use_system_key=use_system_key, spend_token=spend_token)
+            return provider_decorator(with_class_config)(*args, **kwargs)  # type: ignore[no-any-return]
+        return decorated_function
+    return decorator
+
+
+async def get_completion(llm: LLMConfig, messages: Messages, *, hedge: bool = False) -> tuple[dict[str, Any], str]:
+    '''Get a completion from the provider that created llm.
+
+    If llm has a pool of API keys, the key is chosen per request (see gened.keypool).
+    With hedge=True, a slow request may be duplicated (see resilience.hedged()).
+    With COMPLETION_COALESCE, an identical request already in flight for the
+    same class and keys is shared (see gened.coalesce), and the shared
+    response is marked 'coalesced'.  Every caller is charged to its own
+    class's budgets for the response it receives.
+    '''
+    provider = providers.for_config(llm)
+    name = provider.__name__.rpartition('.')[2]
+    key = (name, llm.model)
+
+    async def attempt(keyed_llm: LLMConfig) -> tuple[dict[str, Any], str]:
+        response, response_txt = await provider.get_completion(keyed_llm, messages)
+        if 'error' in response:
+            return response, response_txt
+        usage = response.get('usage') or {}
+        if usage.get('total_tokens'):
+            # Return the rate limit tokens reserved beyond what was actually used
+            await ratelimit.settle(keyed_llm.api_key, ratelimit.request_tokens(messages, keyed_llm.model), usage['total_tokens'])
+        return response, response_txt
+
+    async def request() -> tuple[dict[str, Any], str]:
+        start = time.monotonic()
+        response, response_txt = await keypool.with_pool_key(name, llm, attempt)
+        if 'error' not in response:
+            resilience.latencies.record(key, time.monotonic() - start)
+        return response, response_txt
+
+    async def call() -> tuple[dict[str, Any], str]:
+        if hedge:
+            return await resilience.hedged(name, key, request)
+        return await request()
+
+    if not current_app.config['COMPLETION_COALESCE']:
+        response, response_txt = await call()
+    else:
+        class_id = (await asyncio.to_thread(get_auth))['class_id'] if has_request_context() else None
+        scope = (llm.api_key, getattr(llm, 'key_pool', ()), class_id)
+        try:
+            (response, response_txt), leader = await inflight.run(make_key(name, llm.model, messages, scope), call, timeout=resilience.time_remaining())
+        except WaitTimeoutError:
+            e = resilience.DeadlineExceededError()
+            current_app.logger.error("Coalesced request abandoned at the query deadline")
+            return {'error': str(e)}, f"Error (DeadlineExceededError).  {e}"
+        if not leader:
+            response = {**response, 'coalesced': True}  # so it isn't counted as a separate API call
+
+    if 'error' not in response:
+        await run_in_thread(budgets.charge, name, llm, messages, response, response_txt)
+    return response, response_txt
+
+
+async def stream_completion(llm: LLMConfig, messages: Messages, result: StreamResult) -> AsyncIterator[str]:
+    '''Stream a completion from the provider that created llm (see gened.streaming).
+
+    The completion is charged to the class's budgets when the stream ends (see gened.budgets).
+    '''
+    provider = providers.for_config(llm)
+    name = provider.__name__.rpartition('.')[2]
+    async for delta in keypool.stream_with_pool_key(name, llm, lambda keyed_llm: provider.stream_completion(keyed_llm, messages, result), result):
+        yield delta
+    if not result.is_error:
+        await run_in_thread(budgets.charge, name, llm, messages, result.response, result.text)
+
+
+def get_models() -> list[Row]:
+    """Enumerate the models available in the database."""
+    db = get_db()
+    models = db.execute("SELECT * FROM models WHERE active ORDER BY id ASC").fetchall()
+    return models
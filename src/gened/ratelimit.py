@@ -0,0 +1,266 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Client-side rate limiting of LLM requests per API key.
+
+Every class under a consumer (or a user-created class) shares one API key, so
+a whole lab submitting at once can exceed the provider's rate limits, and
+then every request fails.  Before each request, resilience.with_retries()
+calls acquire(), which takes one request and the estimated tokens from a
+pair of token buckets for the key (RATE_LIMIT_RPM requests and
+RATE_LIMIT_TPM tokens per minute, each able to burst up to a minute's worth).
+
+A request that exceeds the limits is queued: its share of the buckets is
+reserved immediately (letting them go negative), and it waits until they
+would have refilled.  Reserving makes the queue first-come, first-served
+without any polling.  If the wait would be longer than RATE_LIMIT_MAX_WAIT
+(or the query's deadline), the request is refused with RateLimitWaitError
+rather than sent to be refused by the provider.
+
+RATE_LIMIT_BACKEND selects where bucket levels are kept:
+  - 'memory': in this process
+  - 'sqlite': in a small SQLite database in the instance folder, shared by
+    all worker processes (each reservation is one short IMMEDIATE transaction)
+'''
+
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Mapping, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from flask import current_app
+
+from . import tokens as token_estimates
+
+# Estimated tokens in a completion's output, counted against the tokens-per-minute limit
+DEFAULT_OUTPUT_TOKENS = 1000
+
+
+class RateLimitWaitError(Exception):
+    def __init__(self, wait: float) -> None:
+        super().__init__("Too many requests are being made with this class's API key right now.  Please try again in a minute.")
+        self.wait = wait
+
+
+def request_tokens(messages: Sequence[Mapping[str, Any]] | str | None, model: str | None = None) -> int:
+    '''The tokens to reserve for a request: its estimated prompt (see gened.tokens) plus DEFAULT_OUTPUT_TOKENS.'''
+    if isinstance(messages, str):
+        prompt_tokens = token_estimates.estimate_tokens(messages, model)
+    else:
+        prompt_tokens = token_estimates.estimate_messages(messages or [], model)
+    return prompt_tokens + DEFAULT_OUTPUT_TOKENS
+
+
+@dataclass(frozen=True)
+class BucketState:
+    requests: float  # may be negative while requests are queued
+    tokens: float
+    updated: float   # time.time() of the last reservation
+
+
+Reservation = Callable[[BucketState | None], tuple[BucketState, float | None]]
+
+
+def reserve(state: BucketState | None, now: float, rpm: int, tpm: int, tokens: int, max_wait: float) -> tuple[BucketState, float | None]:
+    '''Refill the buckets to `now` and reserve one request and `tokens` tokens.
+
+    Returns the new state and the time to wait before sending the request,
+    or None (with nothing reserved) if that would be longer than max_wait.
+    A limit of 0 is no limit.
+    '''
+    if state is None:
+        state = BucketState(requests=rpm, tokens=tpm, updated=now)
+    elapsed = max(0.0, now - state.updated)
+    requests = min(float(rpm), state.requests + elapsed * rpm / 60)
+    available = min(float(tpm), state.tokens + elapsed * tpm / 60)
+    needed = min(tokens, tpm)  # a request larger than the whole bucket waits for a full one
+
+    wait = 0.0
+    if rpm and requests < 1:
+        wait = (1 - requests) * 60 / rpm
+    if tpm and available < needed:
+        wait = max(wait, (needed - available) * 60 / tpm)
+
+    if wait > max_wait:
+        return BucketState(requests, available, now), None
+    return BucketState(requests - 1 if rpm else 0, available - needed if tpm else 0, now), wait
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(self) -> None:
+        self._states: dict[str, BucketState] = {}
+        self._lock = threading.Lock()
+
+    def update(self, key: str, reservation: Reservation) -> float | None:
+        with self._lock:
+            state, wait = reservation(self._states.get(key))
+            self._states[key] = state
+            return wait
+
+
+class SQLiteBackend:
+    '''Bucket levels in a SQLite database, so that worker processes share them.'''
+    blocking = True
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10, isolation_level=None)
+
+    def update(self, key: str, reservation: Reservation) -> float | None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # take the write lock before reading, so reservations are serialized
+            row = conn.execute("SELECT requests, tokens, updated FROM buckets WHERE key=?", [key]).fetchone()
+            state, wait = reservation(BucketState(*row) if row else None)
+            conn.execute("INSERT OR REPLACE INTO buckets (key, requests, tokens, updated) VALUES (?, ?, ?, ?)",
+                         [key, state.requests, state.tokens, state.updated])
+            conn.execute("COMMIT")
+            return wait
+        finally:
+            conn.close()
+
+
+@dataclass
+class _KeyStats:
+    requests: int = 0
+    queued: int = 0      # requests that had to wait
+    refused: int = 0     # requests refused because the wait would be too long
+    waiting: int = 0     # requests waiting right now
+    max_waiting: int = 0
+    total_wait: float = 0.0
+    max_wait: float = 0.0
+
+
+def _key_id(api_key: str | None) -> str:
+    # Keys are never stored, even in the shared database; a hash identifies them.
+    return hashlib.sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+class RateLimiter:
+    def __init__(self, backend: MemoryBackend | SQLiteBackend) -> None:
+        self.backend = backend
+        self._stats: dict[str, _KeyStats] = defaultdict(_KeyStats)
+        self._labels: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    async def _update(self, key: str, reservation: Reservation) -> float | None:
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.backend.update, key, reservation)
+        return self.backend.update(key, reservation)
+
+    async def acquire(self, api_key: str | None, tokens: int, rpm: int, tpm: int, max_wait: float) -> float:
+        '''Wait until a request with `tokens` tokens may be sent with api_key.
+        Returns the time waited, or raises RateLimitWaitError.'''
+        key = _key_id(api_key)
+        wait = await self._update(key, lambda state: reserve(state, time.time(), rpm, tpm, tokens, max_wait))
+
+        with self._lock:
+            self._labels[key] = f"...{api_key[-4:]}" if api_key else "(none)"
+            stats = self._stats[key]
+            stats.requests += 1
+            if wait is None:
+                stats.refused += 1
+            elif wait > 0:
+                stats.queued += 1
+                stats.waiting += 1
+                stats.max_waiting = max(stats.max_waiting, stats.waiting)
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+
+        if wait is None:
+            raise RateLimitWaitError(max_wait)
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                with self._lock:
+                    self._stats[key].waiting -= 1
+        return wait
+
+    async def settle(self, api_key: str | None, unused_tokens: int, tpm: int) -> None:
+        '''Return tokens reserved for a request that it turned out not to use.'''
+        if unused_tokens <= 0 or not tpm:
+            return
+
+        def give_back(state: BucketState | None) -> tuple[BucketState, float | None]:
+            if state is None:
+                return BucketState(0, tpm, time.time()), 0.0
+            return BucketState(state.requests, min(float(tpm), state.tokens + unused_tokens), state.updated), 0.0
+
+        await self._update(_key_id(api_key), give_back)
+
+    def stats(self) -> list[dict[str, str | int | float]]:
+        with self._lock:
+            items = [(self._labels[key], stats) for key, stats in self._stats.items()]
+        return [
+            {
+                'key': label,
+                'requests': stats.requests,
+                'queued': stats.queued,
+                'refused': stats.refused,
+                'waiting': stats.waiting,
+                'max_waiting': stats.max_waiting,
+                'avg_wait': round(stats.total_wait / stats.queued, 2) if stats.queued else 0.0,
+                'max_wait': round(stats.max_wait, 2),
+            }
+            for label, stats in items
+        ]
+
+
+_limiters: dict[tuple[str, str], RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    '''The rate limiter for the configured backend, shared by the whole process.'''
+    backend_name = current_app.config['RATE_LIMIT_BACKEND']
+    path = str(Path(current_app.instance_path) / 'ratelimit.db') if backend_name == 'sqlite' else ''
+    with _limiters_lock:
+        limiter = _limiters.get((backend_name, path))
+        if limiter is None:
+            backend = SQLiteBackend(Path(path)) if backend_name == 'sqlite' else MemoryBackend()
+            limiter = _limiters[(backend_name, path)] = RateLimiter(backend)
+        return limiter
+
+
+def enabled() -> bool:
+    return bool(current_app.config['RATE_LIMIT_RPM'] or current_app.config['RATE_LIMIT_TPM'])
+
+
+async def acquire(api_key: str | None, tokens: int, time_remaining: float | None = None) -> float:
+    '''Wait for the configured rate limits to allow a request with api_key (see RateLimiter.acquire()).'''
+    if not enabled():
+        return 0.0
+    config = current_app.config
+    max_wait = config['RATE_LIMIT_MAX_WAIT']
+    if time_remaining is not None:
+        max_wait = min(max_wait, max(0.0, time_remaining))
+    return await get_limiter().acquire(api_key, tokens, config['RATE_LIMIT_RPM'], config['RATE_LIMIT_TPM'], max_wait)
+
+
+async def settle(api_key: str | None, estimated_tokens: int, used_tokens: int) -> None:
+    if enabled():
+        await get_limiter().settle(api_key, estimated_tokens - used_tokens, current_app.config['RATE_LIMIT_TPM'])
+
+
+def get_stats() -> list[dict[str, str | int | float]]:
+    '''Per-key queueing statistics of this process, or [] if rate limiting is disabled.'''
+    if not enabled():
+        return []
+    return get_limiter().stats()
@@ -0,0 +1,298 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Retries, hedged requests, and deadlines for LLM completions.
+
+A transient API failure (a timeout, a dropped connection, a rate limit, or a
+5xx response) used to be shown to the student as an error, and they would
+resubmit the query.  Provider modules now make each request through
+with_retries(), which retries retryable failures with jittered exponential
+backoff.
+
+Two policies apply across a whole query:
+  - deadline(): a time limit for all of a query's completions.  Retries stop,
+    and a pending request is abandoned, when the deadline passes, raising
+    DeadlineExceededError.
+  - hedged(): if a request hasn't finished by the p95 latency of recent
+    requests to the same model, a duplicate is sent and the first successful
+    response is used.  Enabled with COMPLETION_HEDGE, for the main prompt only.
+
+with_retries() also consults and updates the circuit breaker of the provider
+and API key (see circuit.py).
+'''
+
+import asyncio
+import contextlib
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict, deque
+from collections.abc import Awaitable, Callable, Iterator
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+import httpx
+from flask import current_app
+
+from . import ratelimit
+from .circuit import CircuitOpenError, circuits
+
+T = TypeVar('T')
+
+# HTTP statuses worth retrying: timeouts, conflicts, rate limits, and server errors
+RETRY_STATUS_CODES = frozenset({408, 409, 429, 500, 502, 503, 504})
+# HTTP statuses that mean an API key can't be used: invalid, not permitted, or out of quota
+KEY_FAILURE_STATUS_CODES = frozenset({401, 402, 403, 429})
+
+LATENCY_SAMPLES = 200      # recent latencies kept per (provider, model)
+MIN_HEDGE_SAMPLES = 20     # no hedging until there are this many samples to estimate p95 from
+HEDGE_QUANTILE = 0.95
+
+
+class RetryableStatusError(Exception):
+    '''Raised by a provider's request for an HTTP response with a status in RETRY_STATUS_CODES.'''
+    def __init__(self, status_code: int, text: str) -> None:
+        super().__init__(text)
+        self.status_code = status_code
+
+
+class DeadlineExceededError(Exception):
+    def __init__(self) -> None:
+        super().__init__("The system took too long producing the response.  Please try again.")
+
+
+def is_retryable(e: BaseException) -> bool:
+    '''True for errors that are likely transient: network errors and retryable HTTP statuses.
+
+    Status codes are found in the `status_code` (OpenAI, Mistral) or `code`
+    (Gemini) attribute of the SDKs' exceptions.
+    '''
+    if isinstance(e, httpx.TransportError):
+        return True
+    status = getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    return status in RETRY_STATUS_CODES
+
+
+# ### Deadlines ###
+
+_deadline: ContextVar[float | None] = ContextVar('completion_deadline', default=None)
+
+
+@contextlib.contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    '''Limit the completions made within the block (and in tasks it starts) to `seconds` in total.
+
+    Nested deadlines can only shorten an enclosing one.  None or 0 sets no limit.
+    '''
+    previous = _deadline.get()
+    current = previous
+    if seconds:
+        new = time.monotonic() + seconds
+        current = new if current is None else min(current, new)
+    _deadline.set(current)
+    try:
+        yield
+    finally:
+        # Not ContextVar.reset(), since a generator holding a deadline may be closed from another context
+        _deadline.set(previous)
+
+
+def time_remaining() -> float | None:
+    '''Seconds until the current deadline, or None if there is none.'''
+    end = _deadline.get()
+    return None if end is None else end - time.monotonic()
+
+
+# ### Retries ###
+
+@dataclass
+class _Counters:
+    requests: int = 0
+    retries: int = 0
+    failures: int = 0   # requests that failed after any retries
+    deadlines: int = 0  # requests abandoned at the deadline
+    hedges: int = 0     # duplicate requests sent
+    hedge_wins: int = 0 # hedged requests whose duplicate finished first
+    fast_fails: int = 0 # requests not made because the key's circuit was open
+
+
+_counters: dict[str, _Counters] = defaultdict(_Counters)
+_counters_lock = threading.Lock()
+
+
+def _count(provider: str, **increments: int) -> None:
+    with _counters_lock:
+        counters = _counters[provider]
+        for name, n in increments.items():
+            setattr(counters, name, getattr(counters, name) + n)
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    '''Delay before retry number `attempt` (from 0): "full jitter" exponential backoff.'''
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def is_key_failure(e: BaseException, retryable: Callable[[BaseException], bool] = is_retryable) -> bool:
+    '''True for errors that count against the provider and API key in its circuit
+    breaker: transient errors that outlasted any retries, invalid keys, and
+    exhausted quotas (as opposed to, e.g., a query that is too long).'''
+    if isinstance(e, DeadlineExceededError) or retryable(e):
+        return True
+    status = getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    return status in KEY_FAILURE_STATUS_CODES
+
+
+async def with_retries(provider: str, request: Callable[[], Awaitable[T]], retryable: Callable[[BaseException], bool] = is_retryable, *, api_key: str | None = None, tokens: int = 0) -> T:
+    '''Await request(), retrying it with jittered exponential backoff while it
+    raises retryable errors, up to COMPLETION_RETRIES times and within the
+    current deadline.  The last error is re-raised.
+
+    The outcome is recorded in the circuit breaker for the provider and
+    api_key, and CircuitOpenError is raised without making the request if
+    that circuit is open.  Each attempt first waits for the rate limits of
+    api_key to allow a request using about `tokens` tokens (see ratelimit.py).
+    '''
+    breaker = circuits.get(provider, api_key)
+    if breaker is not None and not breaker.acquire():
+        _count(provider, fast_fails=1)
+        raise CircuitOpenError(breaker.retry_in())
+
+    try:
+        result = await _with_retries(provider, request, retryable, api_key, tokens)
+    except asyncio.CancelledError:
+        if breaker is not None:
+            breaker.release()  # e.g., the losing request of a hedged pair
+        raise
+    except Exception as e:
+        if breaker is not None:
+            breaker.record(not is_key_failure(e, retryable))
+        raise
+    if breaker is not None:
+        breaker.record(True)
+    return result
+
+
+async def _with_retries(provider: str, request: Callable[[], Awaitable[T]], retryable: Callable[[BaseException], bool], api_key: str | None, tokens: int) -> T:
+    max_retries = current_app.config['COMPLETION_RETRIES']
+    base = current_app.config['COMPLETION_BACKOFF_BASE']
+    cap = current_app.config['COMPLETION_BACKOFF_MAX']
+    _count(provider, requests=1)
+
+    attempt = 0
+    error: Exception
+    while True:
+        try:
+            await ratelimit.acquire(api_key, tokens, time_remaining())
+            remaining = time_remaining()
+            if remaining is None:
+                return await request()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            return await asyncio.wait_for(request(), remaining)
+        except asyncio.TimeoutError as e:
+            remaining = time_remaining()
+            if remaining is not None and remaining <= 0:
+                _count(provider, deadlines=1)
+                raise DeadlineExceededError from e
+            error = e
+        except Exception as e:
+            error = e
+
+        if attempt >= max_retries or not retryable(error):
+            _count(provider, failures=1)
+            raise error
+        delay = backoff_delay(attempt, base, cap)
+        remaining = time_remaining()
+        if remaining is not None and delay >= remaining:
+            _count(provider, failures=1)
+            raise error
+
+        current_app.logger.warning(f"{provider} request failed ({type(error).__name__}: {error}); retrying in {delay:.2f}s")
+        _count(provider, retries=1)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+# ### Hedging ###
+
+class LatencyTracker:
+    '''Recent latencies of successful completions, per key (e.g., provider and model).'''
+    def __init__(self, max_samples: int = LATENCY_SAMPLES) -> None:
+        self._samples: dict[Any, deque[float]] = defaultdict(lambda: deque(maxlen=max_samples))
+        self._lock = threading.Lock()
+
+    def record(self, key: Any, seconds: float) -> None:
+        with self._lock:
+            self._samples[key].append(seconds)
+
+    def quantile(self, key: Any, q: float) -> float | None:
+        '''The q-quantile of recent latencies for key, or None with too few samples.'''
+        with self._lock:
+            samples = list(self._samples.get(key, ()))
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        return statistics.quantiles(samples, n=100, method='inclusive')[round(q * 100) - 1]
+
+    def keys(self) -> list[Any]:
+        with self._lock:
+            return list(self._samples)
+
+
+latencies = LatencyTracker()
+
+
+async def hedged(provider: str, key: Any, request: Callable[[], Awaitable[tuple[dict[str, Any], str]]]) -> tuple[dict[str, Any], str]:
+    '''Await request() (a completion returning a response object and text), sending
+    a duplicate if it takes longer than the p95 latency for key.
+
+    The first response without an error is returned, and the other request is
+    cancelled.  If both fail, the last error response is returned.
+    '''
+    delay = latencies.quantile(key, HEDGE_QUANTILE) if current_app.config['COMPLETION_HEDGE'] else None
+    if delay is None:
+        return await request()
+
+    first = asyncio.ensure_future(request())
+    done, _ = await asyncio.wait({first}, timeout=delay)
+    if done:
+        return first.result()
+
+    _count(provider, hedges=1)
+    second = asyncio.ensure_future(request())
+    pending = {first, second}
+    result = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if 'error' not in result[0]:
+                    if task is second:
+                        _count(provider, hedge_wins=1)
+                    return result
+    finally:
+        for task in pending:
+            task.cancel()
+    assert result is not None
+    return result
+
+
+@dataclass(frozen=True)
+class ResilienceStats:
+    provider: str
+    requests: int
+    retries: int
+    failures: int
+    deadlines: int
+    hedges: int
+    hedge_wins: int
+    fast_fails: int
+
+
+def get_stats() -> list[ResilienceStats]:
+    '''Counts of requests, retries, and hedges per provider since this process started.'''
+    with _counters_lock:
+        return [ResilienceStats(provider, **vars(counters)) for provider, counters in sorted(_counters.items())]
@@ -22,6 +22,11 @@ DROP TABLE IF EXISTS migrations;
 DROP TABLE IF EXISTS models;
 DROP TABLE IF EXISTS experiments;
 DROP TABLE IF EXISTS experiment_class;
+DROP TABLE IF EXISTS completion_cache;
+DROP TABLE IF EXISTS completion_cache_stats;
+DROP TABLE IF EXISTS api_key_pool;
+DROP TABLE IF EXISTS usage_budgets;
+DROP TABLE IF EXISTS usage_ledger;
 
 PRAGMA foreign_keys = ON;  -- back on for good
 
@@ -94,6 +99,7 @@ CREATE TABLE classes (
     id       INTEGER PRIMARY KEY AUTOINCREMENT,
     name     TEXT NOT NULL,
     enabled  BOOLEAN NOT NULL CHECK (enabled IN (0,1)) DEFAULT 1,
+    cache_completions  BOOLEAN NOT NULL CHECK (cache_completions IN (0,1)) DEFAULT 1,  -- see gened.completion_cache
     created  DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
@@ -163,14 +169,29 @@ CREATE TABLE models (
     name        TEXT NOT NULL UNIQUE,
     shortname   TEXT NOT NULL UNIQUE,
     model       TEXT NOT NULL,
-    active      BOOLEAN NOT NULL CHECK (active IN (0,1))
+    provider    TEXT NOT NULL DEFAULT 'openai',  -- module in gened that serves this model (see gened.providers)
+    active      BOOLEAN NOT NULL CHECK (active IN (0,1)),
+    -- models for auxiliary stages of a query when this is the main model (NULL: use this model)
+    sufficiency_model_id  INTEGER REFERENCES models(id),
+    cleanup_model_id      INTEGER REFERENCES models(id),
+    topics_model_id       INTEGER REFERENCES models(id),
+    -- prices in USD per million tokens, for usage budgets (see gened.budgets; NULL: not priced)
+    price_prompt      REAL,
+    price_cached      REAL,  -- cached prompt tokens (NULL: price_prompt)
+    price_completion  REAL
 );
 -- See also: DEFAULT_CLASS_MODEL_SHORTNAME in base.create_app_base()
-INSERT INTO models(name, shortname, model, active) VALUES
-    ('OpenAI GPT-3.5 Turbo', 'GPT-3.5', 'gpt-3.5-turbo-0125', false),
-    ('OpenAI GPT-4o', 'GPT-4o', 'gpt-4o', true),
-    ('OpenAI GPT-4o-mini', 'GPT-4o-mini', 'gpt-4o-mini', true)
+INSERT INTO models(name, shortname, model, active, price_prompt, price_cached, price_completion) VALUES
+    ('OpenAI GPT-3.5 Turbo', 'GPT-3.5', 'gpt-3.5-turbo-0125', false, 0.50, NULL, 1.50),
+    ('OpenAI GPT-4o', 'GPT-4o', 'gpt-4o', true, 2.50, 1.25, 10.00),
+    ('OpenAI GPT-4o-mini', 'GPT-4o-mini', 'gpt-4o-mini', true, 0.15, 0.075, 0.60)
 ;
+-- The large model's auxiliary stages (sufficiency check, cleanup, topics) use the small one
+UPDATE models SET
+    sufficiency_model_id=(SELECT id FROM models WHERE shortname='GPT-4o-mini'),
+    cleanup_model_id=(SELECT id FROM models WHERE shortname='GPT-4o-mini'),
+    topics_model_id=(SELECT id FROM models WHERE shortname='GPT-4o-mini')
+WHERE shortname='GPT-4o';
 
 
 -- Experiments (like feature flags)
@@ -191,3 +212,76 @@ DROP INDEX IF EXISTS exp_crs_experiment_idx;
 CREATE INDEX exp_crs_experiment_idx ON experiment_class(experiment_id);
 DROP INDEX IF EXISTS exp_crs_class_idx;
 CREATE INDEX exp_crs_class_idx ON experiment_class(class_id);
+
+
+-- Exact-match cache of LLM completions (see gened.completion_cache)
+CREATE TABLE completion_cache (
+    key            TEXT PRIMARY KEY,  -- hash of (provider, model, normalized messages, temperature)
+    model          TEXT NOT NULL,
+    response_json  TEXT NOT NULL,
+    response_text  TEXT NOT NULL,
+    created        DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    last_used      DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    hits           INTEGER NOT NULL DEFAULT 0
+);
+DROP INDEX IF EXISTS completion_cache_by_last_used;
+CREATE INDEX completion_cache_by_last_used ON completion_cache(last_used);
+
+CREATE TABLE completion_cache_stats (
+    day     DATE PRIMARY KEY,
+    hits    INTEGER NOT NULL DEFAULT 0,
+    misses  INTEGER NOT NULL DEFAULT 0
+);
+
+-- Additional API keys of a consumer or user class, to spread requests over (see gened.keypool)
+CREATE TABLE api_key_pool (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    consumer_id  INTEGER,  -- exactly one of consumer_id and class_id is set
+    class_id     INTEGER,  -- a user class (classes_user.class_id)
+    api_key      TEXT NOT NULL,
+    weight       INTEGER NOT NULL DEFAULT 1,  -- relative share of requests (with 'weighted' selection)
+    created      DATETIME DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY(consumer_id) REFERENCES consumers(id),
+    FOREIGN KEY(class_id) REFERENCES classes_user(class_id),
+    CHECK ((consumer_id IS NULL) != (class_id IS NULL))
+);
+DROP INDEX IF EXISTS api_key_pool_by_consumer;
+CREATE INDEX api_key_pool_by_consumer ON api_key_pool(consumer_id);
+DROP INDEX IF EXISTS api_key_pool_by_class;
+CREATE INDEX api_key_pool_by_class ON api_key_pool(class_id);
+
+-- Token and cost budgets of a consumer or class (see gened.budgets)
+CREATE TABLE usage_budgets (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    consumer_id        INTEGER UNIQUE,  -- exactly one of consumer_id and class_id is set
+    class_id           INTEGER UNIQUE,
+    token_limit        INTEGER,  -- NULL: no token limit
+    cost_limit         REAL,     -- USD; NULL: no cost limit
+    fallback_model_id  INTEGER,  -- model to switch to when the budget runs low (NULL: none)
+    spent_tokens       INTEGER NOT NULL DEFAULT 0,
+    spent_cost         REAL NOT NULL DEFAULT 0,
+    period_start       DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,  -- spending is counted from here
+    FOREIGN KEY(consumer_id) REFERENCES consumers(id),
+    FOREIGN KEY(class_id) REFERENCES classes(id),
+    FOREIGN KEY(fallback_model_id) REFERENCES models(id),
+    CHECK ((consumer_id IS NULL) != (class_id IS NULL))
+);
+
+-- Every completion charged to a class (see gened.budgets)
+CREATE TABLE usage_ledger (
+    id                 INTEGER PRIMARY KEY AUTOINCREMENT,
+    class_id           INTEGER NOT NULL,
+    consumer_id        INTEGER,  -- of an LTI class
+    provider           TEXT NOT NULL,
+    model              TEXT NOT NULL,
+    prompt_tokens      INTEGER NOT NULL,
+    cached_tokens      INTEGER NOT NULL,
+    completion_tokens  INTEGER NOT NULL,
+    estimated          BOOLEAN NOT NULL CHECK (estimated IN (0, 1)),  -- tokens estimated (not reported by the provider)
+    cost               REAL NOT NULL,  -- USD
+    created            DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+    FOREIGN KEY(class_id) REFERENCES classes(id),
+    FOREIGN KEY(consumer_id) REFERENCES consumers(id)
+);
+DROP INDEX IF EXISTS usage_ledger_by_class;
+CREATE INDEX usage_ledger_by_class ON usage_ledger(class_id, created);
@@ -0,0 +1,82 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Helpers for streaming LLM completions to clients as Server-Sent Events.
+
+Each provider module implements `stream_completion(llm, messages, result)`: an
+async generator that yields text deltas as they arrive and, once exhausted,
+leaves the full response object and text in `result` -- the same pair that its
+get_completion() returns.  Errors are reported the same way as in
+get_completion(): `result.response` holds {'error': ...} and `result.text`
+holds a user-facing error message.
+'''
+
+import json
+from collections.abc import AsyncIterator, Awaitable, Iterator
+from dataclasses import dataclass, field
+from typing import Any, TypeVar
+
+from flask import Response, request, stream_with_context
+
+from .eventloop import get_loop_thread
+
+T = TypeVar('T')
+
+
+@dataclass
+class StreamResult:
+    response: dict[str, Any] = field(default_factory=dict)
+    text: str = ""
+
+    @property
+    def is_error(self) -> bool:
+        return 'error' in self.response
+
+
+async def _await(awaitable: Awaitable[T]) -> T:
+    return await awaitable
+
+
+def iter_async(agen: AsyncIterator[T]) -> Iterator[T]:
+    '''Drive an async iterator from synchronous code (e.g., a WSGI response
+    generator), running each step on the app's event loop (see gened.eventloop).'''
+    loop_thread = get_loop_thread()
+    try:
+        while True:
+            try:
+                yield loop_thread.run(_await(agen.__anext__()))
+            except StopAsyncIteration:
+                break
+    finally:
+        aclose = getattr(agen, 'aclose', None)
+        if aclose is not None:
+            loop_thread.run(_await(aclose()))
+
+
+def sse_event(event: str, data: Any) -> str:
+    '''Format one Server-Sent Event with a JSON payload.'''
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def wants_stream() -> bool:
+    '''True if the current request asked for a streamed (SSE) response.'''
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return True
+    return request.args.get('stream', '') in ('1', 'true')
+
+
+def sse_response(events: Iterator[str]) -> Response:
+    '''Wrap an iterator of formatted events in a streaming response.
+
+    The request context is kept alive for the whole stream so that the
+    generator can use the database and auth information as usual.
+    '''
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no',  # disable proxy buffering (e.g., nginx)
+        },
+    )
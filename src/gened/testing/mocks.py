@@ -5,14 +5,22 @@
 import asyncio
 import datetime
 import time
-from collections.abc import Awaitable, Callable
+from collections.abc import AsyncIterator, Awaitable, Callable
 from typing import Any
 
-from openai.types.chat import ChatCompletionMessage
+from openai.types.chat import ChatCompletionChunk, ChatCompletionMessage
 from openai.types.chat.chat_completion import ChatCompletion, Choice
+from openai.types.chat.chat_completion_chunk import Choice as ChunkChoice
+from openai.types.chat.chat_completion_chunk import ChoiceDelta
+from openai.types.completion_usage import CompletionUsage
 
 
-def _create_dummy_completion() -> ChatCompletion:
+def _create_dummy_completion(content: str = "x " * 500, messages: list[dict[str, Any]] | None = None) -> ChatCompletion:
+    usage = None
+    if messages is not None:
+        # rough token counts (~4 characters per token), for comparing prompt sizes
+        prompt_chars = sum(len(str(msg.get('content', ''))) for msg in messages)
+        usage = CompletionUsage(prompt_tokens=prompt_chars // 4, completion_tokens=len(content) // 4, total_tokens=(prompt_chars + len(content)) // 4)
     return ChatCompletion(
         id="fakeid",
         model="gpt-3.5-turbo",
@@ -22,14 +30,36 @@ def _create_dummy_completion() -> ChatCompletion:
                 finish_reason="stop",
                 index=0,
                 message=ChatCompletionMessage(
-                    content="x " * 500,
+                    content=content,
                     role="assistant",
                 ),
             )
         ],
         created=int(datetime.datetime.now().timestamp()),
+        usage=usage,
     )
 
+async def _dummy_stream(delay: float) -> AsyncIterator[ChatCompletionChunk]:
+    completion = _create_dummy_completion()
+    content = completion.choices[0].message.content or ""
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        await asyncio.sleep(delay / len(words))
+        last = i == len(words) - 1
+        yield ChatCompletionChunk(
+            id=completion.id,
+            model=completion.model,
+            object="chat.completion.chunk",
+            created=completion.created,
+            choices=[
+                ChunkChoice(
+                    index=0,
+                    delta=ChoiceDelta(content=word if last else f"{word} "),
+                    finish_reason="stop" if last else None,
+                )
+            ],
+        )
+
 def mock_completion(delay: float = 0.0) -> Callable[..., ChatCompletion]:
     def mock(*args: Any, **kwargs: Any) -> ChatCompletion:
         time.sleep(delay)
@@ -37,8 +67,17 @@ def mock_completion(delay: float = 0.0) -> Callable[..., ChatCompletion]:
     return mock
 
 
-def mock_async_completion(delay: float = 0.0) -> Callable[..., Awaitable[ChatCompletion]]:
-    async def mock(*args: Any, **kwargs: Any) -> ChatCompletion:
+def mock_async_completion(delay: float = 0.0, respond: Callable[[list[dict[str, Any]]], str] | None = None) -> Callable[..., Awaitable[ChatCompletion | AsyncIterator[ChatCompletionChunk]]]:
+    ''' Mock AsyncCompletions.create().  If given, respond(messages) provides the
+    content of each (non-streamed) completion, which then includes estimated usage.
+    '''
+    async def mock(*args: Any, **kwargs: Any) -> ChatCompletion | AsyncIterator[ChatCompletionChunk]:
+        if kwargs.get('stream'):
+            # the delay is spread across the streamed chunks
+            return _dummy_stream(delay)
         await asyncio.sleep(delay)
+        if respond is not None:
+            messages = kwargs.get('messages', [])
+            return _create_dummy_completion(respond(messages), messages)
         return _create_dummy_completion()
     return mock
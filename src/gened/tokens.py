@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Fast local estimates of token counts, per model family.
+
+An exact count would need each provider's tokenizer (and, for some, a
+network call).  Preflight checks only need to know whether a prompt is
+comfortably within a limit, so counts are estimated from the length of the
+text with a characters-per-token ratio measured for each family of models,
+rounded to err on the high side for code (which tokenizes less efficiently
+than prose).
+
+Families are matched by a substring of the model name in the models table
+(e.g., 'gpt-4o' matches 'gpt-4o-mini', and 'codellama' matches a Dartmouth
+endpoint path), first match first.  Models matching no family use
+DEFAULT_FAMILY.
+'''
+
+import math
+from collections.abc import Mapping, Sequence
+from dataclasses import dataclass
+from typing import Any
+
+
+@dataclass(frozen=True)
+class ModelFamily:
+    name: str
+    patterns: tuple[str, ...]  # lowercase substrings of model names
+    chars_per_token: float
+    context_window: int        # total tokens (prompt and completion)
+
+
+FAMILIES = [
+    ModelFamily('gpt-4o', ('gpt-4o', 'gpt-4.1', 'gpt-5'), 3.6, 128_000),
+    ModelFamily('gpt-4', ('gpt-4-turbo', 'gpt-4-1106', 'gpt-4-0125'), 3.4, 128_000),
+    ModelFamily('gpt-4-8k', ('gpt-4',), 3.4, 8_192),
+    ModelFamily('gpt-3.5', ('gpt-3.5', 'davinci'), 3.4, 16_385),
+    ModelFamily('mistral', ('mistral', 'codestral', 'mixtral'), 3.0, 32_000),
+    ModelFamily('gemini', ('gemini',), 3.6, 1_000_000),
+    ModelFamily('llama', ('llama',), 3.0, 16_384),
+]
+DEFAULT_FAMILY = ModelFamily('default', (), 3.0, 8_192)
+
+# Tokens added by chat formatting for each message
+MESSAGE_OVERHEAD = 4
+
+
+def get_family(model: str | None) -> ModelFamily:
+    name = (model or "").lower()
+    for family in FAMILIES:
+        if any(pattern in name for pattern in family.patterns):
+            return family
+    return DEFAULT_FAMILY
+
+
+def estimate_tokens(text: str, model: str | None = None) -> int:
+    return math.ceil(len(text) / get_family(model).chars_per_token)
+
+
+def max_chars(tokens: int, model: str | None = None) -> int:
+    '''The length of text estimated to have the given number of tokens.'''
+    return int(tokens * get_family(model).chars_per_token)
+
+
+def estimate_messages(messages: Sequence[Mapping[str, Any]], model: str | None = None) -> int:
+    '''Estimate the prompt tokens of a list of chat messages.'''
+    return sum(estimate_tokens(str(msg.get('content') or ""), model) + MESSAGE_OVERHEAD for msg in messages)
+
+
+def context_window(model: str | None) -> int:
+    return get_family(model).context_window
+
+
+def token_counts(response: dict[str, Any]) -> tuple[int | None, int | None, int | None]:
+    '''Prompt, completion, and cached prompt tokens reported in a response's (OpenAI-style) usage.'''
+    usage = response.get('usage') or {}
+    details = usage.get('prompt_tokens_details') or {}
+    return usage.get('prompt_tokens'), usage.get('completion_tokens'), details.get('cached_tokens')
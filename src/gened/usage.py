@@ -0,0 +1,79 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+'''Accounting of the completions made for a request: tokens, wall time, and provider.
+
+Usage reported by providers is otherwise only found in the full response
+objects stored with each query.  While collect_usage() is active, each
+completion recorded with record_stage() is added to its list as a
+StageUsage, which the application can then store in normalized columns
+(e.g., codehelp's query_stages table).
+
+Collection uses a context variable, so completions made in tasks created
+inside collect_usage() (including those run with gened.eventloop.run_async()
+or asyncio.run()) are included.
+'''
+
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any
+
+from .providers import LLMConfig, providers
+from .tokens import token_counts
+
+
+@dataclass(frozen=True)
+class StageUsage:
+    stage: str                     # e.g., 'main', 'sufficiency', 'cleanup'
+    provider: str
+    model: str
+    prompt_tokens: int | None      # None if the provider didn't report usage
+    completion_tokens: int | None
+    cached_tokens: int | None      # prompt tokens served from the provider's prompt cache
+    wall_ms: int
+    source: str                    # 'api', 'cache' (completion cache), or 'coalesced' (see gened.coalesce)
+    error: bool
+
+
+_stages: ContextVar[list[StageUsage] | None] = ContextVar('usage_stages', default=None)
+
+
+@contextmanager
+def collect_usage() -> Iterator[list[StageUsage]]:
+    '''Collect the stages recorded within the block into the yielded list.'''
+    stages: list[StageUsage] = []
+    token = _stages.set(stages)
+    try:
+        yield stages
+    finally:
+        _stages.reset(token)
+
+
+def response_source(response: dict[str, Any]) -> str:
+    if response.get('cached'):
+        return 'cache'
+    if response.get('coalesced'):
+        return 'coalesced'
+    return 'api'
+
+
+def record_stage(stage: str, llm: LLMConfig, response: dict[str, Any], seconds: float) -> None:
+    '''Record a completion for the current collect_usage() block, if any.'''
+    stages = _stages.get()
+    if stages is None:
+        return
+    prompt_tokens, completion_tokens, cached_tokens = token_counts(response)
+    stages.append(StageUsage(
+        stage=stage,
+        provider=providers.for_config(llm).__name__.rpartition('.')[2],
+        model=llm.model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        wall_ms=round(seconds * 1000),
+        source=response_source(response),
+        error='error' in response,
+    ))
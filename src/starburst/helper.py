@@ -10,7 +10,8 @@ from werkzeug.wrappers.response import Response
 
 from gened.auth import class_enabled_required, get_auth, login_required
 from gened.db import get_db
-from gened.openai import LLMConfig, get_completion, with_llm
+from gened.eventloop import run_async
+from gened.providers import LLMConfig, get_completion, with_llm
 from gened.queries import get_history, get_query
 
 from . import prompts
@@ -52,9 +53,8 @@ async def run_query_prompts(llm: LLMConfig, assignment: str, topics: str) -> tup
     '''
     task_main = asyncio.create_task(
         get_completion(
-            client=llm.client,
-            model=llm.model,
-            prompt=prompts.make_main_prompt(assignment, topics),
+            llm,
+            [{"role": "user", "content": prompts.make_main_prompt(assignment, topics)}],
         )
     )
 
@@ -74,7 +74,7 @@ async def run_query_prompts(llm: LLMConfig, assignment: str, topics: str) -> tup
 def run_query(llm: LLMConfig, assignment: str, topics: str) -> int:
     query_id = record_query(assignment, topics)
 
-    responses, texts = asyncio.run(run_query_prompts(llm, assignment, topics))
+    responses, texts = run_async(run_query_prompts(llm, assignment, topics))
 
     record_response(query_id, responses, texts)
 
@@ -2,9 +2,12 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import asyncio
 import tempfile
+import threading
 from pathlib import Path
 
+import jwt
 import openai
 import pytest
 from dotenv import find_dotenv, load_dotenv
@@ -14,6 +17,8 @@ from gened.admin import reload_consumers
 from gened.db import get_db, init_db
 from gened.testing.mocks import mock_async_completion, mock_completion
 
+API_SECRET_KEY = 'test-secret-key-for-api-tokens-0123456789'
+
 # Load test DB data
 test_sql = Path(__file__).parent / 'test_data.sql'
 with test_sql.open('rb') as f:
@@ -52,6 +57,7 @@ def app(monkeypatch, request):
                 'TESTING': True,
                 'DATABASE': str(db_path),
                 'OPENAI_API_KEY': 'invalid',  # ensure an invalid API key for testing
+                'COMPLETION_BACKOFF_BASE': 0.0,  # retry failed completions without waiting
             },
             instance_path=instance_path,
         )
@@ -92,3 +98,55 @@ class AuthActions:
 @pytest.fixture
 def auth(client):
     return AuthActions(client)
+
+
+@pytest.fixture
+def api_headers(monkeypatch):
+    """ Provides a function returning headers that authenticate an API request
+    with a token for the given user (testuser, by default) and any other claims.
+    """
+    monkeypatch.setattr('codehelp.api.SECRET_KEY', API_SECRET_KEY)
+
+    def headers(user_id=11, **claims):
+        token = jwt.encode({'user_id': user_id, **claims}, API_SECRET_KEY, algorithm='HS256')
+        return {'Authorization': f"Bearer {token}"}
+    return headers
+
+
+class FakeCompletions:
+    """ Answers every completion with "OK" (and `usage`, if set) after `delay` seconds,
+    recording the messages, the threads used, and the most completions in flight at once.
+    """
+    def __init__(self):
+        self.delay = 0.0
+        self.usage = None
+        self.calls = []
+        self.threads = set()
+        self.current = 0
+        self.peak = 0
+
+    async def __call__(self, llm, messages, **kwargs):
+        self.calls.append(messages)
+        self.threads.add(threading.current_thread().name)
+        self.current += 1
+        self.peak = max(self.peak, self.current)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.current -= 1
+        response = {'choices': [{'message': {'content': "OK"}}]}
+        if self.usage:
+            response['usage'] = self.usage
+        return response, "OK"
+
+
+@pytest.fixture
+def fake_completions(app, monkeypatch):
+    """ Replaces completions from any provider with a FakeCompletions, bypassing
+    the completion cache and the sufficiency precheck.
+    """
+    fake = FakeCompletions()
+    monkeypatch.setattr('gened.completion_cache.get_completion', fake)
+    app.config['COMPLETION_CACHE_TTL'] = 0
+    app.config['SUFFICIENCY_PRECHECK'] = 'off'
+    return fake
@@ -0,0 +1,133 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import json
+import threading
+from urllib.parse import urlencode
+
+import pytest
+
+from gened.asgi import AsgiApp
+from gened.db import get_db
+
+
+@pytest.fixture
+def in_flight(fake_completions):
+    """ Answer every completion after a short delay. """
+    fake_completions.delay = 0.2
+    return fake_completions
+
+
+async def call(asgi_app, method, path, headers=None, body=b''):
+    """ Make one request to an ASGI app, returning its status, headers, and body. """
+    scope = {
+        'type': 'http',
+        'method': method,
+        'path': path.partition('?')[0],
+        'query_string': path.partition('?')[2].encode(),
+        'headers': [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        'http_version': '1.1',
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi_app(scope, receive, send)
+    start = sent[0]
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def post_json(asgi_app, path, data, headers):
+    return call(asgi_app, 'POST', path, {**headers, 'Content-Type': 'application/json'}, json.dumps(data).encode())
+
+
+QUERY = {'code': "x = 1", 'error': "NameError", 'issue': "Why?", 'user_id': "1234"}
+
+
+def test_api_query(app, api_headers, in_flight):
+    asgi_app = AsgiApp(app)
+    status, headers, body = asyncio.run(post_json(asgi_app, '/api/query', QUERY, api_headers()))
+    assert status == 200
+    assert headers['access-control-allow-origin'] == '*'
+    data = json.loads(body)
+    assert data['responses']['main'] == "OK"
+    # Awaited on the server's event loop, not in a worker thread
+    assert in_flight.threads == {threading.main_thread().name}
+
+    with app.app_context():
+        row = get_db().execute("SELECT algorea_id, response_text FROM queries WHERE id=?", [data['query_id']]).fetchone()
+        assert row['algorea_id'] == "1234"
+        assert json.loads(row['response_text'])['main'] == "OK"
+
+
+def test_requests_do_not_hold_threads(app, api_headers, in_flight):
+    asgi_app = AsgiApp(app, sync_workers=1)
+
+    async def run_all():
+        return await asyncio.gather(*[post_json(asgi_app, '/api/query', QUERY, api_headers()) for _ in range(4)])
+
+    results = asyncio.run(run_all())
+    assert [status for status, _, _ in results] == [200] * 4
+    assert in_flight.peak > 1  # more queries in flight than threads
+
+
+def test_sync_views_and_errors(app, api_headers, in_flight):
+    asgi_app = AsgiApp(app)
+    query_id = json.loads(asyncio.run(post_json(asgi_app, '/api/query', QUERY, api_headers()))[2])['query_id']
+    status, _, body = asyncio.run(call(asgi_app, 'GET', f'/api/query/{query_id}', api_headers()))
+    assert status == 200
+    assert json.loads(body)['status'] == 'done'
+
+    status, _, _ = asyncio.run(call(asgi_app, 'GET', f'/api/query/{query_id}'))  # no token
+    assert status == 403
+
+    status, _, _ = asyncio.run(call(asgi_app, 'GET', '/no/such/page'))
+    assert status == 404
+
+    status, headers, body = asyncio.run(post_json(asgi_app, '/api/query?stream=1', QUERY, api_headers()))
+    assert status == 200
+    assert headers['content-type'].startswith('text/event-stream')
+    assert b"event: done" in body
+
+    status, headers, _ = asyncio.run(call(asgi_app, 'OPTIONS', '/api/query', {'Origin': 'http://example.com'}))
+    assert status == 200
+    assert 'access-control-allow-origin' in headers
+
+
+def test_help_request(app, client, auth, in_flight):
+    auth.login()
+    cookie = client.get_cookie('session')
+    asgi_app = AsgiApp(app)
+    form = urlencode({'code': "x = 1", 'error': "NameError", 'issue': "Why?"}).encode()
+    status, headers, _ = asyncio.run(call(asgi_app, 'POST', '/help/request', {
+        'Cookie': f"session={cookie.value}",
+        'Content-Type': 'application/x-www-form-urlencoded',
+    }, form))
+    assert status == 302
+    assert '/help/view/' in headers['location']
+
+    # The same view still works under WSGI
+    response = client.post('/help/request', data={'code': "x = 1", 'error': "NameError", 'issue': "Why?"})
+    assert response.status_code == 302
+
+
+def test_lifespan(app):
+    asgi_app = AsgiApp(app)
+    messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(asgi_app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
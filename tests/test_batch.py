@@ -0,0 +1,114 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+
+import pytest
+from flask import g
+
+from codehelp import jobs
+from codehelp.helper import QueryInput, answer_queries_async, record_queries
+from gened.db import get_db
+from gened.eventloop import run_async
+from gened.openai import LLMConfig
+
+
+@pytest.fixture
+def in_flight(fake_completions):
+    """ Answer every completion after a short delay. """
+    fake_completions.delay = 0.05
+    return fake_completions
+
+
+def make_batch(n):
+    return {'queries': [{'code': f"x = {i}", 'error': "NameError", 'issue': "Why?", 'user_id': str(1000 + i)} for i in range(n)]}
+
+
+def admin_headers(api_headers):
+    return api_headers(12, is_admin=True)  # testadmin, with no current class (so is_admin comes from the token)
+
+
+def test_batch(app, client, api_headers, in_flight):
+    app.config['BATCH_QUERY_CONCURRENCY'] = 2
+    batch = make_batch(6)
+    batch['queries'].insert(2, {'context': "no such context", 'code': "", 'error': "", 'issue': "?"})
+    response = client.post('/api/queries/batch', json=batch, headers=admin_headers(api_headers))
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [r['index'] for r in results] == list(range(7))
+    assert results[2] == {'index': 2, 'status': 'invalid', 'error': "Context not found: no such context"}
+    done = [r for r in results if r['status'] == 'done']
+    assert len(done) == 6
+    assert all(r['responses']['main'] == "OK" for r in done)
+
+    # Two queries at a time, each with a main and a sufficiency completion
+    assert in_flight.peak == 4
+
+    with app.app_context():
+        rows = get_db().execute("SELECT id, algorea_id, user_id FROM queries WHERE id >= ? ORDER BY id", [done[0]['query_id']]).fetchall()
+        assert [row['id'] for row in rows] == [r['query_id'] for r in done]
+        assert [row['algorea_id'] for row in rows] == [str(1000 + i) for i in range(6)]
+        assert all(row['user_id'] == 12 for row in rows)
+
+
+def test_batch_jobs(app, client, api_headers, in_flight):
+    headers = admin_headers(api_headers)
+    response = client.post('/api/queries/batch?async=1', json=make_batch(3), headers=headers)
+    assert response.status_code == 202
+    results = response.json['results']
+    assert [r['status'] for r in results] == ['pending'] * 3
+
+    for r in results:
+        response = client.get(f"{r['status_url']}?wait=10", headers=headers)
+        assert response.json['status'] == 'done'
+        assert response.json['responses']['main'] == "OK"
+
+
+def test_batch_validation(app, client, api_headers, in_flight):
+    headers = admin_headers(api_headers)
+    assert client.post('/api/queries/batch', json={'queries': []}, headers=headers).status_code == 400
+    assert client.post('/api/queries/batch', json=[{'code': "x"}], headers=headers).status_code == 400
+
+    app.config['BATCH_MAX_QUERIES'] = 2
+    assert client.post('/api/queries/batch', json=make_batch(3), headers=headers).status_code == 400
+
+    response = client.post('/api/queries/batch', json={'queries': [{'code': None}, "x"]}, headers=headers)
+    assert [r['status'] for r in response.json['results']] == ['invalid', 'invalid']
+
+
+def test_batch_requires_instructor(client, api_headers, in_flight):
+    response = client.post('/api/queries/batch', json=make_batch(1), headers=api_headers(11))  # testuser: no instructor role
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize('as_job', [False, True])
+def test_concurrent_queries_recorded_separately(app, in_flight, as_job):
+    app.config['BATCH_QUERY_CONCURRENCY'] = 4
+    app.config['WEBHOOK_DISPATCHER'] = False
+    llm = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+    queries = [QueryInput(None, f"x = {i}", "NameError", "Why?") for i in range(8)]
+
+    with app.test_request_context():
+        db = get_db()
+        db.execute("INSERT INTO class_webhooks (class_id, url, secret) VALUES (2, 'https://example.com/hook', 'secret')")
+        db.commit()
+        g.auth = {'user_id': 11, 'role_id': 4, 'role': 'instructor', 'class_id': 2, 'is_admin': False}  # testuser, in class 2
+        query_ids = record_queries(queries, job_status='pending' if as_job else None)
+        if as_job:
+            jobs.start_batch_job(llm, queries, query_ids, class_id=2)
+            for query_id in query_ids:
+                jobs.wait_for_job(query_id, timeout=10)
+        else:
+            assert run_async(answer_queries_async(llm, queries, query_ids, 2, 4)) == [None] * 8
+
+    with app.app_context():
+        db = get_db()
+        for i, query_id in enumerate(query_ids):
+            row = db.execute("SELECT code, response_text FROM queries WHERE id=?", [query_id]).fetchone()
+            assert row['code'] == f"x = {i}"
+            assert json.loads(row['response_text']) == {'main': "OK"}
+            stages = db.execute("SELECT stage FROM query_stages WHERE query_id=? ORDER BY stage", [query_id]).fetchall()
+            assert [stage['stage'] for stage in stages] == ['main', 'sufficiency']
+            outbox = db.execute("SELECT url, status FROM webhook_outbox WHERE query_id=?", [query_id]).fetchall()
+            assert [tuple(entry) for entry in outbox] == [("https://example.com/hook", 'pending')]
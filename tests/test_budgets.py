@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import datetime as dt
+
+import pytest
+from flask import g
+
+from gened import budgets
+from gened.budgets import Budget, BudgetExhaustedError, apply_budgets, charge, get_budget, get_burndown
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.providers import get_completion
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+MESSAGES = [{'role': 'user', 'content': "Why doesn't this compile?"}]
+USAGE = {'prompt_tokens': 1_000_000, 'completion_tokens': 100_000, 'total_tokens': 1_100_000, 'prompt_tokens_details': {'cached_tokens': 400_000}}
+
+
+def _budget(token_limit=None, cost_limit=None, spent_tokens=0, spent_cost=0.0):
+    return Budget(scope='class', token_limit=token_limit, cost_limit=cost_limit, spent_tokens=spent_tokens, spent_cost=spent_cost, period_start=dt.datetime(2026, 10, 1))
+
+
+def test_remaining_fraction():
+    assert _budget().remaining_fraction == 1.0
+    assert _budget(token_limit=1000, spent_tokens=250).remaining_fraction == 0.75
+    assert _budget(token_limit=1000, spent_tokens=250, cost_limit=1.0, spent_cost=0.9).remaining_fraction == pytest.approx(0.1)
+    assert _budget(cost_limit=1.0, spent_cost=1.2).exhausted
+
+
+def test_charge_updates_ledger_and_budgets(app):
+    with app.test_request_context():
+        g.auth = {'class_id': 1}  # an LTI class of consumer 1
+        budgets.set_budget(10_000_000, None, None, class_id=1)
+        budgets.set_budget(None, 100.0, None, consumer_id=1)
+        budgets.set_budget(None, 100.0, None, consumer_id=2)  # doesn't apply
+        charge('openai', LLM, MESSAGES, {'usage': USAGE}, "Because...")
+
+        db = get_db()
+        row = db.execute("SELECT * FROM usage_ledger").fetchone()
+        # gpt-4o-mini: $0.15 per million prompt tokens, $0.075 cached, $0.60 completion
+        expected_cost = 0.6 * 0.15 + 0.4 * 0.075 + 0.1 * 0.60
+        assert row['cost'] == pytest.approx(expected_cost)
+        assert row['consumer_id'] == 1
+        assert not row['estimated']
+        assert get_budget(class_id=1).spent_tokens == 1_100_000
+        assert get_budget(consumer_id=1).spent_cost == pytest.approx(expected_cost)
+        assert get_budget(consumer_id=2).spent_cost == 0
+
+        # no usage reported: estimated
+        charge('openai', LLM, MESSAGES, {'response': "Because..."}, "Because...")
+        row = db.execute("SELECT * FROM usage_ledger ORDER BY id DESC").fetchone()
+        assert row['estimated']
+        assert 0 < row['prompt_tokens'] < 100
+
+        burndown = get_burndown(1, get_budget(class_id=1))
+        assert burndown[0]['tokens'] == get_budget(class_id=1).spent_tokens
+        assert burndown[0]['tokens_left'] == 10_000_000 - burndown[0]['tokens']
+
+
+def test_completions_charged(app):
+    with app.test_request_context():
+        g.auth = {'class_id': 1}
+        asyncio.run(get_completion(LLM, MESSAGES))
+        g.auth = {'class_id': None}
+        asyncio.run(get_completion(LLM, [{'role': 'user', 'content': "No class"}]))
+        rows = get_db().execute("SELECT class_id, model FROM usage_ledger").fetchall()
+    assert [tuple(row) for row in rows] == [(1, 'gpt-4o-mini')]
+
+
+def test_apply_budgets(app):
+    llm = LLMConfig(model='gpt-4o', api_key='invalid')
+    with app.test_request_context():
+        db = get_db()
+        budgets.set_budget(1000, None, 3, class_id=1)  # falls back to GPT-4o-mini
+        assert apply_budgets(llm, 'openai', 1, spend_token=True).model == 'gpt-4o'
+
+        db.execute("UPDATE usage_budgets SET spent_tokens=900 WHERE class_id=1")
+        assert apply_budgets(llm, 'openai', 1, spend_token=True).model == 'gpt-4o-mini'
+        assert apply_budgets(llm, 'mistral', 1, spend_token=True).model == 'gpt-4o'  # fallback on another provider
+
+        db.execute("UPDATE usage_budgets SET spent_tokens=1000 WHERE class_id=1")
+        with pytest.raises(BudgetExhaustedError):
+            apply_budgets(llm, 'openai', 1, spend_token=True)
+        assert apply_budgets(llm, 'openai', 1, spend_token=False).model == 'gpt-4o-mini'
+
+        budgets.reset_budget(class_id=1)
+        assert apply_budgets(llm, 'openai', 1, spend_token=True).model == 'gpt-4o'
+
+
+def test_instructor_budget(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')  # class 2, where testuser is an instructor
+    response = client.post('/instructor/budget/update', data={'token_limit': '50000', 'cost_limit': '', 'fallback_model_id': '3'})
+    assert response.status_code == 302
+    with app.app_context():
+        budget = get_budget(class_id=2)
+        assert budget.token_limit == 50_000
+        assert budget.cost_limit is None
+        assert budget.fallback_model == 'gpt-4o-mini'
+
+    response = client.post('/instructor/budget/update', data={'token_limit': '-5', 'cost_limit': ''})
+    with client.session_transaction() as session:
+        assert "Invalid usage budget" in session['_flashes'][-1][1]
+
+    client.post('/instructor/budget/update', data={'token_limit': '', 'cost_limit': ''})
+    with app.app_context():
+        assert get_budget(class_id=2) is None
+
+
+def test_consumer_budget(app, client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.post('/admin/consumer/update', data={'consumer_id': 1, 'cost_limit': '25', 'fallback_model_id': '3'}, follow_redirects=True)
+    assert b"Consumer updated." in response.data
+    assert b"Used since" in response.data
+    with app.app_context():
+        assert get_budget(consumer_id=1).cost_limit == 25.0
@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import time
+
+import openai
+import pytest
+
+from gened import circuit, resilience
+from gened.circuit import CircuitBreaker, CircuitOpenError
+from gened.openai import LLMConfig, get_completion
+
+
+@pytest.fixture
+def circuits(monkeypatch):
+    registry = circuit.CircuitRegistry()
+    monkeypatch.setattr(resilience, 'circuits', registry)
+    return registry
+
+
+def _breaker(open_seconds=30.0):
+    return CircuitBreaker(window=10, min_requests=4, error_rate=0.5, open_seconds=open_seconds)
+
+
+def test_trips_at_error_rate():
+    breaker = _breaker()
+    for ok in [True, False, True]:
+        breaker.record(ok)
+    assert breaker.state == 'closed'  # below min_requests
+    breaker.record(False)
+    assert breaker.state == 'open'
+    assert not breaker.acquire()
+    assert breaker.trips == 1
+
+
+def test_half_open_probe():
+    breaker = _breaker(open_seconds=0.05)
+    for _ in range(4):
+        breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.acquire()       # the probe
+    assert not breaker.acquire()   # only one at a time
+    breaker.record(False)
+    assert breaker.state == 'open'
+
+    time.sleep(0.06)
+    assert breaker.acquire()
+    breaker.record(True)
+    assert breaker.state == 'closed'
+    assert breaker.acquire()
+
+
+def _failing(status):
+    calls = []
+
+    async def request():
+        calls.append(1)
+        raise resilience.RetryableStatusError(status, "failed")
+
+    return request, calls
+
+
+def test_fails_fast_when_open(app, circuits):
+    app.config['COMPLETION_RETRIES'] = 0
+    request, calls = _failing(503)
+    with app.app_context():
+        for _ in range(app.config['CIRCUIT_MIN_REQUESTS']):
+            with pytest.raises(resilience.RetryableStatusError):
+                asyncio.run(resilience.with_retries('test', request, api_key='key1'))
+        with pytest.raises(CircuitOpenError):
+            asyncio.run(resilience.with_retries('test', request, api_key='key1'))
+        # other keys are unaffected
+        with pytest.raises(resilience.RetryableStatusError):
+            asyncio.run(resilience.with_retries('test', request, api_key='key2'))
+        assert circuits.status()[0]['state'] == 'open'
+
+    assert len(calls) == app.config['CIRCUIT_MIN_REQUESTS'] + 1
+
+
+def test_query_errors_do_not_trip(app, circuits):
+    request, calls = _failing(400)  # e.g., a query too long for the model
+    with app.app_context():
+        for _ in range(10):
+            with pytest.raises(resilience.RetryableStatusError):
+                asyncio.run(resilience.with_retries('test', request, api_key='key1'))
+        assert circuits.get('test', 'key1').state == 'closed'
+
+
+def test_openai_open_circuit(app, circuits, monkeypatch):
+    calls = []
+
+    async def create(*args, **kwargs):
+        calls.append(kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", create)
+    llm = LLMConfig(model='gpt-4o-mini', api_key='broken')
+    with app.app_context():
+        breaker = circuits.get('openai', 'broken')
+        for _ in range(breaker.min_requests):
+            breaker.record(False)
+        response, text = asyncio.run(get_completion(llm, [{'role': 'user', 'content': "Why?"}]))
+
+    assert calls == []
+    assert text.startswith("Error (CircuitOpenError)")
+
+
+def test_disabled(app, circuits):
+    app.config['CIRCUIT_ERROR_RATE'] = 0
+    with app.app_context():
+        assert circuits.get('test', 'key1') is None
+        circuits.check('test', 'key1')  # never raises
+
+
+def test_admin_state(app, client, auth, circuits, monkeypatch):
+    monkeypatch.setattr('gened.admin.circuits', circuits)
+    with app.app_context():
+        circuits.check('openai', 'keeeez1', class_id=1)
+        breaker = circuits.get('openai', 'keeeez1')
+        for _ in range(breaker.min_requests):
+            breaker.record(False)
+
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/')
+    assert response.status_code == 200
+    assert "open (" in response.text
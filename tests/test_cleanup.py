@@ -0,0 +1,100 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import openai
+
+from codehelp.cleanup import LOCAL_CLEANUP_RESPONSE, strip_code
+from codehelp.helper import run_cleanup
+from gened.openai import LLMConfig
+from gened.testing.mocks import mock_async_completion
+
+EXPLANATION = (
+    "The error `NameError` means that Python does not know the name `y` at the point where you use it. "
+    "Variables must be assigned a value before they are used, and names are case sensitive, so `Y` and `y` are different names."
+)
+CLOSING = "Think about which variable you meant to print. What value do you expect to see when the program runs?"
+
+FENCED = f"""{EXPLANATION}
+
+Your code should look like this:
+
+```python
+x = 1
+print(x)
+```
+
+{CLOSING}"""
+
+
+def test_strips_fenced_code_and_intro():
+    result = strip_code(FENCED)
+    assert result == f"{EXPLANATION}\n\n{CLOSING}"
+
+
+def test_strips_indented_code():
+    indented = FENCED.replace("```python\nx = 1\nprint(x)\n```", "    x = 1\n    print(x)")
+    assert strip_code(indented) == f"{EXPLANATION}\n\n{CLOSING}"
+
+
+def test_keeps_intro_text_before_colon():
+    text = f"{EXPLANATION} You assign x on the first line:\n\n```\nx = 1\n```\n\n{CLOSING}"
+    result = strip_code(text)
+    assert result is not None
+    assert "You assign x on the first line." in result
+    assert "```" not in result
+
+
+def test_keeps_markdown_lists():
+    text = f"{EXPLANATION}\n\n- first point\n- second point\n\n```\nx = 1\n```\n\n{CLOSING}"
+    result = strip_code(text)
+    assert result is not None
+    assert "- first point\n- second point" in result
+
+
+def test_rejects_mostly_code():
+    text = "Here is the fix:\n\n```python\n" + "x = compute(y)\n" * 80 + "```\n\n" + EXPLANATION + " " + CLOSING
+    assert strip_code(text) is None
+
+
+def test_rejects_too_short():
+    assert strip_code("Try this:\n```\nprint(x)\n```\nGood luck!") is None
+
+
+def test_rejects_dangling_reference():
+    text = FENCED.replace(CLOSING, "Compare the code above with yours. " + CLOSING)
+    assert strip_code(text) is None
+
+
+def test_rejects_lost_ending():
+    # the closing sentence (where a group instruction is usually followed) would be removed
+    text = f"{EXPLANATION}\n\n{CLOSING} Your loop should look like a counting loop."
+    assert strip_code(text) is None
+
+
+def test_run_cleanup_local_then_llm(app, monkeypatch):
+    calls = []
+    mock = mock_async_completion()
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    llm = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+
+    with app.test_request_context():
+        response, text = asyncio.run(run_cleanup(llm, FENCED, "code", "error", "issue", None, None, None))
+        assert response == LOCAL_CLEANUP_RESPONSE
+        assert "```" not in text
+        assert len(calls) == 0
+
+        # fails the local quality checks -> LLM rewrite
+        asyncio.run(run_cleanup(llm, "Try this:\n```\nprint(x)\n```", "code", "error", "issue", None, None, None))
+        assert len(calls) == 1
+
+        app.config['LOCAL_CODE_CLEANUP'] = False
+        asyncio.run(run_cleanup(llm, FENCED, "code", "error", "issue", None, None, None))
+        assert len(calls) == 2
@@ -0,0 +1,101 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+from gened.clients import ClientRegistry
+
+
+class FakeClient:
+    def __init__(self, *key):
+        self.key = key
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+def make_registry(max_size=2):
+    async def closer(client):
+        await client.close()
+    return ClientRegistry("test", factory=FakeClient, closer=closer, max_size=max_size)
+
+
+def test_reuse_within_loop():
+    registry = make_registry()
+
+    async def run():
+        async with registry.lease('key1', 'url') as c1:
+            pass
+        async with registry.lease('key1', 'url') as c2:
+            pass
+        async with registry.lease('key2', 'url') as c3:
+            pass
+        return c1, c2, c3
+
+    c1, c2, c3 = asyncio.run(run())
+    assert c1 is c2
+    assert c1 is not c3
+    stats = registry.stats()
+    assert (stats.hits, stats.misses, stats.size) == (1, 2, 2)
+
+
+def test_lru_eviction_closes_idle_clients():
+    registry = make_registry(max_size=2)
+
+    async def run():
+        async with registry.lease('a') as a:
+            pass
+        async with registry.lease('b'):
+            pass
+        async with registry.lease('a'):  # 'a' is now most recently used
+            pass
+        async with registry.lease('c'):  # evicts 'b'
+            pass
+        async with registry.lease('b') as b2:
+            pass
+        await asyncio.sleep(0)  # let scheduled closes run
+        return a, b2
+
+    a, b2 = asyncio.run(run())
+    stats = registry.stats()
+    assert stats.evictions == 2
+    assert stats.size == 2
+    assert not b2.closed
+    assert a.closed  # 'a' was least recently used when 'b' came back
+
+
+def test_leased_client_not_closed_until_released():
+    registry = make_registry(max_size=1)
+
+    async def run():
+        async with registry.lease('a') as a:
+            async with registry.lease('b'):  # evicts 'a' while it is still leased
+                pass
+            assert not a.closed
+        return a
+
+    a = asyncio.run(run())
+    assert a.closed
+
+
+def test_new_loop_gets_new_client():
+    registry = make_registry()
+
+    async def get():
+        async with registry.lease('a') as client:
+            return client
+
+    c1 = asyncio.run(get())
+    c2 = asyncio.run(get())
+    assert c1 is not c2
+    assert registry.stats().size == 1  # entry from the closed loop was pruned
+
+
+def test_llm_status_page(client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/llm_status/')
+    assert response.status_code == 200
+    assert "API Clients" in response.text
+    assert "openai" in response.text
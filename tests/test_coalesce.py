@@ -0,0 +1,200 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import threading
+
+import openai
+import pytest
+from flask import g
+
+from gened import coalesce, completion_cache
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.providers import get_completion
+from gened.resilience import deadline
+from gened.testing.mocks import mock_async_completion
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+MESSAGES = [{'role': 'user', 'content': "Why doesn't this compile?"}]
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+    mock = mock_async_completion(0.2)  # slow enough that concurrent requests overlap
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    monkeypatch.setattr('gened.providers.inflight', coalesce.SingleFlight())
+    return calls
+
+
+def test_concurrent_requests_share_one_call(app, api_calls):
+    async def gather():
+        return await asyncio.gather(
+            get_completion(LLM, MESSAGES),
+            get_completion(LLM, MESSAGES),
+            get_completion(LLM, [{'role': 'user', 'content': "Something else"}]),
+        )
+
+    with app.app_context():
+        (response1, text1), (response2, text2), _ = asyncio.run(gather())
+
+    assert len(api_calls) == 2
+    assert text1 == text2
+    assert 'coalesced' not in response1
+    assert response2['coalesced'] is True
+
+
+def test_requests_across_threads(app, api_calls):
+    texts = []
+
+    def worker():
+        with app.app_context():
+            _, text = asyncio.run(get_completion(LLM, MESSAGES))
+            texts.append(text)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(api_calls) == 1
+    assert len(texts) == 4
+    assert len(set(texts)) == 1
+
+
+def test_cancelled_leader(app, api_calls):
+    async def cancel_leader():
+        leader = asyncio.create_task(get_completion(LLM, MESSAGES))
+        await asyncio.sleep(0.05)
+        follower = asyncio.create_task(get_completion(LLM, MESSAGES))
+        await asyncio.sleep(0.05)
+        leader.cancel()
+        return await follower
+
+    with app.app_context():
+        response, _ = asyncio.run(cancel_leader())
+
+    assert len(api_calls) == 2  # the follower made its own request
+    assert 'error' not in response
+
+
+def test_disabled(app, api_calls):
+    app.config['COMPLETION_COALESCE'] = False
+
+    async def gather():
+        return await asyncio.gather(get_completion(LLM, MESSAGES), get_completion(LLM, MESSAGES))
+
+    with app.app_context():
+        asyncio.run(gather())
+    assert len(api_calls) == 2
+
+
+def test_coalesced_not_stored_again(app, api_calls):
+    async def gather():
+        return await asyncio.gather(
+            completion_cache.cached_completion(LLM, MESSAGES),
+            completion_cache.cached_completion(LLM, MESSAGES),
+        )
+
+    with app.test_request_context():
+        asyncio.run(gather())
+        assert completion_cache.get_stats().entries == 1
+        row = get_db().execute("SELECT response_json FROM completion_cache").fetchone()
+    assert 'coalesced' not in row['response_json']
+
+
+def test_each_query_recorded(app, api_calls):
+    app.config['COMPLETION_CACHE_TTL'] = 0
+
+    def post(code):
+        client = app.test_client()
+        client.post('/auth/login', data={'username': 'testuser', 'password': 'testpassword'})
+        response = client.post('/help/request', data={'code': code, 'error': 'NameError', 'issue': 'help'})
+        assert response.status_code == 302
+
+    post("x = 0")
+    calls_per_query = len(api_calls)
+
+    threads = [threading.Thread(target=post, args=("y = 1",)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(api_calls) == 2 * calls_per_query
+    with app.app_context():
+        rows = get_db().execute("SELECT response_text FROM queries WHERE code='y = 1'").fetchall()
+    assert len(rows) == 2
+    assert all(row['response_text'] for row in rows)
+
+
+def test_not_shared_across_keys_or_classes(app, api_calls):
+    async def gather():
+        return await asyncio.gather(
+            get_completion(LLM, MESSAGES),
+            get_completion(LLMConfig(model='gpt-4o-mini', api_key='other-key'), MESSAGES),
+        )
+
+    with app.app_context():
+        asyncio.run(gather())
+    assert len(api_calls) == 2
+
+    api_calls.clear()
+
+    def in_class(class_id):
+        with app.test_request_context():
+            g.auth = {'class_id': class_id}
+            asyncio.run(get_completion(LLM, MESSAGES))
+
+    threads = [threading.Thread(target=in_class, args=(class_id,)) for class_id in (None, 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(api_calls) == 2
+
+
+def test_followers_charged(app, api_calls):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO usage_budgets (class_id, token_limit) VALUES (1, 1000000)")
+        db.commit()
+
+    def in_class():
+        with app.test_request_context():
+            g.auth = {'class_id': 1}
+            asyncio.run(get_completion(LLM, MESSAGES))
+
+    threads = [threading.Thread(target=in_class) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(api_calls) == 1
+    with app.app_context():
+        assert get_db().execute("SELECT COUNT(*) FROM usage_ledger WHERE class_id=1").fetchone()[0] == 2
+
+
+def test_follower_deadline(app, api_calls):
+    async def follow_with_deadline():
+        leader = asyncio.create_task(get_completion(LLM, MESSAGES))
+        await asyncio.sleep(0.01)
+        with deadline(0.05):
+            response, text = await get_completion(LLM, MESSAGES)
+        await leader
+        return response, text
+
+    with app.app_context():
+        response, text = asyncio.run(follow_with_deadline())
+    assert 'error' in response
+    assert text.startswith("Error (DeadlineExceededError)")
+    assert len(api_calls) == 1
@@ -0,0 +1,102 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import openai
+import pytest
+from flask import g
+
+from gened import completion_cache
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.testing.mocks import mock_async_completion
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+MESSAGES = [{'role': 'user', 'content': "def f():\n    return 1\n"}]
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+    mock = mock_async_completion()
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    return calls
+
+
+def test_key_normalization():
+    key = completion_cache.make_key(LLM, MESSAGES)
+    assert completion_cache.make_key(LLM, [{'role': 'user', 'content': "def f():  \r\n    return 1\r\n\r\n"}]) == key
+    # indentation is significant
+    assert completion_cache.make_key(LLM, [{'role': 'user', 'content': "def f():\nreturn 1\n"}]) != key
+    assert completion_cache.make_key(LLMConfig(model='gpt-4o', api_key='invalid'), MESSAGES) != key
+
+
+def test_repeated_completion_is_cached(app, api_calls):
+    with app.test_request_context():
+        response1, text1 = asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))
+        response2, text2 = asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))
+        stats = completion_cache.get_stats()
+
+    assert len(api_calls) == 1
+    assert text1 == text2
+    assert 'cached' not in response1
+    assert response2['cached'] is True
+    assert (stats.entries, stats.hits, stats.misses) == (1, 1, 1)
+
+
+def test_class_opt_out(app, api_calls):
+    with app.test_request_context():
+        db = get_db()
+        db.execute("UPDATE classes SET cache_completions=0 WHERE id=1")
+        db.commit()
+        g.auth = {'class_id': 1}
+
+        asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))
+        asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))
+        assert completion_cache.get_stats().entries == 0
+
+    assert len(api_calls) == 2
+
+
+def test_size_bounded_eviction(app, api_calls):
+    app.config['COMPLETION_CACHE_MAX_ENTRIES'] = 2
+    with app.test_request_context():
+        for i in range(3):
+            asyncio.run(completion_cache.cached_completion(LLM, [{'role': 'user', 'content': f"query {i}"}]))
+        assert completion_cache.get_stats().entries == 2
+
+
+def test_expired_entries_not_used(app, api_calls):
+    with app.test_request_context():
+        asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))
+        db = get_db()
+        db.execute("UPDATE completion_cache SET created=datetime('now', '-8 days')")
+        db.commit()
+        asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))
+
+    assert len(api_calls) == 2
+
+
+def test_admin_stats(app, client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/llm_status/')
+    assert response.status_code == 200
+    assert "Completion Cache" in response.text
+
+
+def test_does_not_commit_callers_transaction(app, api_calls):
+    app.config['COMPLETION_CACHE_DB_TIMEOUT'] = 0.05
+    with app.test_request_context():
+        db = get_db()
+        db.execute("UPDATE classes SET name='uncommitted' WHERE id=1")
+        asyncio.run(completion_cache.cached_completion(LLM, MESSAGES))  # its write is skipped: the caller holds the lock
+        db.rollback()
+        assert db.execute("SELECT name FROM classes WHERE id=1").fetchone()['name'] != 'uncommitted'
+        assert completion_cache.get_stats().misses == 0
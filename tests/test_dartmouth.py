@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import threading
+import time
+
+import jwt
+import pytest
+
+from gened.dartmouth import JWTCache, TokenRefreshError
+
+
+def make_token(lifetime):
+    return jwt.encode({'exp': int(time.time() + lifetime)}, 'test-secret-long-enough-for-hs256-signing', algorithm='HS256')
+
+
+class CountingFetch:
+    def __init__(self, lifetime=3600, fail=False, delay=0.0):
+        self.lifetime = lifetime
+        self.fail = fail
+        self.delay = delay
+        self.calls = 0
+
+    def __call__(self, api_key):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("JWT endpoint down")
+        return make_token(self.lifetime)
+
+
+def test_token_reused_until_refresh_margin(app):
+    fetch = CountingFetch(lifetime=3600)
+    cache = JWTCache(fetch, refresh_margin=300)
+    with app.app_context():
+        token = cache.get('key')
+        assert cache.get('key') == token
+        assert cache.peek('key') == token
+    assert fetch.calls == 1
+
+
+def test_refresh_ahead_of_expiry(app):
+    fetch = CountingFetch(lifetime=100)  # already inside the 300s refresh margin
+    cache = JWTCache(fetch, refresh_margin=300)
+    with app.app_context():
+        cache.get('key')
+        assert cache.peek('key') is None
+        cache.get('key')
+    assert fetch.calls == 2
+
+
+def test_single_flight_refresh(app):
+    fetch = CountingFetch(delay=0.2)
+    cache = JWTCache(fetch)
+    results = []
+
+    def worker():
+        with app.app_context():
+            results.append(cache.get('key'))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fetch.calls == 1
+    assert len(set(results)) == 1
+
+
+def test_failure_backs_off(app):
+    fetch = CountingFetch(fail=True)
+    cache = JWTCache(fetch, backoff_base=10)
+    with app.app_context():
+        with pytest.raises(TokenRefreshError):
+            cache.get('key')
+        with pytest.raises(TokenRefreshError, match="backing off"):
+            cache.get('key')
+    assert fetch.calls == 1
+    assert cache.stats()[0]['failures'] == 1
+
+
+def test_failure_keeps_valid_token(app):
+    fetch = CountingFetch(lifetime=100)
+    cache = JWTCache(fetch, refresh_margin=300)
+    with app.app_context():
+        token = cache.get('key')
+        fetch.fail = True
+        assert cache.get('key') == token  # refresh fails, but old token is still valid
+    assert fetch.calls == 2
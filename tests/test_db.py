@@ -2,6 +2,7 @@
 #
 # SPDX-License-Identifier: AGPL-3.0-only
 
+import asyncio
 import sqlite3
 
 import pytest
@@ -19,6 +20,22 @@ def test_get_close_db(app):
     assert 'closed' in str(e.value)
 
 
+def test_connection_per_thread(app):
+    async def in_coroutine():
+        with pytest.raises(RuntimeError):
+            get_db()
+        return await asyncio.to_thread(get_db)
+
+    with app.app_context():
+        db = get_db()
+        worker_db = asyncio.run(in_coroutine())
+        assert worker_db is not db
+        worker_db.execute('SELECT 1')
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        worker_db.execute('SELECT 1')
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder:
         called = False
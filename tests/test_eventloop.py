@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import contextvars
+import threading
+
+import pytest
+from flask import current_app
+
+from gened.clients import ClientRegistry
+from gened.eventloop import LoopThread, get_loop_thread, run_async
+
+var: contextvars.ContextVar[str] = contextvars.ContextVar('var', default="unset")
+
+
+async def where() -> tuple[asyncio.AbstractEventLoop, str, str, str]:
+    return asyncio.get_running_loop(), threading.current_thread().name, var.get(), current_app.name
+
+
+def test_one_loop_per_app(app):
+    with app.app_context():
+        var.set("caller")
+        loop1, thread1, value, app_name = run_async(where())
+        loop2, _, _, _ = run_async(where())
+    assert loop1 is loop2  # shared across calls (and requests)
+    assert thread1 == 'gened-event-loop' != threading.current_thread().name
+    assert value == "caller"  # run in a copy of the caller's context
+    assert app_name == app.name
+
+
+def test_clients_shared_across_requests(app):
+    created = []
+
+    async def close(client):
+        pass
+
+    registry = ClientRegistry("test", factory=lambda key: created.append(key) or object(), closer=close)
+
+    async def use_client():
+        async with registry.lease("key") as client:
+            return client
+
+    with app.app_context():
+        assert run_async(use_client()) is run_async(use_client())
+    assert created == ["key"]
+
+
+def test_no_blocking_from_loop_thread(app):
+    with app.app_context():
+        loop_thread = get_loop_thread()
+
+        async def nested():
+            loop_thread.run(asyncio.sleep(0))
+
+        with pytest.raises(RuntimeError, match="deadlock"):
+            loop_thread.run(nested())
+
+
+def test_stop():
+    loop_thread = LoopThread(shutdown_timeout=0.1)
+    finished = []
+
+    async def quick():
+        await asyncio.sleep(0.01)
+        finished.append('quick')
+
+    async def slow():
+        await asyncio.sleep(60)
+        finished.append('slow')
+
+    loop_thread.submit(quick())
+    slow_future = loop_thread.submit(slow())
+    thread = loop_thread._thread
+    loop_thread.stop()
+
+    assert finished == ['quick']  # pending tasks get to finish, up to the timeout
+    assert slow_future.cancelled()
+    assert not thread.is_alive()
+
+    # Started again on the next use
+    assert loop_thread.run(asyncio.sleep(0, result=5)) == 5
+    loop_thread.stop()
@@ -0,0 +1,66 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import pytest
+
+from gened.db import get_db
+
+
+@pytest.fixture
+def slow_completions(fake_completions):
+    """ Answer every completion after a short delay. """
+    fake_completions.delay = 0.2
+
+
+QUERY = {'code': "x = 1", 'error': "NameError", 'issue': "Why?", 'user_id': "1234"}
+
+
+def test_job_mode(app, client, api_headers, slow_completions):
+    response = client.post('/api/query?async=1', json=QUERY, headers=api_headers())
+    assert response.status_code == 202
+    query_id = response.json['query_id']
+    assert response.json['status'] == 'pending'
+    assert response.headers['Location'] == f"/api/query/{query_id}"
+
+    response = client.get(f'/api/query/{query_id}', headers=api_headers())
+    assert response.json['status'] == 'pending'
+    assert response.json['responses'] is None
+
+    response = client.get(f'/api/query/{query_id}?wait=10', headers=api_headers())
+    assert response.json['status'] == 'done'
+    assert response.json['responses']['main'] == "OK"
+
+    with app.app_context():
+        row = get_db().execute("SELECT job_status, algorea_id FROM queries WHERE id=?", [query_id]).fetchone()
+        assert row['job_status'] == 'done'
+        assert row['algorea_id'] == "1234"
+
+
+def test_prefer_header(client, api_headers, slow_completions):
+    response = client.post('/api/query', json=QUERY, headers={**api_headers(), 'Prefer': 'respond-async'})
+    assert response.status_code == 202
+    # Let the job finish before the test's database is removed
+    response = client.get(f"/api/query/{response.json['query_id']}?wait=10", headers=api_headers())
+    assert response.json['status'] == 'done'
+
+
+def test_failed_job(app, client, api_headers, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr('codehelp.jobs.answer_query', fail)
+    response = client.post('/api/query?async=1', json=QUERY, headers=api_headers())
+    query_id = response.json['query_id']
+    response = client.get(f'/api/query/{query_id}?wait=10', headers=api_headers())
+    assert response.json['status'] == 'error'
+    assert 'error' in response.json['responses']
+
+
+def test_sync_mode_unchanged(client, api_headers, slow_completions):
+    response = client.post('/api/query', json=QUERY, headers=api_headers())
+    assert response.status_code == 200
+    assert response.json['responses']['main'] == "OK"
+
+    response = client.get(f"/api/query/{response.json['query_id']}", headers=api_headers())
+    assert response.json['status'] == 'done'
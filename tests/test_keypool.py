@@ -0,0 +1,115 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from gened import keypool
+from gened.db import get_db
+from gened.keypool import KeyBalancer, get_key_pool, parse_keys
+from gened.openai import LLMConfig
+from gened.providers import get_completion
+from gened.testing.mocks import mock_async_completion
+
+POOL = (('key-a', 1), ('key-b', 1))
+MESSAGES = [{'role': 'user', 'content': "Why?"}]
+REQUEST = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+
+
+@pytest.fixture
+def balancer(monkeypatch):
+    balancer = KeyBalancer()
+    monkeypatch.setattr(keypool, 'balancer', balancer)
+    return balancer
+
+
+def test_parse_keys():
+    assert parse_keys("key-a\n\n  key-b 3 \n") == [('key-a', 1), ('key-b', 3)]
+    with pytest.raises(ValueError):
+        parse_keys("key-a heavy")
+    with pytest.raises(ValueError):
+        parse_keys("key-a 0")
+
+
+def test_get_key_pool(app):
+    with app.app_context():
+        assert get_key_pool(1, 'keeeez1') == ()  # no additional keys: no pool
+        keypool.add_keys([('consumer-extra', 2)], consumer_id=1)
+        keypool.add_keys([('class-extra', 1)], class_id=2)
+        # class 1 is under consumer 1
+        assert get_key_pool(1, 'keeeez1') == (('keeeez1', 1), ('consumer-extra', 2))
+        assert get_key_pool(2, 'user-key') == (('user-key', 1), ('class-extra', 1))
+        keypool.clear_keys(consumer_id=1)
+        assert get_key_pool(1, 'keeeez1') == ()
+
+
+def test_least_outstanding(app, balancer):
+    with app.app_context():
+        with balancer.lease('key-a'):
+            assert balancer.choose('openai', POOL, 'least_outstanding') == 'key-b'
+            with balancer.lease('key-b'), balancer.lease('key-b'):
+                assert balancer.choose('openai', POOL, 'least_outstanding') == 'key-a'
+        # weights scale a key's share of outstanding requests
+        with balancer.lease('key-a'):
+            assert balancer.choose('openai', (('key-a', 3), ('key-b', 1)), 'least_outstanding') == 'key-a'
+
+
+def test_weighted_round_robin(app, balancer):
+    with app.app_context():
+        picks = [balancer.choose('openai', (('key-a', 2), ('key-b', 1)), 'weighted') for _ in range(6)]
+    assert picks.count('key-a') == 4
+    assert picks.count('key-b') == 2
+    assert picks[:3] in (['key-a', 'key-b', 'key-a'], ['key-a', 'key-a', 'key-b'])
+
+
+def test_drained_key_skipped(app, balancer):
+    with app.app_context():
+        balancer.drain('key-a', 60)
+        assert all(balancer.choose('openai', POOL, 'weighted') == 'key-b' for _ in range(4))
+        balancer.drain('key-b', 10)
+        # all drained: the one that recovers first
+        assert balancer.choose('openai', POOL, 'weighted') == 'key-b'
+
+
+def test_quota_failover(app, balancer, monkeypatch):
+    keys = []
+    mock = mock_async_completion()
+
+    async def create(self, *args, **kwargs):
+        keys.append(self._client.api_key)
+        if self._client.api_key == 'key-a':
+            raise openai.RateLimitError("You exceeded your current quota", response=httpx.Response(429, request=REQUEST), body=None)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", create)
+    llm = LLMConfig(model='gpt-4o-mini', api_key='key-a', key_pool=POOL)
+    with app.app_context():
+        response, _ = asyncio.run(get_completion(llm, MESSAGES))
+        assert 'error' not in response
+        asyncio.run(get_completion(llm, MESSAGES))
+
+    assert keys == ['key-a', 'key-b', 'key-b']  # key-a is drained after its first failure
+    assert {row['key']: row['drains'] for row in balancer.status()} == {'...ey-a': 1, '...ey-b': 0}
+
+
+def test_instructor_pool_keys(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')
+    with app.app_context():
+        keypool.add_keys([('class-extra-1234', 1)], class_id=2)
+        get_db().commit()
+        assert keypool.list_keys(class_id=2) == [{'key': "*" * 20 + "1234", 'weight': 1}]
+
+    response = client.post('/instructor/user_class/set', data={'save_llm_form': '', 'model_id': 1, 'pool_keys': "key weight"})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert "Invalid additional API keys" in session['_flashes'][-1][1]
+
+    response = client.post('/instructor/user_class/set', data={'clear_pool_keys': ''})
+    assert response.status_code == 302
+    with app.app_context():
+        assert keypool.list_keys(class_id=2) == []
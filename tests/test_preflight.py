@@ -0,0 +1,139 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import pytest
+
+from codehelp.preflight import QueryTooLongError, error_line_numbers, preflight, trim_code, trim_error
+from codehelp.query_config import get_input_budget
+from gened.db import get_db
+from gened.tokens import context_window, estimate_tokens, get_family
+
+LONG_CODE = "\n".join(f"value_{i} = compute({i}) + offset  # step {i}" for i in range(1, 3001))
+
+
+@pytest.fixture
+def api_calls(app, monkeypatch):
+    """ Record the messages of each completion requested, from any provider. """
+    calls = []
+
+    async def fake_completion(llm, messages, **kwargs):
+        calls.append(messages)
+        return {'choices': [{'message': {'content': "OK"}}]}, "OK"
+
+    monkeypatch.setattr('gened.completion_cache.get_completion', fake_completion)
+    app.config['COMPLETION_CACHE_TTL'] = 0
+    return calls
+
+
+def test_families():
+    assert get_family('gpt-4o-mini').name == 'gpt-4o'
+    assert get_family('gpt-4').name == 'gpt-4-8k'
+    assert get_family('/api/ai/tgi/codellama-13b-instruct-hf/generate').name == 'llama'
+    assert get_family(None).name == 'default'
+    assert context_window('gpt-3.5-turbo') == 16_385
+    assert estimate_tokens("x" * 36, 'gpt-4o') == 10
+
+
+@pytest.mark.parametrize(('error', 'expected'), [
+    ('File "main.py", line 12, in <module>\n  File "lib.py", line 3', [12, 3]),
+    ("main.c:41:5: error: expected ';'", [41]),
+    ("at Main.main(Main.java:7)", [7]),
+    ("Program.cs(9,13): error CS1002", [9]),
+    ("Segmentation fault", []),
+])
+def test_error_line_numbers(error, expected):
+    assert error_line_numbers(error) == expected
+
+
+def test_trim_code_keeps_referenced_lines():
+    trimmed = trim_code(LONG_CODE, [1500], 200, 'gpt-4o')
+    assert estimate_tokens(trimmed, 'gpt-4o') < 250
+    assert "value_1500 = compute(1500)" in trimmed
+    assert "value_1 = " not in trimmed
+    assert trimmed.startswith("[... ")
+    assert trimmed.endswith("lines omitted ...]")
+
+    # without a referenced line: the beginning and the end
+    trimmed = trim_code(LONG_CODE, [], 200, 'gpt-4o')
+    assert trimmed.startswith("value_1 = ")
+    assert trimmed.endswith("value_3000 = compute(3000) + offset  # step 3000")
+
+    short = "print(x)"
+    assert trim_code(short, [1], 200, 'gpt-4o') is short
+
+
+def test_trim_error():
+    error = "Traceback (most recent call last):\n" + "\n".join(f'  File "f{i}.py", line {i}, in g' for i in range(500)) + "\nValueError: bad"
+    trimmed = trim_error(error, 100, 'gpt-4o')
+    assert trimmed.startswith("Traceback (most recent call last):\n")
+    assert trimmed.endswith("ValueError: bad")
+    assert "omitted ...]" in trimmed
+
+
+def test_preflight():
+    result = preflight('gpt-4o-mini', "print(x)", "NameError", "Why?", None, 4000)
+    assert not result.trimmed
+    assert result.code == "print(x)"
+    assert result.prompt_tokens > 0
+
+    result = preflight('gpt-4o-mini', LONG_CODE, 'line 2000, in <module>', "Why?", None, 4000)
+    assert result.trimmed
+    assert "value_2000 = " in result.code
+    assert estimate_tokens(result.code, 'gpt-4o-mini') <= 4000
+
+    # an issue alone over the budget can't be trimmed
+    with pytest.raises(QueryTooLongError) as exc_info:
+        preflight('gpt-4o-mini', "", "", "why " * 5000, None, 4000)
+    assert exc_info.value.limit == 4000
+
+    # within a (very large) budget but not the model's context window
+    with pytest.raises(QueryTooLongError) as exc_info:
+        preflight('gpt-4', "", "", "why " * 10000, None, 100_000)
+    assert exc_info.value.limit < 8192
+
+
+def test_long_query_trimmed(app, client, auth, api_calls):
+    auth.login()
+    response = client.post('/help/request', data={'code': LONG_CODE, 'error': 'File "main.py", line 2500\nNameError', 'issue': "Why?"})
+    assert response.status_code == 302
+    assert api_calls
+
+    prompts = "\n".join(str(message['content']) for messages in api_calls for message in messages)
+    assert "value_2500 = compute(2500)" in prompts
+    assert "lines omitted ...]" in prompts
+    assert "value_1 = compute(1)" not in prompts
+
+    with app.app_context():
+        row = get_db().execute("SELECT code, prompt_tokens_est FROM queries ORDER BY id DESC LIMIT 1").fetchone()
+    assert row['code'] == LONG_CODE  # stored as submitted
+    assert 0 < row['prompt_tokens_est'] < 6000
+
+
+def test_too_long_query_rejected(app, client, auth, api_calls):
+    auth.login()
+    response = client.post('/help/request', data={'code': "", 'error': "", 'issue': "why " * 10000})
+    assert response.status_code == 302
+    assert not api_calls
+
+    with app.app_context():
+        row = get_db().execute("SELECT response_text, prompt_tokens_est FROM queries ORDER BY id DESC LIMIT 1").fetchone()
+    assert "QueryTooLongError" in row['response_text']
+    assert row['prompt_tokens_est'] > 4000
+
+
+def test_update_input_budget(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')  # class 2, where testuser is an instructor
+    response = client.post('/instructor/query/update', data={'pipeline': 'multi', 'input_token_budget': 8000})
+    assert response.status_code == 302
+    with app.app_context():
+        assert get_input_budget(2) == 8000
+        assert get_input_budget(1) == app.config['QUERY_INPUT_TOKEN_BUDGET']
+
+    response = client.post('/instructor/query/update', data={'pipeline': 'multi', 'input_token_budget': 10})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert "Invalid input token budget" in session['_flashes'][-1][1]
+    with app.app_context():
+        assert get_input_budget(2) == 8000
@@ -0,0 +1,76 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import pytest
+
+from codehelp import prompts
+from codehelp.admin import get_prompt_cache_stats
+from gened.db import get_db
+
+USAGE = {'prompt_tokens': 1200, 'completion_tokens': 30, 'total_tokens': 1230, 'prompt_tokens_details': {'cached_tokens': 1024}}
+
+
+@pytest.fixture
+def fake_completions(app, monkeypatch):
+    """ Answer every completion, from any provider, with USAGE. """
+    async def fake_completion(llm, messages, **kwargs):
+        return {'choices': [{'message': {'content': "OK"}}], 'usage': USAGE}, "OK"
+
+    monkeypatch.setattr('gened.completion_cache.get_completion', fake_completion)
+    app.config['COMPLETION_CACHE_TTL'] = 0
+    app.config['SUFFICIENCY_PRECHECK'] = 'off'
+
+
+@pytest.mark.parametrize('make_prompt', [prompts.make_main_prompt, prompts.make_sufficient_prompt, prompts.make_structured_prompt])
+def test_static_first_prefix_is_shared(make_prompt):
+    first = make_prompt("x = 1", "NameError", "Why?", "Python 3", layout='static_first')
+    second = make_prompt("for i in range(10):\n    print(j)", "", "Loop help", None, layout='static_first')
+    # The first message is identical across queries; the query itself comes last
+    assert first[0] == second[0]
+    assert "x = 1" not in first[0]['content'] and "Python 3" not in first[0]['content']
+    assert first[-1]['role'] == 'user' and "x = 1" in first[-1]['content']
+    assert "<context>\nPython 3\n</context>" in first[1]['content']
+    assert len(second) == 2  # no context message
+
+    # The classic layout is unchanged: the query is described before the instructions
+    classic = make_prompt("x = 1", "NameError", "Why?", "Python 3")
+    assert "Python 3" in classic[0]['content']
+    assert classic[1]['role'] == 'user'
+
+
+def test_chat_layouts():
+    classic = prompts.make_chat_sys_messages("Recursion", "Python 3")
+    static_first = prompts.make_chat_sys_messages("Recursion", "Python 3", layout='static_first')
+    assert len(classic) == 1
+    assert [m['content'] for m in static_first] == [prompts.chat_guidelines_sys, prompts.chat_topic_template_sys.render(topic="Recursion", context="Python 3")]
+    assert "\n".join(m['content'] for m in static_first) == classic[0]['content']
+
+
+def test_prompt_layout_config(app):
+    with app.app_context():
+        assert prompts.prompt_layout() == 'classic'
+        app.config['PROMPT_LAYOUT'] = 'static_first'
+        assert prompts.prompt_layout() == 'static_first'
+        app.config['PROMPT_LAYOUT'] = 'bogus'
+        assert prompts.prompt_layout() == 'classic'
+
+
+def test_prompt_cache_report(app, client, auth, runner, fake_completions):
+    auth.login()
+    client.post('/help/request', data={'code': "x = 1", 'error': "NameError", 'issue': "Why?"})
+    app.config['PROMPT_LAYOUT'] = 'static_first'
+    client.post('/help/request', data={'code': "y = 2", 'error': "NameError", 'issue': "Why?"})
+
+    with app.app_context():
+        layouts = [row['prompt_layout'] for row in get_db().execute("SELECT prompt_layout FROM queries WHERE prompt_layout IS NOT NULL ORDER BY id")]
+        assert layouts == ['classic', 'static_first']
+
+        stats = {(row['layout'], row['stage']): row for row in get_prompt_cache_stats()}
+        assert stats['static_first', 'main']['calls'] == 1
+        assert stats['static_first', 'main']['cached_tokens'] == 1024
+        assert stats['static_first', 'main']['hit_pct'] == pytest.approx(85.3)
+
+    result = runner.invoke(args=['prompt-cache-report'])
+    assert "static_first" in result.output
+    assert "85.3" in result.output
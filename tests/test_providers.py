@@ -0,0 +1,47 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import pytest
+
+from gened.db import get_db
+from gened.providers import (
+    ProviderRegistry,
+    UnknownProviderError,
+    get_class_provider,
+    providers,
+)
+
+
+def test_registry_loads_and_caches():
+    registry = ProviderRegistry(('openai', 'dartmouth'))
+    assert not registry.is_loaded('openai')
+    module = registry.get('openai')
+    assert module.__name__ == 'gened.openai'
+    assert registry.is_loaded('openai')
+    assert registry.get('openai') is module
+    assert not registry.is_loaded('dartmouth')
+
+
+def test_unknown_provider():
+    with pytest.raises(UnknownProviderError):
+        providers.get('nonexistent')
+
+
+def test_for_config():
+    dartmouth = providers.get('dartmouth')
+    llm = dartmouth.LLMConfig(api_key='key', model='model')
+    assert providers.for_config(llm) is dartmouth
+
+
+def test_class_provider(app):
+    with app.app_context():
+        db = get_db()
+        # class 1 uses consumer 1's model (id 1); classes 3 and 4 use model 2
+        db.execute("UPDATE models SET provider='mistral' WHERE id=2")
+        db.commit()
+
+        assert get_class_provider(1) == 'openai'
+        assert get_class_provider(3) == 'mistral'
+        assert get_class_provider(4) == 'mistral'
+        assert get_class_provider(999) is None
@@ -0,0 +1,104 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import time
+
+import pytest
+
+from gened import ratelimit
+from gened.openai import LLMConfig, get_completion
+from gened.ratelimit import BucketState, RateLimiter, RateLimitWaitError, request_tokens, reserve
+from gened.tokens import estimate_messages, estimate_tokens
+
+
+@pytest.fixture(autouse=True)
+def fresh_limiters(monkeypatch):
+    monkeypatch.setattr(ratelimit, '_limiters', {})
+
+
+def test_reserve_requests():
+    state, wait = reserve(None, 100.0, rpm=2, tpm=0, tokens=10, max_wait=60)
+    assert wait == 0
+    state, wait = reserve(state, 100.0, rpm=2, tpm=0, tokens=10, max_wait=60)
+    assert wait == 0
+    state, wait = reserve(state, 100.0, rpm=2, tpm=0, tokens=10, max_wait=60)
+    assert wait == pytest.approx(30)  # queued behind the first two, until one request has refilled
+    state, wait = reserve(state, 100.0, rpm=2, tpm=0, tokens=10, max_wait=60)
+    assert wait == pytest.approx(60)
+    # too long: refused, and nothing is reserved
+    refused_state, wait = reserve(state, 100.0, rpm=2, tpm=0, tokens=10, max_wait=60)
+    assert wait is None
+    assert refused_state.requests == state.requests
+
+
+def test_reserve_tokens():
+    state, wait = reserve(None, 0.0, rpm=0, tpm=1000, tokens=800, max_wait=60)
+    assert wait == 0
+    state, wait = reserve(state, 0.0, rpm=0, tpm=1000, tokens=800, max_wait=60)
+    assert wait == pytest.approx(36)  # 600 tokens short at 1000/minute
+    # a request bigger than the bucket waits for a full bucket, rather than forever
+    _, wait = reserve(BucketState(0, 1000, 0.0), 0.0, rpm=0, tpm=1000, tokens=5000, max_wait=60)
+    assert wait == 0
+
+
+def test_request_tokens():
+    messages = [{'role': 'system', 'content': "x" * 360}, {'role': 'user', 'content': "y" * 72}]
+    assert request_tokens(messages, 'gpt-4o') == estimate_messages(messages, 'gpt-4o') + ratelimit.DEFAULT_OUTPUT_TOKENS
+    assert request_tokens("x" * 360, 'gpt-4o') == estimate_tokens("x" * 360, 'gpt-4o') + ratelimit.DEFAULT_OUTPUT_TOKENS
+
+
+def test_limiter_queues_and_refuses():
+    limiter = RateLimiter(ratelimit.MemoryBackend())
+    rpm = 6000  # 100 per second
+    limiter.backend._states[ratelimit._key_id('key1')] = BucketState(0, 0, time.time())
+
+    waited = asyncio.run(limiter.acquire('key1', 10, rpm, 0, max_wait=1.0))
+    assert 0 < waited <= 0.02
+    with pytest.raises(RateLimitWaitError):
+        asyncio.run(limiter.acquire('key1', 10, rpm=1, tpm=0, max_wait=0.0))
+
+    stats, = limiter.stats()
+    assert (stats['requests'], stats['queued'], stats['refused'], stats['waiting']) == (2, 1, 1, 0)
+    assert stats['key'] == "...key1"
+
+
+def test_sqlite_backend_shared(tmp_path):
+    # two limiters on one file stand in for two worker processes
+    limiter1 = RateLimiter(ratelimit.SQLiteBackend(tmp_path / 'rl.db'))
+    limiter2 = RateLimiter(ratelimit.SQLiteBackend(tmp_path / 'rl.db'))
+    asyncio.run(limiter1.acquire('key1', 10, rpm=1, tpm=0, max_wait=0.0))
+    with pytest.raises(RateLimitWaitError):
+        asyncio.run(limiter2.acquire('key1', 10, rpm=1, tpm=0, max_wait=0.0))
+    asyncio.run(limiter2.acquire('key2', 10, rpm=1, tpm=0, max_wait=0.0))
+
+
+def test_completion_refused(app):
+    app.config['RATE_LIMIT_RPM'] = 1
+    app.config['RATE_LIMIT_MAX_WAIT'] = 0
+    llm = LLMConfig(model='gpt-4o-mini', api_key='shared')
+    messages = [{'role': 'user', 'content': "Why?"}]
+    with app.app_context():
+        response1, _ = asyncio.run(get_completion(llm, messages))
+        response2, text2 = asyncio.run(get_completion(llm, messages))
+    assert 'error' not in response1
+    assert 'error' in response2
+    assert text2.startswith("Error (RateLimitWaitError)")
+
+
+def test_settle_returns_unused_tokens(app):
+    app.config['RATE_LIMIT_TPM'] = 2000
+    with app.app_context():
+        asyncio.run(ratelimit.acquire('key1', 1500))
+        asyncio.run(ratelimit.settle('key1', 1500, 300))
+        state = ratelimit.get_limiter().backend._states[ratelimit._key_id('key1')]
+    assert state.tokens == pytest.approx(1700, abs=1)
+
+
+def test_admin_stats(app, client, auth):
+    app.config['RATE_LIMIT_RPM'] = 100
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/llm_status/')
+    assert response.status_code == 200
+    assert "Rate Limit Queues" in response.text
@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from gened import resilience
+from gened.openai import LLMConfig, get_completion
+from gened.providers import get_completion as provider_completion
+from gened.testing.mocks import mock_async_completion
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+MESSAGES = [{'role': 'user', 'content': "Why?"}]
+REQUEST = httpx.Request('POST', 'https://api.example.com/v1/chat/completions')
+
+
+def _flaky(failures, error):
+    ''' A request that raises error for its first `failures` calls. '''
+    calls = []
+
+    async def request():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return 'ok'
+
+    return request, calls
+
+
+def test_backoff_delay_bounds():
+    for attempt in range(6):
+        assert 0 <= resilience.backoff_delay(attempt, 0.5, 4.0) <= min(4.0, 0.5 * 2 ** attempt)
+
+
+def test_retries_then_succeeds(app):
+    request, calls = _flaky(2, resilience.RetryableStatusError(503, "unavailable"))
+    with app.app_context():
+        assert asyncio.run(resilience.with_retries('test', request)) == 'ok'
+    assert len(calls) == 3
+
+
+def test_gives_up_after_max_retries(app):
+    app.config['COMPLETION_RETRIES'] = 1
+    request, calls = _flaky(5, httpx.ConnectError("down"))
+    with app.app_context(), pytest.raises(httpx.ConnectError):
+        asyncio.run(resilience.with_retries('test', request))
+    assert len(calls) == 2
+
+
+def test_non_retryable_not_retried(app):
+    request, calls = _flaky(1, resilience.RetryableStatusError(400, "bad request"))
+    with app.app_context(), pytest.raises(resilience.RetryableStatusError):
+        asyncio.run(resilience.with_retries('test', request))
+    assert len(calls) == 1
+
+
+def test_deadline(app):
+    async def slow():
+        await asyncio.sleep(5)
+
+    with app.app_context(), resilience.deadline(0.05), pytest.raises(resilience.DeadlineExceededError):
+        asyncio.run(resilience.with_retries('test', slow))
+    assert resilience.time_remaining() is None
+
+
+def test_openai_retries_rate_limit(app, monkeypatch):
+    calls = []
+    mock = mock_async_completion()
+
+    async def flaky_create(*args, **kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            raise openai.RateLimitError("Rate limit reached", response=httpx.Response(429, request=REQUEST), body=None)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", flaky_create)
+    with app.app_context():
+        response, text = asyncio.run(get_completion(LLM, MESSAGES))
+    assert len(calls) == 2
+    assert 'error' not in response
+
+
+def test_openai_quota_not_retried(app, monkeypatch):
+    calls = []
+
+    async def quota_create(*args, **kwargs):
+        calls.append(kwargs)
+        raise openai.RateLimitError("You exceeded your current quota", response=httpx.Response(429, request=REQUEST), body=None)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", quota_create)
+    with app.app_context():
+        response, text = asyncio.run(get_completion(LLM, MESSAGES))
+    assert len(calls) == 1
+    assert text.startswith("Error (RateLimitError)")
+
+
+def test_hedged_request(app, monkeypatch):
+    app.config['COMPLETION_HEDGE'] = True
+    monkeypatch.setattr(resilience, 'latencies', resilience.LatencyTracker())
+    key = ('openai', LLM.model)
+    for _ in range(resilience.MIN_HEDGE_SAMPLES):
+        resilience.latencies.record(key, 0.01)
+
+    calls = []
+    mock = mock_async_completion()
+
+    async def slow_first(*args, **kwargs):
+        calls.append(kwargs)
+        if len(calls) == 1:
+            await asyncio.sleep(5)  # the original request hangs; the hedge should win
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", slow_first)
+    with app.app_context():
+        response, text = asyncio.run(provider_completion(LLM, MESSAGES, hedge=True))
+    assert len(calls) == 2
+    assert 'error' not in response
+
+
+def test_admin_stats(app, client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/llm_status/')
+    assert response.status_code == 200
+    assert "Completion Retries" in response.text
@@ -0,0 +1,191 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import json
+
+import pytest
+from flask import g
+
+from codehelp import similarity
+from codehelp.context import ContextConfig
+from codehelp.helper import run_query
+from gened.db import get_db
+from gened.openai import LLMConfig
+
+CODE = """
+def average(values):
+    total = 0
+    for v in values:
+        total += v
+    return total / len(values)
+
+print(average([]))
+"""
+ERROR = "ZeroDivisionError: division by zero"
+ISSUE = "Why does my average function crash on an empty list?"
+
+# Same structure, different names and constants
+RENAMED = """
+def mean(nums):
+    s = 0
+    for n in nums:
+        s += n
+    return s / len(nums)
+
+print(mean([]))
+"""
+
+UNRELATED = """
+class Stack:
+    def __init__(self):
+        self.items = []
+    def push(self, item):
+        self.items.append(item)
+"""
+
+
+@pytest.fixture(autouse=True)
+def fresh_indexes():
+    similarity._indexes.clear()
+    yield
+    similarity._indexes.clear()
+
+
+def test_normalized_tokens():
+    assert similarity.code_tokens("x = foo(42, 'bar')") == ['I', '=', 'I', '(', 'N', ',', 'S', ')']
+    assert similarity.code_tokens("return len(x)") == ['return', 'len', '(', 'I', ')']
+
+
+def test_error_tokens():
+    assert similarity.error_tokens("NameError: name 'y' is not defined on line 12") == ['nameerror', 'name', 'y', 'is', 'not', 'defined', 'on', 'line', 'N']
+
+
+def test_signature_similarity():
+    sig = similarity.query_signature(CODE, ERROR, ISSUE)
+    assert similarity.estimate_similarity(sig, similarity.query_signature(RENAMED, ERROR, ISSUE)) == 1.0
+    assert similarity.estimate_similarity(sig, similarity.query_signature(UNRELATED, "", "How do I pop?")) < 0.5
+
+
+def test_index_finds_near_duplicates():
+    index = similarity.SimilarityIndex()
+    index.add(1, similarity.query_signature(CODE, ERROR, ISSUE))
+    index.add(2, similarity.query_signature(UNRELATED, "", "How do I pop?"))
+
+    matches = index.find(similarity.query_signature(RENAMED, ERROR, ISSUE), 0.9)
+    assert [qid for _, qid in matches] == [1]
+
+
+def _mark_helpful(query_id, code):
+    db = get_db()
+    db.execute("UPDATE queries SET code=?, error=?, issue=?, helpful=1 WHERE id=?", [code, ERROR, ISSUE, query_id])
+    db.commit()
+
+
+def test_find_similar_helpful(app):
+    with app.app_context():
+        _mark_helpful(3, CODE)  # class 1, ctx1
+        assert similarity.backfill() == 4
+
+        found = similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE)
+        assert found is not None
+        assert found.query_id == 3
+        assert found.responses == {'main': 'response3'}
+
+        # other contexts and classes are separate
+        assert similarity.find_similar_helpful(1, 'ctx2', RENAMED, ERROR, ISSUE) is None
+        assert similarity.find_similar_helpful(2, 'ctx1', RENAMED, ERROR, ISSUE) is None
+
+        # only helpful responses are reused
+        get_db().execute("UPDATE queries SET helpful=0 WHERE id=3")
+        assert similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE) is None
+
+
+def test_index_catches_up(app):
+    with app.app_context():
+        similarity.backfill()
+        assert similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE) is None
+
+        # a query recorded later by another process (not added to this process's index)
+        db = get_db()
+        db.execute(
+            "INSERT INTO queries (id, context_name, code, error, issue, response_text, helpful, user_id, role_id) VALUES (5, 'ctx1', ?, ?, ?, '{\"main\": \"response5\"}', 1, 21, 1)",
+            [CODE, ERROR, ISSUE]
+        )
+        db.execute(
+            "INSERT INTO query_signatures (query_id, class_id, context_name, signature) VALUES (5, 1, 'ctx1', ?)",
+            [similarity.query_signature(CODE, ERROR, ISSUE).tobytes()]
+        )
+        db.commit()
+        found = similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE)
+        assert found is not None and found.query_id == 5
+
+
+def test_index_catches_up_out_of_order(app):
+    with app.app_context():
+        similarity.backfill()
+        assert similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE) is None
+
+        # a newer query recorded by this process...
+        similarity.index_query(10, 1, 'ctx1', UNRELATED, "", "How do I pop?")
+        assert similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE) is None
+
+        # ...doesn't hide an older one whose signature is written afterward (e.g., by another process or backfill())
+        _mark_helpful(3, CODE)
+        db = get_db()
+        db.execute("DELETE FROM query_signatures WHERE query_id=3")
+        db.commit()
+        assert similarity.backfill() == 1
+        found = similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE)
+        assert found is not None and found.query_id == 3
+
+
+def test_threshold_zero_disables(app):
+    app.config['SIMILAR_QUERY_THRESHOLD'] = 0
+    with app.app_context():
+        _mark_helpful(3, CODE)
+        similarity.backfill()
+        assert similarity.find_similar_helpful(1, 'ctx1', CODE, ERROR, ISSUE) is None
+
+
+def test_run_query_serves_similar(app):
+    app.config['SIMILAR_QUERY_SERVE'] = True
+    with app.test_request_context():
+        _mark_helpful(3, CODE)
+        similarity.backfill()
+        g.auth = {'class_id': 1, 'user_id': 21, 'role_id': 1}
+
+        # no LLM call is made (the API key is invalid, so a call would produce an error response)
+        llm = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+        query_id = run_query(llm, ContextConfig(name='ctx1'), RENAMED, ERROR, ISSUE)
+
+        row = get_db().execute("SELECT response_json, response_text FROM queries WHERE id=?", [query_id]).fetchone()
+        assert json.loads(row['response_text']) == {'main': 'response3'}
+        assert json.loads(row['response_json'])[0]['reused_query_id'] == 3
+
+
+def test_different_error_not_reused(app):
+    app.config['SIMILAR_QUERY_SERVE'] = True
+    with app.test_request_context():
+        _mark_helpful(3, CODE)
+        similarity.backfill()
+        g.auth = {'class_id': 1, 'user_id': 21, 'role_id': 1}
+
+        for error in ["TypeError: unsupported operand type(s) for +=: 'int' and 'str'", ""]:
+            assert similarity.find_similar_helpful(1, 'ctx1', CODE, error, ISSUE) is None
+
+        llm = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+        query_id = run_query(llm, ContextConfig(name='ctx1'), CODE, "IndexError: list index out of range", ISSUE)
+        row = get_db().execute("SELECT response_json FROM queries WHERE id=?", [query_id]).fetchone()
+        assert 'reused_query_id' not in row['response_json']
+
+
+def test_old_signatures_replaced(app):
+    with app.app_context():
+        _mark_helpful(3, CODE)
+        db = get_db()
+        db.execute("INSERT INTO query_signatures (query_id, class_id, context_name, signature) VALUES (3, 1, 'ctx1', zeroblob(128))")
+        db.commit()
+        assert similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE) is None  # ignored
+        assert similarity.backfill() == 4
+        assert similarity.find_similar_helpful(1, 'ctx1', RENAMED, ERROR, ISSUE).query_id == 3
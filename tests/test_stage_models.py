@@ -0,0 +1,67 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import openai
+import pytest
+from flask import g
+
+from codehelp.context import ContextConfig
+from codehelp.helper import run_sufficient_check
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.providers import for_stage, get_stage_models
+from gened.testing.mocks import mock_async_completion
+
+LLM = LLMConfig(model='gpt-4o', api_key='invalid')
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+    mock = mock_async_completion()
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    return calls
+
+
+def test_get_stage_models(app):
+    with app.app_context():
+        # test data: class 4 uses model 2 (GPT-4o), whose stages use GPT-4o-mini
+        assert get_stage_models(4) == {'sufficiency': 'gpt-4o-mini', 'cleanup': 'gpt-4o-mini', 'topics': 'gpt-4o-mini'}
+        # class 1 uses model 1 (GPT-3.5), with no stage models
+        assert get_stage_models(1) == {}
+
+
+def test_stage_model_on_other_provider_ignored(app):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO models (id, name, shortname, model, provider, active) VALUES (10, 'Other', 'Other', 'other-small', 'mistral', 1)")
+        db.execute("UPDATE models SET cleanup_model_id=10 WHERE id=2")
+        db.commit()
+        assert 'cleanup' not in get_stage_models(4)
+        assert get_stage_models(4)['sufficiency'] == 'gpt-4o-mini'
+
+
+def test_for_stage():
+    llm = LLMConfig(model='gpt-4o', api_key='invalid', stage_models={'sufficiency': 'gpt-4o-mini'})
+    assert for_stage(llm, 'sufficiency').model == 'gpt-4o-mini'
+    assert for_stage(llm, 'sufficiency').api_key == 'invalid'
+    assert for_stage(llm, 'topics') is llm
+    assert llm.model == 'gpt-4o'
+
+
+def test_sufficiency_check_uses_stage_model(app, api_calls):
+    app.config['SUFFICIENCY_PRECHECK'] = 'off'
+    llm = LLMConfig(model='gpt-4o', api_key='invalid', stage_models={'sufficiency': 'gpt-4o-mini'})
+    with app.test_request_context():
+        g.auth = {'class_id': 4}
+        asyncio.run(run_sufficient_check(llm, ContextConfig(name='ctx'), "x = 1", "", "help", None))
+
+    assert [call['model'] for call in api_calls] == ['gpt-4o-mini']
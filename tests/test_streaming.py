@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import json
+
+from flask import g
+
+from codehelp.helper import run_query_prompts, stream_query, stream_query_prompts
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.streaming import iter_async, sse_event
+
+
+def test_sse_event_format():
+    event = sse_event('delta', {'text': "line one\nline two"})
+    assert event.startswith("event: delta\ndata: ")
+    assert event.endswith("\n\n")
+    assert json.loads(event.split("data: ", 1)[1]) == {'text': "line one\nline two"}
+
+
+def test_iter_async_closes_generator():
+    closed = []
+
+    async def agen():
+        try:
+            for i in range(10):
+                yield i
+        finally:
+            closed.append(True)
+
+    it = iter_async(agen())
+    assert next(it) == 0
+    assert next(it) == 1
+    it.close()  # e.g., the client disconnected
+    assert closed == [True]
+
+
+def test_stream_query_prompts_matches_run_query_prompts(app):
+    llm = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+    with app.test_request_context():
+        events = list(iter_async(stream_query_prompts(llm, None, "code", "error", "issue", None, None)))
+        expected_responses, expected_texts = asyncio.run(run_query_prompts(llm, None, "code", "error", "issue", None, None))
+
+    names = [name for name, _ in events]
+    assert names.count('delta') > 1  # actually streamed in pieces
+    assert names[-1] == 'result'
+
+    responses, texts = events[-1][1]
+    assert texts == expected_texts
+    assert len(responses) == len(expected_responses)
+    streamed = "".join(data['text'] for name, data in events if name == 'delta')
+    assert streamed.strip() == texts['main']
+    assert responses[0]['choices'][0]['message']['content'] == texts['main']
+
+
+
+def test_disconnected_stream_recorded(app):
+    llm = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+    with app.test_request_context():
+        g.auth = {'class_id': 1, 'user_id': 21, 'role_id': 1}
+        query_id, events = stream_query(llm, None, "code", "error", "issue", lambda query_id: {})
+        sent = [next(events) for _ in range(3)]  # the query ID and two deltas
+        events.close()  # the client disconnected
+
+        row = get_db().execute("SELECT response_json, response_text FROM queries WHERE id=?", [query_id]).fetchone()
+
+    texts = json.loads(row['response_text'])
+    assert texts['error'] == "Error (ClientDisconnected).  The response was not completed."
+    assert texts['main'] == "".join(json.loads(event.split("data: ", 1)[1])['text'] for event in sent[1:])
+    assert json.loads(row['response_json']) == [{'error': texts['error']}]
@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import json
+
+import openai
+import pytest
+from flask import g
+
+from codehelp.helper import parse_structured_response, run_query_prompts
+from codehelp.query_config import get_pipeline
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.testing.mocks import mock_async_completion
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+
+
+@pytest.mark.parametrize(('text', 'expected'), [
+    ('{"sufficient": true, "clarification": "", "main": "Explanation"}', {'sufficient': True, 'clarification': "", 'main': "Explanation"}),
+    ('```json\n{"sufficient": false, "clarification": "Which line?", "main": "M"}\n```', {'sufficient': False, 'clarification': "Which line?", 'main': "M"}),
+    ('{"sufficient": true, "main": "M"}', {'sufficient': True, 'clarification': "", 'main': "M"}),
+    ('Here is the JSON: {"sufficient": true}', None),
+    ('{"sufficient": "yes", "main": "M"}', None),
+    ('["M"]', None),
+])
+def test_parse_structured_response(text, expected):
+    assert parse_structured_response(text) == expected
+
+
+def _run_structured(app, monkeypatch, content):
+    calls = []
+    mock = mock_async_completion(respond=lambda messages: content)
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    app.config['SUFFICIENCY_PRECHECK'] = 'off'
+    with app.test_request_context():
+        db = get_db()
+        db.execute("INSERT INTO class_query_configs (class_id, pipeline) VALUES (1, 'structured')")
+        db.commit()
+        g.auth = {'class_id': 1}
+        responses, texts = asyncio.run(run_query_prompts(LLM, None, "x = 1\nprint(y)", "NameError", "Why?", None, None))
+    return calls, responses, texts
+
+
+def test_structured_single_call(app, monkeypatch):
+    content = json.dumps({'sufficient': False, 'clarification': "What did you expect?", 'main': "The name `y` is not defined."})
+    calls, responses, texts = _run_structured(app, monkeypatch, content)
+    assert len(calls) == 1
+    assert len(responses) == 1
+    assert texts == {'insufficient': "What did you expect?", 'main': "The name `y` is not defined."}
+
+
+def test_structured_cleans_up_code(app, monkeypatch):
+    content = json.dumps({'sufficient': True, 'clarification': "", 'main': "Try this:\n```\nprint(x)\n```"})
+    calls, responses, texts = _run_structured(app, monkeypatch, content)
+    assert len(calls) == 2  # structured + cleanup
+    assert len(responses) == 2
+    assert list(texts) == ['main']
+
+
+def test_structured_falls_back_to_multi(app, monkeypatch):
+    calls, responses, texts = _run_structured(app, monkeypatch, "Not JSON at all")
+    assert len(calls) == 3  # structured + main + sufficiency
+    assert len(responses) == 3
+    assert texts['main'] == "Not JSON at all"
+
+
+def test_update_pipeline(app, client, auth):
+    auth.login()
+    client.get('/classes/switch/2')  # class 2, where testuser is an instructor
+    response = client.post('/instructor/query/update', data={'pipeline': 'structured'})
+    assert response.status_code == 302
+    response = client.post('/instructor/query/update', data={'pipeline': 'invalid'})
+    assert response.status_code == 302
+
+    with app.app_context():
+        assert get_pipeline(2) == 'structured'
+        assert get_pipeline(1) == 'multi'
+
+
+def test_compare_pipelines_command(runner):
+    result = runner.invoke(args=['compare-pipelines', '--mock', '--delay', '0', '--limit', '4'])
+    assert result.exit_code == 0, result.output
+    lines = {line.split()[0]: line.split()[1:] for line in result.output.splitlines()[1:] if line.strip()}
+    assert lines['queries'] == ['4', '4']
+    assert lines['calls/query'] == ['2.00', '1.00']
@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+
+import openai
+import pytest
+from flask import g
+
+from codehelp import sufficiency
+from codehelp.context import ContextConfig
+from codehelp.helper import run_query_prompts
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.testing.mocks import mock_async_completion
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+
+CODE = """
+def average(values):
+    total = 0
+    for v in values:
+        total += v
+    return total / len(values)
+"""
+ERROR = "ZeroDivisionError: division by zero"
+ISSUE = "Why does average crash on an empty list?"
+
+
+@pytest.fixture
+def api_calls(monkeypatch):
+    calls = []
+    mock = mock_async_completion()
+
+    async def counting_mock(*args, **kwargs):
+        calls.append(kwargs)
+        return await mock(*args, **kwargs)
+
+    monkeypatch.setattr(openai.resources.chat.AsyncCompletions, "create", counting_mock)
+    return calls
+
+
+@pytest.mark.parametrize(('code', 'error', 'issue', 'expected'), [
+    (CODE, ERROR, ISSUE, True),
+    (CODE, "", "The average of [1, 2, 3] prints 2.0 but I expected 2 as an integer", True),
+    (CODE, "", "Why is the output wrong?", False),           # no error and a short issue
+    (CODE, ERROR, "help, my code doesn't work", False),      # vague issue
+    ("average([])", ERROR, ISSUE, False),                    # too little code
+    ("", "", "What is a for loop?", False),                  # conceptual question
+])
+def test_looks_sufficient(code, error, issue, expected):
+    assert sufficiency.looks_sufficient(code, error, issue) == expected
+
+
+@pytest.mark.parametrize(('text', 'expected'), [
+    ("OK.", True),
+    ("Your query is sufficient for me to help. OK", True),
+    ("Could you share the error message you see?", False),
+])
+def test_llm_says_sufficient(text, expected):
+    assert sufficiency.llm_says_sufficient(text) == expected
+
+
+def test_recent_insufficient_rate(app):
+    with app.app_context():
+        # test data: queries 1 and 3 are in class 1, ctx1
+        assert sufficiency.recent_insufficient_rate(1, 'ctx1') == 0.0
+        db = get_db()
+        db.execute("""UPDATE queries SET response_json='[{}, {}]', response_text='{"insufficient": "more?", "main": "r"}' WHERE id=3""")
+        db.commit()
+        assert sufficiency.recent_insufficient_rate(1, 'ctx1') == 0.5
+        # queries whose check was skipped don't count
+        db.execute("""UPDATE queries SET response_json='[{}, {"sufficiency": "local"}]' WHERE id=1""")
+        db.commit()
+        assert sufficiency.recent_insufficient_rate(1, 'ctx1') == 1.0
+
+
+def _run(app, mode, code=CODE, error=ERROR, issue=ISSUE):
+    app.config['SUFFICIENCY_PRECHECK'] = mode
+    with app.test_request_context():
+        g.auth = {'class_id': 1}
+        responses, texts = asyncio.run(run_query_prompts(LLM, ContextConfig(name='ctx1'), code, error, issue, None, None))
+        stats = sufficiency.get_stats()
+    return responses, texts, stats
+
+
+def test_precheck_on_skips_llm_call(app, api_calls):
+    responses, texts, stats = _run(app, 'on')
+    assert len(api_calls) == 1  # main only
+    assert responses[-1] == sufficiency.SKIPPED_RESPONSE
+    assert list(texts) == ['main']
+    assert (stats.skipped, stats.ambiguous) == (1, 0)
+
+
+def test_precheck_on_ambiguous_uses_llm(app, api_calls):
+    _, _, stats = _run(app, 'on', issue="help")
+    assert len(api_calls) == 2
+    assert (stats.skipped, stats.ambiguous) == (0, 1)
+
+
+def test_precheck_shadow(app, api_calls):
+    _, texts, stats = _run(app, 'shadow')
+    assert len(api_calls) == 2
+    assert stats.shadowed == 1
+    # The mocked completion isn't "OK.", so the LLM disagrees.
+    assert stats.disagreed == 1
+    assert stats.disagreement_rate == 1.0
+    assert 'insufficient' in texts
+
+
+def test_precheck_off(app, api_calls):
+    _, _, stats = _run(app, 'off')
+    assert len(api_calls) == 2
+    assert stats == sufficiency.PrecheckStats(0, 0, 0, 0, 0)
+
+
+def test_admin_stats(app, client, auth):
+    auth.login('testadmin', 'testadminpassword')
+    response = client.get('/admin/llm_status/')
+    assert response.status_code == 200
+    assert "Sufficiency Pre-check" in response.text
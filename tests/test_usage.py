@@ -0,0 +1,108 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from codehelp.admin import gen_latency_tables, gen_query_charts
+from codehelp.helper import run_query_prompts, stream_query_prompts
+from gened import gemini
+from gened.db import get_db
+from gened.openai import LLMConfig
+from gened.streaming import iter_async
+from gened.tokens import token_counts
+from gened.usage import collect_usage, record_stage
+
+LLM = LLMConfig(model='gpt-4o-mini', api_key='invalid')
+USAGE = {'prompt_tokens': 120, 'completion_tokens': 30, 'total_tokens': 150, 'prompt_tokens_details': {'cached_tokens': 64}}
+
+
+@pytest.fixture
+def fake_completions(app, monkeypatch):
+    """ Answer every completion, from any provider, with USAGE. """
+    async def fake_completion(llm, messages, **kwargs):
+        return {'choices': [{'message': {'content': "OK"}}], 'usage': USAGE}, "OK"
+
+    monkeypatch.setattr('gened.completion_cache.get_completion', fake_completion)
+    app.config['COMPLETION_CACHE_TTL'] = 0
+
+
+def test_token_counts():
+    assert token_counts({'usage': USAGE}) == (120, 30, 64)
+    assert token_counts({'response': "text"}) == (None, None, None)
+    assert token_counts({'usage': {'prompt_tokens': 5, 'completion_tokens': 2, 'prompt_tokens_details': None}}) == (5, 2, None)
+
+
+def test_gemini_usage():
+    metadata = SimpleNamespace(prompt_token_count=100, candidates_token_count=20, total_token_count=120, cached_content_token_count=None)
+    assert gemini._usage(SimpleNamespace(usage_metadata=metadata)) == {
+        'prompt_tokens': 100, 'completion_tokens': 20, 'total_tokens': 120, 'prompt_tokens_details': {'cached_tokens': 0},
+    }
+    assert gemini._usage(SimpleNamespace()) is None
+
+
+def test_collect_usage(app):
+    with app.app_context():
+        record_stage('main', LLM, {'usage': USAGE}, 0.5)  # not collecting: ignored
+        with collect_usage() as stages:
+            record_stage('main', LLM, {'usage': USAGE, 'cached': True}, 0.0123)
+            record_stage('sufficiency', LLM, {'error': "timeout"}, 2.0)
+    assert [(st.stage, st.provider, st.wall_ms, st.source, st.error) for st in stages] == [
+        ('main', 'openai', 12, 'cache', False),
+        ('sufficiency', 'openai', 2000, 'api', True),
+    ]
+    assert stages[0].cached_tokens == 64
+
+
+def test_stages_collected_from_tasks(app):
+    app.config['SUFFICIENCY_PRECHECK'] = 'off'
+    with app.test_request_context():
+        with collect_usage() as stages:
+            asyncio.run(run_query_prompts(LLM, None, "x = 1", "NameError", "Why?", None, None))
+        assert {st.stage for st in stages} == {'main', 'sufficiency'}
+
+        with collect_usage() as stages:
+            list(iter_async(stream_query_prompts(LLM, None, "x = 1", "NameError", "Why?", None, None)))
+        assert {st.stage for st in stages} == {'main', 'sufficiency'}
+    assert all(st.model == 'gpt-4o-mini' and st.wall_ms >= 0 for st in stages)
+
+
+def test_query_stages_recorded(app, client, auth, fake_completions):
+    app.config['SUFFICIENCY_PRECHECK'] = 'off'
+    auth.login()
+    response = client.post('/help/request', data={'code': "x = 1", 'error': "NameError", 'issue': "Why?"})
+    assert response.status_code == 302
+    query_id = int(response.location.rpartition('/')[2])
+
+    response = client.post('/help/request?stream=1', data={'code': "y = 2", 'error': "NameError", 'issue': "Why?"})
+    assert b"event: done" in response.data
+
+    with app.app_context():
+        db = get_db()
+        rows = db.execute("SELECT * FROM query_stages WHERE query_id=? ORDER BY stage", [query_id]).fetchall()
+        assert [row['stage'] for row in rows] == ['main', 'sufficiency']
+        assert all(row['prompt_tokens'] == 120 and row['cached_tokens'] == 64 and row['source'] == 'api' for row in rows)
+        streamed = db.execute("SELECT stage FROM query_stages WHERE query_id > ?", [query_id]).fetchall()
+        assert sorted(row['stage'] for row in streamed) == ['main', 'sufficiency']
+
+
+def test_rollups(app, client, auth, fake_completions):
+    auth.login()
+    client.post('/help/request', data={'code': "x = 1", 'error': "NameError", 'issue': "Why?"})
+
+    with app.app_context():
+        charts = gen_query_charts("1", [])
+        tokens = charts[2].series
+        assert tokens['prompt tokens'][-1] >= 120  # today is last
+        assert tokens['cached prompt tokens'][-1] >= 64
+        assert sum(tokens['completion tokens'][:-1]) == 0
+        assert len(charts[3].series['main (avg s)']) == 15
+
+        table, = gen_latency_tables()
+        main_rows = [row for row in table.rows if row['stage'] == 'main']
+        assert main_rows
+        assert main_rows[0]['calls'] == 1
+        assert main_rows[0]['avg_prompt_tokens'] == 120
@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2026 Rana Moeez Hassan
+#
+# SPDX-License-Identifier: AGPL-3.0-only
+
+import asyncio
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import time
+
+import pytest
+
+from codehelp import webhooks
+from gened.db import get_db
+from gened.openai import LLMConfig
+
+QUERY = {'code': "x = 1", 'error': "NameError", 'issue': "Why?", 'user_id': "1234", 'callback_url': "https://example.com/hook"}
+# Answered queries are submitted as batches here: single queries in a class look up group prompts (in class_group_configs)
+BATCH = {'queries': [{'code': "x = 1", 'error': "NameError", 'issue': "Why?", 'user_id': "s1234"}], 'callback_url': "https://example.com/hook"}
+ADDRESSES = {
+    'example.com': '93.184.216.34',
+    'example.org': '93.184.215.14',
+    'internal.example': '10.0.0.5',
+}
+
+
+@pytest.fixture(autouse=True)
+def dns(monkeypatch):
+    """ Resolve the hosts in ADDRESSES (and IP addresses) without a network. """
+    def resolve(host, port):
+        try:
+            return [ADDRESSES.get(host) or str(ipaddress.ip_address(host))]
+        except ValueError:
+            raise socket.gaierror(f"unknown host {host}") from None
+
+    monkeypatch.setattr('codehelp.webhooks._resolve', resolve)
+
+
+@pytest.fixture
+def posted(app, monkeypatch, fake_completions):
+    """ Record the webhook POSTs instead of sending them.
+
+    testuser (an instructor) and testinstructor (a student) are put in class 2.
+    """
+    calls = []
+
+    async def fake_post(url, body, headers):
+        calls.append((url, body, headers))
+
+    monkeypatch.setattr('gened.openai._get_llm', lambda **kwargs: LLMConfig(model='gpt-4o-mini', api_key='invalid'))  # completions are faked
+    monkeypatch.setattr('codehelp.webhooks.post_batch', fake_post)
+    app.config['WEBHOOK_DISPATCHER'] = False  # delivered with deliver_due() in the tests
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE users SET last_class_id=2 WHERE id IN (11, 13)")
+        db.commit()
+    return calls
+
+
+@pytest.fixture
+def class_secret(client, api_headers, posted):
+    """ Register a secret for class 2's callbacks, with no class-wide webhook. """
+    response = client.put('/api/class/webhook', json={'url': None}, headers=api_headers(11))
+    assert response.status_code == 200
+    return response.json['secret']
+
+
+def outbox(app):
+    with app.app_context():
+        return [dict(row) for row in get_db().execute("SELECT * FROM webhook_outbox ORDER BY id")]
+
+
+def expected_signature(secret, url, headers, body):
+    digest = hmac.new(secret.encode(), f"{headers[webhooks.TIMESTAMP_HEADER]}.{url}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"sha256={digest}"
+
+
+def test_callback_url(app, client, api_headers, posted, class_secret):
+    response = client.post('/api/queries/batch', json=BATCH, headers=api_headers(11))
+    assert response.status_code == 200
+    query_id = response.json['results'][0]['query_id']
+    assert [(row['query_id'], row['class_id'], row['status']) for row in outbox(app)] == [(query_id, 2, 'pending')]
+
+    with app.app_context():
+        assert webhooks.deliver_due() == 1
+        assert webhooks.deliver_due() == 0  # nothing left to deliver
+
+    [(url, body, headers)] = posted
+    assert url == "https://example.com/hook"
+    # The destination is signed too, so the delivery can't be replayed to another endpoint
+    assert headers[webhooks.SIGNATURE_HEADER] == expected_signature(class_secret, url, headers, body)
+    assert headers[webhooks.SIGNATURE_HEADER] != expected_signature(class_secret, "https://example.com/other", headers, body)
+    [delivery] = json.loads(body)['deliveries']
+    assert delivery['query_id'] == query_id
+    assert delivery['algorea_id'] == "s1234"
+    assert delivery['responses']['main'] == "OK"
+    assert outbox(app)[0]['status'] == 'delivered'
+
+
+def test_callbacks_limited_to_instructors(app, client, api_headers, posted, class_secret):
+    response = client.post('/api/query', json=QUERY, headers=api_headers(13))  # testinstructor: a student in class 2
+    assert response.status_code == 403
+    assert outbox(app) == []
+
+
+def test_callback_needs_class_secret(app, client, api_headers, posted):
+    response = client.post('/api/query', json=QUERY, headers=api_headers(11))
+    assert response.status_code == 400
+    assert "PUT /api/class/webhook" in response.json['error']
+
+    # An admin with no class has no class secret to sign with
+    response = client.post('/api/query', json=QUERY, headers=api_headers(12, is_admin=True))
+    assert response.status_code == 400
+    assert outbox(app) == []
+
+
+@pytest.mark.parametrize('url', [
+    "ftp://example.com/",
+    "http://127.0.0.1:8080/hook",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://internal.example/hook",
+    "http://[::1]/hook",
+    "http://unknown.example/hook",
+])
+def test_invalid_callback_url(app, client, api_headers, posted, class_secret, url):
+    response = client.post('/api/query', json={**QUERY, 'callback_url': url}, headers=api_headers(11))
+    assert response.status_code == 400
+    assert client.put('/api/class/webhook', json={'url': url}, headers=api_headers(11)).status_code == 400
+    assert outbox(app) == []
+
+
+@pytest.mark.parametrize(('address', 'allowed'), [
+    ('93.184.216.34', True),
+    ('2606:2800:220:1:248:1893:25c8:1946', True),
+    ('10.1.2.3', False),
+    ('172.16.0.1', False),
+    ('192.168.1.1', False),
+    ('127.0.0.1', False),
+    ('169.254.169.254', False),
+    ('0.0.0.0', False),
+    ('224.0.0.1', False),
+    ('::1', False),
+    ('fd00::1', False),
+    ('fe80::1%eth0', False),
+    ('::ffff:127.0.0.1', False),
+])
+def test_check_destination(monkeypatch, address, allowed):
+    monkeypatch.setattr('codehelp.webhooks._resolve', lambda host, port: ['93.184.216.34', address])
+    if allowed:
+        webhooks.check_destination("https://hooks.example/")
+    else:
+        with pytest.raises(ValueError):
+            webhooks.check_destination("https://hooks.example/")
+
+
+def test_delivery_rechecks_destination(monkeypatch):
+    # e.g., the host's DNS now points at the server's own network
+    monkeypatch.setattr('codehelp.webhooks._resolve', lambda host, port: ['127.0.0.1'])
+    with pytest.raises(webhooks.WebhookError):
+        asyncio.run(webhooks.post_batch("https://example.com/hook", b"{}", {}))
+
+
+def test_batched_delivery(app, client, api_headers, posted, class_secret):
+    app.config['WEBHOOK_BATCH_SIZE'] = 2
+    batch = {
+        'queries': [{'code': f"x = {i}", 'error': "", 'issue': "?"} for i in range(4)],
+        'callback_url': "https://example.com/hook",
+    }
+    batch['queries'][3]['callback_url'] = "https://example.org/other"
+    response = client.post('/api/queries/batch', json=batch, headers=api_headers(11))
+    assert response.status_code == 200
+
+    with app.app_context():
+        assert webhooks.deliver_due() == 4
+    assert sorted((url, len(json.loads(body)['deliveries'])) for url, body, _ in posted) == [
+        ("https://example.com/hook", 1),
+        ("https://example.com/hook", 2),
+        ("https://example.org/other", 1),
+    ]
+    assert all(headers[webhooks.SIGNATURE_HEADER] == expected_signature(class_secret, url, headers, body) for url, body, headers in posted)
+
+
+def test_retries(app, client, api_headers, posted, class_secret, monkeypatch):
+    async def failing_post(url, body, headers):
+        raise webhooks.WebhookError("HTTP 503")
+
+    monkeypatch.setattr('codehelp.webhooks.post_batch', failing_post)
+    app.config['WEBHOOK_RETRY_BASE'] = 0  # retry as soon as deliver_due() runs again
+    app.config['WEBHOOK_MAX_ATTEMPTS'] = 3
+    client.post('/api/queries/batch', json=BATCH, headers=api_headers(11))
+
+    with app.app_context():
+        for _ in range(3):
+            assert webhooks.deliver_due() == 1
+        assert webhooks.deliver_due() == 0
+    [row] = outbox(app)
+    assert row['status'] == 'failed'
+    assert row['attempts'] == 3
+    assert row['last_error'] == "HTTP 503"
+
+
+def test_class_webhook(app, client, api_headers, posted):
+    # testuser is an instructor in class 2, testinstructor a student
+    assert client.put('/api/class/webhook', json={'url': "https://example.com/class"}, headers=api_headers(13)).status_code == 403
+    assert client.put('/api/class/webhook', json={'url': "not a url"}, headers=api_headers(11)).status_code == 400
+    response = client.put('/api/class/webhook', json={'url': "https://example.com/class"}, headers=api_headers(11))
+    assert response.status_code == 200
+    secret = response.json['secret']
+    # The secret is kept when the URL changes
+    response = client.put('/api/class/webhook', json={'url': "https://example.com/class2"}, headers=api_headers(11))
+    assert response.json['secret'] == secret
+    assert client.get('/api/class/webhook', headers=api_headers(11)).json == {'url': "https://example.com/class2", 'secret': secret}
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO queries (id, code, error, issue, response_text, user_id, role_id) VALUES (100, 'c', '', '', '{\"main\": \"hi\"}', 13, 6)")
+        assert webhooks.enqueue(100)
+        db.commit()
+        webhooks.deliver_due()
+    [(url, body, headers)] = posted
+    assert url == "https://example.com/class2"
+    assert headers[webhooks.SIGNATURE_HEADER] == expected_signature(secret, url, headers, body)
+
+    assert client.delete('/api/class/webhook', headers=api_headers(11)).status_code == 200
+    assert client.get('/api/class/webhook', headers=api_headers(11)).status_code == 404
+
+
+def test_dispatcher(app, client, api_headers, posted, class_secret):
+    app.config['WEBHOOK_DISPATCHER'] = True
+    app.config['WEBHOOK_BATCH_WINDOW'] = 0
+    dispatcher = app.extensions['webhooks']
+    try:
+        client.post('/api/queries/batch', json=BATCH, headers=api_headers(11))
+        deadline = time.monotonic() + 5
+        while not posted and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+    assert len(posted) == 1
+    assert outbox(app)[0]['status'] == 'delivered'